@@ -7,6 +7,10 @@
 #include <rdma/rdma_cma.h>
 #include <infiniband/verbs.h>
 #include <sys/mman.h> //To force hugetables
+#include <sys/stat.h>
+#include <sys/vfs.h> //To check the filesystem of the export directories
+#include <fcntl.h>
+#include <fstream>
 #include <math.h>
 #include <vector>
 
@@ -21,21 +25,7 @@ struct dataListEntry
 	uint32_t data;
 };
 
-struct keywriteEntry
-{
-	uint32_t checksum;
-	uint32_t data;
-	//uint32_t data2;
-	//uint32_t data3;
-	//uint32_t data4;
-	//uint32_t data5;
-	//uint32_t data6;
-	//uint32_t data7;
-	
-	//uint64_t data;
-	//uint32_t checksum;
-	//uint32_t offset;
-};
+#include "keywrite_query.h" //struct keywriteEntry, and the query logic
 
 struct postcarderEntry
 {
@@ -89,6 +79,9 @@ class RDMAService
 		string name;
 		int rdmaCMPort;
 		bool isReady = false;
+		string export_name; //Name of the exported segment (see allocateHugepages)
+		string export_path;
+		bool export_hugepages = false;
 		
 		
 		void setupConnectionManager()
@@ -383,6 +376,24 @@ class RDMAService
 			acceptClientConnection();
 		}
 		
+		//Describe the exported segment next to it, so that analytics processes can map it (see dta/attach.py)
+		//Written after the memory is registered, since the rkey is part of the descriptor. Replaced atomically through a rename
+		void exportDescriptor(string layout, uint64_t entry_size, uint64_t num_entries)
+		{
+			if(export_path.empty())
+				return;
+			
+			string descriptor_path = export_path.substr(0, export_path.rfind(".")) + ".json";
+			ofstream descriptor(descriptor_path + ".tmp");
+			descriptor << "{\"name\": \"" << export_name << "\", \"layout\": \"" << layout << "\", \"entry_size\": " << entry_size << ", \"num_entries\": " << num_entries;
+			descriptor << ", \"size\": " << entry_size*num_entries << ", \"path\": \"" << export_path << "\", \"rkey\": " << memory_region->rkey << ", \"queue_pair\": " << queue_pair->qp_num;
+			descriptor << ", \"address\": " << (uint64_t)memory_region->addr << ", \"hugepages\": " << (export_hugepages ? "true" : "false") << "}" << endl;
+			descriptor.close();
+			
+			rename((descriptor_path + ".tmp").c_str(), descriptor_path.c_str());
+			cout << "Exported '" << name << "' as " << export_path << " (descriptor " << descriptor_path << ")" << endl;
+		}
+		
 		void allocateStorage();
 		void printStorage();
 		void analStorage();
@@ -399,7 +410,44 @@ class RDMAService
 		}
 };
 
-void* allocateHugepages(uint64_t size)
+//Stores are exported as named segments (<directory>/<name>.bin), so that analytics can map them read-only from other processes instead of running in the collector
+//Exports need a hugetlbfs mount. Without one, stores stay in private hugepages (not exported), as RDMA writes into regular pages cost IOTLB misses on the data path
+//Set EXPORT_REGULAR_PAGES to export in /dev/shm (regular pages) instead, e.g., for debugging on machines without hugepages
+#define HUGETLBFS_MAGIC 0x958458f6
+#define TMPFS_MAGIC 0x01021994
+const bool EXPORT_STORES = true;
+const bool EXPORT_REGULAR_PAGES = false;
+const string EXPORT_DIRECTORY = "/dev/hugepages/dta";
+const string EXPORT_DIRECTORY_REGULAR_PAGES = "/dev/shm/dta";
+
+//Map a shared segment file of the given size. Returns NULL if the directory is not on the expected filesystem, or the mapping fails
+void* mapExportSegment(string directory, long filesystem, string path, uint64_t size)
+{
+	mkdir(directory.c_str(), 0755);
+	
+	struct statfs fs;
+	if(statfs(directory.c_str(), &fs) != 0 || fs.f_type != filesystem)
+		return NULL;
+	
+	int fd = open(path.c_str(), O_CREAT | O_RDWR | O_TRUNC, 0644);
+	if(fd < 0)
+		return NULL;
+	
+	void* p = MAP_FAILED;
+	if(ftruncate(fd, size) == 0)
+		p = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0); //Pages of hugetlbfs files are hugepages, no MAP_HUGETLB needed
+	close(fd);
+	
+	if(p == MAP_FAILED)
+	{
+		unlink(path.c_str());
+		return NULL;
+	}
+	
+	return p;
+}
+
+void* allocateHugepages(uint64_t size, RDMAService* service=NULL)
 {
 	uint64_t hugepage_size = 1<<30;
 	uint64_t num_hugepages = ceil((double)size/(double)hugepage_size);
@@ -407,16 +455,59 @@ void* allocateHugepages(uint64_t size)
 	
 	cout << "Allocating hugepages for buffer size " << size << ". This requires " << num_hugepages << " hugepages." << endl;
 	
+	bool exporting = EXPORT_STORES && service && !service->export_name.empty();
+	
+	if(exporting)
+	{
+		string path = EXPORT_DIRECTORY + "/" + service->export_name + ".bin";
+		void* p = mapExportSegment(EXPORT_DIRECTORY, HUGETLBFS_MAGIC, path, mmap_alloc_size);
+		if(p)
+		{
+			service->export_path = path;
+			service->export_hugepages = true;
+			cout << "Buffer allocated at address " << p << ", shared as " << path << endl;
+			return p;
+		}
+		
+		cerr << "Could not export '" << service->name << "' on hugepages (is hugetlbfs mounted at /dev/hugepages?)" << endl;
+	}
+	
+	//Keep the data path on hugepages, rather than exporting on regular pages
 	void* p = mmap(NULL, mmap_alloc_size, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS | MAP_HUGETLB, -1, 0);
+	if(p != MAP_FAILED)
+	{
+		if(exporting)
+			cerr << "'" << service->name << "' is in private hugepages, and is NOT exported" << endl;
+		cout << "Buffer allocated at address " << p << endl;
+		return p;
+	}
 	
-	cout << "Buffer allocated at address " << p << endl;
+	cerr << "Failed to allocate " << num_hugepages << " private hugepages (are enough 1G hugepages reserved?)" << endl;
 	
-	return p;
+	if(exporting && EXPORT_REGULAR_PAGES)
+	{
+		string path = EXPORT_DIRECTORY_REGULAR_PAGES + "/" + service->export_name + ".bin";
+		p = mapExportSegment(EXPORT_DIRECTORY_REGULAR_PAGES, TMPFS_MAGIC, path, mmap_alloc_size);
+		if(p)
+		{
+			service->export_path = path;
+			service->export_hugepages = false;
+			cerr << "#############################################################################" << endl;
+			cerr << "WARNING: '" << service->name << "' is exported on REGULAR PAGES in " << path << endl;
+			cerr << "WARNING: RDMA writes will take IOTLB misses, expect a degraded data path!" << endl;
+			cerr << "#############################################################################" << endl;
+			cout << "Buffer allocated at address " << p << ", shared as " << path << endl;
+			return p;
+		}
+	}
+	
+	return MAP_FAILED;
 }
 
 class KeywriteStore : public RDMAService
 {
 	public:
+		const string EXPORT_LAYOUT = "keywriteEntry";
 		uint64_t num_entries;
 		uint64_t buffer_size;
 		struct keywriteEntry* storage;
@@ -427,7 +518,7 @@ class KeywriteStore : public RDMAService
 			
 			cout << "Allocating keywrite storage for '" << name << "'... Entries: " << num_entries << " size(B): " << buffer_size << endl;
 			
-			storage = (struct keywriteEntry*)allocateHugepages(buffer_size);
+			storage = (struct keywriteEntry*)allocateHugepages(buffer_size, this);
 			
 			cout << "keywrite buffer starts at address " << storage << endl;
 		}
@@ -470,43 +561,7 @@ class KeywriteStore : public RDMAService
 		//Query a key
 		uint32_t query(uint32_t key, char redundancy)
 		{
-			char  buffer[5]; //This is the crc input
-			char buffer_key[4];
-			uint32_t slot; //this will be store calculated keyval slots
-			boost::crc_32_type result;
-			boost::crc_32_type result_csum;
-			
-			
-			memcpy( buffer, &key, 4 ); //Copy key into this buffer (same for all redundancies)
-			memcpy( buffer_key, &key, 4 );
-			
-			//Calculate concatenated checksum
-			result_csum.process_bytes(buffer_key, 4);
-			uint32_t checksum = result_csum.checksum();
-			//cout << "We are expecting checksum " << checksum << endl;
-			
-			for(char n = 0; n < redundancy; n++) //Loop through all redundancies
-			{
-				buffer[4] = n; //The redundancy slot will differ
-				
-				//Calculate the index slot for this redundancy entry
-				result.process_bytes(buffer, 5); 
-				slot = result.checksum();
-				//cout << "pure index-selecting checksum: " << slot << endl;
-				
-				slot %= num_entries; //modulo this into actual storage
-				//cout << "Key " << key << " redundancy n=" << (int)n << " hashed to slot " << slot << endl;
-				//cout << "Data in this slot: " << storage[slot].data << "csum: " << storage[slot].checksum << endl;
-				
-				//cout << endl;
-				
-				//If the checksum is correct, stop here and return an answer
-				if( checksum == storage[slot].checksum )
-					return storage[slot].data;
-			}
-			
-			//If no answer was found, return back a 0 (assuming that 0 signals return-None)
-			return 0;
+			return keywriteQuery(storage, num_entries, key, redundancy);
 		}
 		
 		//Query time breakdown
@@ -689,6 +744,7 @@ class KeywriteStore : public RDMAService
 			initiateRDMA();
 			allocateStorage();
 			registerMemoryRegion(storage, buffer_size);
+			exportDescriptor(EXPORT_LAYOUT, sizeof(*storage), num_entries);
 			shareServerMetadata();
 			
 			isReady = true;
@@ -701,9 +757,10 @@ class KeywriteStore : public RDMAService
 			return t;
 		}
 		
-		KeywriteStore(uint64_t init_num_entries, int rdmaPort, string init_name = "KeyWriteStore"): RDMAService(init_name, rdmaPort)
+		KeywriteStore(uint64_t init_num_entries, int rdmaPort, string init_name = "KeyWriteStore", string init_export_name = "keywrite"): RDMAService(init_name, rdmaPort)
 		{
 			num_entries = init_num_entries;
+			export_name = init_export_name;
 			if(num_entries > 536870912)
 			{
 				cerr << "!!! Translator pipeline currently supports as most 536870912 entries! " << num_entries << " allocated" << endl;
@@ -716,6 +773,7 @@ class KeywriteStore : public RDMAService
 class PostcarderStore : public RDMAService
 {
 	public:
+		const string EXPORT_LAYOUT = "postcarderEntry";
 		uint64_t num_entries;
 		uint64_t buffer_size;
 		struct postcarderEntry* storage;
@@ -726,7 +784,7 @@ class PostcarderStore : public RDMAService
 			
 			cout << "Allocating postcarder storage for '" << name << "'... Entries: " << num_entries << " size(B): " << buffer_size << endl;
 			
-			storage = (struct postcarderEntry*)allocateHugepages(buffer_size);
+			storage = (struct postcarderEntry*)allocateHugepages(buffer_size, this);
 			
 			cout << "Postcarder buffer starts at address " << storage << endl;
 		}
@@ -818,6 +876,7 @@ class PostcarderStore : public RDMAService
 			initiateRDMA();
 			allocateStorage();
 			registerMemoryRegion(storage, buffer_size);
+			exportDescriptor(EXPORT_LAYOUT, sizeof(*storage), num_entries);
 			shareServerMetadata();
 			
 			isReady = true;
@@ -830,9 +889,10 @@ class PostcarderStore : public RDMAService
 			return t;
 		}
 		
-		PostcarderStore(uint64_t init_num_entries, int rdmaPort, string init_name = "PostcarderStore"): RDMAService(init_name, rdmaPort)
+		PostcarderStore(uint64_t init_num_entries, int rdmaPort, string init_name = "PostcarderStore", string init_export_name = "postcarder"): RDMAService(init_name, rdmaPort)
 		{
 			num_entries = init_num_entries;
+			export_name = init_export_name;
 			if(num_entries > 536870912)
 			{
 				cerr << "!!! Translator pipeline currently supports as most 536870912 entries! " << num_entries << " allocated" << endl;
@@ -844,6 +904,7 @@ class PostcarderStore : public RDMAService
 class DataList : public RDMAService
 {
 	public:
+		const string EXPORT_LAYOUT = "dataListEntry";
 		uint64_t num_entries;
 		uint64_t buffer_size;
 		struct dataListEntry* storage;
@@ -855,7 +916,7 @@ class DataList : public RDMAService
 			
 			cout << "Allocating List storage for '" << name << "'... Entries: " << num_entries << " size(B): " << buffer_size << endl;
 			//storage = new struct dataListEntry[num_entries]; //Allocate on stack (required for tons of lists where not enough hugepages)
-			storage = (struct dataListEntry*)allocateHugepages(buffer_size); //This is default, allocating on hugepages
+			storage = (struct dataListEntry*)allocateHugepages(buffer_size, this); //This is default, allocating on hugepages
 			cout << "List buffer starts at address " << storage << endl;
 		}
 		
@@ -1048,6 +1109,7 @@ class DataList : public RDMAService
 			initiateRDMA();
 			allocateStorage();
 			registerMemoryRegion(storage, buffer_size);
+			exportDescriptor(EXPORT_LAYOUT, sizeof(*storage), num_entries);
 			shareServerMetadata();
 			clearStorage();
 			isReady = true;
@@ -1061,9 +1123,10 @@ class DataList : public RDMAService
 			return t;
 		}
 		
-		DataList(uint64_t init_num_entries, int rdmaPort, string init_name="DataList"): RDMAService(init_name, rdmaPort)
+		DataList(uint64_t init_num_entries, int rdmaPort, string init_name="DataList", string init_export_name=""): RDMAService(init_name, rdmaPort)
 		{
 			num_entries = init_num_entries;
+			export_name = init_export_name; //Lists are only exported when named
 			cout << "Constructor for '" << name << "'..." << endl;
 			
 			tail_pointer = num_entries; //This ensures that polling will start at 0
@@ -1113,7 +1176,7 @@ int main()
 	for(int i = 0; i < num_lists; i++)
 	{
 		cout << i << endl;
-		*(dataLists+i) = new DataList(slots_per_list, list_port_start+i, "List"+to_string(i));
+		*(dataLists+i) = new DataList(slots_per_list, list_port_start+i, "List"+to_string(i), "list"+to_string(i));
 	}
 	
 	//Initiate the storages in separate threads	
@@ -1127,7 +1190,7 @@ int main()
 	{
 		cout << endl;
 		
-		cout << "Press ENTER to analyze storage. This MIGHT impact RDMA performance, so avoid during benchmarking!";
+		cout << "Press ENTER to analyze storage. This MIGHT impact RDMA performance, so avoid during benchmarking! (The exported stores can instead be analyzed from another process, see python3 -m dta.attach)";
 		cin.ignore();
 		
 		//Print info for all lists (APPEND)
@@ -1247,7 +1310,7 @@ int main()
 			cout << "Done" << endl;
 			*/
 			
-			/* QUERY benchmark
+			/* QUERY benchmark (see also dta/querybench.py, sweeping threads, redundancy, and store sizes without recompiling)
 			int num_threads;
 			uint64_t num_queries;
 			int redundancy;
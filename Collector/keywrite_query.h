@@ -0,0 +1,54 @@
+//KeyWrite query logic, shared by the collector (KeywriteStore::query) and the query benchmark library (query_benchmark.cpp)
+#ifndef KEYWRITE_QUERY_H
+#define KEYWRITE_QUERY_H
+
+#include <stdint.h>
+#include <string.h>
+#include <boost/crc.hpp>  // for boost::crc_32_type
+
+struct keywriteEntry
+{
+	uint32_t checksum;
+	uint32_t data;
+	//uint32_t data2;
+	//uint32_t data3;
+	//uint32_t data4;
+	//uint32_t data5;
+	//uint32_t data6;
+	//uint32_t data7;
+	
+	//uint64_t data;
+	//uint32_t checksum;
+	//uint32_t offset;
+};
+
+//Query a key in a KeyWrite store of num_entries slots (a power of 2). Returns the data of the first redundancy entry with a matching checksum, or 0 if there is none
+//The slot of entry n is CRC32 over {key, n}, and the checksum is CRC32 over the key (same as the translator, and dta/query.py). The CRC state after the key is shared by all entries, so every entry only hashes its n-byte
+inline uint32_t keywriteQuery(const struct keywriteEntry* storage, uint64_t num_entries, uint32_t key, int redundancy, int* found=NULL)
+{
+	boost::crc_32_type key_state;
+	key_state.process_bytes(&key, 4); //The key bytes in host byte order, i.e., little-endian
+	uint32_t checksum = key_state.checksum();
+	
+	for(int n = 0; n < redundancy; n++) //Loop through all redundancies
+	{
+		boost::crc_32_type result = key_state; //Continue from the key state
+		result.process_byte((unsigned char)n); //The redundancy slot will differ
+		uint32_t slot = result.checksum() & (num_entries-1); //Bound into the actual storage
+		
+		//If the checksum is correct, stop here and return an answer
+		if( checksum == storage[slot].checksum )
+		{
+			if(found)
+				*found = 1;
+			return storage[slot].data;
+		}
+	}
+	
+	//If no answer was found, return back a 0 (assuming that 0 signals return-None)
+	if(found)
+		*found = 0;
+	return 0;
+}
+
+#endif
@@ -0,0 +1,174 @@
+//KeyWrite query benchmark, built as a shared library and driven from Python through ctypes (see dta/querybench.py)
+//It runs the collector's query logic (keywrite_query.h) in threads pinned to given cores, on store memory placed on a given NUMA node
+//Compile: g++ -O3 -shared -fPIC -o libdtaquery.so query_benchmark.cpp -lpthread
+#include <stdint.h>
+#include <pthread.h>
+#include <sched.h>
+#include <time.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <atomic>
+#include <thread>
+#include <vector>
+
+#include "keywrite_query.h"
+
+using namespace std;
+
+void pinToCpu(int cpu)
+{
+	if(cpu < 0)
+		return;
+	
+	cpu_set_t cpuset;
+	CPU_ZERO(&cpuset);
+	CPU_SET(cpu, &cpuset);
+	pthread_setaffinity_np(pthread_self(), sizeof(cpu_set_t), &cpuset);
+}
+
+double now()
+{
+	struct timespec t;
+	clock_gettime(CLOCK_MONOTONIC, &t);
+	return t.tv_sec + t.tv_nsec/1e9;
+}
+
+uint64_t nowNs()
+{
+	struct timespec t;
+	clock_gettime(CLOCK_MONOTONIC, &t);
+	return (uint64_t)t.tv_sec*1000000000 + t.tv_nsec;
+}
+
+struct queryBenchmark
+{
+	const struct keywriteEntry* storage;
+	uint64_t num_entries;
+	const uint32_t* keys; //Queried in order, cycling when there are fewer keys than queries
+	uint64_t num_keys;
+	int redundancy;
+	int num_threads;
+	atomic<int> waiting;
+	atomic<bool> go;
+};
+
+//Query every num_threads'th key from offset (the same striding as KeywriteStore::benchmark_querying). With latencies, every query is timed individually
+void queryThread(struct queryBenchmark* benchmark, int offset, int cpu, uint64_t num_queries, uint64_t* latencies, uint64_t* found, uint32_t* sink)
+{
+	pinToCpu(cpu);
+	
+	//Start all threads at once
+	benchmark->waiting--;
+	while(!benchmark->go.load())
+		;
+	
+	uint64_t num_found = 0;
+	uint32_t result = 0; //This prevents optimizing away memory retrieval
+	uint64_t i = 0;
+	for(uint64_t query = offset; query < num_queries; query += benchmark->num_threads, i++)
+	{
+		uint32_t key = benchmark->keys[query % benchmark->num_keys];
+		int key_found;
+		
+		if(latencies)
+		{
+			uint64_t t_start = nowNs();
+			result ^= keywriteQuery(benchmark->storage, benchmark->num_entries, key, benchmark->redundancy, &key_found);
+			latencies[i] = nowNs() - t_start;
+		}
+		else
+			result ^= keywriteQuery(benchmark->storage, benchmark->num_entries, key, benchmark->redundancy, &key_found);
+		
+		num_found += key_found;
+	}
+	
+	*found = num_found;
+	*sink = result;
+}
+
+double runThreads(struct queryBenchmark* benchmark, const int* cpus, uint64_t num_queries, uint64_t* latencies, uint64_t* found)
+{
+	vector<thread> threads;
+	vector<uint64_t> thread_found(benchmark->num_threads);
+	vector<uint32_t> sinks(benchmark->num_threads);
+	
+	benchmark->waiting = benchmark->num_threads;
+	benchmark->go = false;
+	
+	uint64_t latency_offset = 0;
+	for(int i = 0; i < benchmark->num_threads; i++)
+	{
+		threads.push_back(thread(queryThread, benchmark, i, cpus ? cpus[i] : -1, num_queries, latencies ? latencies+latency_offset : NULL, &thread_found[i], &sinks[i]));
+		latency_offset += (num_queries - i + benchmark->num_threads - 1)/benchmark->num_threads; //Queries of thread i
+	}
+	
+	while(benchmark->waiting.load() > 0)
+		;
+	double t_start = now();
+	benchmark->go = true;
+	
+	for(int i = 0; i < benchmark->num_threads; i++)
+		threads[i].join();
+	double duration = now() - t_start;
+	
+	*found = 0;
+	for(int i = 0; i < benchmark->num_threads; i++)
+		*found += thread_found[i];
+	
+	return duration;
+}
+
+//Allocations are rounded up to whole (2MiB) hugepages, mmap and munmap of hugepage-backed memory need that
+uint64_t hugepageAligned(uint64_t size)
+{
+	uint64_t hugepage_size = 1<<21;
+	return (size + hugepage_size - 1) & ~(hugepage_size - 1);
+}
+
+extern "C"
+{
+	//Allocate (hugepage-backed if possible) zeroed memory, first touched by a thread on cpu, so that the kernel places it on the NUMA node of that cpu
+	void* dtaAllocate(uint64_t size, int cpu)
+	{
+		size = hugepageAligned(size);
+		void* p = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS | MAP_HUGETLB, -1, 0);
+		if(p == MAP_FAILED)
+			p = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+		if(p == MAP_FAILED)
+			return NULL;
+		
+		thread toucher([p, size, cpu]() {
+			pinToCpu(cpu);
+			memset(p, 0, size);
+		});
+		toucher.join();
+		
+		return p;
+	}
+	
+	void dtaFree(void* p, uint64_t size)
+	{
+		munmap(p, hugepageAligned(size));
+	}
+	
+	//Query num_queries keys in num_threads threads (thread i pinned to cpus[i], or unpinned if cpus is NULL). Returns the duration in seconds, and the number of answered queries in found
+	//With latencies (an array of num_queries), every query is timed individually and its latency in ns is stored, grouped by thread
+	double dtaBenchmarkQueries(const struct keywriteEntry* storage, uint64_t num_entries, const uint32_t* keys, uint64_t num_keys, int redundancy, int num_threads, const int* cpus, uint64_t num_queries, uint64_t* latencies, uint64_t* found)
+	{
+		struct queryBenchmark benchmark;
+		benchmark.storage = storage;
+		benchmark.num_entries = num_entries;
+		benchmark.keys = keys;
+		benchmark.num_keys = num_keys;
+		benchmark.redundancy = redundancy;
+		benchmark.num_threads = num_threads;
+		
+		return runThreads(&benchmark, cpus, num_queries, latencies, found);
+	}
+	
+	//Single query, to check the library against other implementations
+	uint32_t dtaQuery(const struct keywriteEntry* storage, uint64_t num_entries, uint32_t key, int redundancy, int* found)
+	{
+		return keywriteQuery(storage, num_entries, key, redundancy, found);
+	}
+}
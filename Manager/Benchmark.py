@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+#This script runs DTA benchmarks without interaction: it sweeps the report rate, the redundancy, and the Append batch size per primitive
+#Every step stores one result row (achieved rate, RDMA packets at the collector, loss, PSN gaps, occupancy, goodput, query rate) in a CSV or Parquet file
+#Against the testbed, traffic comes from TReX (Generator.startTraffic_*), and the collector side is measured through the RDMA counters of its NIC
+#With --local, no testbed is needed: reports are translated by the translator model (dta/translator.py) and sent over loopback UDP to the stand-in collector (dta/collector.py)
+#Usage example: ./Benchmark.py --local --primitives keywrite append --rates 100kpps 1mpps --redundancies 1 4 --append_batch_sizes 1 4 --output results.csv
+
+import argparse
+import csv
+import ctypes
+import multiprocessing
+import os
+import socket
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")) #The dta package, in the repository root
+
+from common import log, strToPktrate
+from Orchestrator import Orchestrator
+from dta.headers import ROCEV2_UDP_PORT, UDP_OFFSET
+from dta.encoder import libc, has_mmsg, IOVEC, MMSGHDR
+from dta.collector import SoftCollector, shardedSockets, BTH_OFFSET
+from dta.translator import Translator, generateReports, POSTCARDER_NUM_HOPS
+from dta.query import KeyWriteStore
+
+PRIMITIVES = ["keywrite", "keyincrement", "append", "postcarder"]
+REDUNDANT_PRIMITIVES = ["keywrite", "keyincrement"]
+
+RESULT_FIELDS = ["backend", "primitive", "rate_target_pps", "redundancy", "append_batch_size", "duration", "reports_sent", "rate_sent_pps", "rdma_expected", "rdma_received", "loss_ratio", "psn_gaps", "goodput_pps", "occupancy", "query_rate_qps", "query_hit_ratio", "error"]
+
+RECEIVE_GRACE = 1.0 #Seconds the stand-in collector keeps receiving after the sender is done
+
+#RDMA packets the translator emits per report
+def rdmaPerReport(primitive, redundancy, append_batch_size):
+	if primitive in REDUNDANT_PRIMITIVES:
+		return redundancy
+	if primitive == "append":
+		return 1/append_batch_size
+	return 1/POSTCARDER_NUM_HOPS #One write per completed path
+
+def resultRow(backend, primitive, rate, redundancy, append_batch_size, duration, reports_sent, rdma_expected, rdma_received, psn_gaps=None, goodput=None, occupancy=None, query_rate=None, query_hit_ratio=None):
+	return {
+		"backend": backend,
+		"primitive": primitive,
+		"rate_target_pps": rate,
+		"redundancy": redundancy if primitive in REDUNDANT_PRIMITIVES else None,
+		"append_batch_size": append_batch_size if primitive == "append" else None,
+		"duration": duration,
+		"reports_sent": reports_sent,
+		"rate_sent_pps": reports_sent/duration if duration > 0 else None,
+		"rdma_expected": rdma_expected,
+		"rdma_received": rdma_received,
+		"loss_ratio": max(1 - rdma_received/rdma_expected, 0) if rdma_expected > 0 else None,
+		"psn_gaps": psn_gaps,
+		"goodput_pps": goodput,
+		"occupancy": occupancy,
+		"query_rate_qps": query_rate,
+		"query_hit_ratio": query_hit_ratio
+	}
+
+#Translator model -> loopback UDP -> stand-in collector (in a forked process, on shared memory)
+class LocalBackend:
+	name = "local"
+	append_batch_size = None
+	
+	def __init__(self, port=ROCEV2_UDP_PORT, max_reports=1<<21, burst=256, keywrite_slots=1<<20, append_slots=1<<16, num_lists=4, postcarder_slots=1<<16):
+		assert has_mmsg, "sendmmsg/recvmmsg are not available"
+		
+		self.port = port
+		self.max_reports = max_reports
+		self.burst = burst
+		self.slots = {"keywrite_slots": keywrite_slots, "append_slots": append_slots, "num_lists": num_lists, "postcarder_slots": postcarder_slots}
+	
+	def setup(self):
+		pass
+	
+	def prepare(self, append_batch_size):
+		self.append_batch_size = append_batch_size
+	
+	def runStep(self, primitive, rate, redundancy, duration):
+		num_reports = max(min(int(rate*duration), self.max_reports), 1)
+		
+		translator = Translator(append_batch_size=self.append_batch_size)
+		translator.setupDefault(**self.slots)
+		reports = generateReports(primitive, num_reports, redundancy=redundancy, num_lists=self.slots["num_lists"])
+		emitted = translator.process(reports)
+		
+		#Only the RoCEv2 packets go to the collector (not DTA NACKs)
+		heads = emitted.headers(UDP_OFFSET+4)
+		dstPort = heads[:,UDP_OFFSET+2].astype(np.uint16) << 8 | heads[:,UDP_OFFSET+3]
+		rdma = emitted.select(np.flatnonzero(dstPort == ROCEV2_UDP_PORT))
+		
+		collector = SoftCollector.fromDefault(directory=None, **self.slots)
+		sock = shardedSockets(1, "127.0.0.1", self.port)[0]
+		
+		send_duration = num_reports/rate
+		context = multiprocessing.get_context("fork")
+		receiver = context.Process(target=collector.receive, args=(sock, send_duration + RECEIVE_GRACE))
+		receiver.start()
+		try:
+			duration = self.send(rdma, rate*len(rdma)/num_reports)
+		finally:
+			receiver.join()
+			sock.close()
+		
+		stats = collector.stats[:len(collector.regions)]
+		rows = {region.name: i for i,region in enumerate(collector.regions)}
+		goodput, occupancy, query_rate, query_hit_ratio = self.measure(primitive, collector, stats, rows, redundancy, num_reports, duration)
+		
+		return resultRow(self.name, primitive, rate, redundancy, self.append_batch_size, duration, num_reports, len(rdma), int(stats["packets"].sum()), int(stats["psn_gaps"].sum()), goodput, occupancy, query_rate, query_hit_ratio)
+	
+	#Send the UDP payloads (from the BTH on) of the frames, paced at packet_rate in bursts of sendmmsg. Returns the send duration
+	def send(self, frames, packet_rate):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sock.connect(("127.0.0.1", self.port))
+		
+		#Frames can differ in length, so every message gets its own iovec into the frame buffer
+		iovecs = np.zeros(len(frames), dtype=IOVEC)
+		iovecs["iov_base"] = frames.buffer.ctypes.data + frames.offsets.astype(np.uintp) + BTH_OFFSET
+		iovecs["iov_len"] = frames.lengths - BTH_OFFSET
+		messages = np.zeros(len(frames), dtype=MMSGHDR)
+		messages["msg_iov"] = iovecs.ctypes.data + np.arange(len(frames), dtype=np.uintp)*IOVEC.itemsize
+		messages["msg_iovlen"] = 1
+		
+		t_start = time.perf_counter()
+		sent = 0
+		while sent < len(frames):
+			wait = t_start + sent/packet_rate - time.perf_counter()
+			if wait > 0:
+				time.sleep(wait)
+			
+			ret = libc.sendmmsg(sock.fileno(), ctypes.c_void_p(messages.ctypes.data + sent*MMSGHDR.itemsize), min(self.burst, len(frames)-sent), 0)
+			if ret < 0:
+				errno = ctypes.get_errno()
+				if errno in [11, 105]: #EAGAIN, ENOBUFS: the packets are lost, like on a congested link
+					sent += min(self.burst, len(frames)-sent)
+					continue
+				raise OSError(errno, "sendmmsg failed")
+			sent += ret
+		
+		duration = time.perf_counter() - t_start
+		sock.close()
+		
+		return duration
+	
+	#What actually landed in collector memory: reports per second whose data is there, the share of used entries, and the query rate
+	def measure(self, primitive, collector, stats, rows, redundancy, num_reports, duration):
+		if primitive == "keywrite":
+			region = collector.regions[rows["keywrite"]]
+			store = KeyWriteStore(region.entries, redundancy=redundancy)
+			keys = np.arange(num_reports, dtype=np.uint32)
+			
+			t_start = time.perf_counter()
+			data, found = store.query(keys)
+			query_time = time.perf_counter() - t_start
+			
+			correct = found & (data == keys+1) #generateReports writes key+1 as data
+			return correct.sum()/duration, np.count_nonzero(region.entries["checksum"])/len(region.entries), num_reports/query_time, correct.mean()
+		
+		if primitive == "keyincrement":
+			region = collector.regions[rows["keywrite"]]
+			counters = region.memory.view("<u8")
+			return counters.sum()/redundancy/duration, np.count_nonzero(counters)/len(counters), None, None
+		
+		if primitive == "append":
+			lists = [rows[name] for name in rows if name.startswith("list")]
+			entries = sum(np.count_nonzero(collector.regions[row].entries["data"]) for row in lists)
+			slots = sum(len(collector.regions[row].entries) for row in lists)
+			return int(stats["writes"][lists].sum())*self.append_batch_size/duration, entries/slots, None, None
+		
+		#Postcarder: early flushes write partial paths more than once, so the written slots are counted rather than the writes
+		region = collector.regions[rows["postcarder"]]
+		paths = np.count_nonzero(region.memory.reshape(len(region.entries), -1).any(axis=1))
+		return paths*POSTCARDER_NUM_HOPS/duration, paths/len(region.entries), None, None
+
+#TReX -> Tofino translator -> RDMA collector, measured through the NIC counters of the collector
+class TestbedBackend:
+	name = "testbed"
+	append_batch_size = None
+	
+	def __init__(self, tofino, collector, generator, collector_iface="ens1f1np1", rdma_device="mlx5_1"):
+		self.tofino = tofino
+		self.collector = collector
+		self.generator = generator
+		self.collector_iface = collector_iface
+		self.rdma_device = rdma_device
+	
+	#Bring up TReX (with its RPC statistics) and the collector host before the sweep, concurrently. The translator is brought up by prepare()
+	def setup(self):
+		orchestrator = Orchestrator()
+		orchestrator.add("generator.setup", self.generator.setup)
+		orchestrator.add("collector.setupCollector", self.collector.setupCollector)
+		orchestrator.run()
+	
+	#Start a fresh collector for the translator to connect to. The QPs of the previous one, and the RDMA sessions stored with them, are gone
+	def restartCollector(self):
+		self.collector.killOldCollector()
+		self.collector.startCollector()
+		self.tofino.clearRDMASessions()
+	
+	#A different Append batch size needs a recompiled pipeline, and a new bring-up of the translator
+	def prepare(self, append_batch_size):
+		if append_batch_size == self.append_batch_size:
+			return
+		
+		self.tofino.compilePipeline(append_batch_size=append_batch_size)
+		self.tofino.flashPipeline()
+		self.tofino.confPorts()
+		self.tofino.configureNetworking()
+		self.restartCollector()
+		self.tofino.startController()
+		self.append_batch_size = append_batch_size
+	
+	def counters(self):
+		output = self.collector.run("ethtool -S %s; echo out_of_sequence: $(cat /sys/class/infiniband/%s/ports/1/hw_counters/out_of_sequence)" %(self.collector_iface, self.rdma_device))
+		
+		counters = {}
+		for line in output.splitlines():
+			name, _, value = line.partition(":")
+			if value.strip().isdigit():
+				counters[name.strip()] = int(value)
+		
+		return counters
+	
+	def runStep(self, primitive, rate, redundancy, duration):
+		speed = "%ipps" %rate
+		if primitive == "keywrite":
+			self.generator.startTraffic_keywrite(speed=speed, redundancy=redundancy)
+		elif primitive == "keyincrement":
+			self.generator.startTraffic_keyincrement(speed=speed, redundancy=redundancy)
+		elif primitive == "append":
+			self.generator.startTraffic_append(speed=speed)
+		else:
+			assert False, "The generator has no %s traffic script" %primitive
+		
+		#Measure once TReX is at the target rate
+		try:
+			before = self.counters()
+			t_start = time.time()
+			time.sleep(duration)
+			#The mean TReX rate over the measurement, rather than a single reading at its end
+			rate_sent = self.generator.stats.mean("tx_pps", since=t_start) or self.generator.findCurrentRate()
+			after = self.counters()
+			duration = time.time() - t_start
+		finally:
+			self.generator.stopTraffic()
+		
+		delta = lambda name: after.get(name, 0) - before.get(name, 0)
+		reports_sent = int(rate_sent*duration)
+		rdma_received = delta("rx_vport_rdma_unicast_packets")
+		
+		return resultRow(self.name, primitive, rate, redundancy, self.append_batch_size, duration, reports_sent, reports_sent*rdmaPerReport(primitive, redundancy, self.append_batch_size), rdma_received, delta("out_of_sequence"), rdma_received/rdmaPerReport(primitive, redundancy, self.append_batch_size)/duration)
+
+#Appends rows as they come, so that an interrupted sweep keeps its results. Parquet files are written at the end
+class ResultWriter:
+	def __init__(self, path):
+		self.path = path
+		self.rows = []
+		self.file = None
+		
+		if path.endswith(".parquet"):
+			import pandas #Only needed for Parquet output (with pyarrow or fastparquet). Imported here to fail before the sweep
+		else:
+			self.file = open(path, "w", newline="")
+			self.writer = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS)
+			self.writer.writeheader()
+	
+	def add(self, row):
+		self.rows.append(row)
+		if self.file is not None:
+			self.writer.writerow(row)
+			self.file.flush()
+	
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+		else:
+			import pandas
+			pandas.DataFrame(self.rows, columns=RESULT_FIELDS).to_parquet(self.path)
+
+#Non-append primitives do not depend on the Append batch size, and only run with the first one
+def sweepSteps(primitives, rates, redundancies, append_batch_sizes):
+	steps = []
+	for append_batch_size in append_batch_sizes:
+		for primitive in primitives:
+			if primitive != "append" and append_batch_size != append_batch_sizes[0]:
+				continue
+			for rate in rates:
+				for redundancy in (redundancies if primitive in REDUNDANT_PRIMITIVES else [1]):
+					steps.append((append_batch_size, primitive, rate, redundancy))
+	
+	return steps
+
+def sweep(backend, steps, duration, output):
+	writer = ResultWriter(output)
+	backend.setup()
+	
+	try:
+		for i,(append_batch_size,primitive,rate,redundancy) in enumerate(steps):
+			log("Benchmark: \tStep %i/%i: %s at %i pps, redundancy %i, Append batch size %i" %(i+1, len(steps), primitive, rate, redundancy, append_batch_size))
+			
+			#A failed step (e.g., TReX missing the target rate, or a failed bring-up of the translator) is recorded, and the sweep goes on
+			try:
+				backend.prepare(append_batch_size)
+				row = backend.runStep(primitive, rate, redundancy, duration)
+			except Exception as e:
+				row = resultRow(backend.name, primitive, rate, redundancy, append_batch_size, 0, 0, 0, 0)
+				row["error"] = repr(e)
+			
+			writer.add(row)
+			print("  sent %.0f pps, loss %s, goodput %s pps" %(row["rate_sent_pps"] or 0, "%.4f" %row["loss_ratio"] if row["loss_ratio"] is not None else "-", "%.0f" %row["goodput_pps"] if row["goodput_pps"] is not None else "-"))
+	finally:
+		writer.close()
+	
+	log("Benchmark: \t%i results stored in %s" %(len(writer.rows), output))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Sweep DTA benchmarks over rates, redundancies, and Append batch sizes, and store the results.')
+	parser.add_argument('--local', action='store_true', help='Run against the translator model and the stand-in collector, without the testbed')
+	parser.add_argument('--primitives', type=str, nargs='+', choices=PRIMITIVES, default=["keywrite", "append"], help='The primitives to benchmark')
+	parser.add_argument('--rates', type=str, nargs='+', default=["100kpps"], help='Report rates, e.g., 500kpps 1mpps')
+	parser.add_argument('--redundancies', type=int, nargs='+', default=[1, 2, 4], help='Redundancy levels (KeyWrite and KeyIncrement)')
+	parser.add_argument('--append_batch_sizes', type=int, nargs='+', default=[4], help='APPEND_BATCH_SIZE values (the testbed pipeline is recompiled for each)')
+	parser.add_argument('--duration', type=float, default=10, help='Seconds per step')
+	parser.add_argument('--output', type=str, default="results.csv", help='The results file (.csv, or .parquet)')
+	parser.add_argument('--port', type=int, default=ROCEV2_UDP_PORT, help='Local: the UDP port of the stand-in collector')
+	parser.add_argument('--max_reports', type=int, default=1<<21, help='Local: cap on the number of reports per step')
+	parser.add_argument('--tofino', type=str, default="jonatan@138.37.32.13", help='Testbed: the Tofino host')
+	parser.add_argument('--collector', type=str, default="jlanglet@138.37.32.24", help='Testbed: the collector host')
+	parser.add_argument('--generator', type=str, default="jlanglet@138.37.32.28", help='Testbed: the traffic generator host')
+	args = parser.parse_args()
+	
+	steps = sweepSteps(args.primitives, [strToPktrate(rate) for rate in args.rates], args.redundancies, args.append_batch_sizes)
+	
+	if args.local:
+		backend = LocalBackend(port=args.port, max_reports=args.max_reports)
+	else:
+		from Tofino import Tofino
+		from Collector import Collector
+		from Generator import Generator
+		
+		backend = TestbedBackend(Tofino(host=args.tofino, pipeline="dta_translator"), Collector(host=args.collector), Generator(host=args.generator))
+	
+	sweep(backend, steps, args.duration, args.output)
@@ -22,57 +22,34 @@ class Collector(Machine):
 	def configureNetworking(self):
 		self.log("Configuring networking...")
 		
-		ssh = self.init_ssh()
-		
-		time.sleep(0.5)
-		
-		ssh.sendline("./network_setup.sh")
-		i = ssh.expect(["$", pexpect.TIMEOUT], timeout=10)
-		assert i == 0, "Timeout while running network setup script!"
+		self.run("./network_setup.sh", timeout=10, error="Timeout while running network setup script!")
 		
 		#Check IP assignment
-		ssh.sendline("ifconfig ens1f1np1")
-		i = ssh.expect(["10.0.0.51", pexpect.TIMEOUT], timeout=2)
-		assert i == 0, "Network interface failed to configure!"
+		self.run("ifconfig ens1f1np1", expect="10.0.0.51", timeout=2, error="Network interface failed to configure!")
 		
 		#Check one of the ARP rules
-		ssh.sendline("arp 10.0.0.101")
-		i = ssh.expect(["84:c7:8f:00:6d:b3", pexpect.TIMEOUT], timeout=2)
-		assert i == 0, "ARP rules failed to update!"
-		
-		time.sleep(2)
+		self.run("arp 10.0.0.101", expect="84:c7:8f:00:6d:b3", timeout=2, error="ARP rules failed to update!")
 		
 		self.debug("Networking is set up.")
 	
 	def disabelICRCVerification(self):
 		self.log("Disabling iCRC verification on the NIC...")
 		
-		ssh = self.init_ssh()
-		
-		ssh.sendline("./disable-icrc.sh")
-		i = ssh.expect(["WARNING: this script assumes", pexpect.TIMEOUT], timeout=2)
-		assert i == 0, "Failed to start the disable-icrc.sh script!"
-		
-		i = ssh.expect(["$", pexpect.TIMEOUT], timeout=10)
-		assert i == 0, "Timeout while running icrc disabling script!"
+		self.run("./disable-icrc.sh", expect="WARNING: this script assumes", timeout=12, error="Failed to run the disable-icrc.sh script!")
 		
-		time.sleep(5)
+		#The NIC is reconfigured, wait for its RDMA link to come back
+		self.pollCommand("rdma link show", "state ACTIVE", timeout=30)
 		
 		self.debug("iCRC verification is now disabled")
 	
 	def setupRDMA(self):
 		self.log("Setting up RDMA...")
 		
-		ssh = self.init_ssh()
-		
-		ssh.sendline("./rdma/setup_rdma.sh")
-		i = ssh.expect(["Removing old modules", pexpect.TIMEOUT], timeout=2)
-		assert i == 0, "Failed to start setup_rdma.sh!"
-		
-		i = ssh.expect(["INFO System info file", pexpect.TIMEOUT], timeout=20)
-		assert i == 0, "Timeout while setting up RDMA!"
+		output = self.run("./rdma/setup_rdma.sh", timeout=22, error="Timeout while setting up RDMA!")
+		assert "Removing old modules" in output, "Failed to start setup_rdma.sh!"
+		assert "INFO System info file" in output, "RDMA setup did not finish!"
 		
-		time.sleep(2)
+		self.pollCommand("rdma link show", "state ACTIVE", timeout=30)
 		
 		self.debug("RDMA is now set up and configured!")
 	
@@ -119,35 +96,22 @@ class Collector(Machine):
 	def compileCollector(self):
 		self.log("Compiling the collector service...")
 		
-		ssh = self.init_ssh()
-		
-		ssh.sendline("cd ./rdma/playground")
-		ssh.expect("$", timeout=2)
-		
-		ssh.sendline("mv ./collector_new ./collector_backup_new")
-		ssh.expect("$", timeout=2)
+		#Pooled shells are shared, so commands neither rely on nor leave behind a 'cd' (compile.sh runs in a subshell)
+		self.run("mv ./rdma/playground/collector_new ./rdma/playground/collector_backup_new", timeout=2)
 		
-		ssh.sendline("./compile.sh")
-		i = ssh.expect(["Compiling DTA Collector...", pexpect.TIMEOUT], timeout=10)
-		assert i == 0, "Compilation did not start!"
+		output = self.run("(cd ./rdma/playground && ./compile.sh)", timeout=30, error="Timeout while compiling collector service!")
+		assert "Compiling DTA Collector..." in output, "Compilation did not start!"
+		assert "Compilation done" in output, "Compilation did not finish!"
 		
-		i = ssh.expect(["Compilation done", pexpect.TIMEOUT], timeout=20)
-		assert i == 0, "Timeout while compiling collector service!"
-		
-		ssh.sendline("ls -l")
-		i = ssh.expect(["collector_new", pexpect.TIMEOUT], timeout=5)
-		assert i == 0, "Failed to compile collector service!"
+		self.run("ls -l ./rdma/playground", expect="collector_new", timeout=5, error="Failed to compile collector service!")
 		
 		self.debug("Compilation finished")
 	
 	def killOldCollector(self):
 		self.debug("Killing old collectors, if any are running")
-		ssh = self.init_ssh()
-		ssh.sendline("sudo killall collector_new")
-		i = ssh.expect(["$", pexpect.TIMEOUT], timeout=10)
-		assert i == 0, "Timeout while killing old collector service(s)!"
+		self.run("sudo killall collector_new", timeout=10, error="Timeout while killing old collector service(s)!")
 		
-		time.sleep(2)
+		self.pollCommand("pgrep collector_new || echo No collector", "No collector", timeout=10)
 	
 	def setupCollector(self):
 		self.log("Setting up the collector...")
@@ -170,14 +134,10 @@ class Collector(Machine):
 		i = self.ssh_collector.expect(["Press ENTER to analyze storage.", pexpect.TIMEOUT], timeout=10)
 		assert i == 0, "Failed to start the DTA collector!"
 		
-		
-		time.sleep(3) #Give time for various primitive threads to complete
-		
-		i = self.ssh_collector.expect(["Segmentation fault", pexpect.TIMEOUT], timeout=2)
+		#Give the primitive threads time to set up, failing early on a segfault
+		i = self.ssh_collector.expect(["Segmentation fault", pexpect.TIMEOUT], timeout=3)
 		assert i == 1, "The collector returned a segfault during startup!"
 		
-		time.sleep(2)
-		
 		self.log("DTA collector service is now running")
 		
 	def verifyRDMAConnections(self):
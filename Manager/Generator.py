@@ -7,6 +7,7 @@ import datetime
 
 from common import strToPktrate
 from Machine import Machine
+from TrexStats import TrexStats, TrexRPC
 
 class Generator(Machine):
 	interface = None
@@ -14,6 +15,7 @@ class Generator(Machine):
 	
 	ssh_trex = None
 	ssh_trexConsole = None
+	stats = None #TrexStats, polling the TReX RPC server once it runs
 	
 	def __init__(self, host, name="Generator"):
 		self.host = host
@@ -25,21 +27,13 @@ class Generator(Machine):
 	def configureNetworking(self):
 		self.log("Configuring networking...")
 		
-		ssh = self.init_ssh()
-		
-		ssh.sendline("./network_setup.sh")
-		i = ssh.expect(["$", pexpect.TIMEOUT], timeout=10)
-		assert i == 0, "Timeout while running network setup script!"
+		self.run("./network_setup.sh", timeout=10, error="Timeout while running network setup script!")
 		
 		#Check IP assignment (disabled, dpdk will remove this interface)
-		#ssh.sendline("ifconfig ens2f0")
-		#i = ssh.expect(["10.0.0.200", pexpect.TIMEOUT], timeout=2)
-		#assert i == 0, "Network interface failed to configure!"
+		#self.run("ifconfig ens2f0", expect="10.0.0.200", timeout=2, error="Network interface failed to configure!")
 		
 		#Check one of the ARP rules
-		#ssh.sendline("arp 10.0.0.51")
-		#i = ssh.expect(["b8:ce:f6:d2:12:c7", pexpect.TIMEOUT], timeout=2)
-		#assert i == 0, "ARP rules failed to update!"
+		#self.run("arp 10.0.0.51", expect="b8:ce:f6:d2:12:c7", timeout=2, error="ARP rules failed to update!")
 		
 		self.log("Networking is set up.")
 	
@@ -58,6 +52,23 @@ class Generator(Machine):
 		i = self.ssh_trex.expect(["Global stats enabled", pexpect.TIMEOUT], timeout=30)
 		assert i == 0, "Trex start timed out!"
 		
+		self.connectStats()
+	
+	#Poll the TReX counters over its RPC interface, rather than scraping the daemon output
+	def connectStats(self, port=4501, interval=0.1):
+		if self.stats is not None:
+			self.stats.stop()
+			self.stats.rpc.close()
+		
+		self.log("Connecting to the TReX RPC server...")
+		self.stats = TrexStats(TrexRPC(self.host.split("@")[-1], port))
+		self.stats.start(interval=interval)
+	
+	#Store the sampled TReX time series as CSV
+	def saveStats(self, path):
+		assert self.stats is not None, "TReX statistics are not connected!"
+		num_samples = self.stats.save(path)
+		self.log("Stored %i TReX samples in %s" %(num_samples, path))
 		
 		
 		
@@ -78,8 +89,6 @@ class Generator(Machine):
 		
 		self.log("TReX Console is running!")
 		
-		time.sleep(2)
-		
 	def setup(self):
 		self.log("Setting up the generator")
 		
@@ -87,58 +96,26 @@ class Generator(Machine):
 		self.startTrex()
 		self.startTrexConsole()
 	
-	#TODO: make this check Tofino rate-show!
+	#The transmitted rate (pps) of the latest TReX sample
 	def findCurrentRate(self):
-		trafficFlowing = False
-		for i in range(10):
-			
-			time.sleep(2)
-			
-			#Clear the output buffer
-			self.ssh_trex.read_nonblocking(1000000000, timeout = 1)
-			i = self.ssh_trex.expect(["Total-PPS       :       0.00  pps", pexpect.TIMEOUT], timeout=1)
-			
-			if i == 1:
-				trafficFlowing = True
-				break
-			else:
-				self.log("No traffic yet...")
-		
-		if not trafficFlowing:
-			return 0
-		
-		#assert trafficFlowing, "TReX does not actually generate traffic!"
+		assert self.stats is not None, "TReX statistics are not connected!"
 		
-		#Retrieve reported packet rate
-		self.ssh_trex.expect("Total-PPS", timeout=3)
-		rate_str = self.ssh_trex.readline()
-		rate_str = rate_str.decode('ascii').replace(" ", "").replace(":", "").replace("\r\n", "")
-		self.debug("The reported rate is: %s" %rate_str)
+		samples = self.stats.latest()
+		assert samples, "No TReX samples yet!"
 		
-		return strToPktrate(rate_str)
+		self.debug("The reported rate is: %.0f pps" %samples[-1].tx_pps)
+		return samples[-1].tx_pps
 	
+	#Wait until the transmitted rate is within error_target of the target, for several consecutive samples
 	def waitForSpeed(self, speed_target, error_target=0.1):
-		#Check in trex daemon that traffic is actually generating
-		self.log("Checking in TReX daemon that traffic is flowing...")
+		assert self.stats is not None, "TReX statistics are not connected!"
+		self.log("Checking in TReX statistics that traffic is flowing...")
 		
-		#Wait for the traffic to be in the correct range
 		rate_target = strToPktrate(speed_target)
-		for i in range(10):
-			time.sleep(2)
-			rate = self.findCurrentRate()
-			
-			error = 1 - rate/rate_target
-			
-			self.debug("We generate %s pps, the target is %s pps" %(str(rate), str(rate_target)))
-			
-			if error < error_target:
-				self.debug("The speed error is acceptable: %s" %str(error))
-				break
-			
-			self.debug("The speed error is too large: %s" %str(error))
-			
-		assert error < error_target, "The traffic rate error is too large!"
+		t_start = time.time()
+		rate = self.stats.waitForConvergence(rate_target, tolerance=error_target, timeout=20)
 		
+		self.debug("We generate %.0f pps, the target is %.0f pps (converged after %.2fs)" %(rate, rate_target, time.time() - t_start))
 		self.log("Traffic is flowing correctly!")
 	
 	#Start STL-based replays
@@ -1,14 +1,59 @@
 #!/usr/bin/env python3
 #This script contains the Machine class, with various functions shared between the components
+#All ssh sessions to a machine are multiplexed over one master connection (ControlMaster), so only the first one pays for the handshake
+#Short commands go through run(), on a pool of long-lived shells with a known prompt. Long-running services (switchd, TReX, the collector) get their own sessions through init_ssh()
+import re
+import subprocess
+import threading
 import time
 import pexpect
 
-from common import log
+from common import log, waitFor
+
+SSH_OPTIONS = "-o ControlMaster=auto -o ControlPath=/tmp/dta-ssh-%r@%h:%p -o ControlPersist=600"
+PROMPT_PATTERN = "\\[dta\\]\\$ " #Set as PS1='[dta]''$ ', so that the echoed assignment itself does not match
+
+#A long-lived shell with a known prompt and without echo, so that command output can be read reliably
+class Shell:
+	ssh = None
+	at_prompt = False
+	login_result = None
+	
+	def __init__(self, host, timeout=5):
+		self.ssh = pexpect.spawn("ssh %s %s" %(SSH_OPTIONS, host), encoding="utf-8", codec_errors="replace")
+		self.ssh.delaybeforesend = None #The default 50ms per command is only needed for password prompts
+		self.ssh.sendline("stty -echo; unset PROMPT_COMMAND; bind 'set enable-bracketed-paste off' 2>/dev/null; PS1='[dta]''$ '; PS2=''")
+		
+		i = self.ssh.expect([PROMPT_PATTERN, "Connection refused", pexpect.TIMEOUT, pexpect.EOF], timeout=timeout)
+		self.login_result = ["ok", "connection refused", "timeout", "ssh terminated"][i]
+		self.at_prompt = i == 0
+	
+	#Run a command and return its output, or None if the prompt did not come back in time
+	def run(self, command, timeout):
+		self.at_prompt = False
+		self.ssh.sendline(command)
+		
+		i = self.ssh.expect([PROMPT_PATTERN, pexpect.TIMEOUT, pexpect.EOF], timeout=timeout)
+		if i != 0:
+			return None
+		
+		self.at_prompt = True
+		return self.ssh.before.replace("\r\n", "\n")
+	
+	def close(self):
+		self.at_prompt = False
+		self.ssh.close(force=True)
 
 class Machine:
 	host = None
 	name = None
 	
+	sessions = None #Idle shells, at their prompt
+	latencies = None #command -> list of latencies (seconds)
+	num_logins = 0
+	login_time = 0
+	pool_lock = threading.Lock()
+	
 	def log(self, text):
 		log("%s: \t%s" %(self.name, text))
 	
@@ -21,54 +66,118 @@ class Machine:
 	
 	def reboot(self):
 		self.log("Rebooting %s at %s" %(self.name, self.host))
-		ssh = self.init_ssh()
-		ssh.sendline("sudo reboot")
-		i = ssh.expect([pexpect.EOF, pexpect.TIMEOUT], timeout=10)
+		shell = self.openShell()
+		assert shell is not None, "Can not log into %s!" %self.name
+		
+		shell.ssh.sendline("sudo reboot")
+		i = shell.ssh.expect([pexpect.EOF, pexpect.TIMEOUT], timeout=10)
 		assert i == 0, "Failed to detect reboot!"
 		
-		time.sleep(1)
+		#The pooled shells and the master connection died with the machine
+		self.closeSessions()
 	
 	def testConnection(self):
 		self.debug("Testing connection to %s at %s..." %(self.name, self.host))
 		
-		p = pexpect.spawn("ssh %s" %self.host)
-		i = p.expect(["Welcome to Ubuntu", "Connection refused", pexpect.TIMEOUT, pexpect.EOF], timeout=5)
-		if i == 0:
-			self.debug("Logged into %s" %self.host)
-		elif i == 1:
-			self.debug("Connection refused!")
-			return False
-		elif i == 2:
-			self.debug("Connection timeout!")
-			return False
-		elif i == 3:
-			self.debug("SSH terminates!")
+		shell = self.openShell()
+		if shell is None:
 			return False
 		
 		self.debug("Verifying command capability...")
-		content = "Testing"
-		p.sendline("echo \"%s\" > ssh_works" %content)
-		p.expect("$")
-		p.sendline("cat ssh_works")
-		i = p.expect([content, pexpect.TIMEOUT], timeout=2)
-		if i != 0:
+		output = shell.run("echo SSH works", timeout=2)
+		if output is None or "SSH works" not in output:
 			self.error("Did not find expected output!")
+			shell.close()
 			return False
 		
-		self.debug("Commands work! Resetting and logging out...")
+		self.debug("Commands work!")
+		self.release(shell)
+		
+		return True
+	
+	#A new shell (over the master connection, if one is up), or None if the login fails
+	def openShell(self, timeout=5):
+		t_start = time.time()
+		shell = Shell(self.host, timeout=timeout)
+		
+		if not shell.at_prompt:
+			self.debug("Can not log into %s: %s" %(self.host, shell.login_result))
+			shell.close()
+			return None
 		
-		p.sendline("rm ssh_works")
-		p.expect("$")
-		p.sendline("exit")
-		time.sleep(1)
+		self.num_logins += 1
+		self.login_time += time.time() - t_start
+		return shell
+	
+	#An idle shell from the pool, or a new one
+	def acquire(self):
+		with self.pool_lock:
+			if self.sessions is None:
+				self.sessions = []
+			while self.sessions:
+				shell = self.sessions.pop()
+				if shell.at_prompt and shell.ssh.isalive():
+					return shell
+				shell.close()
 		
-		p.close()
+		shell = self.openShell()
+		assert shell is not None, "Can not log into %s at %s!" %(self.name, self.host)
+		return shell
+	
+	#Return a shell to the pool. Only shells at their prompt are reused
+	def release(self, shell):
+		if not shell.at_prompt:
+			shell.close()
+			return
 		
-		return True
+		with self.pool_lock:
+			if self.sessions is None:
+				self.sessions = []
+			self.sessions.append(shell)
+	
+	def closeSessions(self):
+		with self.pool_lock:
+			for shell in self.sessions or []:
+				shell.close()
+			self.sessions = []
+		
+		subprocess.run("ssh %s -O exit %s" %(SSH_OPTIONS, self.host), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	
+	#Run a command on a pooled shell, and return its output once the prompt is back
+	#If expect is set (a regex), the output must contain it, otherwise the error message is raised
+	def run(self, command, expect=None, timeout=10, error=None):
+		shell = self.acquire()
 		
+		t_start = time.time()
+		output = shell.run(command, timeout)
+		latency = time.time() - t_start
+		
+		if self.latencies is None:
+			self.latencies = {}
+		self.latencies.setdefault(command, []).append(latency)
+		
+		if output is None:
+			shell.close()
+		assert output is not None, "%s (timeout after %gs running '%s' on %s)" %(error or "Command timed out!", timeout, command, self.name)
+		
+		self.release(shell)
+		
+		self.debug("'%s' took %.3fs" %(command, latency))
+		if expect is not None:
+			assert re.search(expect, output), "%s ('%s' on %s did not output '%s')" %(error or "Unexpected output!", command, self.name, expect)
+		
+		return output
+	
+	def latencyReport(self):
+		self.log("%i logins (%.3fs in total)" %(self.num_logins, self.login_time))
+		for command,latencies in sorted((self.latencies or {}).items(), key=lambda item: -sum(item[1])):
+			latencies = sorted(latencies)
+			print("  %6i x %8.3fs avg %8.3fs p50 %8.3fs max   %s" %(len(latencies), sum(latencies)/len(latencies), latencies[len(latencies)//2], latencies[-1], command))
+	
+	#A dedicated session, e.g., for a service that keeps running in the foreground
 	def init_ssh(self):
 		self.debug("Logging into %s at %s..." %(self.name, self.host))
-		p = pexpect.spawn("ssh %s" %self.host)
+		p = pexpect.spawn("ssh %s %s" %(SSH_OPTIONS, self.host))
 		i = p.expect(["$", pexpect.TIMEOUT], timeout=5)
 		
 		if i != 0:
@@ -78,3 +187,8 @@ class Machine:
 		self.debug("SSH to %s is initiated" %self.host)
 		
 		return p
+	
+	#Re-run a command until its output matches the pattern (readiness polling instead of fixed sleeps)
+	def pollCommand(self, command, pattern, timeout=30, interval=0.5):
+		duration = waitFor(lambda: re.search(pattern, self.run(command, timeout=timeout)) is not None, timeout=timeout, interval=interval, what="'%s' on %s" %(pattern, self.name))
+		self.debug("'%s' is ready after %.1fs" %(command, duration))
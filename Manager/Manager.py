@@ -4,6 +4,8 @@
 import time
 
 #from common import log, debug, strToPktrate
+from common import waitFor
+from Orchestrator import Orchestrator
 from Tofino import Tofino
 from Collector import Collector
 from Generator import Generator
@@ -13,41 +15,48 @@ host_collector = "jlanglet@138.37.32.24" #Point to the collector
 host_generator = "jlanglet@138.37.32.28" #Point to the traffic generator
 
 
+#The bring-up as a dependency graph: independent steps (e.g., Tofino flashing, collector RDMA setup, TReX startup) run concurrently
 def setup(do_reboot=False, manual_collector=True):
+	orchestrator = Orchestrator()
+
 	#Reboot the machines and wait for them to come back online
-	if do_reboot:
-		systems = [tofino, collector, generator]
-		
-		#Reboot all
-		for system in systems:
-			system.reboot()
-		
-		#Wait for all to come online
-		for system in systems:
-			while not system.testConnection():
-				print("%s is offline..." %system.name)
-				time.sleep(20)
+	online = {}
+	for system in [tofino, collector, generator]:
+		if do_reboot:
+			reboot = orchestrator.add("%s.reboot" %system.name.lower(), system.reboot)
+			online[system] = [orchestrator.add("%s.online" %system.name.lower(), lambda system=system: waitFor(system.testConnection, timeout=900, interval=5, what="%s to come online" %system.name), after=[reboot])]
+		else:
+			online[system] = []
 
+	flash = orchestrator.add("tofino.flashPipeline", tofino.flashPipeline, after=online[tofino])
+	ports = orchestrator.add("tofino.confPorts", tofino.confPorts, after=[flash])
+	networking = orchestrator.add("tofino.configureNetworking", tofino.configureNetworking, after=[flash])
 
-	tofino.flashPipeline()
-	tofino.confPorts()
+	collector_setup = orchestrator.add("collector.setupCollector", collector.setupCollector, after=online[collector])
 
-	tofino.configureNetworking()
-	collector.setupCollector()
+	#setupCollector kills the running collector, and with it the QPs of any stored RDMA sessions
+	sessions = orchestrator.add("tofino.clearRDMASessions", tofino.clearRDMASessions, after=online[tofino] + [collector_setup])
 
 	if manual_collector:
-		print("sudo /home/jlanglet/rdma/playground/collector_new")
-		input("Start the DTA collector and press ENTER")
+		def startManually():
+			print("sudo /home/jlanglet/rdma/playground/collector_new")
+			input("Start the DTA collector and press ENTER")
+		collector_start = orchestrator.add("collector.manualStart", startManually, after=[collector_setup], interactive=True)
 	else:
-		collector.startCollector()
+		collector_start = orchestrator.add("collector.startCollector", collector.startCollector, after=[collector_setup])
 
-
-	tofino.startController()
+	controller = orchestrator.add("tofino.startController", tofino.startController, after=[ports, networking, collector_start, sessions])
 
 	if not manual_collector:
-		collector.verifyRDMAConnections() #Manually disabled
+		orchestrator.add("collector.verifyRDMAConnections", collector.verifyRDMAConnections, after=[controller]) #Manually disabled
+
+	orchestrator.add("generator.setup", generator.setup, after=online[generator])
 
-	generator.setup()
+	try:
+		orchestrator.run()
+	finally:
+		for system in [tofino, collector, generator]:
+			system.latencyReport()
 
 def Menu():
 	print("1: \t(S)tart up DTA environment")
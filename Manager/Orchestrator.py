@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#This script contains the Orchestrator class, running setup steps concurrently according to their dependencies
+#Each step starts as soon as all steps it depends on have finished, so the bring-up takes as long as the longest chain of steps rather than the sum of all steps
+#The steps are blocking (pexpect sessions), and run in a thread pool. Interactive steps (e.g., waiting for the user to press ENTER) run on the main thread instead
+
+import time
+import concurrent.futures
+
+from common import log
+
+class Step:
+	name = None
+	function = None
+	after = None
+	interactive = False
+	
+	started = None
+	finished = None
+	error = None
+	
+	def __init__(self, name, function, after, interactive=False):
+		self.name = name
+		self.function = function
+		self.after = after
+		self.interactive = interactive
+	
+	@property
+	def duration(self):
+		if self.started is None or self.finished is None:
+			return None
+		return self.finished - self.started
+
+class Orchestrator:
+	steps = None
+	max_workers = 8
+	started = None
+	finished = None
+	
+	def __init__(self, max_workers=8):
+		self.steps = {}
+		self.max_workers = max_workers
+	
+	#Add a step, running function() once all steps in 'after' are done. Returns the step name, to be used in later dependencies
+	#Interactive steps run on the main thread, as input() from a worker thread competes with the other steps for the terminal
+	def add(self, name, function, after=[], interactive=False):
+		assert name not in self.steps, "Step %s is added twice!" %name
+		self.steps[name] = Step(name, function, list(after), interactive)
+		return name
+	
+	#Check that all dependencies exist and that there are no cycles
+	def validate(self):
+		for step in self.steps.values():
+			for dependency in step.after:
+				assert dependency in self.steps, "Step %s depends on unknown step %s!" %(step.name, dependency)
+		
+		remaining = {name: set(step.after) for name,step in self.steps.items()}
+		while remaining:
+			ready = [name for name,after in remaining.items() if not after]
+			assert ready, "The steps %s have circular dependencies!" %sorted(remaining)
+			for name in ready:
+				del remaining[name]
+			for after in remaining.values():
+				after.difference_update(ready)
+	
+	def runStep(self, step):
+		log("Orchestrator: \tStarting %s" %step.name)
+		step.started = time.time()
+		try:
+			step.function()
+		finally:
+			step.finished = time.time()
+	
+	#Run all steps. If a step fails, no new steps are started, the running steps are awaited, and the error is raised
+	def run(self):
+		self.validate()
+		
+		self.started = time.time()
+		done = set()
+		failed = None
+		running = {}
+		
+		with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+			while True:
+				interactive = []
+				if failed is None:
+					for step in self.steps.values():
+						if step.started is None and step.name not in running.values() and all(dependency in done for dependency in step.after):
+							if step.interactive:
+								interactive.append(step)
+							else:
+								running[executor.submit(self.runStep, step)] = step.name
+				
+				#The workers keep running their steps meanwhile
+				for step in interactive:
+					future = concurrent.futures.Future()
+					try:
+						self.runStep(step)
+						future.set_result(None)
+					except Exception as e:
+						future.set_exception(e)
+					running[future] = step.name
+				
+				if not running:
+					break
+				
+				completed, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+				for future in completed:
+					step = self.steps[running.pop(future)]
+					try:
+						future.result()
+					except Exception as e:
+						step.error = e
+						log("Orchestrator: \tERROR: %s failed after %.1fs: %s" %(step.name, step.duration, repr(e)))
+						if failed is None:
+							failed = step
+						continue
+					
+					done.add(step.name)
+					log("Orchestrator: \tFinished %s in %.1fs" %(step.name, step.duration))
+		
+		self.finished = time.time()
+		self.report()
+		
+		if failed is not None:
+			raise failed.error
+	
+	#The chain of steps that determined the total time: walk back from the last finished step, through the dependency that finished last
+	def criticalPath(self):
+		finished = [step for step in self.steps.values() if step.finished is not None]
+		if not finished:
+			return []
+		
+		path = [max(finished, key=lambda step: step.finished)]
+		while True:
+			dependencies = [self.steps[name] for name in path[-1].after if self.steps[name].finished is not None]
+			if not dependencies:
+				break
+			path.append(max(dependencies, key=lambda step: step.finished))
+		
+		return [step.name for step in reversed(path)]
+	
+	def report(self):
+		total = self.finished - self.started
+		serial = sum(step.duration for step in self.steps.values() if step.duration is not None)
+		
+		log("Orchestrator: \tStep timing report")
+		print("%-32s %10s %10s   %s" %("Step", "Start (s)", "Time (s)", "Status"))
+		for step in sorted(self.steps.values(), key=lambda step: (step.started is None, step.started or 0)):
+			if step.started is None:
+				print("%-32s %10s %10s   %s" %(step.name, "-", "-", "not started"))
+				continue
+			
+			status = "ok" if step.error is None else "FAILED (%s)" %repr(step.error)
+			print("%-32s %10.1f %10.1f   %s" %(step.name, step.started - self.started, step.duration, status))
+		
+		print("Total %.1fs (%.1fs if run in sequence)" %(total, serial))
+		print("Critical path: %s" %" -> ".join(self.criticalPath()))
@@ -7,6 +7,7 @@
 import pexpect
 import time
 import datetime
+import json
 
 from Machine import Machine
 
@@ -19,6 +20,10 @@ class Tofino(Machine):
 	ssh_switchd = None
 	ssh_controller = None
 	
+	trace_file = "/home/jonatan/dta_translator_trace.json" #The bootstrap timeline, written by the controller (tracefile in switch_cpu.py)
+	trace = None #Chrome trace events of the last controller bootstrap
+	session_store = "/home/jonatan/projects/dta/translator/rdma_sessions.bin" #RDMA sessions kept by the controller (rdma_session_store in switch_cpu.py)
+	
 	def __init__(self, host, pipeline, name="Tofino"):
 		self.host = host
 		self.name = name
@@ -62,9 +67,6 @@ class Tofino(Machine):
 		
 		assert append_batch_size in [1,2,4,8,16], "Unsupported Append batch size"
 		
-		
-		ssh = self.init_ssh()
-		
 		#
 		# Generate compilation command
 		#
@@ -90,26 +92,22 @@ class Tofino(Machine):
 		
 		self.debug("Executing '%s'..." %command)
 		
-		ssh.sendline(command)
-		i = ssh.expect(["Compilation finished", "error:", pexpect.TIMEOUT], timeout=180)
+		output = self.run(command, timeout=180, error="Compilation timeout!")
 		
-		if i == 1:
+		if "error:" in output:
 			self.error("Compilation error!")
-		elif i == 2:
-			self.error("Compilation timeout!")
 		
-		assert i == 0, "Pipeline compilation failed!"
+		assert "Compilation finished" in output, "Pipeline compilation failed!"
 		
 		self.debug("Compilation done!")
 		
 	
 	def flashPipeline(self):
-		self.ssh_switchd = self.init_ssh()
-		
 		#Killing old process (if one is running)
-		self.ssh_switchd.sendline("sudo killall bf_switchd")
-		self.ssh_switchd.expect("$", timeout=4)
+		self.run("sudo killall bf_switchd", timeout=4)
 		
+		#switchd keeps running in the foreground of its own session
+		self.ssh_switchd = self.init_ssh()
 		
 		#Flash the pipeline
 		self.log("Flashing pipeline %s at %s" %(self.pipeline, self.host))
@@ -158,7 +156,7 @@ class Tofino(Machine):
 			self.debug("Checking port %s..." %port)
 			
 			portUp = False
-			for i in range(10):
+			for i in range(50):
 				ssh_ucli.sendline("show %s" %port)
 				i = ssh_ucli.expect([port, pexpect.TIMEOUT], timeout=10)
 				assert i == 0, "Port %s was not configured!" %port
@@ -168,7 +166,7 @@ class Tofino(Machine):
 				assert i != 2, "Timeout when checking port status!"
 				if i == 1:
 					self.debug("Port %s is down..." %port)
-					time.sleep(5)
+					time.sleep(1)
 					continue
 				elif i == 0:
 					self.debug("Port %s is up!" %port)
@@ -185,15 +183,13 @@ class Tofino(Machine):
 		
 		ssh_ucli = self.initUCLI()
 		
+		#Wait for the ucli prompt after each command, instead of a fixed delay
 		for cmd in self.port_config:
 			self.debug(" > %s" %cmd)
 			ssh_ucli.sendline(cmd)
-			time.sleep(0.1)
-		
-		i = ssh_ucli.expect(["bf-sde.bf_pltfm.led", pexpect.TIMEOUT], timeout=5)
-		assert i == 0, "Failed to enter port config commands!"
+			i = ssh_ucli.expect(["bf-sde.*>", pexpect.TIMEOUT], timeout=5)
+			assert i == 0, "No ucli prompt after '%s'!" %cmd
 		
-		time.sleep(1) #Give configuration time to trigger
 		self.debug("Ports are now configured.")
 		
 		self.verifyPorts()
@@ -201,30 +197,30 @@ class Tofino(Machine):
 	def configureNetworking(self):
 		self.log("Configuring networking...")
 		
-		ssh = self.init_ssh()
-		
-		ssh.sendline("./network_setup.sh")
-		i = ssh.expect(["$", pexpect.TIMEOUT], timeout=10)
-		assert i == 0, "Timeout while running network setup script!"
+		self.run("./network_setup.sh", timeout=10, error="Timeout while running network setup script!")
 		
 		#Check an IP assignment
-		ssh.sendline("ifconfig enp4s0f0")
-		i = ssh.expect(["10.0.0.101", pexpect.TIMEOUT], timeout=2)
-		assert i == 0, "Network interface failed to configure!"
+		self.run("ifconfig enp4s0f0", expect="10.0.0.101", timeout=2, error="Network interface failed to configure!")
 		
 		#Check one of the ARP rules
-		ssh.sendline("arp 10.0.0.51")
-		i = ssh.expect(["b8:ce:f6:d2:12:c7", pexpect.TIMEOUT], timeout=2)
-		assert i == 0, "ARP rules failed to update!"
+		self.run("arp 10.0.0.51", expect="b8:ce:f6:d2:12:c7", timeout=2, error="ARP rules failed to update!")
 		
 		self.debug("Networking is set up.")
 	
+	#Forget the stored RDMA sessions. Their QPs and rkeys die with the collector, so this is needed whenever the collector restarts
+	def clearRDMASessions(self):
+		self.debug("Clearing the RDMA session store...")
+		self.run("python3 /home/jonatan/projects/dta/translator/rdma_sessions.py --clear --store %s" %self.session_store, timeout=10, error="Failed to clear the RDMA session store!")
+	
 	def startController(self):
 		self.log("Starting the controller...")
 		
 		#TODO: Make this into a parameter or dynamic depending on pipeline
 		#file_script = "/home/jonatan/projects/dta/translator/switch_cpu.py"
 		
+		#A timeline left from an earlier bootstrap would be mistaken for this one
+		self.run("rm -f %s" %self.trace_file, timeout=2)
+		
 		self.ssh_controller = self.init_ssh()
 		
 		self.ssh_controller.sendline("$SDE/run_bfshell.sh -b /home/jonatan/projects/dta/translator/switch_cpu.py -i")
@@ -236,29 +232,42 @@ class Tofino(Machine):
 		assert i == 0, "Controller script failed to start!"
 		self.debug("Controller script is starting...")
 		
-		#TODO: add checks that we hear back from the collector RDMA NIC here!
-		
-		i = self.ssh_controller.expect(["Inserting KeyWrite rules...", pexpect.TIMEOUT], timeout=5)
-		assert i == 0, "Timeout waiting for keywrite preparation!"
-		self.debug("Controller is configuring KeyWrite...")
+		i = self.ssh_controller.expect(["DigProc: Bootstrap complete", pexpect.TIMEOUT], timeout=60)
+		assert i == 0, "Timeout waiting for controller to finish!"
 		
+		#The RDMA connections and bootstrap phases come from the controller's timeline, instead of its log lines
+		self.collectTrace()
 		
-		numConnections = 0
-		while True:
-			i = self.ssh_controller.expect(["DigProc: Setting up a new RDMA connection from virtual client...", pexpect.TIMEOUT], timeout=10)
-			if i == 0:
-				numConnections += 1
-				self.debug("An RDMA connection is establishing at translator. Total %i" %numConnections)
-			else:
-				break
+		handshakes = [event for event in self.trace if event["ph"] == "X" and event["cat"] == "rdma" and event["name"].startswith("handshake")]
+		established = [event for event in handshakes if event["args"].get("state") == "established"]
+		reused = [port for event in self.trace if event["name"] == "load RDMA sessions" for port in event["args"].get("reused", [])]
+		for event in handshakes:
+			self.debug("RDMA handshake with port %i: %s after %.3fs (%i attempts)" %(event["args"]["port"], event["args"]["state"], event["dur"]/1000000, event["args"]["attempts"]))
 		
-		self.log("There seems to be %i RDMA connections established at the translator" %numConnections)
+		numConnections = len(established) + len(reused)
+		self.log("There are %i RDMA connections at the translator (%i established, %i reused sessions, %i failed)" %(numConnections, len(established), len(reused), len(handshakes)-len(established)))
 		assert numConnections > 0, "No RDMA connections were detected at the translator!"
 		
-		i = self.ssh_controller.expect(["DigProc: Bootstrap complete", pexpect.TIMEOUT], timeout=60)
-		assert i == 0, "Timeout waiting for controller to finish!"
 		self.log("Controller bootstrap finished!")
 	
+	#Fetch the bootstrap timeline of the controller, and log its phases
+	def collectTrace(self):
+		output = self.run("cat %s" %self.trace_file, expect="traceEvents", timeout=10, error="The controller did not store its bootstrap timeline!")
+		self.trace = json.loads(output)["traceEvents"]
+		
+		phases = sorted([event for event in self.trace if event["ph"] == "X" and event["cat"] == "phase"], key=lambda event: event["ts"])
+		for event in phases:
+			self.debug("%-32s %8.3fs (at %.3fs)" %(event["name"], event["dur"]/1000000, event["ts"]/1000000))
+		
+		return self.trace
+	
+	#Store the last bootstrap timeline locally (Chrome trace, open in chrome://tracing or https://ui.perfetto.dev)
+	def saveTrace(self, path):
+		assert self.trace is not None, "No controller timeline collected yet!"
+		with open(path, "w") as f:
+			json.dump({"traceEvents": self.trace, "displayTimeUnit": "ms"}, f)
+		self.log("Stored the controller timeline in %s" %path)
+	
 	def ui_compilePipeline(self):
 		self.log("Menu for compiling Translator pipeline.")
 		
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+#This script contains the TReX statistics subsystem: structured stats straight from the TReX JSON-RPC server (ZMQ, port 4501), instead of scraping the TReX terminal
+#TrexStats samples global, per-port, and per-stream (flow stats pgid) counters at a fixed interval into a ring buffer, detects rate convergence, and stores the time series as CSV
+#MockTrexServer answers the same RPC methods with a synthetic rate that converges towards a target, for testing without a generator
+#Usage example: ./TrexStats.py --server 138.37.32.28 --interval 0.1 --duration 30 --output trex_stats.csv, or ./TrexStats.py --mock
+
+import argparse
+import collections
+import csv
+import json
+import math
+import threading
+import time
+
+from common import log
+
+TREX_RPC_PORT = 4501
+TREX_API_VERSION = (5, 1) #STL API version handed to api_sync_v2
+
+GLOBAL_FIELDS = ["tx_pps", "rx_pps", "tx_bps", "rx_bps", "rx_drop_bps", "queue_full", "cpu_util"]
+PORT_FIELDS = ["opackets", "ipackets", "obytes", "ibytes", "oerrors", "ierrors"]
+STREAM_FIELDS = ["tx_pkts", "rx_pkts", "tx_pps", "rx_pps"]
+
+#JSON-RPC 2.0 over a ZMQ REQ socket, as spoken by the TReX server
+class TrexRPC:
+	host = None
+	port = TREX_RPC_PORT
+	timeout = 2.0
+	api_h = None
+	
+	def __init__(self, host, port=TREX_RPC_PORT, timeout=2.0):
+		import zmq #pyzmq, only needed for the TReX stats
+		
+		self.zmq = zmq
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.context = zmq.Context.instance()
+		self.next_id = 1
+		
+		self.connect()
+		self.api_h = self.call("api_sync_v2", name="STL", major=TREX_API_VERSION[0], minor=TREX_API_VERSION[1])["api_h"]
+	
+	def connect(self):
+		self.socket = self.context.socket(self.zmq.REQ)
+		self.socket.setsockopt(self.zmq.LINGER, 0)
+		self.socket.setsockopt(self.zmq.RCVTIMEO, int(self.timeout*1000))
+		self.socket.setsockopt(self.zmq.SNDTIMEO, int(self.timeout*1000))
+		self.socket.connect("tcp://%s:%i" %(self.host, self.port))
+	
+	def call(self, method, **params):
+		if self.api_h is not None:
+			params["api_h"] = self.api_h
+		
+		request = {"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params}
+		self.next_id += 1
+		
+		try:
+			self.socket.send_string(json.dumps(request))
+			reply = json.loads(self.socket.recv_string())
+		except self.zmq.Again:
+			#A REQ socket that missed its reply can not send again
+			self.socket.close()
+			self.connect()
+			reply = None
+		
+		assert reply is not None, "TReX at %s:%i did not answer %s within %.1fs" %(self.host, self.port, method, self.timeout)
+		assert "error" not in reply, "TReX RPC %s failed: %s" %(method, reply["error"].get("message", reply["error"]))
+		
+		return reply["result"]
+	
+	def close(self):
+		self.socket.close()
+
+class Sample:
+	timestamp = None
+	tx_pps = 0
+	rx_pps = 0
+	tx_bps = 0
+	rx_bps = 0
+	rx_drop_bps = 0
+	queue_full = 0
+	cpu_util = 0
+	ports = None #port -> {opackets, ipackets, obytes, ibytes, oerrors, ierrors}
+	streams = None #pgid -> {tx_pkts, rx_pkts, tx_pps, rx_pps}
+	
+	def row(self):
+		row = {"timestamp": self.timestamp}
+		for field in GLOBAL_FIELDS:
+			row[field] = getattr(self, field)
+		for port,counters in sorted(self.ports.items()):
+			for field in PORT_FIELDS:
+				row["port%i_%s" %(port, field)] = counters[field]
+		for pgid,counters in sorted(self.streams.items()):
+			for field in STREAM_FIELDS:
+				row["pg%i_%s" %(pgid, field)] = counters[field]
+		
+		return row
+
+class TrexStats:
+	rpc = None
+	ports = None
+	samples = None #Ring buffer of the latest samples
+	thread = None
+	interval = 0.1
+	
+	def __init__(self, rpc, ports=[0, 1], capacity=36000, streams=True):
+		self.rpc = rpc
+		self.ports = list(ports)
+		self.streams = streams
+		self.samples = collections.deque(maxlen=capacity)
+		self.lock = threading.Lock()
+		self.running = threading.Event()
+	
+	#Query TReX once and append the sample to the ring. Per-stream rates come from the packet counters of consecutive samples
+	def sample(self):
+		sample = Sample()
+		sample.timestamp = time.time()
+		
+		stats = self.rpc.call("get_global_stats")
+		for field in GLOBAL_FIELDS:
+			setattr(sample, field, stats.get("m_%s" %field, 0))
+		
+		sample.ports = {}
+		for port in self.ports:
+			stats = self.rpc.call("get_port_stats", port_id=port)
+			sample.ports[port] = {field: stats.get(field, 0) for field in PORT_FIELDS}
+		
+		sample.streams = {}
+		if self.streams:
+			pgids = self.rpc.call("get_active_pgids")["ids"]["flow_stats"]
+			if pgids:
+				stats = self.rpc.call("get_pgid_stats", pgids=pgids)["flow_stats"]
+				for pgid in pgids:
+					counters = stats.get(str(pgid), {})
+					sample.streams[pgid] = {"tx_pkts": counters.get("tx_pkts", {}).get("total", 0), "rx_pkts": counters.get("rx_pkts", {}).get("total", 0), "tx_pps": 0, "rx_pps": 0}
+		
+		with self.lock:
+			if self.samples:
+				previous = self.samples[-1]
+				elapsed = sample.timestamp - previous.timestamp
+				for pgid,counters in sample.streams.items():
+					if pgid in previous.streams and elapsed > 0:
+						counters["tx_pps"] = (counters["tx_pkts"] - previous.streams[pgid]["tx_pkts"])/elapsed
+						counters["rx_pps"] = (counters["rx_pkts"] - previous.streams[pgid]["rx_pkts"])/elapsed
+			self.samples.append(sample)
+		
+		return sample
+	
+	#Sample in a background thread every interval seconds
+	def start(self, interval=0.1):
+		if self.thread is not None:
+			return
+		
+		self.interval = interval
+		self.running.set()
+		self.thread = threading.Thread(target=self.poll, daemon=True)
+		self.thread.start()
+	
+	def poll(self):
+		while self.running.is_set():
+			t_start = time.time()
+			try:
+				self.sample()
+			except AssertionError as e:
+				log("TrexStats: \tERROR: %s" %e)
+			time.sleep(max(self.interval - (time.time() - t_start), 0))
+	
+	def stop(self):
+		if self.thread is None:
+			return
+		
+		self.running.clear()
+		self.thread.join()
+		self.thread = None
+	
+	def latest(self, n=1):
+		#Indexing a deque near its ends is O(1), so this does not copy the whole ring
+		with self.lock:
+			return [self.samples[-i] for i in range(min(n, len(self.samples)), 0, -1)]
+	
+	#The mean of a field over the samples taken since a point in time
+	def mean(self, field="tx_pps", since=0):
+		with self.lock:
+			values = [getattr(sample, field) for sample in self.samples if sample.timestamp >= since]
+		
+		return sum(values)/len(values) if values else None
+	
+	#The rate, if the last window samples are within tolerance of the target (or, without a target, of each other). None otherwise
+	def converged(self, target=None, field="tx_pps", tolerance=0.05, window=3):
+		samples = self.latest(window)
+		if len(samples) < window:
+			return None
+		
+		values = [getattr(sample, field) for sample in samples]
+		mean = sum(values)/window
+		if mean <= 0:
+			return None
+		
+		reference = mean if target is None else target
+		if all(abs(value - reference) <= tolerance*reference for value in values):
+			return mean
+		
+		return None
+	
+	#Wait until the rate converges. Uses the background samples if the poller runs, and samples directly otherwise
+	def waitForConvergence(self, target=None, field="tx_pps", tolerance=0.05, window=3, interval=0.1, timeout=10):
+		t_start = time.time()
+		since = t_start
+		
+		while True:
+			if self.thread is None:
+				self.sample()
+			
+			#Only samples taken after the call count, not the previous rate
+			samples = self.latest(window)
+			if len(samples) == window and samples[0].timestamp >= since:
+				rate = self.converged(target, field, tolerance, window)
+				if rate is not None:
+					return rate
+			
+			last = "%.0f" %getattr(samples[-1], field) if samples else "-"
+			assert time.time() - t_start < timeout, "%s did not converge to %s within %is (last: %s)" %(field, "%.0f" %target if target else "a stable rate", timeout, last)
+			time.sleep(interval)
+	
+	#Store the time series, one row per sample
+	def save(self, path):
+		rows = [sample.row() for sample in self.latest(len(self.samples))]
+		fields = []
+		for row in rows:
+			fields += [field for field in row if field not in fields]
+		
+		with open(path, "w", newline="") as f:
+			writer = csv.DictWriter(f, fieldnames=fields)
+			writer.writeheader()
+			writer.writerows(rows)
+		
+		return len(rows)
+
+
+#A stand-in for the TReX RPC server. The transmitted rate approaches the target exponentially, with the given time constant
+class MockTrexServer:
+	port = TREX_RPC_PORT
+	num_ports = 2
+	time_constant = 0.2
+	packet_size = 64
+	drop_ratio = 0
+	
+	def __init__(self, port=TREX_RPC_PORT, num_ports=2, time_constant=0.2, pgids=[1]):
+		import zmq
+		
+		self.zmq = zmq
+		self.port = port
+		self.num_ports = num_ports
+		self.time_constant = time_constant
+		self.pgids = list(pgids)
+		
+		self.rate = 0
+		self.target = 0
+		self.tx_pkts = 0
+		self.rx_pkts = 0
+		self.updated = time.time()
+		self.lock = threading.Lock()
+		self.running = threading.Event()
+		
+		self.socket = zmq.Context.instance().socket(zmq.REP)
+		self.socket.setsockopt(zmq.LINGER, 0)
+		self.socket.setsockopt(zmq.RCVTIMEO, 100)
+		self.socket.bind("tcp://127.0.0.1:%i" %port)
+	
+	def setRate(self, pps, drop_ratio=0):
+		with self.lock:
+			self.advance()
+			self.target = pps
+			self.drop_ratio = drop_ratio
+	
+	#Move the rate towards the target, and count the packets sent in the meantime
+	def advance(self):
+		now = time.time()
+		elapsed = now - self.updated
+		decay = math.exp(-elapsed/self.time_constant)
+		sent = self.target*elapsed + (self.rate - self.target)*self.time_constant*(1 - decay)
+		
+		self.rate = self.target + (self.rate - self.target)*decay
+		self.tx_pkts += sent
+		self.rx_pkts += sent*(1 - self.drop_ratio)
+		self.updated = now
+	
+	def start(self):
+		self.running.set()
+		self.thread = threading.Thread(target=self.serve, daemon=True)
+		self.thread.start()
+	
+	def stop(self):
+		self.running.clear()
+		self.thread.join()
+		self.socket.close()
+	
+	def serve(self):
+		while self.running.is_set():
+			try:
+				request = json.loads(self.socket.recv_string())
+			except self.zmq.Again:
+				continue
+			
+			with self.lock:
+				self.advance()
+				handler = getattr(self, "rpc_%s" %request["method"], None)
+				if handler is None:
+					reply = {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32601, "message": "Method not found"}}
+				else:
+					reply = {"jsonrpc": "2.0", "id": request["id"], "result": handler(request.get("params", {}))}
+			
+			self.socket.send_string(json.dumps(reply))
+	
+	def rpc_api_sync_v2(self, params):
+		return {"api_h": "mock"}
+	
+	def rpc_get_global_stats(self, params):
+		bps = self.rate*self.packet_size*8
+		return {"m_tx_pps": self.rate, "m_rx_pps": self.rate*(1 - self.drop_ratio), "m_tx_bps": bps, "m_rx_bps": bps*(1 - self.drop_ratio), "m_rx_drop_bps": bps*self.drop_ratio, "m_queue_full": 0, "m_cpu_util": min(self.rate/1e6, 100)}
+	
+	def rpc_get_port_stats(self, params):
+		share = 1/self.num_ports
+		tx, rx = int(self.tx_pkts*share), int(self.rx_pkts*share)
+		return {"opackets": tx, "ipackets": rx, "obytes": tx*self.packet_size, "ibytes": rx*self.packet_size, "oerrors": 0, "ierrors": int(tx-rx)}
+	
+	def rpc_get_active_pgids(self, params):
+		return {"ids": {"flow_stats": self.pgids, "latency": []}}
+	
+	def rpc_get_pgid_stats(self, params):
+		share = 1/max(len(self.pgids), 1)
+		return {"flow_stats": {str(pgid): {"tx_pkts": {"total": int(self.tx_pkts*share)}, "rx_pkts": {"total": int(self.rx_pkts*share)}} for pgid in params["pgids"]}}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Record TReX statistics through its RPC server, or try the stats subsystem against a mock server.')
+	parser.add_argument('--server', type=str, default="127.0.0.1", help='The TReX host')
+	parser.add_argument('--port', type=int, default=TREX_RPC_PORT, help='The TReX RPC port')
+	parser.add_argument('--interval', type=float, default=0.1, help='Seconds between samples')
+	parser.add_argument('--duration', type=float, default=10, help='Seconds to record for')
+	parser.add_argument('--output', type=str, help='Store the time series in this CSV file')
+	parser.add_argument('--mock', action='store_true', help='Start a mock TReX server, and measure how fast a rate change is detected')
+	parser.add_argument('--rate', type=str, default="1mpps", help='Mock: the target rate')
+	args = parser.parse_args()
+	
+	server = None
+	if args.mock:
+		server = MockTrexServer(port=args.port)
+		server.start()
+	
+	stats = TrexStats(TrexRPC(args.server, args.port))
+	stats.start(args.interval)
+	
+	if args.mock:
+		from common import strToPktrate
+		
+		target = strToPktrate(args.rate)
+		t_start = time.time()
+		server.setRate(target)
+		rate = stats.waitForConvergence(target, tolerance=0.05, interval=args.interval)
+		log("TrexStats: \tConverged to %.0f pps (target %.0f pps) in %.2fs" %(rate, target, time.time() - t_start))
+	else:
+		time.sleep(args.duration)
+	
+	stats.stop()
+	if args.output:
+		log("TrexStats: \tStored %i samples in %s" %(stats.save(args.output), args.output))
+	
+	if server is not None:
+		server.stop()
@@ -5,6 +5,9 @@ import pexpect
 import time
 import datetime
 import re
+import threading
+
+log_lock = threading.Lock() #Steps may log from several threads (see Orchestrator.py)
 
 def getTime():
 	return datetime.datetime.now()
@@ -13,7 +16,17 @@ def log(text):
 	timestamp_str = getTime()
 	fulltext = "%s\t %s" %(timestamp_str, text)
 	
-	print(fulltext)
+	with log_lock:
+		print(fulltext)
+
+#Poll condition() until it returns True, instead of sleeping for a fixed time. Returns the time it took
+def waitFor(condition, timeout=30, interval=0.5, what="condition"):
+	t_start = time.time()
+	while not condition():
+		assert time.time() - t_start < timeout, "Timeout after %is waiting for %s!" %(timeout, what)
+		time.sleep(interval)
+	
+	return time.time() - t_start
 
 #Converting inputs like 966.95kpps or 1MPPS to float with raw PPS
 def strToPktrate(rate_str):
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#Assignment of the collector_hash space (tbl_hashToCollectorServer) to collector servers, weighted by their capacity
+#Every collector gets a quota of hash buckets proportional to its weight (largest remainder, so shares are exact to one bucket). Buckets are placed by weighted rendezvous hashing: each bucket prefers the collectors with the highest hash score for it
+#Changes move as few buckets as possible: buckets stay where they are unless their collector left or is above its new quota, so adding a collector only takes buckets over to it, and removing one only redistributes its own buckets
+#Usage example: python3 collector_assignment.py --collector 10.0.0.51 1 --collector 10.0.0.52 2 --add 10.0.0.53 1 (prints the load shares, and the entries changed by adding 10.0.0.53)
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import struct
+
+#Operation kinds returned by the assignment, mapped onto BFRT calls by the controller (see applyCollectorOperations() in switch_cpu.py)
+ENTRY_ADD = "add"
+ENTRY_MODIFY = "modify"
+ENTRY_DELETE = "delete"
+
+#Weighted rendezvous score of a collector for a bucket (higher is preferred). -weight/ln(u) with u uniform in (0,1) gives each collector a share of first choices proportional to its weight
+def rendezvousScore(bucket, collector_ip, weight):
+	digest = hashlib.md5(("%i/%s" %(bucket, collector_ip)).encode()).digest()
+	u = (struct.unpack("<Q", digest[:8])[0] + 0.5)/2**64
+	return -weight/math.log(u)
+
+class CollectorAssignment:
+	num_buckets = 256
+	weights = None #collector IP -> capacity weight
+	owners = None #bucket -> collector IP (None: unassigned)
+	
+	def __init__(self, num_buckets=256):
+		self.num_buckets = num_buckets
+		self.weights = {}
+		self.owners = [None]*num_buckets
+	
+	#Assign the buckets for a set of collectors from scratch (or from a previous assignment, keeping as much of it as possible). Returns the assignment, and the operations programming it into an empty table
+	@classmethod
+	def build(cls, collectors, num_buckets=256, previous=None):
+		assignment = cls(num_buckets)
+		if previous is not None and len(previous) == num_buckets:
+			assignment.owners = list(previous)
+		
+		for collector_ip,weight in collectors:
+			assert weight > 0, "Collector %s needs a positive weight" %collector_ip
+			assignment.weights[collector_ip] = weight
+		assignment.rebalance()
+		
+		return assignment, [(ENTRY_ADD, bucket, owner) for bucket,owner in enumerate(assignment.owners) if owner is not None]
+	
+	#Add a collector, or change its weight. Returns the operations for the changed entries
+	def setCollector(self, collector_ip, weight=1):
+		assert weight > 0, "Collector %s needs a positive weight" %collector_ip
+		self.weights[collector_ip] = weight
+		return self.rebalance()
+	
+	def removeCollector(self, collector_ip):
+		assert collector_ip in self.weights, "Collector %s is not assigned" %collector_ip
+		del self.weights[collector_ip]
+		return self.rebalance()
+	
+	#Buckets per collector, proportional to the weights. Leftover buckets go to the largest remainders
+	def quotas(self):
+		total_weight = sum(self.weights.values())
+		if total_weight == 0:
+			return {}
+		
+		exact = {collector_ip: self.num_buckets*weight/total_weight for collector_ip,weight in self.weights.items()}
+		quotas = {collector_ip: int(share) for collector_ip,share in exact.items()}
+		leftover = self.num_buckets - sum(quotas.values())
+		for collector_ip in sorted(exact, key=lambda collector_ip: (quotas[collector_ip] - exact[collector_ip], collector_ip))[:leftover]:
+			quotas[collector_ip] += 1
+		
+		return quotas
+	
+	#Move the buckets needed to meet the quotas, and return the operations for the changed entries
+	def rebalance(self):
+		quotas = self.quotas()
+		old_owners = list(self.owners)
+		
+		#Release buckets of departed collectors, and the least preferred buckets of collectors above their quota
+		buckets_of = {collector_ip: [] for collector_ip in quotas}
+		for bucket,owner in enumerate(self.owners):
+			if owner in buckets_of:
+				buckets_of[owner].append(bucket)
+			else:
+				self.owners[bucket] = None
+		
+		for collector_ip,buckets in buckets_of.items():
+			excess = len(buckets) - quotas[collector_ip]
+			if excess > 0:
+				weight = self.weights[collector_ip]
+				for bucket in sorted(buckets, key=lambda bucket: rendezvousScore(bucket, collector_ip, weight))[:excess]:
+					self.owners[bucket] = None
+		
+		#Hand the free buckets to the collectors below their quota, best rendezvous scores first
+		room = {collector_ip: quotas[collector_ip] - min(len(buckets), quotas[collector_ip]) for collector_ip,buckets in buckets_of.items()}
+		free = [bucket for bucket,owner in enumerate(self.owners) if owner is None]
+		candidates = sorted(((rendezvousScore(bucket, collector_ip, self.weights[collector_ip]), bucket, collector_ip) for bucket in free for collector_ip in room if room[collector_ip] > 0), reverse=True)
+		for _,bucket,collector_ip in candidates:
+			if self.owners[bucket] is None and room[collector_ip] > 0:
+				self.owners[bucket] = collector_ip
+				room[collector_ip] -= 1
+		
+		operations = []
+		for bucket,(old_owner,owner) in enumerate(zip(old_owners, self.owners)):
+			if old_owner == owner:
+				continue
+			if old_owner is None:
+				operations.append((ENTRY_ADD, bucket, owner))
+			elif owner is None:
+				operations.append((ENTRY_DELETE, bucket, None))
+			else:
+				operations.append((ENTRY_MODIFY, bucket, owner))
+		
+		return operations
+	
+	#Per collector: (buckets, share of the hash space, share targeted by its weight)
+	def loadShares(self):
+		total_weight = sum(self.weights.values())
+		counts = {collector_ip: 0 for collector_ip in self.weights}
+		for owner in self.owners:
+			if owner is not None:
+				counts[owner] += 1
+		
+		return {collector_ip: (counts[collector_ip], counts[collector_ip]/self.num_buckets, self.weights[collector_ip]/total_weight) for collector_ip in sorted(self.weights)}
+	
+	#Largest share relative to its target (1.0 is perfectly balanced)
+	def imbalance(self):
+		shares = self.loadShares()
+		if not shares:
+			return 0
+		return max(share/target for _,share,target in shares.values())
+	
+	def describe(self):
+		lines = ["%i buckets over %i collectors (imbalance %.3f)" %(self.num_buckets, len(self.weights), self.imbalance())]
+		for collector_ip,(buckets,share,target) in self.loadShares().items():
+			lines.append("  %-15s weight %-6g %4i buckets, %6.2f%% of the load (target %6.2f%%)" %(collector_ip, self.weights[collector_ip], buckets, 100*share, 100*target))
+		return "\n".join(lines)
+	
+	#Stored so that a restarted controller keeps the buckets where they were (the collectors keep their data)
+	def save(self, path):
+		with open(path + ".tmp", "w") as f:
+			json.dump({"weights": self.weights, "owners": self.owners}, f)
+		os.replace(path + ".tmp", path)
+	
+	#The bucket owners of a stored assignment (None if there is none)
+	@staticmethod
+	def loadOwners(path):
+		if not os.path.exists(path):
+			return None
+		
+		with open(path) as f:
+			return json.load(f)["owners"]
+
+
+#Collect --add and --remove into one list, so that the changes are applied in command-line order
+class ChangeAction(argparse.Action):
+	def __call__(self, parser, namespace, values, option_string=None):
+		changes = list(getattr(namespace, self.dest) or [])
+		if self.const == "add":
+			changes.append(("add", values[0], float(values[1])))
+		else:
+			changes.append(("remove", values, None))
+		setattr(namespace, self.dest, changes)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Print the collector hash assignment of a set of collectors, and the entries changed by adding or removing collectors.')
+	parser.add_argument('--collector', type=str, nargs=2, action='append', default=[], metavar=('IP', 'WEIGHT'), help='A collector server and its capacity weight (repeatable)')
+	parser.add_argument('--add', type=str, nargs=2, action=ChangeAction, const='add', dest='changes', default=[], metavar=('IP', 'WEIGHT'), help='Collector to add (or re-weight) afterwards (repeatable, applied in order with --remove)')
+	parser.add_argument('--remove', type=str, action=ChangeAction, const='remove', dest='changes', default=[], help='Collector to remove afterwards (repeatable, applied in order with --add)')
+	parser.add_argument('--buckets', type=int, default=256, help='Size of the collector hash space (2^collector_hash_t)')
+	args = parser.parse_args()
+	
+	assert args.collector, "Specify at least one --collector!"
+	
+	assignment, operations = CollectorAssignment.build([(ip, float(weight)) for ip,weight in args.collector], args.buckets)
+	print(assignment.describe())
+	
+	for change,collector_ip,weight in args.changes:
+		if change == "add":
+			operations = assignment.setCollector(collector_ip, weight)
+		else:
+			operations = assignment.removeCollector(collector_ip)
+		
+		print("\nAfter %s %s: %i of %i entries changed" %("adding" if change == "add" else "removing", collector_ip, len(operations), args.buckets))
+		print(assignment.describe())
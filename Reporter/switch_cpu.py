@@ -3,10 +3,18 @@ import ipaddress
 import hashlib
 import struct
 import math
+import sys
+sys.path.append("/home/sde/projects/dta/translator") #The digest pipeline is shared with the translator controller
+from digest_pipeline import DigestPipeline, FieldAggregator
+sys.path.append("/home/sde/projects/dta/reporter")
+from collector_assignment import CollectorAssignment, ENTRY_ADD, ENTRY_MODIFY, ENTRY_DELETE
 p4 = bfrt.dta_reporter.pipe
 mirror = bfrt.mirror
 
 logfile = "/home/sde/dta_reporter.log"
+digest_logfile = "/home/sde/dta_reporter_digests.bin" #Binary log of the debug digests, see digest_pipeline.py. None disables the log
+digest_statsfile = "/home/sde/dta_reporter_digest_stats.json" #Digest counters, refreshed every second
+collector_assignment_file = "/home/sde/dta_collector_assignment.json" #Current collector hash assignment, kept across controller restarts so that collectors keep their hash ranges
 
 
 #Add static forwarding rules according to our testbed topology
@@ -20,11 +28,14 @@ forwardingRules = [
 collectorHashBits = 8 #Ensure this matches collector_hash_t in p4
 maxCollectorHashVal = 2**collectorHashBits
 
-#List the collector server IPs. Algo will automatically map these across collector hash range
-collectorServerIPs = [
-"10.0.0.51"
+#List the collector server IPs and their capacity weights. The collector hash range is split proportionally to the weights (see collector_assignment.py)
+#Collectors can be added, re-weighted, or removed at runtime with addCollectorServer(ip, weight)/removeCollectorServer(ip), which only rewrite the moved hash entries
+collectorServers = [
+("10.0.0.51", 1)
 ]
 
+collectorAssignment = None #CollectorAssignment, set up by insertCollectorServerLookups()
+
 def log(text):
 	global logfile, datetime
 	line = "%s \t DigProc: %s" %(str(datetime.datetime.now()), str(text))
@@ -34,18 +45,16 @@ def log(text):
 	f.write(line + "\n")
 	f.close()
 
+#Digests are queued by the callback and processed by a worker thread, counting the reported debug values
+digests = DigestPipeline(["random", "debug"], FieldAggregator("debug"), log_path=digest_logfile, stats_path=digest_statsfile, log=log)
+
 
 def digest_callback(dev_id, pipe_id, direction, parser_id, session, msg):
-	global p4, log, Digest
-	#smac = p4.Ingress.smac
-	log("Received message from data plane!")
-	for dig in msg:
-		print(dig)
-	
-	return 0
+	global digests
+	return digests.callback(dev_id, pipe_id, direction, parser_id, session, msg)
 
 def bindDigestCallback():
-	global digest_callback, log, p4
+	global digest_callback, digests, log, p4
 	
 	try:
 		p4.SwitchIngressDeparser.debug_digest.callback_deregister()
@@ -54,6 +63,8 @@ def bindDigestCallback():
 	finally:
 		log("Deregistering old callback function (if any)")
 
+	digests.start()
+
 	#Register as callback for digests (bind to DMA?)
 	log("Registering callback...")
 	p4.SwitchIngressDeparser.debug_digest.callback_register(digest_callback)
@@ -79,24 +90,63 @@ def insertNewCollectorServer(collector_hash, collector_ip):
 	
 	p4.SwitchEgress.Reporting.tbl_hashToCollectorServer.add_with_set_collector_info(collector_hash=collector_hash, collector_ip=collector_ip)
 	
-#Map collector hashes into collector server IPs
+#Apply the changed hash entries of a collector assignment
+def applyCollectorOperations(operations):
+	global p4, log, ipaddress, insertNewCollectorServer, ENTRY_ADD, ENTRY_MODIFY, ENTRY_DELETE
+	
+	for operation,collector_hash,collector_ip in operations:
+		if operation == ENTRY_ADD:
+			insertNewCollectorServer(collector_hash=collector_hash, collector_ip=collector_ip)
+		elif operation == ENTRY_MODIFY:
+			p4.SwitchEgress.Reporting.tbl_hashToCollectorServer.mod_with_set_collector_info(collector_hash=collector_hash, collector_ip=ipaddress.ip_address(collector_ip))
+		elif operation == ENTRY_DELETE:
+			p4.SwitchEgress.Reporting.tbl_hashToCollectorServer.delete(collector_hash=collector_hash)
+	
+	log("Applied %i collector hash entry changes" %len(operations))
+
+def saveCollectorAssignment():
+	global collectorAssignment, collector_assignment_file, log
+	
+	try:
+		collectorAssignment.save(collector_assignment_file)
+	except OSError as e:
+		log("Can not store the collector assignment %s (%s)" %(collector_assignment_file, e))
+
+#Map collector hashes into collector server IPs, weighted by collector capacity. A stored assignment is kept as far as the configured collectors allow
 def insertCollectorServerLookups():
-	global log, insertNewCollectorServer, maxCollectorHashVal, collectorServerIPs, math
+	global log, maxCollectorHashVal, collectorServers, collectorAssignment, collector_assignment_file, CollectorAssignment, applyCollectorOperations, saveCollectorAssignment
 	log("Inserting server mapping P4 rules...")
 	
-	numCollectors = len(collectorServerIPs)
-	hashesPerCollector = math.ceil(maxCollectorHashVal/numCollectors)
+	previous = CollectorAssignment.loadOwners(collector_assignment_file)
+	collectorAssignment, operations = CollectorAssignment.build(collectorServers, maxCollectorHashVal, previous)
+	log(collectorAssignment.describe())
 	
-	print("numCollectors", numCollectors)
-	print("hashesPerCollector", hashesPerCollector)
+	applyCollectorOperations(operations)
+	saveCollectorAssignment()
+
+#Add a collector server (or change its weight) at runtime. Only the hash entries moved to it are rewritten
+def addCollectorServer(collector_ip, weight=1):
+	global collectorAssignment, log, applyCollectorOperations, saveCollectorAssignment
 	
-	for collector_hash in range(maxCollectorHashVal):
-		collectorIndexPointer = int(collector_hash/hashesPerCollector)
-		
-		collector_ip = collectorServerIPs[collectorIndexPointer] #Retrieve a collector IP from global list
-		
-		insertNewCollectorServer(collector_hash=collector_hash, collector_ip=collector_ip)
+	log("Assigning collector server %s with weight %s" %(collector_ip, weight))
+	applyCollectorOperations(collectorAssignment.setCollector(collector_ip, weight))
+	saveCollectorAssignment()
+	log(collectorAssignment.describe())
+
+#Remove a collector server at runtime. Only its own hash entries are moved to the remaining collectors
+def removeCollectorServer(collector_ip):
+	global collectorAssignment, log, applyCollectorOperations, saveCollectorAssignment
 	
+	log("Removing collector server %s" %collector_ip)
+	applyCollectorOperations(collectorAssignment.removeCollector(collector_ip))
+	saveCollectorAssignment()
+	log(collectorAssignment.describe())
+
+#Print the load share of every collector server
+def printCollectorLoad():
+	global collectorAssignment
+	print(collectorAssignment.describe())
+
 def configMirrorSessions():
 	global mirror, log
 	log("Configuring mirroring sessions...")
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+#Digest ingestion for the switch-local controllers (SwitchIngressDeparser.debug_digest), keeping the driver callback short under load
+#The callback only stores the digest list it is handed in a preallocated ring (one producer, one consumer, no locks), and returns. When the ring is full, digests are dropped and counted instead of blocking the digest DMA path
+#A worker thread takes the digests out in batches, decodes them into fixed-size records, updates the counters of an aggregator, and appends the records to a compact binary log
+#Counters (received, dropped, ring occupancy, aggregates) are written to a JSON stats file every stats_interval seconds
+#Usage example: python3 digest_pipeline.py /home/jonatan/dta_digests.bin (summarizes a binary digest log), or python3 digest_pipeline.py --benchmark
+
+import argparse
+import itertools
+import json
+import operator
+import os
+import struct
+import threading
+import time
+
+LOG_MAGIC = b"DTADIG1\0"
+
+#Single-producer single-consumer ring. The producer only moves head, and the consumer only moves tail, so the GIL makes both sides safe without locks
+class DigestRing:
+	slots = None
+	capacity = None
+	head = 0 #Total items pushed
+	tail = 0 #Total items popped
+	
+	def __init__(self, capacity=65536):
+		self.capacity = capacity
+		self.slots = [None]*capacity
+	
+	def __len__(self):
+		return self.head - self.tail
+	
+	#Returns False (without blocking) if the ring is full
+	def push(self, item):
+		head = self.head
+		if head - self.tail >= self.capacity:
+			return False
+		
+		self.slots[head % self.capacity] = item
+		self.head = head + 1 #Published after the slot is written
+		return True
+	
+	def popBatch(self, max_items):
+		tail = self.tail
+		num_items = min(self.head - tail, max_items)
+		
+		batch = []
+		for position in range(tail, tail+num_items):
+			slot = position % self.capacity
+			batch.append(self.slots[slot])
+			self.slots[slot] = None #Release the digest list
+		self.tail = tail + num_items
+		
+		return batch
+
+#Appends records to a binary log: a header (magic, header length, JSON description of the record fields), then packed little-endian records (timestamp in ns, then the 32-bit digest fields)
+#The log is rotated to <path>.1 once it grows past max_bytes
+class DigestLog:
+	path = None
+	fields = None
+	record = None
+	max_bytes = None
+	file = None
+	size = 0
+	records_written = 0
+	rotations = 0
+	
+	def __init__(self, path, fields, max_bytes=1<<30):
+		self.path = path
+		self.fields = fields
+		self.record = recordStruct(fields)
+		self.max_bytes = max_bytes
+	
+	def open(self):
+		header = json.dumps({"fields": self.fields, "record": self.record.format, "created": time.time()}).encode()
+		self.file = open(self.path, "wb")
+		self.file.write(LOG_MAGIC + struct.pack("<I", len(header)) + header)
+		self.size = len(LOG_MAGIC) + 4 + len(header)
+	
+	def write(self, data, num_records):
+		if self.file is None:
+			self.open()
+		elif self.size + len(data) > self.max_bytes:
+			self.file.close()
+			os.replace(self.path, self.path + ".1")
+			self.rotations += 1
+			self.open()
+		
+		self.file.write(data)
+		self.size += len(data)
+		self.records_written += num_records
+	
+	def flush(self):
+		if self.file is not None:
+			self.file.flush()
+	
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+def recordStruct(fields):
+	return struct.Struct("<Q" + "I"*len(fields))
+
+#Read a binary digest log. Returns (fields, records), records as (timestamp_ns, field values...) tuples
+def readLog(path):
+	with open(path, "rb") as f:
+		data = f.read()
+	
+	assert data[:len(LOG_MAGIC)] == LOG_MAGIC, "%s is not a digest log" %path
+	header_length = struct.unpack_from("<I", data, len(LOG_MAGIC))[0]
+	start = len(LOG_MAGIC) + 4
+	header = json.loads(data[start:start+header_length])
+	record = struct.Struct(header["record"])
+	
+	body = data[start+header_length:]
+	body = body[:len(body) - len(body) % record.size] #A record may be cut short if the controller was killed mid-write
+	
+	return header["fields"], list(record.iter_unpack(body))
+
+#Counts digests per value of one field (e.g., the debug value the pipeline reports), keeping the max_values most frequent
+class FieldAggregator:
+	field = None
+	index = None
+	counts = None
+	max_values = 1024
+	num_digests = 0
+	
+	def __init__(self, field="debug", max_values=1024):
+		self.field = field
+		self.max_values = max_values
+		self.counts = {}
+	
+	def bind(self, fields):
+		self.index = fields.index(self.field)
+	
+	def update(self, records):
+		self.num_digests += len(records)
+		counts = self.counts
+		index = self.index + 1
+		for record in records:
+			value = record[index]
+			counts[value] = counts.get(value, 0) + 1
+		
+		if len(counts) > 2*self.max_values:
+			self.counts = dict(sorted(counts.items(), key=lambda item: -item[1])[:self.max_values])
+	
+	def stats(self):
+		top = sorted(self.counts.items(), key=lambda item: -item[1])[:16]
+		return {"digests": self.num_digests, "top_%s" %self.field: [[value, count] for value,count in top]}
+
+#RDMA acknowledgements the translator sees from the collector (debug = PSN, debug2 = destination QP, see the ingress apply block of dta_translator.p4)
+#Per QP: acknowledgements, and PSN regressions. A NAK carries the PSN the collector expects, at or below the last acknowledged one, and the translator then resyncs its PSN, so regressions count NAKs and resyncs
+class RDMAAckAggregator:
+	psn_index = None
+	qp_index = None
+	acks = None
+	regressions = None
+	last_psn = None
+	num_digests = 0
+	
+	def __init__(self, psn_field="debug", qp_field="debug2"):
+		self.psn_field = psn_field
+		self.qp_field = qp_field
+		self.acks = {}
+		self.regressions = {}
+		self.last_psn = {}
+	
+	def bind(self, fields):
+		self.psn_index = fields.index(self.psn_field) + 1
+		self.qp_index = fields.index(self.qp_field) + 1
+	
+	def update(self, records):
+		self.num_digests += len(records)
+		acks, regressions, last_psn = self.acks, self.regressions, self.last_psn
+		for record in records:
+			qp = record[self.qp_index]
+			psn = record[self.psn_index]
+			acks[qp] = acks.get(qp, 0) + 1
+			
+			previous = last_psn.get(qp)
+			if previous is not None and (psn == previous or ((psn - previous) & 0xffffff) >= 0x800000): #24-bit PSNs wrap around
+				regressions[qp] = regressions.get(qp, 0) + 1
+			last_psn[qp] = psn
+	
+	def stats(self):
+		return {
+			"digests": self.num_digests,
+			"acks": sum(self.acks.values()),
+			"psn_regressions": sum(self.regressions.values()),
+			"queue_pairs": {str(qp): {"acks": self.acks[qp], "psn_regressions": self.regressions.get(qp, 0), "last_psn": self.last_psn[qp]} for qp in sorted(self.acks)}
+		}
+
+class DigestPipeline:
+	fields = None
+	ring = None
+	aggregator = None
+	digest_log = None
+	stats_path = None
+	batch_size = 256 #Digest lists (callback invocations) per batch
+	interval = 0.01 #Seconds the worker sleeps while the ring is empty
+	stats_interval = 1.0
+	worker = None
+	running = False
+	
+	#Producer counters (callback thread)
+	callbacks = 0
+	received = 0
+	dropped = 0
+	dropped_callbacks = 0
+	max_occupancy = 0
+	
+	#Consumer counters (worker thread)
+	decoded = 0
+	batches = 0
+	decode_errors = 0
+	worker_time = 0
+	
+	def __init__(self, fields, aggregator=None, log_path=None, stats_path=None, capacity=65536, batch_size=256, interval=0.01, stats_interval=1.0, max_log_bytes=1<<30, log=print):
+		self.fields = list(fields)
+		self.ring = DigestRing(capacity)
+		self.aggregator = aggregator or FieldAggregator(self.fields[0])
+		self.aggregator.bind(self.fields)
+		self.digest_log = DigestLog(log_path, self.fields, max_log_bytes) if log_path else None
+		self.stats_path = stats_path
+		self.batch_size = batch_size
+		self.interval = interval
+		self.stats_interval = stats_interval
+		self.log = log
+		self.record = recordStruct(self.fields)
+		
+		#The field values of a digest, as a tuple
+		getter = operator.itemgetter(*self.fields)
+		self.getter = getter if len(self.fields) > 1 else lambda digest: (getter(digest),)
+	
+	#The digest callback, as registered with callback_register(). Runs in the driver's thread, so it only enqueues
+	def callback(self, dev_id, pipe_id, direction, parser_id, session, msg):
+		self.callbacks += 1
+		num_digests = len(msg)
+		self.received += num_digests
+		
+		if not self.ring.push((time.time_ns(), msg)):
+			self.dropped += num_digests
+			self.dropped_callbacks += 1
+		else:
+			occupancy = len(self.ring)
+			if occupancy > self.max_occupancy:
+				self.max_occupancy = occupancy
+		
+		return 0
+	
+	def start(self):
+		if self.running:
+			return
+		
+		self.running = True
+		self.worker = threading.Thread(target=self.run, name="digest worker", daemon=True)
+		self.worker.start()
+		self.log("Digest worker started (ring of %i, fields %s)" %(self.ring.capacity, ", ".join(self.fields)))
+	
+	#Stop the worker after it drained the ring, and store the final counters
+	def stop(self):
+		if not self.running:
+			return
+		
+		self.running = False
+		self.worker.join()
+		self.log("Digest worker stopped: %s" %self.summary())
+	
+	def run(self):
+		t_stats = time.time()
+		while self.running or len(self.ring) > 0:
+			batch = self.ring.popBatch(self.batch_size)
+			if batch:
+				t_start = time.perf_counter()
+				self.process(batch)
+				self.worker_time += time.perf_counter() - t_start
+			elif self.running:
+				time.sleep(self.interval)
+			
+			if time.time() - t_stats >= self.stats_interval:
+				t_stats = time.time()
+				self.flush()
+		
+		self.flush()
+		if self.digest_log is not None:
+			self.digest_log.close()
+	
+	#Decode a batch of digest lists into records, aggregate them, and log them
+	def process(self, batch):
+		records = []
+		for timestamp,msg in batch:
+			try:
+				records.extend([(timestamp,) + self.getter(digest) for digest in msg])
+			except (KeyError, TypeError):
+				records.extend(self.decodeEach(timestamp, msg))
+		
+		self.aggregator.update(records)
+		if self.digest_log is not None and records:
+			try:
+				self.digest_log.write(self.pack(records), len(records))
+			except OSError as e:
+				self.log("Can not write digest log %s (%s), logging disabled" %(self.digest_log.path, e))
+				self.digest_log = None
+		
+		self.decoded += len(records)
+		self.batches += 1
+	
+	#Digest by digest, skipping (and counting) the ones that lack fields
+	def decodeEach(self, timestamp, msg):
+		records = []
+		for digest in msg:
+			try:
+				records.append((timestamp,) + self.getter(digest))
+			except (KeyError, TypeError):
+				self.decode_errors += 1
+		
+		return records
+	
+	#All records of a batch in one pack call. Values that do not fit the fields are truncated
+	def pack(self, records):
+		values = itertools.chain.from_iterable(records)
+		try:
+			return struct.pack("<" + self.record.format[1:]*len(records), *values)
+		except struct.error:
+			return b"".join(self.record.pack(record[0], *(value & 0xffffffff for value in record[1:])) for record in records)
+	
+	def flush(self):
+		if self.digest_log is not None:
+			self.digest_log.flush()
+		if self.stats_path is not None:
+			self.saveStats(self.stats_path)
+	
+	def stats(self):
+		return {
+			"timestamp": time.time(),
+			"callbacks": self.callbacks,
+			"received": self.received,
+			"dropped": self.dropped,
+			"dropped_callbacks": self.dropped_callbacks,
+			"decoded": self.decoded,
+			"decode_errors": self.decode_errors,
+			"batches": self.batches,
+			"ring_capacity": self.ring.capacity,
+			"ring_occupancy": len(self.ring),
+			"max_ring_occupancy": self.max_occupancy,
+			"worker_seconds": self.worker_time,
+			"log_records": self.digest_log.records_written if self.digest_log is not None else 0,
+			"log_rotations": self.digest_log.rotations if self.digest_log is not None else 0,
+			"aggregate": self.aggregator.stats()
+		}
+	
+	#Replaced atomically, so the stats can be polled from another process (e.g., over ssh by the Manager)
+	def saveStats(self, path):
+		try:
+			with open(path + ".tmp", "w") as f:
+				json.dump(self.stats(), f)
+			os.replace(path + ".tmp", path)
+		except OSError as e:
+			self.log("Can not write digest stats %s (%s), stats disabled" %(path, e))
+			self.stats_path = None
+	
+	def summary(self):
+		return "%i digests received, %i dropped (max ring occupancy %i/%i), %i decoded in %i batches" %(self.received, self.dropped, self.max_occupancy, self.ring.capacity, self.decoded, self.batches)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Summarize a binary digest log of a switch-local controller, or benchmark the digest pipeline.')
+	parser.add_argument('log', type=str, nargs='?', help='The digest log to summarize, e.g., /home/jonatan/dta_digests.bin (with --benchmark: the log to write)')
+	parser.add_argument('--print_limit', type=int, default=16, help='Prevent printing more records than this')
+	parser.add_argument('--benchmark', action='store_true', help='Feed synthetic RDMA ack digests through the pipeline, as fast as the callback takes them')
+	parser.add_argument('--digests', type=int, default=1000000, help='Benchmark: number of digests')
+	parser.add_argument('--per_callback', type=int, default=16, help='Benchmark: digests per callback invocation')
+	args = parser.parse_args()
+	
+	assert args.log or args.benchmark, "Specify a log or --benchmark!"
+	
+	if args.benchmark:
+		pipeline = DigestPipeline(["debug", "debug2"], RDMAAckAggregator(), log_path=args.log)
+		pipeline.start()
+		
+		msg = [{"debug": psn, "debug2": 0x500 + psn%4} for psn in range(args.per_callback)]
+		t_start = time.perf_counter()
+		for _ in range(args.digests//args.per_callback):
+			pipeline.callback(0, 0, 0, 0, None, msg)
+		duration = time.perf_counter() - t_start
+		pipeline.stop()
+		
+		print("Callback: %.0f ns per digest (%.3f million digests per second)" %(1e9*duration/max(1, pipeline.received), pipeline.received/(duration*1000000)))
+		print("Worker: %.0f ns per digest" %(1e9*pipeline.worker_time/max(1, pipeline.decoded)))
+	else:
+		fields, records = readLog(args.log)
+		print("%i records of %s" %(len(records), ", ".join(fields)))
+		for record in records[:args.print_limit]:
+			print("%.6f: %s" %(record[0]/1e9, ", ".join("%s=%i" %(field, value) for field,value in zip(fields, record[1:]))))
+		
+		if records:
+			duration = (records[-1][0] - records[0][0])/1e9
+			print("Spanning %.3f seconds (%.0f digests per second)" %(duration, len(records)/duration if duration > 0 else 0))
@@ -10,18 +10,24 @@
 #
 # I wish you luck.
 
+from tracing import Tracer
+tracer = Tracer(name="init_rdma_connection") #Only a handful of spans, stored with --trace
+
 #from scapy.all import send, IP, ICMP
-from scapy.all import *
+with tracer.span("import scapy"):
+	from scapy.all import *
 import random
 import sys
 import binascii
 import struct
 import argparse
 
+from rdma_sessions import RDMASession, SessionStore
 
 parser = argparse.ArgumentParser(description='Initiate an RDMA connection with the collector, and write metadata to disk.')
 parser.add_argument('--port', type=int, default=1337, help='The TCP port to the collector RDMA_CM')
-parser.add_argument('--dir', type=str, default="/home/jonatan/rdma_metadata/", help='The directory where to store the RDMA connection metadata')
+parser.add_argument('--store', type=str, default="/home/jonatan/projects/dta/translator/rdma_sessions.bin", help='The RDMA session store to write the connection metadata to')
+parser.add_argument('--trace', type=str, help='Store a timeline of the handshake here (Chrome trace JSON)')
 args = parser.parse_args()
 
 class rocev2_bth(Packet):
@@ -363,34 +369,10 @@ def informOfMetadata():
 	print("Memory length in collector: %u" %memory_length)
 	print("The remote key is: %u" %remote_key)
 	
-	path = args.dir
-	#create the path
-	try:
-		os.makedirs(path)
-	except:
-		pass
-	
-	print("Writing RDMA connection metadata to %s" %path)
-	
-	f = open("%s/tmp_qpnum"%path, "w")
-	f.write(str(qpNum))
-	f.close()
-	
-	f = open("%s/tmp_psn"%path, "w")
-	f.write(str(psn))
-	f.close()
+	print("Writing RDMA connection metadata to %s" %args.store)
 	
-	f = open("%s/tmp_memaddr"%path, "w")
-	f.write(str(memory_start))
-	f.close()
-	
-	f = open("%s/tmp_memlen"%path, "w")
-	f.write(str(memory_length))
-	f.close()
-	
-	f = open("%s/tmp_rkey"%path, "w")
-	f.write(str(remote_key))
-	f.close()
+	#One atomic update of the session store, keyed by the CM port
+	SessionStore(args.store).update([RDMASession(args.port, qpNum, psn, memory_start, memory_length, remote_key)])
 
 def process_rocev2(packet):
 	global num_processed_rocev2,qpNum,psn,memory_start,remote_key,memory_length
@@ -400,6 +382,8 @@ def process_rocev2(packet):
 	
 	print(binascii.hexlify(bytes(packet[UDP].payload)))
 	
+	tracer.instant("RoCEv2 packet %i" %num_processed_rocev2, "rdma")
+	
 	#If this is the first rocev2 packet, must be ConnectReply
 	if num_processed_rocev2 == 1:
 		lComID,qpNum,psn = process_connectReply(packet)
@@ -432,15 +416,23 @@ pkt = craft_ConnectRequest()
 
 
 print("Starting sniffer...")
-sniffer.start()
+with tracer.span("start sniffer"):
+	sniffer.start()
 
 print("Waiting 1 sec before continuing")
-time.sleep(1)
+with tracer.span("sleep before ConnectRequest"):
+	time.sleep(1)
 
 print("Sending packet", pkt)
-sendp(pkt, iface="enp4s0f0")
+with tracer.span("send ConnectRequest", "rdma", port=args.port):
+	sendp(pkt, iface="enp4s0f0")
 
 print("Waiting 3 sec to allow setup to complete")
-time.sleep(3)
+with tracer.span("sleep for handshake"):
+	time.sleep(3)
+
+with tracer.span("stop sniffer"):
+	sniffer.stop()
 
-sniffer.stop()
+if args.trace:
+	tracer.save(args.trace)
@@ -1,160 +1,106 @@
 #!/usr/bin/env python3
 #Written by Jonatan Langlet for Direct Telemetry Access
-#Used to inject synthetic DTA reports into the translator. Too slow for benchmarking, but good for testing translation capabilities
+#Used to inject synthetic DTA reports into the translator. Reports are encoded in batches into preallocated buffers and sent through sendmmsg (see dta/encoder.py)
+#Good for testing translation capabilities, and fast enough (~1Mpps per core) for moderate-rate benchmarking
 
-#from scapy.all import send, IP, ICMP
-from scapy.all import *
-import random
+import os
 import sys
-import binascii
-import struct
 import argparse
 import time
+import numpy as np
 
-parser = argparse.ArgumentParser(description='Inject a DTA Key-Write packet into the Tofino ASIC.')
-parser.add_argument('operation',  type=str, nargs='+', choices=["keywrite", "append"], help='The DTA operation')
-parser.add_argument('--data',  type=int, nargs='+', help='The telemetry data')
-parser.add_argument('--key',  type=int, nargs='+', help='The telemetry key for KeyWrite operations')
-parser.add_argument('--redundancy', type=int, nargs='+', help='The telemetry redundancy for KeyWrite operations')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dta.encoder import ReportEncoder, RawSender, ifaceMac
+from dta.headers import DTA_PRIMITIVE_NAMES, DTA_OPCODE_KEYWRITE, DTA_OPCODE_KEYINCREMENT, DTA_OPCODE_APPEND, DTA_OPCODE_POSTCARDER
+
+parser = argparse.ArgumentParser(description='Inject DTA reports into the Tofino ASIC.')
+parser.add_argument('operation',  type=str, nargs='+', choices=list(DTA_PRIMITIVE_NAMES), help='The DTA operation')
+parser.add_argument('--data',  type=int, nargs='+', help='The telemetry data (the counter value for KeyIncrement operations)')
+parser.add_argument('--key',  type=int, nargs='+', help='The telemetry key for KeyWrite, KeyIncrement, and Postcarder operations')
+parser.add_argument('--redundancy', type=int, nargs='+', help='The telemetry redundancy for KeyWrite and KeyIncrement operations')
 parser.add_argument('--listID', type=int, nargs='+', help='The telemetry list ID for Append operations')
+parser.add_argument('--hopNum', type=int, nargs='+', help='The hop number for Postcarder operations')
 parser.add_argument('--loop', action='store_true', help='Indicates that the script should loop, generating traffic continuously')
 parser.add_argument('--increment_data', action='store_true', help='Indicates that the data value should increment, if looping is enabled')
 parser.add_argument('--increment_key', action='store_true', help='Indicates that the key-write key should increment, if looping is enabled')
 parser.add_argument('--ipg', type=float, default=0.0, help='The IPG to replay traffic at, if emitting multiple packets simultaneously')
 parser.add_argument('--batchsize', type=int, default=1, help='The batch size to use when --loop is enabled')
+parser.add_argument('--interval', type=float, help='Seconds to sleep between batches when looping (default 1 for KeyWrite, 0 otherwise)')
+parser.add_argument('--iface', type=str, default="enp4s0f0", help='The interface to send reports on')
 
 #args = vars(parser.parse_args())
 args = parser.parse_args()
 print(args)
 
+operation = args.operation[0]
+opcode = DTA_PRIMITIVE_NAMES[operation]
 
-class dta_base(Packet):
-	name = "dtaBase"
-	fields_desc = [ 
-		XByteField("opcode",		0x01),
-		XByteField("seqnum",		0), #DTA sequence number
-		BitField("immediate",		0,		1),
-		BitField("retransmitable",	0,		1),
-		BitField("reserved", 		0,		6)
-	]
-
-class dta_keyWrite(Packet):
-	name = "dtaKeyWrite"
-	fields_desc = [ 
-		ByteField("redundancy",	0x02),
-		#IntField("key",		0),
-		IntField("key",		0),
-		IntField("data", 	0)
-	]
+if opcode in [DTA_OPCODE_KEYWRITE, DTA_OPCODE_KEYINCREMENT, DTA_OPCODE_POSTCARDER]:
+	assert args.key, "No telemetry key specified!"
+if opcode in [DTA_OPCODE_KEYWRITE, DTA_OPCODE_KEYINCREMENT]:
+	assert args.redundancy, "No telemetry redundancy specified!"
+if opcode == DTA_OPCODE_APPEND:
+	assert args.listID, "No telemetry list ID specified!"
+if opcode == DTA_OPCODE_POSTCARDER:
+	assert args.hopNum, "No hop number specified!"
+assert args.data, "No telemetry data specified!"
 
-class dta_append(Packet):
-	name = "dtaAppend"
-	fields_desc = [ 
-		IntField("listID",		0),
-		IntField("data", 	0)
-	]
+encoder = ReportEncoder(opcode, dstMac="b8:ce:f6:d2:12:c7", srcMac=ifaceMac(args.iface), srcIP="10.0.0.101", dstIP="10.0.0.51")
+sender = RawSender(args.iface)
 
-def craft_dta_keywrite(key, data, redundancy):
-	print("Crafting a keywrite packet with key:%i data:%i, redundancy:%i" %(key,data,redundancy))
-	
-	key_bin = struct.pack(">I", key)
+#Encode a batch of reports, starting at the given key and data. The key/data increment within the batch if requested
+def encodeBatch(frames, key, data, batchSize):
+	offsets = np.arange(batchSize, dtype=np.uint64)
+	keys = key + offsets*args.increment_key
+	values = data + offsets*args.increment_data
 	
-	pkt = Ether(dst="b8:ce:f6:d2:12:c7")\
-	/IP(src="10.0.0.101",dst="10.0.0.51")\
-	/UDP(sport=40041,dport=40040)\
-	/dta_base(opcode=0x01)\
-	/dta_keyWrite(redundancy=redundancy, key=RawVal(key_bin), data=data)
-	#/dta_keyWrite(redundancy=redundancy, key=key, data=data)
-	
-	return pkt
+	if opcode == DTA_OPCODE_KEYWRITE:
+		return encoder.encodeKeyWrite(keys, values, args.redundancy[0], frames=frames)
+	elif opcode == DTA_OPCODE_KEYINCREMENT:
+		return encoder.encodeKeyIncrement(keys, values, args.redundancy[0], frames=frames)
+	elif opcode == DTA_OPCODE_APPEND:
+		return encoder.encodeAppend(np.full(batchSize, args.listID[0], dtype=np.uint32), values, frames=frames)
+	elif opcode == DTA_OPCODE_POSTCARDER:
+		return encoder.encodePostcarder(keys, args.hopNum[0], values, frames=frames)
 
-def craft_dta_append(listID, data):
-	print("Crafting an append packet with listID:%i data:%i" %(listID,data))
-	
-	pkt = Ether(dst="b8:ce:f6:d2:12:c7")\
-	/IP(src="10.0.0.101",dst="10.0.0.51")\
-	/UDP(sport=40041,dport=40040)\
-	/dta_base(opcode=0x02)\
-	/dta_append(listID=listID, data=data)
+def emitPacket(frames):
+	ipg = args.ipg
 	
-	return pkt
+	if ipg > 0:
+		for i in range(len(frames)):
+			sender.send(frames[i:i+1])
+			time.sleep(ipg)
+	else:
+		sender.send(frames)
 
-def emitPacket(pkts):
-	ipg = args.ipg
-	print("Sending %i DTA packet(s) at ipg:%.3f" %(len(pkts),ipg))
-	sendp(pkts, inter=ipg, iface="enp4s0f0")
+key = args.key[0] if args.key else 0
+data = args.data[0]
 
-if args.operation[0] == "keywrite":
-	print("Crafting a DTA KeyWrite packet...")
+if args.loop: #Keep incrementing, used for one-off test of reliability
+	batchSize = args.batchsize
+	interval = args.interval
+	if interval is None:
+		interval = 1 if opcode == DTA_OPCODE_KEYWRITE else 0
+	print("Looping enabled with batchsize %i, sending %s reports on %s" %(batchSize, operation, args.iface))
 	
-	assert args.key, "No telemetry key specified!"
-	assert args.redundancy, "No telemetry redundancy specified!"
-	assert args.data, "No telemetry data specified!"
-	
-	
-	#Craft a KeyWrite packet
-	key = args.key[0]
-	data = args.data[0]
-	redundancy = args.redundancy[0]
-	doLoop = args.loop
-	increment_data = args.increment_data
-	increment_key = args.increment_key
-	
-	if doLoop: #Keep incrementing, used for one-off test of reliability
-		batchSize = args.batchsize
-		print("Looping enabled with batchsize %i" %batchSize)
+	frames = encoder.allocate(batchSize)
+	t_start = time.perf_counter()
+	while True:
+		batch = encodeBatch(frames, key, data, batchSize)
+		emitPacket(batch)
 		
-		pkts = []
-		while True: 
-			pkt = craft_dta_keywrite(key=key, data=data, redundancy=redundancy)
-			
-			pkts.append(pkt)
-			
-			if len(pkts) >= batchSize:
-				emitPacket(pkts)
-				pkts = []
-				print("sleeping 1 sec before next batch...")
-				time.sleep(1)
-			
-			if increment_key:
-				key = key + 1
-			if increment_data:
-				data = data + 1
-			print("Incremented key:%i and data:%i" %(key,data))
-	else: #This is default functionality. Craft and send a single packet
-		print("Looping disabled, sending single packet")
-		pkt = craft_dta_keywrite(key=key, data=data, redundancy=redundancy)
-		emitPacket(pkt)
-
-if args.operation[0] == "append":
-	print("Crafting a DTA Append packet...")
-	
-	assert args.listID, "No telemetry list ID specified!"
-	assert args.data, "No telemetry data specified!"
-	doLoop = args.loop
-	listID = args.listID[0]
-	data = args.data[0]
-	increment_data = args.increment_data
-	
-	if doLoop: #Keep incrementing, used for one-off test of reliability
-		batchSize = args.batchsize
-		print("Looping enabled with batchsize %i" %batchSize)
+		if args.increment_key:
+			key = key + batchSize
+		if args.increment_data:
+			data = data + batchSize
 		
-		pkts = []
-		while True: 
-			pkt = craft_dta_append(listID=listID, data=data)
-			
-			pkts.append(pkt)
-			
-			if len(pkts) >= batchSize:
-				emitPacket(pkts)
-				pkts = []
-			
-			if increment_data:
-				data = data + 1
-			print("Incremented data:%i" %(data))
-	else:
-		#Craft a single Append packet
-		pkt = craft_dta_append(listID=listID, data=data)
-		emitPacket(pkt)
-
+		#Progress is printed every 2^20 reports, per-packet prints would dominate the send rate
+		if (sender.num_sent // batchSize) % max(1, (1<<20) // batchSize) == 0:
+			print("Sent %i reports (%.3f Mpps), next key:%i data:%i" %(sender.num_sent, sender.num_sent/((time.perf_counter()-t_start)*1000000), key, data))
+		
+		if interval > 0:
+			time.sleep(interval)
+else: #This is default functionality. Craft and send a single packet
+	print("Looping disabled, sending single %s packet" %operation)
+	batch = encodeBatch(None, key, data, 1)
+	emitPacket(batch)
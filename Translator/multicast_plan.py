@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#Multicast plan of the translator: which multicast groups (MGIDs) and nodes replicate KeyWrite RDMA packets, and which tbl_Prep_KeyWrite entries point at them
+#There is one multicast group per (egress port, redundancy level), shared by all collectors behind that port. Groups are looked up in dicts, and group/node IDs come from allocators that recycle freed IDs
+#Adding or removing a collector returns only the table operations needed for that change, so the rest of the groups are never reprogrammed
+#Usage example (print the plan of a topology): python3 multicast_plan.py --ports 8 64 --collector 10.0.0.51 156 --redundancy 4
+
+import argparse
+import heapq
+import ipaddress
+
+MAX_MGID = 0xffff
+MAX_NODE_ID = 0xffffff
+
+#Operation kinds returned by the plan, mapped onto BFRT calls by the controller (see applyMulticastOperations() in switch_cpu.py)
+NODE_ADD = "node_add"
+NODE_DELETE = "node_delete"
+MGID_ADD = "mgid_add"
+MGID_DELETE = "mgid_delete"
+KEYWRITE_ADD = "keywrite_add"
+KEYWRITE_DELETE = "keywrite_delete"
+
+#Hands out the lowest free ID, starting at 1. Freed IDs are reused before new ones
+class IDAllocator:
+	next_id = 1
+	max_id = None
+	free = None
+	
+	def __init__(self, max_id):
+		self.max_id = max_id
+		self.free = []
+	
+	def allocate(self):
+		if self.free:
+			return heapq.heappop(self.free)
+		
+		assert self.next_id <= self.max_id, "Out of IDs (max %i)" %self.max_id
+		self.next_id += 1
+		return self.next_id - 1
+	
+	def release(self, id):
+		heapq.heappush(self.free, id)
+
+class MulticastGroup:
+	mgid = None
+	egress_port = None
+	redundancy = None
+	node_ids = None
+	
+	def __init__(self, mgid, egress_port, redundancy, node_ids):
+		self.mgid = mgid
+		self.egress_port = egress_port
+		self.redundancy = redundancy
+		self.node_ids = node_ids
+	
+	#L1 exclusion IDs are not used by DTA: all zero, and invalid
+	@property
+	def l1_xids(self):
+		return [0]*self.redundancy
+	
+	def __repr__(self):
+		return "MulticastGroup(mgid=%i, egr=%i, redundancy=%i, nodes=%s)" %(self.mgid, self.egress_port, self.redundancy, self.node_ids)
+
+class MulticastPlan:
+	max_redundancy = 4
+	groups = None #(egress port, redundancy) -> MulticastGroup
+	collectors = None #collector IP -> egress port
+	port_users = None #egress port -> number of collectors behind it
+	static_ports = None #Ports whose groups are kept even without collectors
+	
+	def __init__(self, max_redundancy=4):
+		self.max_redundancy = max_redundancy
+		self.groups = {}
+		self.collectors = {}
+		self.port_users = {}
+		self.static_ports = set()
+		self.mgids = IDAllocator(MAX_MGID)
+		self.node_ids = IDAllocator(MAX_NODE_ID)
+	
+	#Build the plan of a whole topology. Returns the plan, and the operations programming it from scratch
+	@classmethod
+	def compile(cls, collectors, ports=(), max_redundancy=4):
+		plan = cls(max_redundancy)
+		operations = []
+		for port in ports:
+			operations += plan.addPort(port)
+		for collectorIP,egressPort in collectors:
+			operations += plan.addCollector(collectorIP, egressPort)
+		
+		return plan, operations
+	
+	def mgid(self, egressPort, redundancy):
+		return self.groups[(egressPort, redundancy)].mgid
+	
+	#Create the groups of a port (one per redundancy level), unless they already exist
+	def addPort(self, egressPort, static=True):
+		if static:
+			self.static_ports.add(egressPort)
+		if (egressPort, 1) in self.groups:
+			return []
+		
+		operations = []
+		for redundancy in range(1, self.max_redundancy+1):
+			group = MulticastGroup(self.mgids.allocate(), egressPort, redundancy, [])
+			for i in range(redundancy):
+				group.node_ids.append(self.node_ids.allocate())
+				operations.append((NODE_ADD, {"DEV_PORT": [egressPort], "MULTICAST_NODE_ID": group.node_ids[-1]}))
+			
+			operations.append((MGID_ADD, {"MGID": group.mgid, "MULTICAST_NODE_ID": group.node_ids, "MULTICAST_NODE_L1_XID": group.l1_xids, "MULTICAST_NODE_L1_XID_VALID": [False]*redundancy}))
+			self.groups[(egressPort, redundancy)] = group
+		
+		return operations
+	
+	#Remove the groups of a port, and release their IDs
+	def removePort(self, egressPort):
+		assert self.port_users.get(egressPort, 0) == 0, "Port %i still has collectors" %egressPort
+		self.static_ports.discard(egressPort)
+		
+		operations = []
+		for redundancy in range(1, self.max_redundancy+1):
+			group = self.groups.pop((egressPort, redundancy), None)
+			if group is None:
+				continue
+			
+			operations.append((MGID_DELETE, {"MGID": group.mgid}))
+			for node_id in group.node_ids:
+				operations.append((NODE_DELETE, {"MULTICAST_NODE_ID": node_id}))
+				self.node_ids.release(node_id)
+			self.mgids.release(group.mgid)
+		
+		return operations
+	
+	#A new collector gets KeyWrite rules towards the groups of its port. The groups are only created if the port has none yet
+	def addCollector(self, collectorIP, egressPort):
+		assert collectorIP not in self.collectors, "Collector %s is already in the plan" %collectorIP
+		
+		operations = self.addPort(egressPort, static=False)
+		self.collectors[collectorIP] = egressPort
+		self.port_users[egressPort] = self.port_users.get(egressPort, 0) + 1
+		
+		dstIP = ipaddress.ip_address(collectorIP)
+		for redundancy in range(1, self.max_redundancy+1):
+			operations.append((KEYWRITE_ADD, {"dstAddr": dstIP, "redundancyLevel": redundancy, "mcast_grp": self.mgid(egressPort, redundancy)}))
+		
+		return operations
+	
+	#Delete the KeyWrite rules of a collector. The groups of its port go as well, once no collector (or static port) uses them
+	def removeCollector(self, collectorIP):
+		egressPort = self.collectors.pop(collectorIP)
+		self.port_users[egressPort] -= 1
+		
+		dstIP = ipaddress.ip_address(collectorIP)
+		operations = [(KEYWRITE_DELETE, {"dstAddr": dstIP, "redundancyLevel": redundancy}) for redundancy in range(1, self.max_redundancy+1)]
+		
+		if self.port_users[egressPort] == 0:
+			del self.port_users[egressPort]
+			if egressPort not in self.static_ports:
+				operations += self.removePort(egressPort)
+		
+		return operations
+	
+	#Move a collector to another port: delete and re-add its KeyWrite rules
+	def moveCollector(self, collectorIP, egressPort):
+		return self.removeCollector(collectorIP) + self.addCollector(collectorIP, egressPort)
+	
+	def summary(self):
+		lines = []
+		for (egressPort,redundancy),group in sorted(self.groups.items()):
+			lines.append("%s%s" %(group, " (static)" if egressPort in self.static_ports else ""))
+		for collectorIP,egressPort in sorted(self.collectors.items()):
+			lines.append("Collector %s -> port %i, mgids %s" %(collectorIP, egressPort, [self.mgid(egressPort, r) for r in range(1, self.max_redundancy+1)]))
+		return "\n".join(lines)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Compile the multicast plan and KeyWrite rules of a translator topology.')
+	parser.add_argument('--ports', type=int, nargs='*', default=[], help='Egress ports that always get multicast groups (e.g., for debugging)')
+	parser.add_argument('--collector', type=str, nargs=2, action='append', default=[], metavar=('IP', 'PORT'), help='A collector IP and its egress port (can be repeated)')
+	parser.add_argument('--redundancy', type=int, default=4, help='The maximum KeyWrite redundancy level')
+	parser.add_argument('--operations', action='store_true', help='Also print the table operations')
+	args = parser.parse_args()
+	
+	plan, operations = MulticastPlan.compile([(ip, int(port)) for ip,port in args.collector], ports=args.ports, max_redundancy=args.redundancy)
+	print(plan.summary())
+	
+	if args.operations:
+		for kind,fields in operations:
+			print(kind, fields)
+	print("%i groups, %i table operations" %(len(plan.groups), len(operations)))
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+#In-process RDMA connection manager for the translator, replacing one init_rdma_connection.py process per collector structure
+#All ConnectRequests are sent at once on one shared raw socket. Replies are demultiplexed per connection: CM ConnectReplies by the echoed comm ID (lComID), buffer metadata by destination QP
+#Packet contents are exactly those of init_rdma_connection.py (see the notes there on the hard-coded values), built with struct instead of scapy
+#Usage example: sudo ./rdma_cm.py --ports 1336 1337 1338 1339 1340 1341 --store /home/jonatan/projects/dta/translator/rdma_sessions.bin
+
+import argparse
+import select
+import socket
+import struct
+import time
+
+from rdma_sessions import RDMASession, SessionStore
+from tracing import Tracer, NULL_TRACER
+
+SRC_MAC = "b8:ce:f6:d2:13:26"
+DST_MAC = "b8:ce:f6:d2:12:c7"
+SRC_IP = "10.0.0.101"
+DST_IP = "10.0.0.51"
+UDP_SPORT = 10000
+ROCEV2_UDP_PORT = 4791
+IP_ID = 0x2c70 #stolen from cloned traffic
+CM_PSN = 100
+
+ETH_P_IP = 0x0800
+PACKET_OUTGOING = 4
+
+BTH_OPCODE_RC_SEND_ONLY = 0x04
+BTH_OPCODE_ACK = 0x11
+BTH_OPCODE_UD_SEND_ONLY = 0x64
+BTH_MIGREQ = 0x40
+GSI_QP = 1
+
+MAD_ATTR_CONNECT_REQUEST = 0x0010
+MAD_ATTR_CONNECT_REJECT = 0x0012
+MAD_ATTR_CONNECT_REPLY = 0x0013
+MAD_ATTR_READY_TO_USE = 0x0014
+
+#Offsets into the UDP payload
+BTH_LEN = 12
+DETH_LEN = 8
+MAD_LEN = 24
+MAD_ATTR_OFFSET = BTH_LEN + DETH_LEN + 16
+CM_OFFSET = BTH_LEN + DETH_LEN + MAD_LEN
+
+#The captured ConnectRequest (rocev2_connectRequest in init_rdma_connection.py), as 58 32-bit words
+CONNECT_REQUEST_TEMPLATE = [0x633d317c, 0x000015b3, 0x0, 0x01060539, 0xb8cef603, 0x00d21326, 0x0, 0x0, 0x0011b903, 0x00000003, 0x000000b0, 0xe6fb20b3, 0xffff30f0, 0xffffffff, 0x0, 0x0, 0x0000ffff, 0x0a000065, 0x0, 0x0, 0x0000ffff, 0x0a000033, 0x943e0007, 0x00400098] + [0x0]*11 + [0x0040d079] + [0x0]*3 + [0x0a000065] + [0x0]*3 + [0x0a000033] + [0x0]*14
+CONNECT_REQUEST_WORD_LCOMID = 0
+CONNECT_REQUEST_WORD_DSTPORT = 3
+CONNECT_REQUEST_WORD_SOURCEQP = 8
+CONNECT_REQUEST_WORDS_SRCIP = [17, 39]
+CONNECT_REQUEST_WORDS_DSTIP = [21, 43]
+READY_TO_USE_WORDS = 58
+
+#Connection states
+STATE_REQUESTED = "requested" #ConnectRequest sent, waiting for the ConnectReply
+STATE_CONNECTED = "connected" #ReadyToUse sent, waiting for the buffer metadata
+STATE_ESTABLISHED = "established"
+STATE_FAILED = "failed"
+
+def macBytes(mac):
+	return bytes(int(octet, 16) for octet in mac.split(":"))
+
+def ipBytes(ip):
+	return socket.inet_aton(ip)
+
+def onesComplement(data):
+	if len(data) % 2:
+		data += b"\x00"
+	total = sum(struct.unpack("!%iH" %(len(data)//2), data))
+	while total >> 16:
+		total = (total & 0xffff) + (total >> 16)
+	return total
+
+#Ethernet/IPv4/UDP around a RoCEv2 payload (BTH onwards, iCRC included), with the same header values as the scapy-crafted packets
+def craftFrame(roce, srcMac=SRC_MAC, dstMac=DST_MAC, srcIP=SRC_IP, dstIP=DST_IP):
+	udp_len = 8 + len(roce)
+	ip_header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20+udp_len, IP_ID, 0x4000, 64, 17, 0, ipBytes(srcIP), ipBytes(dstIP))
+	ip_header = ip_header[:10] + struct.pack("!H", 0xffff - onesComplement(ip_header)) + ip_header[12:]
+	
+	udp_header = struct.pack("!HHHH", UDP_SPORT, ROCEV2_UDP_PORT, udp_len, 0)
+	pseudo_header = ipBytes(srcIP) + ipBytes(dstIP) + struct.pack("!BBH", 0, 17, udp_len)
+	udp_checksum = 0xffff - onesComplement(pseudo_header + udp_header + roce)
+	udp_header = udp_header[:6] + struct.pack("!H", udp_checksum or 0xffff)
+	
+	return macBytes(dstMac) + macBytes(srcMac) + struct.pack("!H", ETH_P_IP) + ip_header + udp_header + roce
+
+def bth(opcode, destQP, psn=CM_PSN):
+	return struct.pack("!BBHII", opcode, BTH_MIGREQ, 0xffff, destQP & 0xffffff, psn & 0xffffff)
+
+#BTH/DETH/MAD of a CM message to the GSI QP, advertising the source QP of the connection
+def cmHeaders(sourceQP, attribute):
+	deth = struct.pack("!II", 0x80010000, sourceQP & 0xffffff)
+	mad = struct.pack("!IIIIII", 0x01070203, 0x0, 0x00000006, 0x7c313d63, attribute << 16, 0x30000000)
+	return bth(BTH_OPCODE_UD_SEND_ONLY, GSI_QP) + deth + mad
+
+#The CM port of the collector structure doubles as lComID and advertised source QP, keeping them consistent and unique
+def craftConnectRequest(port, srcIP=SRC_IP, dstIP=DST_IP):
+	words = list(CONNECT_REQUEST_TEMPLATE)
+	words[CONNECT_REQUEST_WORD_LCOMID] = port
+	words[CONNECT_REQUEST_WORD_DSTPORT] = (words[CONNECT_REQUEST_WORD_DSTPORT] & 0xffff0000) | port
+	words[CONNECT_REQUEST_WORD_SOURCEQP] = port << 8
+	for word in CONNECT_REQUEST_WORDS_SRCIP:
+		words[word] = struct.unpack("!I", ipBytes(srcIP))[0]
+	for word in CONNECT_REQUEST_WORDS_DSTIP:
+		words[word] = struct.unpack("!I", ipBytes(dstIP))[0]
+	
+	return cmHeaders(port, MAD_ATTR_CONNECT_REQUEST) + struct.pack("!%iI" %len(words), *words) + struct.pack("!I", 0)
+
+def craftReadyToUse(port, rComID):
+	words = [port, rComID] + [0x0]*(READY_TO_USE_WORDS-2)
+	return cmHeaders(port, MAD_ATTR_READY_TO_USE) + struct.pack("!%iI" %len(words), *words) + struct.pack("!I", 0)
+
+def craftAck(msgSeqNum, qpNum):
+	return bth(BTH_OPCODE_ACK, qpNum) + struct.pack("!I", msgSeqNum & 0xffffff) + struct.pack("!I", 0)
+
+#One connection to a collector structure, identified by its RDMA_CM port
+class CollectorConnection:
+	port = None
+	state = None
+	attempts = 0
+	deadline = None
+	t_start = None
+	t_trace = None #Start on the tracer clock
+	duration = None
+	
+	#Filled in by the handshake
+	rComID = None
+	queue_pair = None
+	start_psn = None
+	memory_start = None
+	memory_length = None
+	remote_key = None
+	
+	def __init__(self, port):
+		self.port = port
+	
+	@property
+	def done(self):
+		return self.state in [STATE_ESTABLISHED, STATE_FAILED]
+	
+	#Same order as the values getCollectorMetadata() in switch_cpu.py returns
+	@property
+	def metadata(self):
+		return self.queue_pair, self.start_psn, self.memory_start, self.memory_length, self.remote_key
+	
+	#The established connection, as stored in the session store (see rdma_sessions.py)
+	def session(self, name=""):
+		return RDMASession(self.port, self.queue_pair, self.start_psn, self.memory_start, self.memory_length, self.remote_key, name=name)
+
+class ConnectionManager:
+	iface = None
+	timeout = 1.0
+	retries = 3
+	sock = None
+	tracer = None
+	
+	#Every handshake is traced on its own track (named after the port), from the first ConnectRequest until it is established or fails
+	def __init__(self, iface="enp4s0f0", timeout=1.0, retries=3, log=print, srcMac=SRC_MAC, dstMac=DST_MAC, srcIP=SRC_IP, dstIP=DST_IP, tracer=None):
+		self.iface = iface
+		self.timeout = timeout
+		self.retries = retries
+		self.log = log
+		self.tracer = tracer or NULL_TRACER
+		self.addresses = {"srcMac":srcMac, "dstMac":dstMac, "srcIP":srcIP, "dstIP":dstIP}
+		
+		self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_IP))
+		self.sock.bind((iface, ETH_P_IP))
+		self.sock.setblocking(False)
+	
+	def send(self, roce):
+		self.sock.send(craftFrame(roce, **self.addresses))
+	
+	def sendConnectRequest(self, connection):
+		connection.state = STATE_REQUESTED
+		connection.attempts += 1
+		connection.deadline = time.time() + self.timeout
+		self.tracer.instant("ConnectRequest", "rdma", connection.port, attempt=connection.attempts)
+		self.send(craftConnectRequest(connection.port, self.addresses["srcIP"], self.addresses["dstIP"]))
+	
+	#Bring up connections to all ports in parallel. Returns {port: CollectorConnection}, failed connections included
+	def connectAll(self, ports):
+		connections = {port: CollectorConnection(port) for port in ports}
+		
+		t_start = time.time()
+		t_trace = self.tracer.now()
+		for connection in connections.values():
+			connection.t_start = t_start
+			connection.t_trace = t_trace
+			self.tracer.nameTrack(connection.port, "port %i" %connection.port)
+			self.sendConnectRequest(connection)
+		self.log("Sent %i ConnectRequests on %s" %(len(connections), self.iface))
+		
+		while not all(connection.done for connection in connections.values()):
+			now = time.time()
+			for connection in connections.values():
+				if connection.done or now < connection.deadline:
+					continue
+				
+				if connection.attempts <= self.retries:
+					self.log("Connection to port %i timed out in state '%s', retrying (attempt %i)" %(connection.port, connection.state, connection.attempts+1))
+					self.sendConnectRequest(connection)
+				else:
+					self.log("   !!!   Connection to port %i failed after %i attempts   !!!   " %(connection.port, connection.attempts))
+					connection.state = STATE_FAILED
+					self.traceHandshake(connection)
+			
+			pending = [connection.deadline for connection in connections.values() if not connection.done]
+			if not pending:
+				break
+			
+			readable,_,_ = select.select([self.sock], [], [], max(min(pending) - time.time(), 0))
+			if readable:
+				self.receiveAll(connections)
+		
+		num_established = sum(connection.state == STATE_ESTABLISHED for connection in connections.values())
+		self.log("%i/%i RDMA connections established in %.3f seconds" %(num_established, len(connections), time.time()-t_start))
+		self.tracer.complete("connectAll", t_trace, self.tracer.now(), "rdma", ports=list(connections), established=num_established)
+		
+		return connections
+	
+	def traceHandshake(self, connection):
+		self.tracer.complete("handshake %i" %connection.port, connection.t_trace, self.tracer.now(), "rdma", connection.port, port=connection.port, state=connection.state, attempts=connection.attempts, queue_pair=connection.queue_pair)
+	
+	#Drain the socket, handling every RoCEv2 packet from the collector
+	def receiveAll(self, connections):
+		while True:
+			try:
+				frame, address = self.sock.recvfrom(65535)
+			except BlockingIOError:
+				return
+			
+			if address[2] == PACKET_OUTGOING:
+				continue
+			
+			ihl = (frame[14] & 0x0f)*4
+			if frame[23] != 17 or len(frame) < 14+ihl+8+BTH_LEN:
+				continue
+			if struct.unpack_from("!H", frame, 14+ihl+2)[0] != ROCEV2_UDP_PORT:
+				continue
+			
+			self.handle(frame[14+ihl+8:], connections)
+	
+	def handle(self, payload, connections):
+		opcode = payload[0]
+		destQP = struct.unpack_from("!I", payload, 4)[0] & 0xffffff
+		
+		if opcode == BTH_OPCODE_UD_SEND_ONLY and destQP == GSI_QP and len(payload) >= CM_OFFSET+24:
+			attribute = struct.unpack_from("!H", payload, MAD_ATTR_OFFSET)[0]
+			lComID, rComID = struct.unpack_from("!II", payload, CM_OFFSET)
+			
+			#Replies carry our lComID as their remote comm ID
+			connection = connections.get(rComID)
+			if connection is None or connection.done:
+				return
+			
+			if attribute == MAD_ATTR_CONNECT_REPLY:
+				connection.rComID = lComID
+				connection.queue_pair = int.from_bytes(payload[CM_OFFSET+12:CM_OFFSET+15], "big")
+				connection.start_psn = int.from_bytes(payload[CM_OFFSET+20:CM_OFFSET+23], "big")
+				
+				#A repeated ConnectReply (e.g., after a retry) gets the ReadyToUse again
+				self.tracer.instant("ConnectReply", "rdma", connection.port, queue_pair=connection.queue_pair)
+				self.send(craftReadyToUse(connection.port, lComID))
+				connection.state = STATE_CONNECTED
+				connection.deadline = time.time() + self.timeout
+			elif attribute == MAD_ATTR_CONNECT_REJECT:
+				self.log("Connection to port %i was rejected, retrying after the timeout" %connection.port)
+				self.tracer.instant("ConnectReject", "rdma", connection.port)
+		
+		elif opcode == BTH_OPCODE_RC_SEND_ONLY and len(payload) >= BTH_LEN+16:
+			#The collector sends its buffer metadata to the QP we advertised, i.e., the CM port
+			connection = connections.get(destQP)
+			if connection is None or connection.state != STATE_CONNECTED:
+				return
+			
+			connection.memory_start, connection.memory_length, connection.remote_key = struct.unpack_from("<QII", payload, BTH_LEN)
+			self.send(craftAck(2, connection.queue_pair))
+			
+			connection.state = STATE_ESTABLISHED
+			connection.duration = time.time() - connection.t_start
+			self.traceHandshake(connection)
+			self.log("Port %i: QP %i, PSN %i, memory 0x%x (%iB), rkey %i, established after %.3f seconds" %(connection.port, connection.queue_pair, connection.start_psn, connection.memory_start, connection.memory_length, connection.remote_key, connection.duration))
+	
+	def close(self):
+		self.sock.close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Initiate RDMA connections with the collector in parallel, and store their metadata.')
+	parser.add_argument('--ports', type=int, nargs='+', default=[1337], help='The TCP ports to the collector RDMA_CM')
+	parser.add_argument('--store', type=str, default="/home/jonatan/projects/dta/translator/rdma_sessions.bin", help='The RDMA session store to write the connection metadata to')
+	parser.add_argument('--iface', type=str, default="enp4s0f0", help='The interface towards the collector')
+	parser.add_argument('--timeout', type=float, default=1.0, help='Seconds to wait for each handshake step before retrying')
+	parser.add_argument('--retries', type=int, default=3, help='Number of retries per connection')
+	parser.add_argument('--trace', type=str, help='Store a timeline of the handshakes here (Chrome trace JSON)')
+	args = parser.parse_args()
+	
+	tracer = Tracer(enabled=args.trace is not None, name="rdma_cm")
+	manager = ConnectionManager(args.iface, timeout=args.timeout, retries=args.retries, tracer=tracer)
+	connections = manager.connectAll(args.ports)
+	manager.close()
+	
+	SessionStore(args.store).update([connection.session() for connection in connections.values() if connection.state == STATE_ESTABLISHED])
+	tracer.save(args.trace)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#Store of established RDMA sessions (one per collector structure), keyed by the RDMA_CM port
+#All sessions live in one file of fixed-size binary records, loaded with a single read and replaced atomically on every update (write to a temporary file, fsync, rename)
+#A partially written store can therefore never be read, and the switch-local controller can reuse still-valid QPs after a restart instead of re-handshaking them
+#Usage example: ./rdma_sessions.py --store /home/jonatan/projects/dta/translator/rdma_sessions.bin
+
+import argparse
+import os
+import struct
+import time
+
+STORE_MAGIC = b"DTARDMA1"
+STORE_HEADER = struct.Struct("<8sII") #magic, record size, number of records
+SESSION_RECORD = struct.Struct("<I16sIIIQQd") #port, name, queue_pair, start_psn, remote_key, memory_start, memory_length, timestamp
+
+class RDMASession:
+	port = None
+	name = ""
+	queue_pair = None
+	start_psn = None
+	memory_start = None
+	memory_length = None
+	remote_key = None
+	timestamp = None
+	
+	def __init__(self, port, queue_pair, start_psn, memory_start, memory_length, remote_key, name="", timestamp=None):
+		self.port = port
+		self.name = name
+		self.queue_pair = queue_pair
+		self.start_psn = start_psn
+		self.memory_start = memory_start
+		self.memory_length = memory_length
+		self.remote_key = remote_key
+		self.timestamp = time.time() if timestamp is None else timestamp
+	
+	#Same order as the values getCollectorMetadata() in switch_cpu.py returns
+	@property
+	def metadata(self):
+		return self.queue_pair, self.start_psn, self.memory_start, self.memory_length, self.remote_key
+	
+	@property
+	def age(self):
+		return time.time() - self.timestamp
+	
+	def pack(self):
+		return SESSION_RECORD.pack(self.port, self.name.encode()[:16], self.queue_pair, self.start_psn, self.remote_key, self.memory_start, self.memory_length, self.timestamp)
+	
+	@classmethod
+	def unpack(cls, record):
+		port, name, queue_pair, start_psn, remote_key, memory_start, memory_length, timestamp = record
+		return cls(port, queue_pair, start_psn, memory_start, memory_length, remote_key, name=name.rstrip(b"\x00").decode(), timestamp=timestamp)
+	
+	def __repr__(self):
+		return "RDMASession(port=%i, name='%s', qp=%i, psn=%i, memory=0x%x, length=%i, rkey=%i, age=%.0fs)" %(self.port, self.name, self.queue_pair, self.start_psn, self.memory_start, self.memory_length, self.remote_key, self.age)
+
+class SessionStore:
+	path = None
+	
+	def __init__(self, path):
+		self.path = path
+	
+	#All sessions as {port: RDMASession}, in one read. A missing store is empty
+	def load(self):
+		try:
+			with open(self.path, "rb") as f:
+				data = f.read()
+		except FileNotFoundError:
+			return {}
+		
+		assert len(data) >= STORE_HEADER.size, "RDMA session store %s is truncated!" %self.path
+		magic, record_size, num_records = STORE_HEADER.unpack_from(data)
+		assert magic == STORE_MAGIC, "%s is not an RDMA session store!" %self.path
+		assert record_size == SESSION_RECORD.size, "RDMA session store %s has %iB records, expected %iB" %(self.path, record_size, SESSION_RECORD.size)
+		assert len(data) == STORE_HEADER.size + num_records*record_size, "RDMA session store %s is truncated!" %self.path
+		
+		sessions = [RDMASession.unpack(record) for record in SESSION_RECORD.iter_unpack(data[STORE_HEADER.size:])]
+		return {session.port: session for session in sessions}
+	
+	#Replace the whole store with these sessions. Readers see either the old or the new store, never a mix
+	def save(self, sessions):
+		sessions = sorted(sessions.values() if isinstance(sessions, dict) else sessions, key=lambda session: session.port)
+		data = STORE_HEADER.pack(STORE_MAGIC, SESSION_RECORD.size, len(sessions)) + b"".join(session.pack() for session in sessions)
+		
+		directory = os.path.dirname(os.path.abspath(self.path))
+		os.makedirs(directory, exist_ok=True)
+		
+		tmp_path = "%s.tmp.%i" %(self.path, os.getpid())
+		with open(tmp_path, "wb") as f:
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_path, self.path)
+		
+		#Make the rename itself durable
+		fd = os.open(directory, os.O_RDONLY)
+		try:
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+	
+	#Insert or replace sessions, keeping the others
+	def update(self, sessions):
+		stored = self.load()
+		for session in sessions:
+			stored[session.port] = session
+		self.save(stored)
+		
+		return stored
+	
+	def remove(self, ports):
+		stored = self.load()
+		for port in ports:
+			stored.pop(port, None)
+		self.save(stored)
+		
+		return stored
+	
+	#Sessions that can be reused without a new handshake. max_age=None accepts sessions of any age
+	def valid(self, ports, max_age=None):
+		stored = self.load()
+		return {port: stored[port] for port in ports if port in stored and (max_age is None or stored[port].age <= max_age)}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Inspect or edit the RDMA session store of the translator.')
+	parser.add_argument('--store', type=str, default="/home/jonatan/projects/dta/translator/rdma_sessions.bin", help='The session store')
+	parser.add_argument('--remove', type=int, nargs='+', help='Forget the sessions of these CM ports, forcing new handshakes')
+	parser.add_argument('--clear', action='store_true', help='Forget all sessions')
+	args = parser.parse_args()
+	
+	store = SessionStore(args.store)
+	if args.clear:
+		store.save([])
+	elif args.remove:
+		store.remove(args.remove)
+	
+	for port,session in sorted(store.load().items()):
+		print(session)
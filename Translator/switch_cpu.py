@@ -5,11 +5,25 @@ import ipaddress
 import hashlib
 import struct
 import os
+import sys
+sys.path.append("/home/jonatan/projects/dta/translator")
+from tracing import Tracer
+t_imports = Tracer.now()
+from rdma_cm import ConnectionManager, STATE_ESTABLISHED
+from rdma_sessions import SessionStore, RDMASession
+from table_programmer import LogWriter, TableProgrammer
+from multicast_plan import MulticastPlan
+from digest_pipeline import DigestPipeline, RDMAAckAggregator
 p4 = bfrt.dta_translator.pipe
 mirror = bfrt.mirror
 pre = bfrt.pre
 
 logfile = "/home/jonatan/dta_translator.log"
+digest_logfile = "/home/jonatan/dta_digests.bin" #Binary log of the debug digests (RDMA acks/naks from the collector), see digest_pipeline.py. None disables the log
+digest_statsfile = "/home/jonatan/dta_digest_stats.json" #Digest counters, refreshed every second
+tracefile = "/home/jonatan/dta_translator_trace.json" #Timeline of the bootstrap phases and RDMA handshakes (Chrome trace, see tracing.py). None disables tracing
+
+dry_run = getattr(bfrt, "is_recorder", False) #Running offline against a recording bfrt (see table_programmer.py)
 
 
 #Add static forwarding rules according to our testbed topology
@@ -20,7 +34,7 @@ forwardingRules = [
 ("10.0.0.51", 156) #earl-04 Bluefield (collector)
 ]
 
-#Map collector destination IPs to egress ports (ensure mcRules exist for all these ports) (for KeyWrite and KeyIncrement)
+#Map collector destination IPs to egress ports (multicast groups are created for these ports) (for KeyWrite and KeyIncrement)
 collectorIPtoPorts = [
 #("10.1.0.1", 65),
 #("10.1.0.2", 65),
@@ -39,93 +53,40 @@ postcarder_slot_size_B = 32 #5x2B = 20B, +16 padding = 32B. We need this to be a
 
 num_data_lists = 4 #Number of data lists
 
-#Multicast rules, used to map egress port and redundancy to multicast group ID
-mcRules = [
-	{
-	"mgid":1,
-	"egressPort":8,
-	"redundancy":1
-	},
-	{
-	"mgid":2,
-	"egressPort":8,
-	"redundancy":2
-	},
-	{
-	"mgid":3,
-	"egressPort":8,
-	"redundancy":3
-	},
-	{
-	"mgid":4,
-	"egressPort":8,
-	"redundancy":4
-	},
-	{
-	"mgid":5,
-	"egressPort":64,
-	"redundancy":1
-	},
-	{
-	"mgid":6,
-	"egressPort":64,
-	"redundancy":2
-	},
-	{
-	"mgid":7,
-	"egressPort":64,
-	"redundancy":3
-	},
-	{
-	"mgid":8,
-	"egressPort":64,
-	"redundancy":4
-	},
-	{
-	"mgid":9,
-	"egressPort":156,
-	"redundancy":1
-	},
-	{
-	"mgid":10,
-	"egressPort":156,
-	"redundancy":2
-	},
-	{
-	"mgid":11,
-	"egressPort":156,
-	"redundancy":3
-	},
-	{
-	"mgid":12,
-	"egressPort":156,
-	"redundancy":4
-	}
-	]
+rdma_iface = "enp4s0f0" #Interface towards the collector, used to set up the RDMA connections
+rdma_timeout = 1.0 #Seconds to wait for each RDMA handshake step before retrying
+rdma_retries = 3
+rdma_session_store = "/home/jonatan/projects/dta/translator/rdma_sessions.bin" #Established sessions, reused across controller restarts
+rdma_reuse_sessions = False #Reuse stored sessions instead of re-handshaking. Only valid while the collector that accepted them keeps running (the Manager clears the store whenever it restarts the collector)
+rdma_session_max_age = None #Seconds after which stored sessions are re-handshaked (None: never)
 
+collectorMetadata = {} #RDMA_CM port -> (queue_pair, start_psn, memory_start, memory_length, remote_key)
 
+#Egress ports that always get multicast groups (one per redundancy level), even without collectors. Collector ports get groups automatically
+multicastPorts = [8, 64, 156]
+maxRedundancyLevel = 4
 
-def log(text):
-	global logfile, datetime
-	line = "%s \t DigProc: %s" %(str(datetime.datetime.now()), str(text))
-	print(line)
-	
-	f = open(logfile, "a")
-	f.write(line + "\n")
-	f.close()
+#The multicast groups and KeyWrite rules, kept up to date by addCollector()/removeCollector() (see multicast_plan.py)
+multicastPlan = MulticastPlan(maxRedundancyLevel)
+
+
+
+#One buffered log writer, one tracer, and one programmer batching all table operations
+log = LogWriter(logfile)
+tracer = Tracer(enabled=tracefile is not None, name="translator controller", origin=t_imports)
+tracer.complete("imports", t_imports, Tracer.now())
+programmer = TableProgrammer(bfrt, log=log, tracer=tracer)
+
+#Digests are queued by the callback and processed by a worker thread (debug = PSN, debug2 = destination QP)
+digests = DigestPipeline(["debug", "debug2"], RDMAAckAggregator(), log_path=digest_logfile, stats_path=digest_statsfile, log=log)
 
 
 def digest_callback(dev_id, pipe_id, direction, parser_id, session, msg):
-	global p4, log, Digest
-	#smac = p4.Ingress.smac
-	log("Received message from data plane!")
-	for dig in msg:
-		print(dig)
-	
-	return 0
+	global digests
+	return digests.callback(dev_id, pipe_id, direction, parser_id, session, msg)
 
 def bindDigestCallback():
-	global digest_callback, log, p4
+	global digest_callback, digests, log, p4, tracer
 	
 	try:
 		p4.SwitchIngressDeparser.debug_digest.callback_deregister()
@@ -133,90 +94,112 @@ def bindDigestCallback():
 		pass
 	finally:
 		log("Deregistering old callback function (if any)")
-
+	
+	digests.start()
+	
 	#Register as callback for digests (bind to DMA?)
 	log("Registering callback...")
-	p4.SwitchIngressDeparser.debug_digest.callback_register(digest_callback)
-
+	with tracer.span("callback_register", "bfrt"):
+		p4.SwitchIngressDeparser.debug_digest.callback_register(digest_callback)
+	
 	log("Bound callback to digest")
 
 
 def insertForwardingRules():
-	global p4, log, ipaddress, forwardingRules
+	global p4, log, ipaddress, forwardingRules, programmer
 	log("Inserting forwarding rules...")
 	
 	for dstAddr,egrPort in forwardingRules:
 		dstIP = ipaddress.ip_address(dstAddr)
 		log("%s->%i" %(dstIP, egrPort))
-		p4.SwitchIngress.tbl_forward.add_with_forward(dstAddr=dstIP, port=egrPort)
+		programmer.add(p4.SwitchIngress.tbl_forward.add_with_forward, dstAddr=dstIP, port=egrPort)
 
 def insertKeyWriteRules():
-	global p4, log, ipaddress, collectorIPtoPorts, mcRules
+	global log, collectorIPtoPorts, multicastPlan, applyMulticastOperations
 	log("Inserting KeyWrite rules...")
 	
-	maxRedundancyLevel = 4
-	
 	for collectorIP,egrPort in collectorIPtoPorts:
-		collectorIP_bin = ipaddress.ip_address(collectorIP)
-		
-		for redundancyLevel in range(1,maxRedundancyLevel+1):
-			
-			log("%s,%i,%i" %(collectorIP,egrPort,redundancyLevel))
-			
-			#Find the correct multicast group ID from the mcRules list
-			rule = [ r for r in mcRules if r["redundancy"]==redundancyLevel and r["egressPort"]==egrPort ]
-			log(rule[0])
-			multicastGroupID = rule[0]["mgid"]
-			
-			#multicastGroupID = 1 #Static for now. Update to match created multicast groups
-			
-			log("Adding multiwrite rule %s,N=%i - %i" %(collectorIP,redundancyLevel,multicastGroupID))
-			
-			p4.SwitchIngress.ProcessDTAPacket.tbl_Prep_KeyWrite.add_with_prep_MultiWrite(dstAddr=collectorIP_bin, redundancyLevel=redundancyLevel, mcast_grp=multicastGroupID)
+		log("Adding multiwrite rules %s,egr:%i" %(collectorIP,egrPort))
+		applyMulticastOperations(multicastPlan.addCollector(collectorIP, egrPort))
 
-
-
-def getCollectorMetadata(port):
-	global log, os
+#Issue the table operations of the multicast plan
+def applyMulticastOperations(operations):
+	global p4, pre, log, programmer
 	
-
-	metadata_dir = "/home/jonatan/projects/dta/translator/rdma_metadata/%i" %port
+	tables = {
+		"node_add": pre.node.add,
+		"node_delete": pre.node.delete,
+		"mgid_add": pre.mgid.add,
+		"mgid_delete": pre.mgid.delete,
+		"keywrite_add": p4.SwitchIngress.ProcessDTAPacket.tbl_Prep_KeyWrite.add_with_prep_MultiWrite,
+		"keywrite_delete": p4.SwitchIngress.ProcessDTAPacket.tbl_Prep_KeyWrite.delete
+	}
 	
-	log("Setting up a new RDMA connection from virtual client... port %i dir %s" %(port, metadata_dir))
-	os.system("python3 /home/jonatan/projects/dta/translator/init_rdma_connection.py --port %i --dir %s" %(port, metadata_dir))
+	for kind,fields in operations:
+		log("%s %s" %(kind, fields))
+		programmer.add(tables[kind], **fields)
+
+#Runtime updates (from the bfrt_python shell): only the groups and rules of this collector are touched
+def addCollector(collectorIP, egrPort):
+	global log, multicastPlan, applyMulticastOperations, programmer
+	log("Adding collector %s,egr:%i" %(collectorIP,egrPort))
+	applyMulticastOperations(multicastPlan.addCollector(collectorIP, egrPort))
+	programmer.flush()
+	log.flush()
+
+def removeCollector(collectorIP):
+	global log, multicastPlan, applyMulticastOperations, programmer
+	log("Removing collector %s" %collectorIP)
+	applyMulticastOperations(multicastPlan.removeCollector(collectorIP))
+	programmer.flush()
+	log.flush()
+
+def connectCollectors(structures):
+	global log, tracer, ConnectionManager, STATE_ESTABLISHED, SessionStore, RDMASession, collectorMetadata, rdma_iface, rdma_timeout, rdma_retries, rdma_session_store, rdma_reuse_sessions, rdma_session_max_age, dry_run
 	
-	log("Reading collector metadata from disk...")
-	try:
-		f = open("%s/tmp_qpnum"%metadata_dir, "r")
-		queue_pair = int(f.read())
-		f.close()
-		
-		f = open("%s/tmp_psn"%metadata_dir, "r")
-		start_psn = int(f.read())
-		f.close()
-		
-		f = open("%s/tmp_memaddr"%metadata_dir, "r")
-		memory_start = int(f.read())
-		f.close()
-		
-		f = open("%s/tmp_memlen"%metadata_dir, "r")
-		memory_length = int(f.read())
-		f.close()
-		
-		f = open("%s/tmp_rkey"%metadata_dir, "r")
-		remote_key = int(f.read())
-		f.close()
-	except:
-		log("   !!!   !!!   Failed to read RDMA metadata   !!!   !!!   ")
+	#Dry runs use made-up RDMA metadata, without touching the network or the session store
+	if dry_run:
+		for port,name in structures.items():
+			collectorMetadata[port] = RDMASession(port, port, 0, 0x7f0000000000 + (port << 32), 1 << 26, port, name=name).metadata
+		return
+	
+	store = SessionStore(rdma_session_store)
+	with tracer.span("load RDMA sessions", "rdma") as span:
+		reused = store.valid(list(structures), rdma_session_max_age) if rdma_reuse_sessions else {}
+		span.set(reused=sorted(reused))
+	for port,session in reused.items():
+		log("Reusing stored RDMA session %s" %session)
+		collectorMetadata[port] = session.metadata
+	
+	ports = [port for port in structures if port not in reused]
+	if len(ports) == 0:
+		return
+	
+	log("Setting up %i RDMA connections in parallel from virtual client... ports %s" %(len(ports), ports))
+	manager = ConnectionManager(rdma_iface, timeout=rdma_timeout, retries=rdma_retries, log=log, tracer=tracer)
+	connections = manager.connectAll(ports)
+	manager.close()
 	
-	log("Collector metadata read from disk!")
+	sessions = [connection.session(structures[port]) for port,connection in connections.items() if connection.state == STATE_ESTABLISHED]
+	for session in sessions:
+		collectorMetadata[session.port] = session.metadata
+	
+	log("Storing %i RDMA sessions in %s" %(len(sessions), rdma_session_store))
+	with tracer.span("store RDMA sessions", "rdma", sessions=len(sessions)):
+		store.update(sessions)
 
-	return queue_pair, start_psn, memory_start, memory_length, remote_key
+def getCollectorMetadata(port):
+	global log, collectorMetadata
+	
+	if port not in collectorMetadata:
+		log("   !!!   !!!   Failed to set up RDMA connection on port %i   !!!   !!!   " %port)
+	
+	return collectorMetadata[port]
 
 psn_reg_index = 0
 
 def setupKeyvalConnection(port=1337):
-	global p4, log, ipaddress, collectorIPtoPorts, getCollectorMetadata, psn_reg_index, keywrite_slot_size_B
+	global p4, log, ipaddress, collectorIPtoPorts, getCollectorMetadata, psn_reg_index, keywrite_slot_size_B, programmer
 	
 	source_qp = port
 	
@@ -231,19 +214,19 @@ def setupKeyvalConnection(port=1337):
 		collector_num_storage_slots = int(memory_length/keywrite_slot_size_B) #How many data slots are allocated in the collector? memory_length/(csum+data size in bytes)
 		
 		#Populate packet sequence number register
-		p4.SwitchEgress.CraftRDMA.reg_rdma_sequence_number.mod(f1=start_psn, REGISTER_INDEX=psn_reg_index)
+		programmer.add(p4.SwitchEgress.CraftRDMA.reg_rdma_sequence_number.mod, f1=start_psn, REGISTER_INDEX=psn_reg_index)
 		
 		log("Populating PSN-resynchronization lookup table for QP->regIndex mapping")
-		p4.SwitchEgress.RDMARatelimit.tbl_get_qp_reg_num.add_with_set_qp_reg_num(queue_pair=source_qp, qp_reg_index=psn_reg_index)
+		programmer.add(p4.SwitchEgress.RDMARatelimit.tbl_get_qp_reg_num.add_with_set_qp_reg_num, queue_pair=source_qp, qp_reg_index=psn_reg_index)
 		
 		log("Inserting KeyWrite RDMA lookup rule for collector ip %s" %dstAddr)
 		print("psn_reg_index", psn_reg_index)
-		p4.SwitchEgress.PrepareKeyWrite.tbl_getCollectorMetadataFromIP.add_with_set_server_info(dstAddr=dstIP, remote_key=remote_key, queue_pair=queue_pair, memory_address_start=memory_start, collector_num_storage_slots=collector_num_storage_slots, qp_reg_index=psn_reg_index)
+		programmer.add(p4.SwitchEgress.PrepareKeyWrite.tbl_getCollectorMetadataFromIP.add_with_set_server_info, dstAddr=dstIP, remote_key=remote_key, queue_pair=queue_pair, memory_address_start=memory_start, collector_num_storage_slots=collector_num_storage_slots, qp_reg_index=psn_reg_index)
 		
 		psn_reg_index += 1
 
 def setupDatalistConnection():
-	global p4, log, getCollectorMetadata, psn_reg_index, num_data_lists
+	global p4, log, getCollectorMetadata, psn_reg_index, num_data_lists, programmer
 	
 	#  This is where you specify how many dataLists to set up connections to, and populate ASIC with metadata of
 	#  list of (listID,rdmaCMPort) tuples
@@ -265,10 +248,10 @@ def setupDatalistConnection():
 		source_qp = port
 		
 		#Populate packet sequence number register
-		p4.SwitchEgress.CraftRDMA.reg_rdma_sequence_number.mod(f1=start_psn, REGISTER_INDEX=psn_reg_index)
+		programmer.add(p4.SwitchEgress.CraftRDMA.reg_rdma_sequence_number.mod, f1=start_psn, REGISTER_INDEX=psn_reg_index)
 		
 		log("Populating PSN-resynchronization lookup table for QP->regIndex mapping")
-		p4.SwitchEgress.RDMARatelimit.tbl_get_qp_reg_num.add_with_set_qp_reg_num(queue_pair=source_qp, qp_reg_index=psn_reg_index)
+		programmer.add(p4.SwitchEgress.RDMARatelimit.tbl_get_qp_reg_num.add_with_set_qp_reg_num, queue_pair=source_qp, qp_reg_index=psn_reg_index)
 		
 		collector_num_storage_slots = int(memory_length/listSlotSize) #How many data slots are allocated in the collector? memory_length/(data size in bytes)
 		psn_reg_index = int(psn_reg_index)
@@ -279,13 +262,13 @@ def setupDatalistConnection():
 		print("collector_num_storage_slots", collector_num_storage_slots)
 		
 		
-		p4.SwitchEgress.PrepareAppend.tbl_getCollectorMetadataFromListID_1.add_with_set_server_info_1(listID=listID, remote_key=remote_key, queue_pair=queue_pair, memory_address_start=memory_start)
-		p4.SwitchEgress.PrepareAppend.tbl_getCollectorMetadataFromListID_2.add_with_set_server_info_2(listID=listID, collector_num_storage_slots=collector_num_storage_slots, qp_reg_index=psn_reg_index)
+		programmer.add(p4.SwitchEgress.PrepareAppend.tbl_getCollectorMetadataFromListID_1.add_with_set_server_info_1, listID=listID, remote_key=remote_key, queue_pair=queue_pair, memory_address_start=memory_start)
+		programmer.add(p4.SwitchEgress.PrepareAppend.tbl_getCollectorMetadataFromListID_2.add_with_set_server_info_2, listID=listID, collector_num_storage_slots=collector_num_storage_slots, qp_reg_index=psn_reg_index)
 		psn_reg_index += 1
 
 
 def setupPostcarderConnection(port=1336):
-	global p4, log, ipaddress, collectorIPtoPorts, getCollectorMetadata, psn_reg_index, postcarder_slot_size_B
+	global p4, log, ipaddress, collectorIPtoPorts, getCollectorMetadata, psn_reg_index, postcarder_slot_size_B, programmer
 	
 	source_qp = port
 	
@@ -300,77 +283,81 @@ def setupPostcarderConnection(port=1336):
 		collector_num_storage_slots = int(memory_length/postcarder_slot_size_B) #How many data slots are allocated in the collector? memory_length/(slotsize in bytes = 32B)
 		
 		#Populate packet sequence number register
-		p4.SwitchEgress.CraftRDMA.reg_rdma_sequence_number.mod(f1=start_psn, REGISTER_INDEX=psn_reg_index)
+		programmer.add(p4.SwitchEgress.CraftRDMA.reg_rdma_sequence_number.mod, f1=start_psn, REGISTER_INDEX=psn_reg_index)
 		
 		log("Populating PSN-resynchronization lookup table for QP->regIndex mapping")
-		p4.SwitchEgress.RDMARatelimit.tbl_get_qp_reg_num.add_with_set_qp_reg_num(queue_pair=source_qp, qp_reg_index=psn_reg_index)
+		programmer.add(p4.SwitchEgress.RDMARatelimit.tbl_get_qp_reg_num.add_with_set_qp_reg_num, queue_pair=source_qp, qp_reg_index=psn_reg_index)
 		
 		log("Inserting Postcarder RDMA lookup rule for collector ip %s" %dstAddr)
 		print("psn_reg_index", psn_reg_index)
-		p4.SwitchEgress.PreparePostcarder.tbl_getCollectorMetadataFromIP.add_with_set_server_info(dstAddr=dstIP, remote_key=remote_key, queue_pair=queue_pair, memory_address_start=memory_start, collector_num_storage_slots=collector_num_storage_slots, qp_reg_index=psn_reg_index)
+		programmer.add(p4.SwitchEgress.PreparePostcarder.tbl_getCollectorMetadataFromIP.add_with_set_server_info, dstAddr=dstIP, remote_key=remote_key, queue_pair=queue_pair, memory_address_start=memory_start, collector_num_storage_slots=collector_num_storage_slots, qp_reg_index=psn_reg_index)
 		
 		psn_reg_index += 1
 
 
 def insertCollectorMetadataRules():
-	global p4, log, ipaddress, collectorIPtoPorts, getCollectorMetadata, setupKeyvalConnection, setupDatalistConnection, setupPostcarderConnection
+	global p4, log, tracer, ipaddress, collectorIPtoPorts, getCollectorMetadata, setupKeyvalConnection, setupDatalistConnection, setupPostcarderConnection, connectCollectors, num_data_lists
 	log("Inserting RDMA metadata into ASIC...")
 	
-	setupPostcarderConnection()
+	#Postcarder, KeyWrite, then the data lists (same CM ports as the setup functions below)
+	structures = {1336:"postcarder", 1337:"keywrite"}
+	for listID in range(num_data_lists):
+		structures[1338+listID] = "list%i" %listID
+	with tracer.span("connectCollectors", structures=len(structures)):
+		connectCollectors(structures)
 	
-	setupKeyvalConnection()
+	with tracer.span("setupPostcarderConnection"):
+		setupPostcarderConnection()
 	
-	setupDatalistConnection()
+	with tracer.span("setupKeyvalConnection"):
+		setupKeyvalConnection()
 	
+	with tracer.span("setupDatalistConnection"):
+		setupDatalistConnection()
+
 
-#NOTE: this might break ALL rules about multicasting. Very hacky
 def configMulticasting():
-	global p4, pre, log, mcRules
-	log("Configuring mirroring sessions...")
-	
-	lastNodeID=0
-	
-	for mcastGroup in mcRules:
-		mgid = mcastGroup["mgid"]
-		egressPort = mcastGroup["egressPort"]
-		redundancy = mcastGroup["redundancy"]
-		log("Setting up multicast %i, egr:%i, redundancy:%i" %(mgid, egressPort, redundancy))
-		
-		nodeIDs = []
-		log("Adding multicast nodes...")
-		for i in range(redundancy):
-			lastNodeID += 1
-			log("Creating node %i" %lastNodeID)
-			pre.node.add(DEV_PORT=[egressPort], MULTICAST_NODE_ID=lastNodeID)
-			nodeIDs.append(lastNodeID)
-		
-		log("Creating the multicast group")
-		pre.mgid.add(MGID=mgid, MULTICAST_NODE_ID=nodeIDs, MULTICAST_NODE_L1_XID=[0]*redundancy, MULTICAST_NODE_L1_XID_VALID=[False]*redundancy)
+	global log, multicastPorts, multicastPlan, applyMulticastOperations
+	log("Configuring multicast groups...")
 	
+	for egressPort in multicastPorts:
+		log("Setting up multicast, egr:%i, redundancy:1-%i" %(egressPort, multicastPlan.max_redundancy))
+		applyMulticastOperations(multicastPlan.addPort(egressPort))
+
 
 def configMirrorSessions():
-	global mirror, log
+	global mirror, log, programmer
 	log("Configuring mirroring sessions...")
 	
 	#TODO: fix truncation length
-	mirror.cfg.add_with_normal(sid=1, session_enable=True, ucast_egress_port=65, ucast_egress_port_valid=True, direction="BOTH", max_pkt_len=43) #Mirror header+Ethernet+IP
-	
-	
+	programmer.add(mirror.cfg.add_with_normal, sid=1, session_enable=True, ucast_egress_port=65, ucast_egress_port_valid=True, direction="BOTH", max_pkt_len=43) #Mirror header+Ethernet+IP
+
+
 def populateTables():
-	global p4, log, insertForwardingRules, insertKeyWriteRules, insertCollectorMetadataRules
+	global p4, log, tracer, insertForwardingRules, insertKeyWriteRules, insertCollectorMetadataRules
 	
 	log("Populating the P4 tables...")
 	
-	insertForwardingRules()
-	insertKeyWriteRules()
-	insertCollectorMetadataRules()
+	with tracer.span("insertForwardingRules"):
+		insertForwardingRules()
+	with tracer.span("insertKeyWriteRules"):
+		insertKeyWriteRules()
+	with tracer.span("insertCollectorMetadataRules"):
+		insertCollectorMetadataRules()
 
 log("Starting")
 
-configMulticasting()
-populateTables()
-configMirrorSessions()
-bindDigestCallback()
+with tracer.span("bootstrap"):
+	with tracer.span("configMulticasting"):
+		configMulticasting()
+	with tracer.span("populateTables"):
+		populateTables()
+	with tracer.span("configMirrorSessions"):
+		configMirrorSessions()
+	with tracer.span("flush table operations"):
+		programmer.flush()
+	with tracer.span("bindDigestCallback"):
+		bindDigestCallback()
 
 #log("Starting periodic injection of DTA write packet (keeping system alive)")
 #os.system("watch \"sudo /home/sde/dta/translator/inject_dta.py keywrite --data 10000 --key 0 --redundancy 1\" &")
@@ -380,4 +367,8 @@ print("*** Now start period WRITE function manually")
 
 
 
+#Stored before announcing completion, so the timeline is complete once the Manager sees "Bootstrap complete"
+if tracer.save(tracefile):
+	log("Stored the bootstrap timeline in %s" %tracefile)
 log("Bootstrap complete")
+log.flush()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+#Table programming layer for the switch-local controller
+#Table entries are queued and issued in BFRT batches (batch_begin/batch_end around each flush), and log lines go through one buffered writer instead of an open/append/close per line
+#RecordingBfrt stands in for the bfrt object of bfrt_python, capturing the intended table state, so that the controller bring-up can be benchmarked and diffed offline
+#Usage example (offline, no switch needed): python3 table_programmer.py switch_cpu.py --output translator_tables.json
+
+import argparse
+import datetime
+import ipaddress
+import json
+import os
+import sys
+import time
+
+from tracing import NULL_TRACER
+
+#Log lines are printed immediately, and written to the log file in chunks through one open file handle
+class LogWriter:
+	path = None
+	prefix = "DigProc"
+	flush_every = 1000
+	lines = None
+	file = None
+	
+	def __init__(self, path, prefix="DigProc", flush_every=1000):
+		self.path = path
+		self.prefix = prefix
+		self.flush_every = flush_every
+		self.lines = []
+	
+	def __call__(self, text):
+		line = "%s \t %s: %s" %(str(datetime.datetime.now()), self.prefix, str(text))
+		print(line)
+		
+		self.lines.append(line + "\n")
+		if len(self.lines) >= self.flush_every:
+			self.flush()
+	
+	def flush(self):
+		if len(self.lines) == 0 or self.path is None:
+			self.lines = []
+			return
+		
+		if self.file is None:
+			try:
+				self.file = open(self.path, "a")
+			except OSError as e:
+				print("Can not open log file %s (%s), logging to stdout only" %(self.path, e))
+				self.path = None
+				self.lines = []
+				return
+		
+		self.file.write("".join(self.lines))
+		self.file.flush()
+		self.lines = []
+	
+	def close(self):
+		self.flush()
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+#Queues table operations (e.g., p4.SwitchIngress.tbl_forward.add_with_forward) and issues them in BFRT batches
+class TableProgrammer:
+	bfrt = None
+	batch_size = 4096
+	pending = None
+	num_issued = 0
+	num_batches = 0
+	duration = 0
+	tracer = None
+	
+	def __init__(self, bfrt, log=print, batch_size=4096, tracer=None):
+		self.bfrt = bfrt
+		self.log = log
+		self.batch_size = batch_size
+		self.pending = []
+		self.tracer = tracer or NULL_TRACER
+	
+	def add(self, operation, **fields):
+		self.pending.append((operation, fields))
+		if len(self.pending) >= self.batch_size:
+			self.flush()
+	
+	#Issue all queued operations in one batch. The batch is closed even if an entry fails, and the error is raised
+	def flush(self):
+		if len(self.pending) == 0:
+			return
+		
+		pending = self.pending
+		self.pending = []
+		
+		t_start = time.perf_counter()
+		with self.tracer.span("table batch", "bfrt", operations=len(pending)):
+			batching = self.beginBatch()
+			try:
+				for operation,fields in pending:
+					operation(**fields)
+			finally:
+				if batching:
+					self.bfrt.batch_end()
+		self.duration += time.perf_counter() - t_start
+		
+		self.num_issued += len(pending)
+		self.num_batches += 1
+		self.log("Issued a batch of %i table operations (%i in total, %.3f seconds)" %(len(pending), self.num_issued, self.duration))
+	
+	#Older SDEs lack batching, the operations are then issued one by one
+	def beginBatch(self):
+		try:
+			self.bfrt.batch_begin()
+		except AttributeError:
+			return False
+		return True
+
+
+#A fake bfrt object. Any attribute path can be called, and calls are recorded instead of reaching a switch
+class RecordingNode:
+	def __init__(self, recorder, path):
+		self._recorder = recorder
+		self._path = path
+	
+	def __getattr__(self, name):
+		if name.startswith("__"):
+			raise AttributeError(name)
+		return RecordingNode(self._recorder, "%s.%s" %(self._path, name))
+	
+	def __call__(self, *args, **fields):
+		return self._recorder.record(self._path, args, fields)
+
+class RecordingBfrt(RecordingNode):
+	is_recorder = True #Lets controllers detect a dry run, e.g., to skip RDMA handshakes
+	calls = None
+	num_batches = 0
+	batch_depth = 0
+	
+	def __init__(self):
+		RecordingNode.__init__(self, self, "bfrt")
+		self.calls = []
+	
+	def record(self, path, args, fields):
+		if path == "bfrt.batch_begin":
+			self.batch_depth += 1
+			self.num_batches += 1
+		elif path == "bfrt.batch_end":
+			self.batch_depth -= 1
+		else:
+			self.calls.append({"call": path, "args": [jsonValue(arg) for arg in args], "fields": {name:jsonValue(value) for name,value in fields.items()}, "batched": self.batch_depth > 0})
+	
+	#The intended table state: per table, the (sorted) operations issued on it. Sorting makes states comparable regardless of programming order
+	def state(self):
+		tables = {}
+		for call in self.calls:
+			table, operation = call["call"].rsplit(".", 1)
+			entry = {"operation": operation, "fields": call["fields"]}
+			if call["args"]:
+				entry["args"] = call["args"]
+			tables.setdefault(table, []).append(entry)
+		
+		for table in tables:
+			tables[table].sort(key=lambda entry: json.dumps(entry, sort_keys=True))
+		
+		return tables
+	
+	def save(self, path):
+		summary = {
+			"num_operations": len(self.calls),
+			"num_unbatched": sum(not call["batched"] for call in self.calls),
+			"num_batches": self.num_batches,
+			"tables": self.state()
+		}
+		
+		with open(path, "w") as f:
+			json.dump(summary, f, indent=1, sort_keys=True)
+
+def jsonValue(value):
+	if isinstance(value, (bool, int, float, str)) or value is None:
+		return value
+	if isinstance(value, (list, tuple)):
+		return [jsonValue(v) for v in value]
+	if isinstance(value, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+		return str(value)
+	if callable(value):
+		return getattr(value, "__name__", repr(value))
+	return str(value)
+
+#Run a bfrt_python controller script against a bfrt object (e.g., a RecordingBfrt)
+def runController(script, bfrt):
+	sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+	with open(script) as f:
+		code = compile(f.read(), script, "exec")
+	
+	exec(code, {"bfrt": bfrt, "__name__": "__bfrt__", "__file__": script})
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Dry-run a switch-local controller against a recording bfrt object, and store the intended table state.')
+	parser.add_argument('script', type=str, help='The controller script, e.g., switch_cpu.py')
+	parser.add_argument('--output', type=str, default="tables.json", help='Where to store the recorded table state (JSON, sorted for diffing)')
+	args = parser.parse_args()
+	
+	recorder = RecordingBfrt()
+	
+	t_start = time.perf_counter()
+	runController(args.script, recorder)
+	duration = time.perf_counter() - t_start
+	
+	recorder.save(args.output)
+	print("Recorded %i table operations (%i batches) in %.3f seconds, stored in %s" %(len(recorder.calls), recorder.num_batches, duration, args.output))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#Span/timer instrumentation for the translator controller and the RDMA handshakes, stored as a Chrome trace (load it in chrome://tracing or https://ui.perfetto.dev)
+#Spans are context managers on a monotonic clock. A disabled tracer hands out one shared no-op span, so instrumented code costs a method call when tracing is off
+#Usage example: python3 tracing.py /home/jonatan/dta_translator_trace.json (prints the time spent per span)
+
+import argparse
+import json
+import os
+import threading
+import time
+
+#Returned by disabled tracers
+class NullSpan:
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc, traceback):
+		return False
+	
+	def set(self, **args):
+		pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+	__slots__ = ("tracer", "name", "category", "track", "args", "t_start")
+	
+	def __init__(self, tracer, name, category, track, args):
+		self.tracer = tracer
+		self.name = name
+		self.category = category
+		self.track = track
+		self.args = args
+	
+	def __enter__(self):
+		self.t_start = time.perf_counter_ns()
+		return self
+	
+	def __exit__(self, exc_type, exc, traceback):
+		if exc_type is not None:
+			self.args["error"] = exc_type.__name__
+		self.tracer.complete(self.name, self.t_start, time.perf_counter_ns(), self.category, self.track, **self.args)
+		return False
+	
+	#Add arguments to the span, e.g., results known only at its end
+	def set(self, **args):
+		self.args.update(args)
+
+class Tracer:
+	name = None
+	enabled = True
+	events = None #(phase, name, category, track, t_start, duration, args), times in ns
+	track_names = None
+	lock = None
+	pid = None
+	t_origin = None
+	
+	#Timestamps are relative to origin (from now()), by default the creation of the tracer
+	def __init__(self, enabled=True, name="dta", origin=None):
+		self.name = name
+		self.enabled = enabled
+		self.events = []
+		self.track_names = {}
+		self.lock = threading.Lock()
+		self.pid = os.getpid()
+		self.t_origin = origin or time.perf_counter_ns()
+	
+	#Monotonic timestamp (ns), for spans recorded with complete()
+	@staticmethod
+	def now():
+		return time.perf_counter_ns()
+	
+	#A span around a block: "with tracer.span("populateTables"):". Spans go on the track of the current thread, unless another track (e.g., an RDMA CM port) is given
+	def span(self, name, category="phase", track=None, **args):
+		if not self.enabled:
+			return NULL_SPAN
+		return Span(self, name, category, track, args)
+	
+	#Decorator tracing every call of a function
+	def traced(self, name=None, category="phase"):
+		def decorator(function):
+			span_name = name or function.__name__
+			def wrapper(*args, **kwargs):
+				if not self.enabled:
+					return function(*args, **kwargs)
+				with Span(self, span_name, category, None, {}):
+					return function(*args, **kwargs)
+			wrapper.__name__ = function.__name__
+			return wrapper
+		return decorator
+	
+	#A span with known start and end (from now()), e.g., for work interleaved with other work like parallel handshakes
+	def complete(self, name, t_start, t_end, category="phase", track=None, **args):
+		if not self.enabled:
+			return
+		with self.lock:
+			self.events.append(("X", name, category, track, t_start, t_end - t_start, args))
+	
+	#A point in time, e.g., a received reply
+	def instant(self, name, category="event", track=None, **args):
+		if not self.enabled:
+			return
+		with self.lock:
+			self.events.append(("i", name, category, track, time.perf_counter_ns(), 0, args))
+	
+	#Show a track under a name in the timeline (e.g., "port 1337")
+	def nameTrack(self, track, name):
+		if self.enabled:
+			self.track_names[track] = name
+	
+	#The events in the Chrome trace event format (timestamps in microseconds since the origin)
+	def chromeTrace(self):
+		thread_id = threading.get_native_id()
+		trace = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0, "args": {"name": self.name}}]
+		for track,name in self.track_names.items():
+			trace.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": track, "args": {"name": name}})
+		
+		with self.lock:
+			events = list(self.events)
+		
+		for phase,name,category,track,t_start,duration,args in events:
+			event = {"name": name, "cat": category, "ph": phase, "ts": (t_start - self.t_origin)/1000, "pid": self.pid, "tid": thread_id if track is None else track, "args": args}
+			if phase == "X":
+				event["dur"] = duration/1000
+			else:
+				event["s"] = "t"
+			trace.append(event)
+		
+		return {"traceEvents": trace, "displayTimeUnit": "ms", "otherData": {"name": self.name, "created": time.strftime("%Y-%m-%d %H:%M:%S")}}
+	
+	#Write the trace (replaced atomically, so readers never see a partial one). Returns False if it could not be written
+	def save(self, path):
+		if not self.enabled or path is None:
+			return False
+		
+		try:
+			with open(path + ".tmp", "w") as f:
+				json.dump(self.chromeTrace(), f)
+			os.replace(path + ".tmp", path)
+		except OSError as e:
+			print("Can not write trace %s (%s)" %(path, e))
+			return False
+		
+		return True
+	
+	#Time per span name: name -> (count, total seconds)
+	def summary(self):
+		with self.lock:
+			events = list(self.events)
+		
+		return summarize([{"name": name, "ph": phase, "dur": duration/1000} for phase,name,_,_,_,duration,_ in events])
+
+#Default of instrumented classes without a tracer
+NULL_TRACER = Tracer(enabled=False)
+
+#Time per span name of Chrome trace events: name -> (count, total seconds)
+def summarize(events):
+	totals = {}
+	for event in events:
+		if event.get("ph") != "X":
+			continue
+		count, total = totals.get(event["name"], (0, 0))
+		totals[event["name"]] = (count+1, total + event["dur"]/1000000)
+	
+	return totals
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Print the time spent per span of a stored Chrome trace.')
+	parser.add_argument('trace', type=str, help='The trace file, e.g., /home/jonatan/dta_translator_trace.json')
+	args = parser.parse_args()
+	
+	with open(args.trace) as f:
+		trace = json.load(f)
+	
+	for name,(count,total) in sorted(summarize(trace["traceEvents"]).items(), key=lambda item: -item[1][1]):
+		print("%8.3fs %6i x  %s" %(total, count, name))
@@ -0,0 +1,2 @@
+#Host-side Python library for Direct Telemetry Access
+#Modules are imported individually (e.g., "from dta.query import KeyWriteStore"), so that switch-local controllers can use the lightweight ones without NumPy installed
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+#Streaming reader of Append lists (dataListEntry ring buffers in collector memory), replacing the one-entry-at-a-time DataList::pull
+#The reader keeps an absolute tail position, and every poll returns the new entries as NumPy views into the list (at most two, split where the ring wraps), without copying
+#Where the writer is comes from one of:
+# - a head counter: the number of entries written into the list so far (e.g., the RDMA bytes of the stand-in collector, or reg_head_pointer read from the translator through HeadTracker)
+# - sequence-valued payloads: entry p of the stream holds first_value+p (mod 2^32), so new entries, and a writer that lapped the reader, are recognized in the data itself
+#If the writer is more than a full list ahead, the overwritten entries are counted as lost and the reader skips to the oldest intact entry
+#Usage example: python3 -m dta.append /dev/shm/dta/list0.bin --duration 10, or python3 -m dta.append --benchmark --slots 1048576
+
+import argparse
+import asyncio
+import mmap
+import multiprocessing
+import time
+import numpy as np
+
+from dta.layout import DATALIST_ENTRY, mapDump
+
+#Turns a wrapping head slot (e.g., reg_head_pointer of the list, read from the translator) into an absolute head counter
+#Laps are counted when the slot goes backwards, so the head must be read at least once per lap
+class HeadTracker:
+	read_slot = None
+	num_slots = None
+	laps = 0
+	last_slot = 0
+	
+	def __init__(self, read_slot, num_slots):
+		self.read_slot = read_slot
+		self.num_slots = num_slots
+	
+	def __call__(self):
+		slot = int(self.read_slot())
+		if slot < self.last_slot:
+			self.laps += 1
+		self.last_slot = slot
+		
+		return self.laps*self.num_slots + slot
+
+#The head counter of a list region of the stand-in collector (dta.collector.SoftCollector), in entries. Its statistics are updated after the data is written
+def collectorHead(collector, name):
+	row = [region.name for region in collector.regions].index(name)
+	return lambda: int(collector.stats["bytes"][row])//DATALIST_ENTRY.itemsize
+
+class AppendReader:
+	entries = None
+	data = None
+	num_slots = None
+	head = None #Callable returning the absolute head, or None in sequence mode
+	position = 0 #Absolute position of the next entry to read
+	first_value = 1 #Sequence mode: the value of the first entry. Not 0, so that zeroed memory does not look like data
+	max_batch = None
+	resync_slack = None #Entries skipped beyond the oldest intact one after a lap, so that the writer does not overwrite the new tail right away
+	
+	#Counters
+	consumed = 0
+	lost = 0
+	resyncs = 0
+	polls = 0
+	empty_polls = 0
+	
+	def __init__(self, entries, head=None, first_value=1, position=0, max_batch=None):
+		assert entries.dtype == DATALIST_ENTRY, "Storage is not laid out as dataListEntry!"
+		
+		self.entries = entries
+		self.data = entries["data"]
+		self.num_slots = len(entries)
+		self.head = head
+		self.first_value = first_value
+		self.position = position
+		self.max_batch = max_batch or self.num_slots
+		self.resync_slack = self.num_slots//4
+	
+	@classmethod
+	def fromDump(cls, path, head=None, first_value=1, position=0, max_batch=None):
+		return cls(mapDump(path, DATALIST_ENTRY), head, first_value, position, max_batch)
+	
+	@property
+	def sequence(self):
+		return self.head is None
+	
+	#The expected value of the entry at an absolute position (sequence mode)
+	def expected(self, position):
+		return np.uint32((self.first_value + position) & 0xffffffff)
+	
+	#Skip entries the writer already overwrote
+	def skipTo(self, position):
+		if position > self.position:
+			self.lost += position - self.position
+			self.resyncs += 1
+			self.position = position
+	
+	#Up to two contiguous (start slot, length) pieces of the ring, covering num_entries from the tail
+	def pieces(self, num_entries):
+		start = self.position % self.num_slots
+		first = min(num_entries, self.num_slots - start)
+		
+		pieces = [(start, first)]
+		if num_entries > first:
+			pieces.append((0, num_entries - first))
+		
+		return pieces
+	
+	#The number of entries ready at the tail (head mode)
+	def availableFromHead(self):
+		head = self.head()
+		if head - self.position > self.num_slots:
+			self.skipTo(head - self.num_slots)
+		
+		return max(0, head - self.position)
+	
+	#The number of entries ready at the tail (sequence mode): the run of entries holding the expected values
+	def availableFromSequence(self):
+		available = self.sequenceRun()
+		
+		#A tail entry from a later lap means the writer overwrote unread entries
+		if available == 0 and self.lapped():
+			available = self.sequenceRun()
+		
+		return available
+	
+	def sequenceRun(self):
+		available = 0
+		for start,length in self.pieces(self.max_batch):
+			values = self.data[start:start+length]
+			expected = self.expected(self.position + available) + np.arange(length, dtype=np.uint32)
+			mismatch = np.flatnonzero(values != expected) #Vectorized over the whole piece, there is no per-entry Python work
+			if len(mismatch) > 0:
+				available += int(mismatch[0])
+				break
+			available += length
+		
+		return available
+	
+	#How much later than position the entry in its slot was written (a multiple of num_slots, 0 if it is the expected one), or None if it is from an earlier lap or not part of the stream (e.g., zeroed memory)
+	def lapDistance(self, position):
+		distance = (int(self.data[position % self.num_slots]) - int(self.expected(position))) & 0xffffffff
+		if distance >= 1<<31 or distance % self.num_slots != 0:
+			return None
+		
+		return distance
+	
+	#Check whether the tail slot was overwritten by a later lap. If so, skip to the oldest intact entry, plus some slack
+	#The head is found by a binary search over single entries, so that it is still current when the reader skips. Under overload, a scan of the whole ring would be outdated by then, and the skip would land on overwritten entries again
+	def lapped(self):
+		distance = self.lapDistance(self.position)
+		if not distance:
+			return False
+		
+		#From the entry now in the tail slot on, the written positions are a run ending at the head
+		written = self.position + distance
+		unwritten = written + self.num_slots
+		while unwritten - written > 1:
+			middle = (written + unwritten)//2
+			if self.lapDistance(middle) is None:
+				unwritten = middle
+			else:
+				written = middle
+		
+		self.skipTo(unwritten - self.num_slots + self.resync_slack)
+		return True
+	
+	#The new entries, as up to two views into the list (empty if there are none). The tail advances past them
+	def poll(self, max_entries=None):
+		self.polls += 1
+		available = self.availableFromSequence() if self.sequence else self.availableFromHead()
+		available = min(available, max_entries or self.max_batch)
+		if available == 0:
+			self.empty_polls += 1
+			return []
+		
+		batches = [self.entries[start:start+length] for start,length in self.pieces(available)]
+		self.position += available
+		self.consumed += available
+		
+		return batches
+	
+	#Whether entries read from an absolute position are still intact (the writer did not wrap onto them since). Check after processing views that may lag
+	def intact(self, position, head=None):
+		if head is None:
+			head = self.head() if not self.sequence else self.position
+		return head - position <= self.num_slots
+	
+	#Blocking iteration over batches, (position, view), polling every interval seconds while the list has no new entries
+	def batches(self, interval=0.001, duration=None):
+		deadline = None if duration is None else time.time() + duration
+		while deadline is None or time.time() < deadline:
+			position = self.position
+			batches = self.poll()
+			if not batches:
+				time.sleep(interval)
+				continue
+			
+			for batch in batches:
+				yield position, batch
+				position += len(batch)
+	
+	#Asynchronous iteration over batches, e.g., "async for position, batch in reader:"
+	def __aiter__(self):
+		return self.asyncBatches()
+	
+	async def asyncBatches(self, interval=0.001, duration=None):
+		deadline = None if duration is None else time.time() + duration
+		while deadline is None or time.time() < deadline:
+			position = self.position
+			batches = self.poll()
+			if not batches:
+				await asyncio.sleep(interval)
+				continue
+			
+			for batch in batches:
+				yield position, batch
+				position += len(batch)
+	
+	def summary(self):
+		return "%i entries consumed, %i lost in %i resyncs, %i polls (%i empty)" %(self.consumed, self.lost, self.resyncs, self.polls, self.empty_polls)
+
+#Benchmark writer: fills the list with sequence values in batches of batch_size, as fast as possible or at rate entries per second. The number of entries written is stored in written (a shared Value)
+def writeSequence(memory, num_slots, first_value, duration, batch_size, rate=None, written=None):
+	data = np.frombuffer(memory, dtype=DATALIST_ENTRY)["data"]
+	values = np.arange(batch_size, dtype=np.uint32)
+	position = 0
+	t_start = time.time()
+	
+	while time.time() - t_start < duration:
+		if rate is not None and position > rate*(time.time() - t_start):
+			continue
+		
+		slot = position % num_slots
+		data[slot:slot+batch_size] = values + np.uint32((first_value + position) & 0xffffffff)
+		position += batch_size
+	
+	if written is not None:
+		written.value = position
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Stream new entries out of an Append list (collector dataListEntry ring) with sequence-valued payloads.')
+	parser.add_argument('list', type=str, nargs='?', help='Path to the list memory, e.g., /dev/shm/dta/list0.bin')
+	parser.add_argument('--first_value', type=int, default=1, help='The payload of the first entry in the stream')
+	parser.add_argument('--duration', type=float, default=10, help='Seconds to stream for')
+	parser.add_argument('--interval', type=float, default=0.001, help='Seconds between polls while the list has no new entries')
+	parser.add_argument('--benchmark', action='store_true', help='Stream from a list filled by a local writer process, to measure the reader')
+	parser.add_argument('--slots', type=int, default=1<<20, help='Benchmark: list size in entries')
+	parser.add_argument('--batch_size', type=int, default=4096, help='Benchmark: entries per write')
+	parser.add_argument('--rate', type=float, help='Benchmark: entries per second written (default: as fast as possible)')
+	args = parser.parse_args()
+	
+	assert args.list or args.benchmark, "Specify a list or --benchmark!"
+	
+	writer = None
+	written = None
+	if args.benchmark:
+		assert args.slots % args.batch_size == 0, "The list size must be a multiple of the batch size"
+		memory = mmap.mmap(-1, args.slots*DATALIST_ENTRY.itemsize)
+		reader = AppendReader(np.frombuffer(memory, dtype=DATALIST_ENTRY), first_value=args.first_value)
+		written = multiprocessing.get_context("fork").Value("q", 0)
+		writer = multiprocessing.get_context("fork").Process(target=writeSequence, args=(memory, args.slots, args.first_value, args.duration, args.batch_size, args.rate, written))
+		writer.start()
+	else:
+		reader = AppendReader.fromDump(args.list, first_value=args.first_value)
+	
+	print("Streaming %i-entry list for %gs..." %(reader.num_slots, args.duration))
+	checksum = 0
+	t_start = time.perf_counter()
+	for position,batch in reader.batches(args.interval, args.duration):
+		checksum += int(batch["data"][-1]) #Touch the batch, like a consumer would
+	duration = time.perf_counter() - t_start
+	
+	if writer is not None:
+		writer.join()
+	
+	print(reader.summary())
+	print("Read rate: %.3f million entries per second (%.3f million lost per second)" %(reader.consumed/(duration*1000000), reader.lost/(duration*1000000)))
+	
+	#Under overload, the reader must keep reading between resyncs rather than resync on every poll
+	if written is not None:
+		print("Write rate: %.3f million entries per second" %(written.value/(args.duration*1000000)))
+		if reader.resyncs:
+			print("Overloaded: the writer lapped the reader %i times, %.1f%% of the written entries were read (%i entries per resync)" %(reader.resyncs, 100*reader.consumed/max(written.value, 1), reader.consumed//reader.resyncs))
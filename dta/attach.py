@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#Attach to the stores of a running collector from another process, read-only and without copying
+#The collector (Collector/collector.cpp, or the stand-in dta.collector) exports every store as a named segment <name>.bin in a hugetlbfs mount (or /dev/shm), next to a <name>.json descriptor:
+# {"name", "layout", "entry_size", "num_entries", "size", "path", "rkey", "queue_pair", "address", "hugepages"}
+#Usage example: python3 -m dta.attach (lists the exported stores), or in Python: store = KeyWriteStore(attach("keywrite").entries)
+
+import argparse
+import json
+import mmap
+import os
+import numpy as np
+
+from dta.layout import KEYWRITE_ENTRY, KEYINCREMENT_ENTRY, POSTCARDER_ENTRY, DATALIST_ENTRY, mapBuffer
+
+#Searched in order. The collector uses the first that works
+EXPORT_DIRECTORIES = ["/dev/hugepages/dta", "/dev/shm/dta"]
+
+#Struct names of collector.cpp
+LAYOUTS = {
+	"keywriteEntry": KEYWRITE_ENTRY,
+	"keyincrementEntry": KEYINCREMENT_ENTRY,
+	"postcarderEntry": POSTCARDER_ENTRY,
+	"dataListEntry": DATALIST_ENTRY
+}
+
+def layoutName(entry):
+	for name,layout in LAYOUTS.items():
+		if layout == entry:
+			return name
+	assert False, "No collector layout matches %s" %entry
+
+#Write the descriptor of an exported store. It is replaced atomically, so attaching processes never read a partial one
+def writeDescriptor(path, name, entry, num_entries, rkey=0, queue_pair=0, address=0, hugepages=False):
+	descriptor = {
+		"name": name,
+		"layout": layoutName(entry),
+		"entry_size": entry.itemsize,
+		"num_entries": int(num_entries),
+		"size": int(num_entries)*entry.itemsize,
+		"path": path,
+		"rkey": int(rkey),
+		"queue_pair": int(queue_pair),
+		"address": int(address),
+		"hugepages": hugepages
+	}
+	
+	descriptor_path = os.path.splitext(path)[0] + ".json"
+	with open(descriptor_path + ".tmp", "w") as f:
+		json.dump(descriptor, f, indent=1)
+	os.replace(descriptor_path + ".tmp", descriptor_path)
+	
+	return descriptor
+
+def readDescriptor(path):
+	with open(path) as f:
+		descriptor = json.load(f)
+	
+	assert descriptor["layout"] in LAYOUTS, "Unknown layout %s in %s" %(descriptor["layout"], path)
+	assert descriptor["entry_size"] == LAYOUTS[descriptor["layout"]].itemsize, "%s: entry size %iB does not match %s (%iB)" %(path, descriptor["entry_size"], descriptor["layout"], LAYOUTS[descriptor["layout"]].itemsize)
+	
+	return descriptor
+
+#All exported stores, name -> descriptor. Earlier directories take precedence
+def descriptors(directories=None):
+	found = {}
+	for directory in directories or EXPORT_DIRECTORIES:
+		if not os.path.isdir(directory):
+			continue
+		for filename in sorted(os.listdir(directory)):
+			if filename.endswith(".json"):
+				descriptor = readDescriptor(os.path.join(directory, filename))
+				found.setdefault(descriptor["name"], descriptor)
+	
+	return found
+
+#A mapped store. The mapping stays valid after the collector exits, until the segment file is deleted
+class Segment:
+	descriptor = None
+	memory = None
+	entries = None
+	
+	def __init__(self, descriptor, writable=False):
+		self.descriptor = descriptor
+		
+		#The whole file is mapped (hugetlbfs segments are rounded up to whole hugepages), and the entries are a view of its start
+		with open(descriptor["path"], "r+b" if writable else "rb") as f:
+			size = os.fstat(f.fileno()).st_size
+			assert size >= descriptor["size"], "Segment %s is %iB, smaller than its %i entries" %(descriptor["path"], size, descriptor["num_entries"])
+			self.memory = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+		
+		self.entries = mapBuffer(self.memory, LAYOUTS[descriptor["layout"]], num_entries=descriptor["num_entries"])
+	
+	@property
+	def name(self):
+		return self.descriptor["name"]
+	
+	def __len__(self):
+		return len(self.entries)
+	
+	#The mapping can only be closed once no views of it are left
+	def close(self):
+		self.entries = None
+		self.memory.close()
+
+#Map an exported store by name. Read-only by default, so analytics can not disturb the collector
+def attach(name, directories=None, writable=False):
+	found = descriptors(directories)
+	assert name in found, "No exported store named %s in %s (found: %s)" %(name, ", ".join(directories or EXPORT_DIRECTORIES), ", ".join(sorted(found)) or "none")
+	
+	return Segment(found[name], writable)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='List the stores exported by a running collector, and map them read-only.')
+	parser.add_argument('--directory', type=str, nargs='*', help='Where to look for exported stores (default: %s)' %" and ".join(EXPORT_DIRECTORIES))
+	parser.add_argument('--usage', action='store_true', help='Also count the used (not all-zero) entries of every store')
+	args = parser.parse_args()
+	
+	found = descriptors(args.directory)
+	if not found:
+		print("No exported stores found")
+	
+	for name,descriptor in sorted(found.items()):
+		line = "%-12s %-18s %12i x %2iB  rkey 0x%08x  qp 0x%06x  %s%s" %(name, descriptor["layout"], descriptor["num_entries"], descriptor["entry_size"], descriptor["rkey"], descriptor["queue_pair"], descriptor["path"], " (hugepages)" if descriptor["hugepages"] else "")
+		
+		if args.usage:
+			segment = Segment(descriptor)
+			raw = np.frombuffer(segment.memory, dtype=np.uint8, count=descriptor["size"]).reshape(descriptor["num_entries"], descriptor["entry_size"])
+			line += "  %.2f%% used" %(100*np.count_nonzero(raw.any(axis=1))/max(1, descriptor["num_entries"]))
+			del raw
+			segment.close()
+		
+		print(line)
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+#Software stand-in for the RDMA collector (Collector/collector.cpp), for running DTA without an RDMA-capable NIC
+#RoCEv2 WRITEs and Fetch&Adds are applied into memory regions laid out exactly like the collector buffers (keywriteEntry, postcarderEntry, dataListEntry)
+#PSN gaps, out-of-order arrivals, and the conditions a real responder would NAK are tracked per QP, to measure end-to-end report loss and ingestion rates
+#Reception uses recvmmsg on UDP 4791, optionally sharded across processes by destination QP (SO_REUSEPORT with a classic BPF steering program)
+#Usage example: python3 -m dta.collector --pcap rdma.pcap, or python3 -m dta.collector --listen --workers 4 --duration 60
+
+import argparse
+import ctypes
+import mmap
+import multiprocessing
+import os
+import socket
+import struct
+import time
+import numpy as np
+
+from dta.headers import *
+from dta.layout import KEYWRITE_ENTRY, POSTCARDER_ENTRY, DATALIST_ENTRY
+from dta.frames import FrameBatch, readPcap
+from dta.encoder import libc, has_mmsg, messageVector, UIO_MAXIOV
+from dta.translator import defaultConnections, lookup
+from dta.attach import writeDescriptor
+
+MEMORY_DIRECTORY = "/dev/shm/dta" #Where the regions are created (with descriptors, see dta.attach), so that they can be mapped by dta.query and friends while the collector runs
+RECV_SLOT_SIZE = 2048 #Bytes per datagram in the receive ring
+RECV_TIMEOUT = 0.2 #Seconds recvmmsg blocks before checking for the end of the run
+MSG_WAITFORONE = 0x10000
+SO_ATTACH_REUSEPORT_CBPF = 51
+
+BTH_OFFSET = UDP_OFFSET + UDP.itemsize #In full frames. Datagrams received on the UDP socket start at the BTH
+PSN_HALF = 1<<23 #PSN distances above this are treated as going backwards
+
+#Opcodes the translator generates. Anything else is an invalid request for this responder
+RDMA_OPCODES_SUPPORTED = [RDMA_OPCODE_WRITE_ONLY, RDMA_OPCODE_FETCH_ADD]
+
+#Per-QP statistics, kept in shared memory so that the receive workers and the parent see the same values
+STAT_NAMES = ["packets", "writes", "fetchadds", "bytes", "psn_gaps", "psn_skipped", "out_of_order", "duplicates", "discarded", "nak_sequence", "nak_access", "nak_invalid"]
+QP_STATS = np.dtype([(name, "<u8") for name in STAT_NAMES] + [
+	("highest_psn", "<i8"), #-1 until the first packet. In strict mode this is the last accepted PSN (expected-1)
+	("nak_pending", "<u8"), #Strict mode: a sequence NAK was issued, and is not re-issued until the expected PSN arrives
+	("first_seen", "<f8"),
+	("last_seen", "<f8")
+])
+
+#Shared memory of a given size. File-backed (in directory) if given, otherwise anonymous. Both stay shared with forked workers
+def sharedMemory(size, path=None):
+	if path is None:
+		return np.frombuffer(mmap.mmap(-1, size), dtype=np.uint8)
+	
+	return np.memmap(path, dtype=np.uint8, mode="w+", shape=(size,))
+
+#One registered memory region of the collector, and the RDMA metadata the translator uses to write into it
+class MemoryRegion:
+	name = None
+	entry = None
+	queue_pair = None
+	remote_key = None
+	memory_start = None
+	size = None
+	path = None
+	memory = None
+	
+	def __init__(self, name, entry, num_entries, queue_pair, remote_key, memory_start, directory=None):
+		self.name = name
+		self.entry = entry
+		self.queue_pair = queue_pair
+		self.remote_key = remote_key
+		self.memory_start = memory_start
+		self.size = num_entries*entry.itemsize
+		
+		if directory is not None:
+			os.makedirs(directory, exist_ok=True)
+			self.path = os.path.join(directory, "%s.bin" %name)
+		self.memory = sharedMemory(self.size, self.path)
+		
+		#Described like the exports of collector.cpp, so that dta.attach finds the region
+		if self.path is not None:
+			writeDescriptor(self.path, name, entry, num_entries, remote_key, queue_pair, memory_start)
+	
+	#The region as collector entries, e.g., for KeyWriteStore(region.entries)
+	@property
+	def entries(self):
+		return self.memory.view(self.entry)
+	
+	def clear(self):
+		self.memory[:] = 0
+
+class SoftCollector:
+	regions = None
+	stats = None
+	strict = False
+	
+	def __init__(self, regions, strict=False):
+		self.regions = list(regions)
+		self.strict = strict
+		self.qpTable = {region.queue_pair & QP_MASK: i for i,region in enumerate(self.regions)}
+		self.qp_rows = np.array([self.qpTable[qp] for qp in sorted(self.qpTable)] or [0], dtype=np.int64) #Row of every lookup() index
+		
+		#The last row counts packets to unknown QPs
+		self.stats = sharedMemory((len(self.regions)+1)*QP_STATS.itemsize).view(QP_STATS)
+		self.stats["highest_psn"] = -1
+		
+		self.remote_keys = np.array([region.remote_key for region in self.regions], dtype=np.uint32)
+		self.memory_starts = np.array([region.memory_start for region in self.regions], dtype=np.uint64)
+		self.sizes = np.array([region.size for region in self.regions], dtype=np.uint64)
+	
+	#The regions of collector.cpp, with the RDMA metadata the translator model uses by default (see defaultConnections in dta/translator.py)
+	@classmethod
+	def fromDefault(cls, directory=MEMORY_DIRECTORY, keywrite_slots=1<<20, append_slots=1<<16, num_lists=4, postcarder_slots=1<<16, strict=False):
+		entries = {"keywrite": KEYWRITE_ENTRY, "postcarder": POSTCARDER_ENTRY}
+		
+		regions = []
+		for name,connection,_ in defaultConnections(keywrite_slots, append_slots, num_lists, postcarder_slots):
+			regions.append(MemoryRegion(name, entries.get(name, DATALIST_ENTRY), connection.num_slots, connection.queue_pair, connection.remote_key, connection.memory_start, directory))
+		
+		return cls(regions, strict=strict)
+	
+	#Apply a batch of RoCEv2 packets. Full frames are filtered on UDP port 4791, datagrams (bth_offset=0) are taken as-is
+	def process(self, batch, bth_offset=BTH_OFFSET):
+		if len(batch) == 0:
+			return
+		
+		if bth_offset > 0:
+			heads = batch.headers(bth_offset)
+			etherType = heads[:,12].astype(np.uint16) << 8 | heads[:,13]
+			dstPort = heads[:,UDP_OFFSET+2].astype(np.uint16) << 8 | heads[:,UDP_OFFSET+3]
+			is_roce = (etherType == ETHERTYPE_IPV4) & (heads[:,IPV4_OFFSET+9] == IPV4_PROTO_UDP) & (dstPort == ROCEV2_UDP_PORT)
+			if not np.all(is_roce):
+				batch = batch.select(np.flatnonzero(is_roce))
+				if len(batch) == 0:
+					return
+		
+		#BTH and the first extended header (RETH or AtomicETH)
+		heads = batch.headers(bth_offset + BTH.itemsize + ATOMIC_ETH.itemsize)[:,bth_offset:]
+		opcode = heads[:,0]
+		queue_pair = np.ascontiguousarray(heads[:,4:8]).view(">u4").ravel() & QP_MASK
+		psn = np.ascontiguousarray(heads[:,8:12]).view(">u4").ravel() & PSN_MASK
+		
+		hit, rows = lookup(self.qpTable, queue_pair)
+		rows = np.where(hit, self.qp_rows[rows], len(self.regions))
+		
+		num_rows = len(self.regions)+1
+		self.stats["packets"] += np.bincount(rows, minlength=num_rows).astype(np.uint64)
+		now = time.time()
+		seen = np.unique(rows)
+		self.stats["first_seen"][seen] = np.where(self.stats["first_seen"][seen] == 0, now, self.stats["first_seen"][seen])
+		self.stats["last_seen"][seen] = now
+		
+		known = np.flatnonzero(hit)
+		if len(known) == 0:
+			return
+		rows = rows[known]
+		opcode = opcode[known]
+		heads = heads[known]
+		frame_lengths = batch.lengths[known] - bth_offset
+		
+		accepted = self.trackPSNs(rows, psn[known])
+		
+		supported = np.isin(opcode, RDMA_OPCODES_SUPPORTED)
+		self.count("nak_invalid", rows[accepted & ~supported])
+		
+		eth = BTH.itemsize
+		virtual_address = np.ascontiguousarray(heads[:,eth:eth+8]).view(">u8").ravel()
+		remote_key = np.ascontiguousarray(heads[:,eth+8:eth+12]).view(">u4").ravel()
+		offsets = virtual_address - self.memory_starts[rows]
+		
+		is_write = accepted & (opcode == RDMA_OPCODE_WRITE_ONLY)
+		if np.any(is_write):
+			dma_length = np.ascontiguousarray(heads[:,eth+12:eth+16]).view(">u4").ravel().astype(np.uint64)
+			valid = (remote_key == self.remote_keys[rows]) & (virtual_address >= self.memory_starts[rows]) & (offsets + dma_length <= self.sizes[rows])
+			#The payload (and ICRC) have to be in the packet. Truncated packets are malformed, not an access error
+			complete = frame_lengths >= BTH.itemsize + RETH.itemsize + dma_length.astype(np.int64) + ICRC.itemsize
+			
+			self.count("nak_access", rows[is_write & ~valid])
+			self.count("nak_invalid", rows[is_write & valid & ~complete])
+			
+			applied = np.flatnonzero(is_write & valid & complete)
+			self.applyWrites(batch.select(known[applied]), rows[applied], offsets[applied], dma_length[applied], bth_offset)
+		
+		is_fetchadd = accepted & (opcode == RDMA_OPCODE_FETCH_ADD)
+		if np.any(is_fetchadd):
+			add = np.ascontiguousarray(heads[:,eth+12:eth+20]).view(">u8").ravel()
+			valid = (remote_key == self.remote_keys[rows]) & (virtual_address >= self.memory_starts[rows]) & (offsets + 8 <= self.sizes[rows])
+			aligned = offsets % 8 == 0
+			
+			self.count("nak_access", rows[is_fetchadd & ~valid])
+			self.count("nak_invalid", rows[is_fetchadd & valid & ~aligned])
+			
+			applied = np.flatnonzero(is_fetchadd & valid & aligned)
+			self.applyFetchAdds(rows[applied], offsets[applied], add[applied])
+	
+	def count(self, name, rows):
+		if len(rows):
+			self.stats[name] += np.bincount(rows, minlength=len(self.stats)).astype(np.uint64)
+	
+	#Classify PSNs per QP against the highest PSN seen so far. Returns which packets are executed
+	#Lenient mode executes everything (measuring what arrives). Strict mode follows an RC responder: only the expected PSN is executed, and a sequence NAK is raised once per gap
+	def trackPSNs(self, rows, psns):
+		order = np.argsort(rows, kind="stable")
+		sorted_rows = rows[order]
+		sorted_psns = psns[order].astype(np.int64)
+		
+		starts = np.flatnonzero(np.concatenate([[True], sorted_rows[1:] != sorted_rows[:-1]]))
+		group_rows = sorted_rows[starts]
+		group_sizes = np.diff(np.append(starts, len(order)))
+		group_of = np.repeat(np.arange(len(starts)), group_sizes)
+		
+		#Unwrap the 24-bit PSNs relative to the highest PSN before this batch (0). A QP's first packet ever counts as in order
+		highest = self.stats["highest_psn"][group_rows]
+		highest = np.where(highest < 0, (sorted_psns[starts]-1) & PSN_MASK, highest)
+		previous = np.empty(len(order), dtype=np.int64)
+		previous[1:] = sorted_psns[:-1]
+		previous[starts] = highest
+		steps = (sorted_psns - previous) & PSN_MASK
+		steps = np.where(steps >= PSN_HALF, steps - (PSN_MASK+1), steps)
+		unwrapped = np.cumsum(steps)
+		unwrapped -= np.repeat(unwrapped[starts] - steps[starts], group_sizes)
+		
+		accepted = np.ones(len(order), dtype=bool)
+		if not self.strict:
+			#Distance to the highest PSN seen before each packet. Groups are offset so the running maximum does not cross them
+			offset = np.repeat(np.arange(len(starts), dtype=np.int64) << 40, group_sizes)
+			running = np.maximum.accumulate(unwrapped + offset) - offset
+			highest_before = np.zeros(len(order), dtype=np.int64)
+			highest_before[1:] = running[:-1]
+			highest_before[starts] = 0
+			highest_before = np.maximum(highest_before, 0)
+			distance = unwrapped - highest_before
+			
+			gaps = distance > 1
+			self.count("psn_gaps", sorted_rows[gaps])
+			self.count("nak_sequence", sorted_rows[gaps])
+			self.stats["psn_skipped"] += np.bincount(sorted_rows[gaps], weights=distance[gaps]-1, minlength=len(self.stats)).astype(np.uint64)
+			self.count("duplicates", sorted_rows[distance == 0])
+			self.count("out_of_order", sorted_rows[distance < 0])
+			
+			top = np.maximum(np.maximum.reduceat(unwrapped, starts), 0)
+			self.stats["highest_psn"][group_rows] = (highest + top) & PSN_MASK
+		else:
+			for group in range(len(starts)):
+				first = starts[group]
+				accepted[first:first+group_sizes[group]] = self.acceptSequence(group_rows[group], highest[group], unwrapped[first:first+group_sizes[group]])
+		
+		unsorted = np.empty(len(order), dtype=bool)
+		unsorted[order] = accepted
+		return unsorted
+	
+	#Strict mode for one QP: PSNs are unwrapped relative to the last accepted PSN
+	def acceptSequence(self, row, highest, unwrapped):
+		stats = self.stats[row:row+1]
+		
+		#Fast path: everything arrives in order
+		if np.array_equal(unwrapped, np.arange(1, len(unwrapped)+1)):
+			stats["highest_psn"] = (highest + len(unwrapped)) & PSN_MASK
+			stats["nak_pending"] = 0
+			return np.ones(len(unwrapped), dtype=bool)
+		
+		accepted = np.zeros(len(unwrapped), dtype=bool)
+		expected = 1
+		nak_pending = int(stats["nak_pending"][0])
+		for i,psn in enumerate(unwrapped.tolist()):
+			if psn == expected:
+				accepted[i] = True
+				expected += 1
+				nak_pending = 0
+			elif psn > expected:
+				stats["discarded"] += 1
+				if not nak_pending:
+					stats["nak_sequence"] += 1
+					stats["psn_gaps"] += 1
+					stats["psn_skipped"] += psn - expected
+					nak_pending = 1
+			else:
+				stats["duplicates"] += 1
+				stats["discarded"] += 1
+		
+		stats["highest_psn"] = (highest + expected-1) & PSN_MASK
+		stats["nak_pending"] = nak_pending
+		return accepted
+	
+	#RDMA WRITE payloads into the regions. Writes to the same address keep the last one, as the NIC would execute them in order
+	def applyWrites(self, batch, rows, offsets, lengths, bth_offset):
+		if len(rows) == 0:
+			return
+		
+		payload_start = bth_offset + BTH.itemsize + RETH.itemsize
+		for length in np.unique(lengths):
+			selected = np.flatnonzero(lengths == length)
+			payloads = batch.select(selected).headers(payload_start + int(length))[:,payload_start:]
+			
+			for row in np.unique(rows[selected]):
+				in_region = selected[rows[selected] == row]
+				region_offsets = offsets[in_region].astype(np.int64)
+				
+				_, last = np.unique(region_offsets[::-1], return_index=True)
+				last = len(region_offsets)-1 - last
+				
+				memory = self.regions[row].memory
+				memory[region_offsets[last,None] + np.arange(int(length), dtype=np.int64)] = payloads[np.searchsorted(selected, in_region[last])]
+				
+				self.count("writes", np.full(len(in_region), row))
+				self.stats["bytes"][row] += np.uint64(len(in_region)*int(length))
+	
+	#RDMA Fetch&Add, on 8-byte counters in host byte order
+	def applyFetchAdds(self, rows, offsets, values):
+		for row in np.unique(rows):
+			selected = rows == row
+			counters = self.regions[row].memory[:self.regions[row].size//8*8].view("<u8")
+			np.add.at(counters, (offsets[selected]//8).astype(np.int64), values[selected])
+			
+			self.count("fetchadds", rows[selected])
+			self.stats["bytes"][row] += np.uint64(8*int(selected.sum()))
+	
+	#Receive datagrams from a bound UDP socket through recvmmsg until duration seconds pass, or count packets arrive
+	def receive(self, sock, duration=None, count=None, batch_size=UIO_MAXIOV):
+		assert has_mmsg, "recvmmsg is not available"
+		
+		#A receive timeout lets the loop notice the end of the run, while keeping the socket blocking
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, struct.pack("ll", int(RECV_TIMEOUT), int((RECV_TIMEOUT%1)*1000000)))
+		
+		buffer = np.zeros(batch_size*RECV_SLOT_SIZE, dtype=np.uint8)
+		messages, iovecs = messageVector(buffer, batch_size, RECV_SLOT_SIZE)
+		offsets = np.arange(batch_size, dtype=np.int64)*RECV_SLOT_SIZE
+		
+		num_received = 0
+		deadline = None if duration is None else time.time() + duration
+		while (deadline is None or time.time() < deadline) and (count is None or num_received < count):
+			ret = libc.recvmmsg(sock.fileno(), ctypes.c_void_p(messages.ctypes.data), batch_size, MSG_WAITFORONE, None)
+			if ret < 0:
+				errno = ctypes.get_errno()
+				if errno in [11, 4]: #EAGAIN (timeout), EINTR
+					continue
+				raise OSError(errno, "recvmmsg failed")
+			
+			lengths = messages["msg_len"][:ret].astype(np.int64)
+			self.process(FrameBatch(buffer, offsets[:ret], lengths), bth_offset=0)
+			num_received += ret
+		
+		return num_received
+	
+	def summary(self):
+		lines = ["%-12s %10s %10s %10s %10s %10s %10s %10s %10s %10s %10s %12s" %("region", "packets", "writes", "fetchadds", "gaps", "lost", "reordered", "dup", "discarded", "nak_seq", "nak_other", "Mpps")]
+		for i,name in enumerate([region.name for region in self.regions] + ["unknown_qp"]):
+			stats = self.stats[i]
+			if stats["packets"] == 0 and i < len(self.regions):
+				continue
+			
+			elapsed = stats["last_seen"] - stats["first_seen"]
+			rate = "%.3f" %(stats["packets"]/(elapsed*1000000)) if elapsed > 0 else "-"
+			lost = max(int(stats["psn_skipped"]) - int(stats["out_of_order"]), 0) if not self.strict else int(stats["psn_skipped"])
+			lines.append("%-12s %10i %10i %10i %10i %10i %10i %10i %10i %10i %10i %12s" %(name, stats["packets"], stats["writes"], stats["fetchadds"], stats["psn_gaps"], lost, stats["out_of_order"], stats["duplicates"], stats["discarded"], stats["nak_sequence"], stats["nak_access"]+stats["nak_invalid"], rate))
+		
+		return "\n".join(lines)
+
+#Classic BPF steering the datagrams of a reuseport group by destination QP: socket index = QP % num_sockets
+#The program sees the UDP payload, i.e., it starts at the BTH
+def steeringProgram(num_sockets):
+	BPF_LD_W_ABS = 0x20
+	BPF_ALU_AND_K = 0x54
+	BPF_ALU_MOD_K = 0x94
+	BPF_RET_A = 0x16
+	
+	instructions = [(BPF_LD_W_ABS, 0, 0, 4), (BPF_ALU_AND_K, 0, 0, QP_MASK), (BPF_ALU_MOD_K, 0, 0, num_sockets), (BPF_RET_A, 0, 0, 0)]
+	program = ctypes.create_string_buffer(b"".join(struct.pack("HBBI", *instruction) for instruction in instructions))
+	
+	return program, struct.pack("HP", len(instructions), ctypes.addressof(program))
+
+#One UDP socket per worker, in one SO_REUSEPORT group, with datagrams steered to them by destination QP
+def shardedSockets(num_workers, address="0.0.0.0", port=ROCEV2_UDP_PORT, rcvbuf=1<<26):
+	sockets = []
+	for _ in range(num_workers):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+		sock.bind((address, port))
+		sockets.append(sock)
+	
+	if num_workers > 1:
+		program, fprog = steeringProgram(num_workers)
+		sockets[0].setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, fprog)
+	
+	return sockets
+
+#Receive on num_workers processes. The regions and statistics are shared memory, and every QP is only written by one worker
+def receiveSharded(collector, num_workers, duration=None, count=None, address="0.0.0.0", port=ROCEV2_UDP_PORT):
+	sockets = shardedSockets(num_workers, address, port)
+	if num_workers == 1:
+		return collector.receive(sockets[0], duration, count)
+	
+	context = multiprocessing.get_context("fork")
+	workers = [context.Process(target=collector.receive, args=(sock, duration, count)) for sock in sockets]
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+	
+	return int(collector.stats["packets"].sum())
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Software stand-in for the DTA collector, applying RoCEv2 WRITEs and Fetch&Adds into shared memory.')
+	parser.add_argument('--pcap', type=str, nargs='+', help='Apply the RoCEv2 packets of these captures, e.g., dta.translator output')
+	parser.add_argument('--listen', action='store_true', help='Receive RoCEv2 on UDP port 4791')
+	parser.add_argument('--address', type=str, default="0.0.0.0", help='The address to listen on')
+	parser.add_argument('--workers', type=int, default=1, help='Number of receive processes, sharded by destination QP')
+	parser.add_argument('--duration', type=float, help='Seconds to receive for (default: until interrupted)')
+	parser.add_argument('--count', type=int, help='Number of packets to receive per worker')
+	parser.add_argument('--directory', type=str, default=MEMORY_DIRECTORY, help='Where to create the memory regions (as <name>.bin)')
+	parser.add_argument('--strict', action='store_true', help='Only execute packets with the expected PSN, like an RC responder')
+	parser.add_argument('--keywrite_slots', type=int, default=1<<20, help='Number of KeyWrite slots')
+	parser.add_argument('--append_slots', type=int, default=1<<16, help='Number of slots per Append list')
+	parser.add_argument('--num_lists', type=int, default=4, help='Number of Append lists')
+	parser.add_argument('--postcarder_slots', type=int, default=1<<16, help='Number of Postcarder slots')
+	args = parser.parse_args()
+	
+	assert args.pcap or args.listen, "Specify --pcap or --listen!"
+	
+	collector = SoftCollector.fromDefault(args.directory, args.keywrite_slots, args.append_slots, args.num_lists, args.postcarder_slots, strict=args.strict)
+	print("Regions in %s: %s" %(args.directory, ", ".join("%s (QP 0x%x, %iB)" %(region.name, region.queue_pair, region.size) for region in collector.regions)))
+	
+	t_start = time.perf_counter()
+	if args.pcap:
+		for path in args.pcap:
+			collector.process(readPcap(path))
+	else:
+		print("Listening on %s:%i with %i worker(s)..." %(args.address, ROCEV2_UDP_PORT, args.workers))
+		try:
+			receiveSharded(collector, args.workers, args.duration, args.count, args.address)
+		except KeyboardInterrupt:
+			pass
+	duration = time.perf_counter() - t_start
+	
+	print(collector.summary())
+	num_packets = int(collector.stats["packets"].sum())
+	print("Applied %i packets in %.3f seconds. This equals %.3f million packets per second" %(num_packets, duration, num_packets/(max(duration, 1e-9)*1000000)))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#Per-key rates from the KeyIncrement counters (8-byte RDMA Fetch&Add targets in the key-value region of the collector)
+#Every report adds to the counters at its N redundancy slots, the same slots KeyWrite uses, so the region is a count-min sketch: a key's count is the minimum of its N counters
+#CounterSampler copies the region into a ring of snapshots, and rates come from the difference of two snapshots, for all slots (or a whole key population) at once
+#Usage example: python3 -m dta.counters /dev/shm/dta/keywrite.bin --redundancy 2 --interval 1 --duration 60 --top 10 --key_range 0 1000000 --output heavy_keys.csv
+
+import argparse
+import csv
+import time
+import numpy as np
+
+from dta.layout import KEYINCREMENT_ENTRY, mapDump, isPowerOfTwo
+from dta.query import keySlotMatrix
+
+class KeyIncrementStore:
+	counters = None
+	num_entries = None
+	redundancy = None
+	
+	def __init__(self, storage, redundancy=2):
+		assert storage.dtype == KEYINCREMENT_ENTRY, "Storage is not laid out as KeyIncrement counters!"
+		assert isPowerOfTwo(len(storage)), "The translator only supports power-of-2 store sizes, got %i entries" %len(storage)
+		
+		self.counters = storage["counter"]
+		self.num_entries = len(storage)
+		self.redundancy = redundancy
+	
+	@classmethod
+	def fromDump(cls, path, redundancy=2):
+		return cls(mapDump(path, KEYINCREMENT_ENTRY), redundancy)
+	
+	#The slots of the keys, shape (num_keys, redundancy)
+	def slots(self, keys):
+		return keySlotMatrix(np.asarray(keys, dtype=np.uint32).ravel(), self.num_entries, self.redundancy)
+	
+	#Count-min estimate of the keys' counts, from any array of slot values (the counters, or snapshot deltas)
+	def estimate(self, keys, values=None, slots=None):
+		if values is None:
+			values = self.counters
+		if slots is None:
+			slots = self.slots(keys)
+		
+		return values[slots].min(axis=1)
+
+#Periodic snapshots of the counters in a preallocated ring, and the per-slot and per-key deltas between them
+class CounterSampler:
+	store = None
+	ring = None
+	timestamps = None
+	num_snapshots = 0
+	keys = None
+	key_slots = None #Slots of the key population, computed once
+	
+	def __init__(self, store, history=4, keys=None):
+		assert history >= 2, "Deltas need at least two snapshots"
+		
+		self.store = store
+		self.ring = np.zeros((history, store.num_entries), dtype=np.uint64)
+		self.timestamps = np.zeros(history, dtype=np.float64)
+		if keys is not None:
+			self.setKeys(keys)
+	
+	def setKeys(self, keys):
+		self.keys = np.asarray(keys, dtype=np.uint32).ravel()
+		self.key_slots = self.store.slots(self.keys)
+	
+	#Copy the counters into the next ring row. A sequential copy, the region is never scanned key by key
+	def snapshot(self):
+		row = self.num_snapshots % len(self.ring)
+		self.timestamps[row] = time.time()
+		np.copyto(self.ring[row], self.store.counters)
+		self.num_snapshots += 1
+		
+		return row
+	
+	def row(self, age):
+		assert age < min(self.num_snapshots, len(self.ring)), "No snapshot that old (%i taken, history of %i)" %(self.num_snapshots, len(self.ring))
+		return (self.num_snapshots - 1 - age) % len(self.ring)
+	
+	#Counter increments of every slot over the last span snapshot intervals, and the time they took
+	def slotDeltas(self, span=1):
+		newest, oldest = self.row(0), self.row(span)
+		deltas = self.ring[newest] - self.ring[oldest] #Unsigned, so counter wraparound is handled
+		
+		return deltas, self.timestamps[newest] - self.timestamps[oldest]
+	
+	#Count-min estimate of every key's increments, and rate (per second), over the last span intervals
+	def keyDeltas(self, span=1):
+		assert self.key_slots is not None, "No key population set!"
+		deltas, duration = self.slotDeltas(span)
+		key_deltas = self.store.estimate(None, deltas, self.key_slots)
+		
+		return key_deltas, key_deltas/max(duration, 1e-9)
+	
+	#The k heaviest keys over the last span intervals, as (keys, deltas, rates), heaviest first
+	#With a key population, keys are ranked by their count-min estimates. Without one, the heaviest slots are returned instead (their index in place of a key)
+	def top(self, k=10, span=1):
+		if self.key_slots is None:
+			deltas, duration = self.slotDeltas(span)
+			names = None
+		else:
+			deltas, _ = self.keyDeltas(span)
+			duration = self.timestamps[self.row(0)] - self.timestamps[self.row(span)]
+			names = self.keys
+		
+		k = min(k, len(deltas))
+		if k == 0:
+			return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint64), np.zeros(0)
+		
+		#Partial selection is linear in the number of slots, then only the k winners are sorted
+		heaviest = np.argpartition(deltas, len(deltas)-k)[len(deltas)-k:]
+		heaviest = heaviest[np.argsort(deltas[heaviest])[::-1]]
+		indexes = heaviest.astype(np.uint32) if names is None else names[heaviest]
+		
+		return indexes, deltas[heaviest], deltas[heaviest]/max(duration, 1e-9)
+
+#Appends the heavy keys of every interval to a CSV file, flushed after each interval so that it can be followed while sampling
+class CounterExporter:
+	path = None
+	file = None
+	writer = None
+	rows = 0
+	
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, "w", newline="")
+		self.writer = csv.writer(self.file)
+		self.writer.writerow(["timestamp", "rank", "key", "delta", "rate", "total_delta", "total_rate"])
+	
+	def write(self, timestamp, keys, deltas, rates, total_delta, total_rate):
+		for rank,(key,delta,rate) in enumerate(zip(keys.tolist(), deltas.tolist(), rates.tolist())):
+			self.writer.writerow([timestamp, rank+1, key, delta, "%.3f" %rate, total_delta, "%.3f" %total_rate])
+		self.file.flush()
+		self.rows += len(keys)
+	
+	def close(self):
+		self.file.close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Sample KeyIncrement counters in collector memory, and report per-key rates and heavy keys.')
+	parser.add_argument('dump', type=str, help='Path to the counter region, e.g., /dev/shm/dta/keywrite.bin of the stand-in collector')
+	parser.add_argument('--redundancy', type=int, default=2, help='The KeyIncrement redundancy (N) used by the reporters')
+	parser.add_argument('--interval', type=float, default=1.0, help='Seconds between snapshots')
+	parser.add_argument('--duration', type=float, default=10, help='Seconds to sample for')
+	parser.add_argument('--top', type=int, default=10, help='Number of heavy keys to report per interval')
+	parser.add_argument('--key_range', type=int, nargs=2, help='The key population, all keys in the range [start, end). Without it, the heaviest slots are reported')
+	parser.add_argument('--output', type=str, help='Append the heavy keys of every interval to this CSV file')
+	args = parser.parse_args()
+	
+	store = KeyIncrementStore.fromDump(args.dump, args.redundancy)
+	sampler = CounterSampler(store)
+	if args.key_range:
+		sampler.setKeys(np.arange(args.key_range[0], args.key_range[1], dtype=np.uint64).astype(np.uint32))
+	
+	exporter = CounterExporter(args.output) if args.output else None
+	print("Sampling %i counters every %gs..." %(store.num_entries, args.interval))
+	
+	sampler.snapshot()
+	t_end = time.time() + args.duration
+	while time.time() + args.interval <= t_end:
+		time.sleep(args.interval)
+		
+		t_start = time.perf_counter()
+		sampler.snapshot()
+		keys, deltas, rates = sampler.top(args.top)
+		slot_deltas, duration = sampler.slotDeltas()
+		total_delta = int(slot_deltas.sum())//store.redundancy #Every report increments N counters
+		processing = time.perf_counter() - t_start
+		
+		print("%s: %i increments (%.0f/s), processed in %.3fs. Heaviest %s: %s" %(time.strftime("%H:%M:%S"), total_delta, total_delta/duration, processing, "keys" if args.key_range else "slots", ", ".join("%i (%.0f/s)" %(key, rate) for key,rate in zip(keys[:5].tolist(), rates[:5].tolist()))))
+		if exporter is not None:
+			exporter.write(sampler.timestamps[sampler.row(0)], keys, deltas, rates, total_delta, total_delta/duration)
+	
+	if exporter is not None:
+		exporter.close()
+		print("Stored %i rows in %s" %(exporter.rows, args.output))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#Vectorized CRC calculations, matching the hash units used by the DTA pipelines on Tofino
+#Hash inputs are byte arrays of shape (num_items, num_bytes), holding the hashed fields concatenated MSB-first (as the P4 hash.get({...}) lists them)
+
+import numpy as np
+
+def reflect(value, width):
+	result = 0
+	for i in range(width):
+		if value & (1<<i):
+			result |= 1<<(width-1-i)
+	return result
+
+#A CRC engine in the Rocksoft model (polynomial without the top bit, reflected in/out, initial register value, final xor)
+class CRC:
+	width = None
+	poly = None
+	reflected = None
+	init = None
+	xorout = None
+	mask = None
+	dtype = None
+	table = None
+	
+	def __init__(self, poly, width=32, reflected=True, init=0xffffffff, xorout=0xffffffff):
+		self.width = width
+		self.poly = poly
+		self.reflected = reflected
+		self.mask = (1<<width)-1
+		self.init = init & self.mask
+		self.xorout = xorout & self.mask
+		
+		self.dtype = np.uint32 if width > 16 else np.uint16 if width > 8 else np.uint8
+		self.table = self.buildTable()
+	
+	def buildTable(self):
+		table = np.zeros(256, dtype=np.uint64)
+		
+		if self.reflected:
+			poly = reflect(self.poly, self.width)
+			for i in range(256):
+				crc = i
+				for _ in range(8):
+					crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+				table[i] = crc
+		else:
+			topbit = 1<<(self.width-1)
+			for i in range(256):
+				crc = i << (self.width-8) if self.width >= 8 else i
+				for _ in range(8):
+					crc = ((crc << 1) ^ self.poly) if crc & topbit else crc << 1
+				table[i] = crc & self.mask
+		
+		return table.astype(self.dtype)
+	
+	#Initial shift register state for num_items parallel calculations
+	def start(self, num_items):
+		return np.full(num_items, self.init, dtype=self.dtype)
+	
+	#Feed a (num_items, num_bytes) uint8 array into the shift registers
+	def update(self, state, data):
+		data = np.asarray(data, dtype=np.uint8)
+		if data.ndim == 1:
+			data = data.reshape(-1,1)
+		
+		state = state.copy()
+		for column in range(data.shape[1]):
+			byte = data[:,column].astype(self.dtype)
+			if self.reflected:
+				state = self.table[(state ^ byte) & 0xff] ^ (state >> 8)
+			else:
+				state = self.table[((state >> (self.width-8)) ^ byte) & 0xff] ^ ((state << 8) & self.dtype(self.mask))
+		
+		return state
+	
+	#Final xor, turning a shift register state into the CRC value
+	def finish(self, state):
+		return state ^ self.dtype(self.xorout)
+	
+	def compute(self, data):
+		data = np.asarray(data, dtype=np.uint8)
+		if data.ndim == 1:
+			data = data.reshape(1,-1)
+		
+		return self.finish(self.update(self.start(data.shape[0]), data))
+	
+	#Scalar convenience wrapper, taking a bytes object
+	def checksum(self, data):
+		return int(self.compute(np.frombuffer(bytes(data), dtype=np.uint8).reshape(1,-1))[0])
+
+
+#HashAlgorithm_t.CRC32 (same as zlib.crc32)
+CRC32 = CRC(0x04c11db7, width=32, reflected=True, init=0xffffffff, xorout=0xffffffff)
+
+#HashAlgorithm_t.CRC16 (CRC-16/ARC)
+CRC16 = CRC(0x8005, width=16, reflected=True, init=0x0000, xorout=0x0000)
+
+#HashAlgorithm_t.CRC8 (CRC-8/SMBUS)
+CRC8 = CRC(0x07, width=8, reflected=False, init=0x00, xorout=0x00)
+
+#Build the engine for a P4 CRCPolynomial<bit<32>>(coeff, reversed, msb, extended, init, xor)
+def customCRC32(coeff, reversed=True, init=0xffffffff, xorout=0xffffffff):
+	return CRC(coeff, width=32, reflected=reversed, init=init, xorout=xorout)
+
+
+#Split uint32 values into (num_items, 4) byte arrays, in the requested byte order
+def uint32Bytes(values, byteorder="big"):
+	values = np.ascontiguousarray(values, dtype=np.uint32)
+	dtype = ">u4" if byteorder == "big" else "<u4"
+	
+	return values.astype(dtype).view(np.uint8).reshape(-1,4)
+
+#Truncate a hash to the output width of a Hash<bit<W>> extern (the least significant bits are kept)
+def truncate(values, width):
+	return values & ((1<<width)-1)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+#Batched encoder for DTA reports. Frames are written straight into a preallocated NumPy buffer from a precomputed template
+#Only the per-report fields (seqnum, key, data, listID, ...) and the UDP checksum are patched, and batches are handed to a raw socket through sendmmsg
+#Usage example: python3 -m dta.encoder keywrite --iface enp4s0f0 --count 10000000 --batchsize 1024
+
+import argparse
+import ctypes
+import ctypes.util
+import socket
+import time
+import numpy as np
+
+from dta.headers import *
+
+class ReportEncoder:
+	opcode = None
+	frame = None
+	template = None
+	seqnum = 0
+	udp_checksum = True
+	
+	def __init__(self, opcode, dstMac="b8:ce:f6:d2:12:c7", srcMac="00:00:00:00:00:00", srcIP="10.0.0.101", dstIP="10.0.0.51", sport=DTA_REPORTER_PORT_NUMBER, dport=DTA_PORT_NUMBER, immediate=False, retransmitable=False, udp_checksum=True):
+		self.opcode = opcode
+		self.frame = reportFrame(opcode)
+		self.udp_checksum = udp_checksum
+		self.srcAddr = ipToInt(srcIP)
+		self.dstAddr = ipToInt(dstIP)
+		
+		template = np.zeros(1, dtype=self.frame)
+		template["ethernet"]["dstAddr"] = macBytes(dstMac)
+		template["ethernet"]["srcAddr"] = macBytes(srcMac)
+		template["ethernet"]["etherType"] = ETHERTYPE_IPV4
+		
+		template["ipv4"]["version_ihl"] = 0x45
+		template["ipv4"]["totalLen"] = self.frame.itemsize - IPV4_OFFSET
+		template["ipv4"]["identification"] = 1
+		template["ipv4"]["ttl"] = 64
+		template["ipv4"]["protocol"] = IPV4_PROTO_UDP
+		template["ipv4"]["srcAddr"] = self.srcAddr
+		template["ipv4"]["dstAddr"] = self.dstAddr
+		template["ipv4"]["hdrChecksum"] = ipv4Checksum(template.view(np.uint8)[IPV4_OFFSET:UDP_OFFSET])
+		
+		template["udp"]["srcPort"] = sport
+		template["udp"]["dstPort"] = dport
+		template["udp"]["length"] = self.frame.itemsize - UDP_OFFSET
+		
+		template["dta_base"]["opcode"] = opcode
+		template["dta_base"]["flags"] = (DTA_FLAG_IMMEDIATE if immediate else 0) | (DTA_FLAG_RETRANSMITABLE if retransmitable else 0)
+		
+		self.template = template
+	
+	@property
+	def frame_len(self):
+		return self.frame.itemsize
+	
+	#Preallocate a buffer of batch_size frames, pre-filled with the template (static fields are never rewritten)
+	def allocate(self, batch_size):
+		return np.repeat(self.template, batch_size)
+	
+	#Encode a batch of reports. Fields are named as in the primitive header (e.g., key=, data=, redundancy=, listID=), and can be arrays or scalars
+	#If frames is given (from allocate()), the reports are written into its first entries, otherwise a new buffer is allocated
+	def encode(self, frames=None, seqnums=None, **fields):
+		num_reports = max([np.size(value) for value in fields.values()] + [1 if seqnums is None else np.size(seqnums)])
+		
+		if frames is None:
+			frames = self.allocate(num_reports)
+		assert len(frames) >= num_reports, "Frame buffer too small for %i reports!" %num_reports
+		frames = frames[:num_reports]
+		
+		for name, value in fields.items():
+			assert name in self.frame["dta"].names, "The %s header has no field '%s'" %(self.frame["dta"], name)
+			frames["dta"][name] = value
+		
+		#Sequence numbers continue across batches, wrapping with the 8-bit field
+		if seqnums is None:
+			seqnums = (self.seqnum + np.arange(num_reports)) & 0xff
+			self.seqnum = (self.seqnum + num_reports) & 0xff
+		frames["dta_base"]["seqnum"] = seqnums
+		
+		if self.udp_checksum:
+			frames["udp"]["checksum"] = udpChecksums(rawFrames(frames), self.srcAddr, self.dstAddr)
+		
+		return frames
+	
+	def encodeKeyWrite(self, keys, data, redundancy, frames=None):
+		return self.encode(frames=frames, key=keys, data=data, redundancy=redundancy)
+	
+	def encodeKeyIncrement(self, keys, counters, redundancy, frames=None):
+		return self.encode(frames=frames, key=keys, counter=counters, redundancy=redundancy)
+	
+	def encodeAppend(self, listIDs, data, frames=None):
+		return self.encode(frames=frames, listID=listIDs, data=data)
+	
+	def encodePostcarder(self, keys, hopNums, data, frames=None):
+		return self.encode(frames=frames, key=keys, hopNum=hopNums, data=data)
+
+#View structured frames as a (num_frames, frame_len) byte array, without copying
+def rawFrames(frames):
+	return frames.view(np.uint8).reshape(len(frames), frames.dtype.itemsize)
+
+
+class iovec(ctypes.Structure):
+	_fields_ = [
+		("iov_base", ctypes.c_void_p),
+		("iov_len", ctypes.c_size_t)
+	]
+
+class msghdr(ctypes.Structure):
+	_fields_ = [
+		("msg_name", ctypes.c_void_p),
+		("msg_namelen", ctypes.c_uint32),
+		("msg_iov", ctypes.c_void_p),
+		("msg_iovlen", ctypes.c_size_t),
+		("msg_control", ctypes.c_void_p),
+		("msg_controllen", ctypes.c_size_t),
+		("msg_flags", ctypes.c_int)
+	]
+
+class mmsghdr(ctypes.Structure):
+	_fields_ = [
+		("msg_hdr", msghdr),
+		("msg_len", ctypes.c_uint)
+	]
+
+#NumPy mirrors of the C structs, so that a whole message vector can be filled without Python-level loops
+IOVEC = np.dtype({"names":["iov_base", "iov_len"], "formats":[np.uintp, np.uintp], "offsets":[iovec.iov_base.offset, iovec.iov_len.offset], "itemsize":ctypes.sizeof(iovec)})
+MMSGHDR = np.dtype({"names":["msg_iov", "msg_iovlen", "msg_len"], "formats":[np.uintp, np.uintp, np.uint32], "offsets":[msghdr.msg_iov.offset, msghdr.msg_iovlen.offset, mmsghdr.msg_len.offset], "itemsize":ctypes.sizeof(mmsghdr)})
+
+UIO_MAXIOV = 1024 #The kernel caps the vector length of a single sendmmsg/recvmmsg call
+SOL_PACKET = 263
+PACKET_QDISC_BYPASS = 20
+
+libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+has_mmsg = hasattr(libc, "sendmmsg")
+
+#Build the message vector for num_frames consecutive frames in a buffer (one iovec per frame)
+def messageVector(buffer, num_frames, frame_len):
+	iovecs = np.zeros(num_frames, dtype=IOVEC)
+	iovecs["iov_base"] = buffer.ctypes.data + np.arange(num_frames, dtype=np.uintp)*frame_len
+	iovecs["iov_len"] = frame_len
+	
+	messages = np.zeros(num_frames, dtype=MMSGHDR)
+	messages["msg_iov"] = iovecs.ctypes.data + np.arange(num_frames, dtype=np.uintp)*IOVEC.itemsize
+	messages["msg_iovlen"] = 1
+	
+	return messages, iovecs
+
+#The MAC address of a local interface, used as the source MAC (raw sockets do not fill it in)
+def ifaceMac(iface):
+	try:
+		with open("/sys/class/net/%s/address" %iface) as f:
+			return f.read().strip()
+	except OSError:
+		return "00:00:00:00:00:00"
+
+#Sends batches of frames through one raw AF_PACKET socket, one syscall per (up to) UIO_MAXIOV frames
+class RawSender:
+	iface = None
+	sock = None
+	num_sent = 0
+	vectors = None
+	
+	def __init__(self, iface, qdisc_bypass=True):
+		self.iface = iface
+		self.vectors = {}
+		
+		self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+		self.sock.bind((iface, 0))
+		
+		if qdisc_bypass:
+			try:
+				self.sock.setsockopt(SOL_PACKET, PACKET_QDISC_BYPASS, 1)
+			except OSError:
+				pass
+	
+	def send(self, frames):
+		frames = np.ascontiguousarray(frames)
+		num_frames = len(frames)
+		frame_len = frames.dtype.itemsize if frames.dtype.names else frames.shape[1]
+		
+		if not has_mmsg:
+			raw = memoryview(frames.view(np.uint8).ravel())
+			for i in range(num_frames):
+				self.sock.send(raw[i*frame_len:(i+1)*frame_len])
+			self.num_sent += num_frames
+			return num_frames
+		
+		#The vectors only depend on where the buffer lives, so repeated sends from a preallocated buffer reuse them
+		vector_id = (frames.ctypes.data, num_frames, frame_len)
+		if vector_id not in self.vectors:
+			self.vectors = {vector_id: messageVector(frames, num_frames, frame_len)}
+		messages, _ = self.vectors[vector_id]
+		
+		sent = 0
+		while sent < num_frames:
+			vlen = min(num_frames-sent, UIO_MAXIOV)
+			ret = libc.sendmmsg(self.sock.fileno(), ctypes.c_void_p(messages.ctypes.data + sent*MMSGHDR.itemsize), vlen, 0)
+			if ret < 0:
+				errno = ctypes.get_errno()
+				raise OSError(errno, "sendmmsg failed on %s" %self.iface)
+			sent += ret
+		
+		self.num_sent += sent
+		return sent
+	
+	def close(self):
+		self.sock.close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Generate synthetic DTA reports at high rates through batched encoding and sendmmsg.')
+	parser.add_argument('operation', type=str, choices=list(DTA_PRIMITIVE_NAMES), help='The DTA operation')
+	parser.add_argument('--iface', type=str, help='The interface to send on. Without it, only encoding is benchmarked')
+	parser.add_argument('--count', type=int, default=1000000, help='Total number of reports to generate')
+	parser.add_argument('--batchsize', type=int, default=1024, help='Number of reports encoded and sent per batch')
+	parser.add_argument('--redundancy', type=int, default=2, help='The redundancy for KeyWrite and KeyIncrement')
+	parser.add_argument('--num_lists', type=int, default=4, help='Number of lists to round-robin Append reports over')
+	parser.add_argument('--srcIP', type=str, default="10.0.0.101", help='The reporter IP address')
+	parser.add_argument('--dstIP', type=str, default="10.0.0.51", help='The collector IP address')
+	parser.add_argument('--dstMac', type=str, default="b8:ce:f6:d2:12:c7", help='The destination MAC address')
+	parser.add_argument('--no_udp_checksum', action='store_true', help='Leave the UDP checksum at 0 (it is optional in IPv4)')
+	args = parser.parse_args()
+	
+	opcode = DTA_PRIMITIVE_NAMES[args.operation]
+	srcMac = ifaceMac(args.iface) if args.iface else "00:00:00:00:00:00"
+	encoder = ReportEncoder(opcode, dstMac=args.dstMac, srcMac=srcMac, srcIP=args.srcIP, dstIP=args.dstIP, udp_checksum=not args.no_udp_checksum)
+	sender = RawSender(args.iface) if args.iface else None
+	
+	frames = encoder.allocate(args.batchsize)
+	counter = np.arange(args.batchsize, dtype=np.uint64)
+	
+	print("Generating %i %s reports in batches of %i (%iB frames)..." %(args.count, args.operation, args.batchsize, encoder.frame_len))
+	
+	t_start = time.perf_counter()
+	for batch_start in range(0, args.count, args.batchsize):
+		values = (counter[:min(args.batchsize, args.count-batch_start)] + batch_start)
+		
+		if opcode == DTA_OPCODE_KEYWRITE:
+			batch = encoder.encodeKeyWrite(values, values+1, args.redundancy, frames=frames)
+		elif opcode == DTA_OPCODE_KEYINCREMENT:
+			batch = encoder.encodeKeyIncrement(values, 1, args.redundancy, frames=frames)
+		elif opcode == DTA_OPCODE_APPEND:
+			batch = encoder.encodeAppend(values % args.num_lists, values+1, frames=frames)
+		elif opcode == DTA_OPCODE_POSTCARDER:
+			batch = encoder.encodePostcarder(values//5, values%5 + 1, values+1, frames=frames)
+		
+		if sender:
+			sender.send(batch)
+	duration = time.perf_counter() - t_start
+	
+	print("Done in %.3f seconds. This equals %.3f million reports per second" %(duration, args.count/(duration*1000000)))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+#Batches of variable-length frames kept in one flat buffer, with pcap reading/writing and raw socket capture
+#Frames are never copied into per-packet Python objects, so multi-million packet captures can be processed with NumPy
+
+import socket
+import struct
+import time
+import numpy as np
+
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAP_LINKTYPE_ETHERNET = 1
+PCAP_SNAPLEN = 65535
+
+PCAP_GLOBAL_HEADER = np.dtype([
+	("magic", "<u4"),
+	("version_major", "<u2"),
+	("version_minor", "<u2"),
+	("thiszone", "<i4"),
+	("sigfigs", "<u4"),
+	("snaplen", "<u4"),
+	("network", "<u4")
+])
+
+PCAP_RECORD_HEADER = np.dtype([
+	("ts_sec", "<u4"),
+	("ts_frac", "<u4"),
+	("incl_len", "<u4"),
+	("orig_len", "<u4")
+])
+
+RAGGED_CHUNK_SIZE = 1<<16 #Frames per chunk when copying ragged data, bounds the size of index arrays
+
+class FrameBatch:
+	buffer = None
+	offsets = None
+	lengths = None
+	timestamps = None
+	
+	def __init__(self, buffer, offsets, lengths, timestamps=None):
+		self.buffer = buffer
+		self.offsets = np.asarray(offsets, dtype=np.int64)
+		self.lengths = np.asarray(lengths, dtype=np.int64)
+		
+		if timestamps is None:
+			timestamps = np.zeros(len(self.offsets), dtype=np.float64)
+		self.timestamps = np.asarray(timestamps, dtype=np.float64)
+	
+	#Wrap equally sized frames, e.g., a structured array of crafted frames
+	@classmethod
+	def fromArray(cls, frames, timestamps=None):
+		raw = np.ascontiguousarray(frames).view(np.uint8).reshape(len(frames), -1)
+		frame_len = raw.shape[1]
+		
+		return cls(raw.ravel(), np.arange(len(raw), dtype=np.int64)*frame_len, np.full(len(raw), frame_len, dtype=np.int64), timestamps)
+	
+	@classmethod
+	def fromBytes(cls, frames, timestamps=None):
+		lengths = np.array([len(frame) for frame in frames], dtype=np.int64)
+		offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+		buffer = np.frombuffer(b"".join(frames), dtype=np.uint8)
+		
+		return cls(buffer, offsets, lengths, timestamps)
+	
+	def __len__(self):
+		return len(self.offsets)
+	
+	def frame(self, i):
+		return self.buffer[self.offsets[i]:self.offsets[i]+self.lengths[i]].tobytes()
+	
+	def select(self, indices):
+		return FrameBatch(self.buffer, self.offsets[indices], self.lengths[indices], self.timestamps[indices])
+	
+	#The first width bytes of every frame as a (num_frames, width) array, zero-padded for shorter frames
+	def headers(self, width):
+		#Fast path: equally sized and spaced frames (fixed-size pcap records or crafted arrays) are read through a strided view
+		if len(self) > 1 and np.all(self.lengths == self.lengths[0]):
+			strides = np.diff(self.offsets)
+			available = min(width, int(self.lengths[0]))
+			if strides[0] > 0 and np.all(strides == strides[0]) and self.offsets[-1]+available <= len(self.buffer):
+				view = np.lib.stride_tricks.as_strided(self.buffer[self.offsets[0]:], shape=(len(self), available), strides=(int(strides[0])*self.buffer.strides[0], self.buffer.strides[0]), writeable=False)
+				headers = np.zeros((len(self), width), dtype=np.uint8)
+				headers[:,:available] = view
+				return headers
+		
+		columns = np.arange(width, dtype=np.int64)
+		index = self.offsets[:,None] + columns
+		valid = columns < self.lengths[:,None]
+		
+		headers = self.buffer[np.where(valid, index, 0)]
+		headers[~valid] = 0
+		
+		return headers
+	
+	#All frames concatenated back-to-back
+	def payload(self):
+		return gatherRagged(self.buffer, self.offsets, self.lengths)
+
+#Copy ragged slices buffer[offsets[i]:offsets[i]+lengths[i]] into one contiguous array
+def gatherRagged(buffer, offsets, lengths):
+	output = np.empty(int(np.sum(lengths)), dtype=np.uint8)
+	
+	position = 0
+	for start in range(0, len(offsets), RAGGED_CHUNK_SIZE):
+		chunk_offsets = offsets[start:start+RAGGED_CHUNK_SIZE]
+		chunk_lengths = lengths[start:start+RAGGED_CHUNK_SIZE]
+		chunk_total = int(np.sum(chunk_lengths))
+		
+		#Index of every byte: its frame start, plus the distance into the frame
+		starts = np.cumsum(chunk_lengths) - chunk_lengths
+		index = np.repeat(chunk_offsets - starts, chunk_lengths) + np.arange(chunk_total, dtype=np.int64)
+		
+		output[position:position+chunk_total] = buffer[index]
+		position += chunk_total
+	
+	return output
+
+#Merge equally sized frame groups into one batch, ordered by a per-frame position key
+#parts is a list of (frames, positions, timestamps), frames being (num_frames, frame_len) uint8 arrays or structured arrays
+def mergeFrames(parts):
+	parts = [(np.ascontiguousarray(frames).view(np.uint8).reshape(len(frames), -1), np.asarray(positions), np.asarray(timestamps, dtype=np.float64)) for frames,positions,timestamps in parts if len(frames) > 0]
+	if len(parts) == 0:
+		return FrameBatch(np.zeros(0, dtype=np.uint8), [], [], [])
+	
+	positions = np.concatenate([part[1] for part in parts])
+	lengths = np.concatenate([np.full(len(part[0]), part[0].shape[1], dtype=np.int64) for part in parts])
+	timestamps = np.concatenate([part[2] for part in parts])
+	
+	order = np.argsort(positions, kind="stable")
+	sorted_lengths = lengths[order]
+	sorted_offsets = np.cumsum(sorted_lengths) - sorted_lengths
+	
+	#A single frame size needs no scatter, the frames are just reordered
+	if len(parts) == 1:
+		return FrameBatch(parts[0][0][order].ravel(), sorted_offsets, sorted_lengths, timestamps[order])
+	
+	#Destination offset of every frame, in the original (part-concatenated) order
+	offsets = np.empty(len(order), dtype=np.int64)
+	offsets[order] = sorted_offsets
+	
+	buffer = np.empty(int(np.sum(lengths)), dtype=np.uint8)
+	first = 0
+	for raw,_,_ in parts:
+		destinations = offsets[first:first+len(raw)]
+		buffer[destinations[:,None] + np.arange(raw.shape[1], dtype=np.int64)] = raw
+		first += len(raw)
+	
+	return FrameBatch(buffer, sorted_offsets, sorted_lengths, timestamps[order])
+
+def concatFrames(batches):
+	batches = [batch for batch in batches if len(batch) > 0]
+	if len(batches) == 0:
+		return FrameBatch(np.zeros(0, dtype=np.uint8), [], [], [])
+	
+	buffers = [batch.payload() for batch in batches]
+	lengths = np.concatenate([batch.lengths for batch in batches])
+	offsets = np.cumsum(lengths) - lengths
+	
+	return FrameBatch(np.concatenate(buffers), offsets, lengths, np.concatenate([batch.timestamps for batch in batches]))
+
+
+#Read a pcap file (memory-mapped). Captures where all frames have the same length are indexed without any per-packet Python code
+def readPcap(path):
+	data = np.memmap(path, dtype=np.uint8, mode="r")
+	assert len(data) >= PCAP_GLOBAL_HEADER.itemsize, "%s is not a pcap file!" %path
+	
+	header = data[:PCAP_GLOBAL_HEADER.itemsize].view(PCAP_GLOBAL_HEADER)[0]
+	assert header["magic"] in [PCAP_MAGIC_US, PCAP_MAGIC_NS], "Unsupported pcap magic 0x%08x in %s (only little-endian pcap is supported, not pcapng)" %(header["magic"], path)
+	assert header["network"] == PCAP_LINKTYPE_ETHERNET, "Only Ethernet captures are supported"
+	frac_scale = 1e-9 if header["magic"] == PCAP_MAGIC_NS else 1e-6
+	
+	start = PCAP_GLOBAL_HEADER.itemsize
+	size = len(data) - start
+	if size == 0:
+		return FrameBatch(data, [], [], [])
+	
+	#Fast path: fixed-size records
+	first_len = int(data[start+8:start+12].view("<u4")[0])
+	record_len = PCAP_RECORD_HEADER.itemsize + first_len
+	if size % record_len == 0:
+		records = data[start:].reshape(-1, record_len)
+		record_headers = np.ascontiguousarray(records[:,:PCAP_RECORD_HEADER.itemsize]).view(PCAP_RECORD_HEADER).ravel()
+		
+		if np.all(record_headers["incl_len"] == first_len):
+			offsets = start + np.arange(len(records), dtype=np.int64)*record_len + PCAP_RECORD_HEADER.itemsize
+			lengths = np.full(len(records), first_len, dtype=np.int64)
+			timestamps = record_headers["ts_sec"] + record_headers["ts_frac"]*frac_scale
+			
+			return FrameBatch(data, offsets, lengths, timestamps)
+	
+	#Slow path: walk the records
+	raw = memoryview(data)
+	offsets = []
+	lengths = []
+	timestamps = []
+	position = start
+	while position + PCAP_RECORD_HEADER.itemsize <= len(data):
+		ts_sec, ts_frac, incl_len, _ = struct.unpack_from("<IIII", raw, position)
+		position += PCAP_RECORD_HEADER.itemsize
+		
+		offsets.append(position)
+		lengths.append(incl_len)
+		timestamps.append(ts_sec + ts_frac*frac_scale)
+		position += incl_len
+	
+	return FrameBatch(data, offsets, lengths, timestamps)
+
+def writePcap(path, batch, nanosecond=False):
+	frac_scale = 1e9 if nanosecond else 1e6
+	
+	header = np.zeros(1, dtype=PCAP_GLOBAL_HEADER)
+	header["magic"] = PCAP_MAGIC_NS if nanosecond else PCAP_MAGIC_US
+	header["version_major"] = 2
+	header["version_minor"] = 4
+	header["snaplen"] = PCAP_SNAPLEN
+	header["network"] = PCAP_LINKTYPE_ETHERNET
+	
+	with open(path, "wb") as f:
+		f.write(header.tobytes())
+		
+		for start in range(0, len(batch), RAGGED_CHUNK_SIZE):
+			chunk = batch.select(slice(start, start+RAGGED_CHUNK_SIZE))
+			
+			records = np.zeros(len(chunk), dtype=PCAP_RECORD_HEADER)
+			records["ts_sec"] = np.floor(chunk.timestamps)
+			records["ts_frac"] = np.round((chunk.timestamps - np.floor(chunk.timestamps))*frac_scale)
+			records["incl_len"] = chunk.lengths
+			records["orig_len"] = chunk.lengths
+			
+			#Interleave record headers and frames by treating the headers as a second ragged source
+			record_bytes = records.view(np.uint8)
+			joint = np.concatenate([record_bytes, chunk.payload()])
+			header_offsets = np.arange(len(chunk), dtype=np.int64)*PCAP_RECORD_HEADER.itemsize
+			frame_offsets = len(record_bytes) + np.cumsum(chunk.lengths) - chunk.lengths
+			
+			offsets = np.empty(2*len(chunk), dtype=np.int64)
+			offsets[0::2] = header_offsets
+			offsets[1::2] = frame_offsets
+			lengths = np.empty(2*len(chunk), dtype=np.int64)
+			lengths[0::2] = PCAP_RECORD_HEADER.itemsize
+			lengths[1::2] = chunk.lengths
+			
+			f.write(gatherRagged(joint, offsets, lengths).tobytes())
+
+
+#Capture up to count frames from an interface through a raw socket. Returns early after timeout seconds
+#Frames are received straight into one preallocated buffer
+def captureFrames(iface, count, timeout=1.0, snaplen=2048, sock=None):
+	if sock is None:
+		sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(0x0003)) #ETH_P_ALL
+		sock.bind((iface, 0))
+	sock.settimeout(timeout)
+	
+	buffer = np.empty(count*snaplen, dtype=np.uint8)
+	view = memoryview(buffer)
+	lengths = np.zeros(count, dtype=np.int64)
+	timestamps = np.zeros(count, dtype=np.float64)
+	
+	num_frames = 0
+	deadline = time.time() + timeout
+	while num_frames < count and time.time() < deadline:
+		try:
+			lengths[num_frames] = sock.recv_into(view[num_frames*snaplen:(num_frames+1)*snaplen], snaplen)
+		except socket.timeout:
+			break
+		timestamps[num_frames] = time.time()
+		num_frames += 1
+	
+	offsets = np.arange(num_frames, dtype=np.int64)*snaplen
+	return FrameBatch(buffer, offsets, lengths[:num_frames], timestamps[:num_frames])
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+#Header definitions for DTA reports, as NumPy dtypes (packed, network byte order)
+#These mirror the scapy definitions in Translator/inject_dta.py and the TReX profiles in Generator/
+#The dta_base header includes the seqnum byte by default, i.e., the layout of translators compiled with DO_NACK_TRACKING
+
+import ipaddress
+import numpy as np
+
+ETHERTYPE_IPV4 = 0x0800
+IPV4_PROTO_UDP = 0x11
+
+DTA_PORT_NUMBER = 40040
+DTA_ACK_PORT_NUMBER = 40044
+DTA_REPORTER_PORT_NUMBER = 40041 #Source port used by our report generators
+
+DTA_OPCODE_KEYWRITE = 0x01
+DTA_OPCODE_APPEND = 0x02
+DTA_OPCODE_KEYINCREMENT = 0x03
+DTA_OPCODE_POSTCARDER = 0x04
+
+DTA_FLAG_IMMEDIATE = 0x80
+DTA_FLAG_RETRANSMITABLE = 0x40
+
+ROCEV2_UDP_PORT = 4791
+ROCEV2_SRC_PORT = 10000 #Source port of all translator-generated RoCEv2 (same as in init_rdma_connection.py)
+
+RDMA_OPCODE_WRITE_ONLY = 0x0a
+RDMA_OPCODE_ACK = 0x11
+RDMA_OPCODE_FETCH_ADD = 0x14
+
+ETHERNET = np.dtype([
+	("dstAddr", "u1", 6),
+	("srcAddr", "u1", 6),
+	("etherType", ">u2")
+])
+
+IPV4 = np.dtype([
+	("version_ihl", "u1"),
+	("tos", "u1"),
+	("totalLen", ">u2"),
+	("identification", ">u2"),
+	("flags_fragOffset", ">u2"),
+	("ttl", "u1"),
+	("protocol", "u1"),
+	("hdrChecksum", ">u2"),
+	("srcAddr", ">u4"),
+	("dstAddr", ">u4")
+])
+
+UDP = np.dtype([
+	("srcPort", ">u2"),
+	("dstPort", ">u2"),
+	("length", ">u2"),
+	("checksum", ">u2")
+])
+
+DTA_BASE = np.dtype([
+	("opcode", "u1"),
+	("seqnum", "u1"),
+	("flags", "u1") #immediate(1), retransmitable(1), reserved(6)
+])
+
+#dta_base without NACK tracking (the default translator build, and the reporter)
+DTA_BASE_NO_SEQNUM = np.dtype([
+	("opcode", "u1"),
+	("flags", "u1") #immediate(1), reserved(7)
+])
+
+DTA_KEYWRITE = np.dtype([
+	("redundancy", "u1"),
+	("key", ">u4"),
+	("data", ">u4")
+])
+
+DTA_KEYINCREMENT = np.dtype([
+	("redundancy", "u1"),
+	("key", ">u4"),
+	("counter", ">u8")
+])
+
+DTA_APPEND = np.dtype([
+	("listID", ">u4"),
+	("data", ">u4")
+])
+
+DTA_POSTCARDER = np.dtype([
+	("key", ">u4"),
+	("hopNum", "u1"),
+	("data", ">u4")
+])
+
+DTA_ACK = np.dtype([
+	("seqnum", "u1"),
+	("flags", "u1") #nack(1), reserved(7)
+])
+
+#Infiniband base transport header (12 bytes)
+BTH = np.dtype([
+	("opcode", "u1"),
+	("flags", "u1"), #solicitedEvent(1), migReq(1), padCount(2), transportHeaderVersion(4)
+	("partitionKey", ">u2"),
+	("destinationQP", ">u4"), #fRes(1), bRes(1), reserved(6), destinationQP(24)
+	("packetSequenceNumber", ">u4") #ackRequest(1), reserved(7), psn(24)
+])
+
+#RDMA extended transport header (16 bytes)
+RETH = np.dtype([
+	("virtualAddress", ">u8"),
+	("rKey", ">u4"),
+	("dmaLength", ">u4")
+])
+
+#Atomic extended transport header (28 bytes)
+ATOMIC_ETH = np.dtype([
+	("virtualAddress", ">u8"),
+	("rKey", ">u4"),
+	("data", ">u8"),
+	("compare", ">u8")
+])
+
+#ACK extended transport header (4 bytes)
+AETH = np.dtype([
+	("syndrome", "u1"),
+	("msn", "u1", 3)
+])
+
+ICRC = np.dtype([
+	("iCRC", ">u4")
+])
+
+BTH_MIGREQ = 0x40
+PSN_MASK = 0xffffff
+QP_MASK = 0xffffff
+
+DTA_PRIMITIVES = {
+	DTA_OPCODE_KEYWRITE: DTA_KEYWRITE,
+	DTA_OPCODE_APPEND: DTA_APPEND,
+	DTA_OPCODE_KEYINCREMENT: DTA_KEYINCREMENT,
+	DTA_OPCODE_POSTCARDER: DTA_POSTCARDER
+}
+
+DTA_PRIMITIVE_NAMES = {
+	"keywrite": DTA_OPCODE_KEYWRITE,
+	"append": DTA_OPCODE_APPEND,
+	"keyincrement": DTA_OPCODE_KEYINCREMENT,
+	"postcarder": DTA_OPCODE_POSTCARDER
+}
+
+#Byte offsets into a full report frame
+ETHERNET_OFFSET = 0
+IPV4_OFFSET = ETHERNET_OFFSET + ETHERNET.itemsize
+UDP_OFFSET = IPV4_OFFSET + IPV4.itemsize
+DTA_BASE_OFFSET = UDP_OFFSET + UDP.itemsize
+DTA_PRIMITIVE_OFFSET = DTA_BASE_OFFSET + DTA_BASE.itemsize
+
+#The full Ether/IP/UDP/dta_base/primitive frame for an opcode
+def reportFrame(opcode, seqnum=True):
+	return np.dtype([
+		("ethernet", ETHERNET),
+		("ipv4", IPV4),
+		("udp", UDP),
+		("dta_base", DTA_BASE if seqnum else DTA_BASE_NO_SEQNUM),
+		("dta", DTA_PRIMITIVES[opcode])
+	])
+
+#A RoCEv2 frame carrying the given extended transport header and payload
+def rocev2Frame(payload, eth=RETH):
+	return np.dtype([
+		("ethernet", ETHERNET),
+		("ipv4", IPV4),
+		("udp", UDP),
+		("bth", BTH),
+		("eth", eth),
+		("payload", payload),
+		("icrc", ICRC)
+	])
+
+def macBytes(mac):
+	return np.frombuffer(bytes.fromhex(mac.replace(":", "")), dtype=np.uint8)
+
+def ipToInt(ip):
+	return int(ipaddress.ip_address(ip))
+
+#One's complement sum of 16-bit words, folded to 16 bits. Works on (num_items, num_bytes) uint8 arrays
+def onesComplementSum(data, initial=0):
+	data = np.asarray(data, dtype=np.uint8)
+	if data.shape[1] % 2:
+		data = np.concatenate([data, np.zeros((data.shape[0],1), dtype=np.uint8)], axis=1)
+	
+	words = data[:,0::2].astype(np.uint32) << 8 | data[:,1::2].astype(np.uint32)
+	total = words.sum(axis=1, dtype=np.uint64) + initial
+	
+	while np.any(total >> 16):
+		total = (total & 0xffff) + (total >> 16)
+	
+	return total.astype(np.uint32)
+
+def ipv4Checksum(header):
+	return int(ipv4Checksums(np.asarray(header, dtype=np.uint8).reshape(1,-1))[0])
+
+#Header checksums of (num_items, 20) uint8 IPv4 headers
+def ipv4Checksums(headers):
+	headers = np.array(headers, dtype=np.uint8)
+	headers[:,10:12] = 0
+	
+	return ~onesComplementSum(headers) & 0xffff
+
+#UDP checksums of (num_items, frame_len) uint8 frames, all sharing the same addresses (pseudo header) and length
+def udpChecksums(frames, srcAddr, dstAddr, udp_offset=UDP_OFFSET):
+	segment = np.array(frames[:,udp_offset:], dtype=np.uint8)
+	segment[:,6:8] = 0
+	udp_length = segment.shape[1]
+	
+	pseudo = (srcAddr >> 16) + (srcAddr & 0xffff) + (dstAddr >> 16) + (dstAddr & 0xffff) + IPV4_PROTO_UDP + udp_length
+	checksums = ~onesComplementSum(segment, initial=pseudo) & 0xffff
+	checksums[checksums == 0] = 0xffff #0 means no checksum in UDP, so it is transmitted as all-ones
+	
+	return checksums
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+#Reporter SDK for end hosts: applications and host agents emit KeyWrite/KeyIncrement/Append/Postcarder reports with one call per report (or per array of reports)
+#Reports are staged per thread in flat lists, where staging a report is one atomic list extend (no locks on the reporting path). A single flusher drains them every flush_interval seconds, or as soon as a thread staged flush_size reports, and encodes and sends them in batches with the headers and encoder of Translator/inject_dta.py (dta/headers.py, dta/encoder.py)
+#Repeated KeyIncrements of the same key (and redundancy) within a flush are coalesced into one report carrying the sum
+#Staging is bounded: a thread with max_staged reports of a primitive waiting (single reports and arrays each) drops and counts further reports, rather than letting a slow transport grow memory without limit
+#The flusher is a thread ("with HostReporter(...) as reporter:"), or a task on the asyncio event loop ("async with HostReporter(...) as reporter:")
+#Usage example: python3 -m dta.hostreporter --threads 4 --duration 10 --keys 10000 (encoding only), or python3 -m dta.hostreporter --iface enp4s0f0 --threads 4
+
+import argparse
+import asyncio
+import threading
+import time
+import numpy as np
+
+from dta.encoder import ReportEncoder, RawSender, ifaceMac
+from dta.headers import *
+
+#Staged fields per primitive, in staging order
+STAGED_FIELDS = {
+	DTA_OPCODE_KEYWRITE: ("key", "data", "redundancy"),
+	DTA_OPCODE_KEYINCREMENT: ("key", "counter", "redundancy"),
+	DTA_OPCODE_APPEND: ("listID", "data"),
+	DTA_OPCODE_POSTCARDER: ("key", "hopNum", "data")
+}
+
+#Reports staged by one thread. The owner thread only appends, the flusher only takes from the front, so neither needs a lock
+class StagingBuffer:
+	values = None #opcode -> flat list of field values, len(STAGED_FIELDS[opcode]) per report
+	arrays = None #opcode -> list of (num_reports, num_fields) arrays staged in bulk
+	arrays_staged = None #opcode -> reports staged in bulk so far. Only the owner writes it
+	arrays_drained = None #opcode -> reports drained from the arrays so far. Only the flusher writes it
+	dropped = 0 #Reports dropped as the buffer was full. Only the owner writes it
+	
+	def __init__(self):
+		self.values = {opcode: [] for opcode in STAGED_FIELDS}
+		self.arrays = {opcode: [] for opcode in STAGED_FIELDS}
+		self.arrays_staged = {opcode: 0 for opcode in STAGED_FIELDS}
+		self.arrays_drained = {opcode: 0 for opcode in STAGED_FIELDS}
+	
+	#Reports staged in bulk that are not drained yet
+	def pendingArrays(self, opcode):
+		return self.arrays_staged[opcode] - self.arrays_drained[opcode]
+	
+	#Take the reports staged so far, as (num_reports, num_fields) arrays. Reading a prefix and deleting it are single list operations, so reports staged meanwhile stay for the next drain
+	def drain(self, opcode):
+		arrays = self.arrays[opcode]
+		num_arrays = len(arrays)
+		parts = arrays[:num_arrays]
+		del arrays[:num_arrays]
+		self.arrays_drained[opcode] += sum(len(part) for part in parts)
+		
+		values = self.values[opcode]
+		num_values = len(values)
+		if num_values:
+			staged = values[:num_values]
+			del values[:num_values]
+			parts.append(np.array(staged, dtype=np.uint64).reshape(-1, len(STAGED_FIELDS[opcode])))
+		
+		return parts
+
+#KeyIncrements summed per (key, redundancy). Counters wrap at 64 bits, like the Fetch&Adds they turn into
+def coalesceIncrements(reports):
+	combined = reports[:,0] << np.uint64(8) | reports[:,2]
+	order = np.argsort(combined, kind="stable")
+	combined = combined[order]
+	
+	starts = np.concatenate([[0], np.flatnonzero(combined[1:] != combined[:-1]) + 1])
+	coalesced = reports[order[starts]]
+	coalesced[:,1] = np.add.reduceat(reports[order,1], starts)
+	
+	return coalesced
+
+#Encodes reports with one ReportEncoder per primitive into reused buffers, and hands the frames to sender (a RawSender, or anything with send(frames))
+#A RetransmittingReporter (dta/retransmit.py) has the same send(opcode, **fields), and can be used instead for retransmitable reports
+class DirectTransport:
+	sender = None
+	encoders = None #opcode -> ReportEncoder
+	frames = None #opcode -> frame buffer
+	encoder_args = None
+	
+	def __init__(self, sender, dstMac="b8:ce:f6:d2:12:c7", srcMac="00:00:00:00:00:00", srcIP="10.0.0.101", dstIP="10.0.0.51", immediate=False, udp_checksum=True):
+		self.sender = sender
+		self.encoders = {}
+		self.frames = {}
+		self.encoder_args = dict(dstMac=dstMac, srcMac=srcMac, srcIP=srcIP, dstIP=dstIP, immediate=immediate, udp_checksum=udp_checksum)
+	
+	def send(self, opcode, **fields):
+		num_reports = max(np.size(value) for value in fields.values())
+		if opcode not in self.encoders:
+			self.encoders[opcode] = ReportEncoder(opcode, **self.encoder_args)
+		if opcode not in self.frames or len(self.frames[opcode]) < num_reports:
+			self.frames[opcode] = self.encoders[opcode].allocate(num_reports)
+		
+		frames = self.encoders[opcode].encode(frames=self.frames[opcode], **fields)
+		self.sender.send(frames)
+		return num_reports
+
+#Counts the frames instead of sending them, to measure the reporter itself
+class NullSender:
+	num_sent = 0
+	
+	def send(self, frames):
+		self.num_sent += len(frames)
+		return len(frames)
+
+class HostReporter:
+	transport = None
+	flush_interval = 0.001
+	flush_size = 4096 #Staged reports (per thread and primitive) that trigger a flush before the interval ends
+	max_staged = 1<<18 #Staged reports (per thread and primitive) beyond which new reports are dropped
+	batch_size = 1024 #Reports per transport.send()
+	coalesce = True
+	nack_sock = None #Polled for NACKs between batches, if the transport is a RetransmittingReporter
+	retransmitting = False #The transport is a RetransmittingReporter, whose ring of unconfirmed reports must not overflow
+	max_stall = 0.1 #Seconds a batch waits for room in the retransmission ring, before it is sent anyway
+	
+	buffers = None #The staging buffers of all threads that reported
+	local = None
+	wakeup = None #Wakes the flusher (thread or asyncio task) early
+	signaled = False
+	running = False
+	worker = None
+	task = None
+	
+	counters = None
+	flush_seconds = 0
+	stall_seconds = 0
+	
+	def __init__(self, transport, flush_interval=0.001, flush_size=4096, batch_size=1024, coalesce=True, nack_sock=None, max_staged=1<<18):
+		assert max_staged >= flush_size, "The staging cap must allow a full flush_size!"
+		
+		self.transport = transport
+		self.flush_interval = flush_interval
+		self.flush_size = flush_size
+		self.max_staged = max_staged
+		self.batch_size = batch_size
+		self.coalesce = coalesce
+		self.nack_sock = nack_sock
+		self.retransmitting = hasattr(transport, "occupancy")
+		
+		self.buffers = []
+		self.local = threading.local()
+		self.event = threading.Event()
+		self.wakeup = self.event.set
+		self.counters = {name:0 for name in ["reports", "coalesced", "sent", "flushes", "early_flushes", "retransmitted", "stalls"]}
+	
+	#The staging lists of the calling thread
+	def staging(self):
+		try:
+			return self.local.values
+		except AttributeError:
+			buffer = StagingBuffer()
+			self.local.buffer = buffer
+			self.local.values = buffer.values
+			self.buffers.append(buffer)
+			return buffer.values
+	
+	def signal(self):
+		if not self.signaled:
+			self.signaled = True
+			self.wakeup()
+	
+	#
+	# Reporting, one report per call
+	#
+	def keyWrite(self, key, data, redundancy=1):
+		values = self.staging()[DTA_OPCODE_KEYWRITE]
+		if len(values) >= 3*self.max_staged:
+			self.local.buffer.dropped += 1
+			return
+		values.extend((key, data, redundancy))
+		if len(values) >= 3*self.flush_size:
+			self.signal()
+	
+	def keyIncrement(self, key, counter=1, redundancy=1):
+		values = self.staging()[DTA_OPCODE_KEYINCREMENT]
+		if len(values) >= 3*self.max_staged:
+			self.local.buffer.dropped += 1
+			return
+		values.extend((key, counter, redundancy))
+		if len(values) >= 3*self.flush_size:
+			self.signal()
+	
+	def append(self, listID, data):
+		values = self.staging()[DTA_OPCODE_APPEND]
+		if len(values) >= 2*self.max_staged:
+			self.local.buffer.dropped += 1
+			return
+		values.extend((listID, data))
+		if len(values) >= 2*self.flush_size:
+			self.signal()
+	
+	def postcard(self, key, hopNum, data):
+		values = self.staging()[DTA_OPCODE_POSTCARDER]
+		if len(values) >= 3*self.max_staged:
+			self.local.buffer.dropped += 1
+			return
+		values.extend((key, hopNum, data))
+		if len(values) >= 3*self.flush_size:
+			self.signal()
+	
+	#
+	# Reporting in bulk, arrays (or scalars) per field
+	#
+	def stageArrays(self, opcode, *columns):
+		reports = np.column_stack(np.broadcast_arrays(*[np.atleast_1d(np.asarray(column, dtype=np.uint64)) for column in columns]))
+		
+		self.staging()
+		buffer = self.local.buffer
+		room = self.max_staged - buffer.pendingArrays(opcode)
+		if room < len(reports):
+			buffer.dropped += len(reports) - max(room, 0)
+			reports = reports[:max(room, 0)]
+			if len(reports) == 0:
+				return
+		
+		buffer.arrays[opcode].append(reports)
+		buffer.arrays_staged[opcode] += len(reports)
+		if len(reports) >= self.flush_size:
+			self.signal()
+	
+	def keyWrites(self, keys, data, redundancy=1):
+		self.stageArrays(DTA_OPCODE_KEYWRITE, keys, data, redundancy)
+	
+	def keyIncrements(self, keys, counters=1, redundancy=1):
+		self.stageArrays(DTA_OPCODE_KEYINCREMENT, keys, counters, redundancy)
+	
+	def appends(self, listIDs, data):
+		self.stageArrays(DTA_OPCODE_APPEND, listIDs, data)
+	
+	def postcards(self, keys, hopNums, data):
+		self.stageArrays(DTA_OPCODE_POSTCARDER, keys, hopNums, data)
+	
+	#
+	# Flushing
+	#
+	#Drain the staging buffers of all threads, and send. Only the flusher calls this (or the owner, once the flusher is stopped). Returns the number of reports sent
+	def flush(self):
+		t_start = time.perf_counter()
+		self.signaled = False
+		num_sent = 0
+		
+		for opcode,fields in STAGED_FIELDS.items():
+			parts = []
+			for buffer in list(self.buffers):
+				parts += buffer.drain(opcode)
+			if not parts:
+				continue
+			
+			reports = np.concatenate(parts) if len(parts) > 1 else parts[0]
+			self.counters["reports"] += len(reports)
+			if opcode == DTA_OPCODE_KEYINCREMENT and self.coalesce:
+				num_staged = len(reports)
+				reports = coalesceIncrements(reports)
+				self.counters["coalesced"] += num_staged - len(reports)
+			
+			batch_size = min(self.batch_size, self.transport.ring.capacity) if self.retransmitting else self.batch_size
+			for start in range(0, len(reports), batch_size):
+				batch = reports[start:start+batch_size]
+				if self.retransmitting:
+					self.waitForRoom(len(batch))
+				num_sent += self.transport.send(opcode, **{name: batch[:,column] for column,name in enumerate(fields)})
+		
+		if self.nack_sock is not None:
+			self.counters["retransmitted"] += self.transport.poll(self.nack_sock)
+		
+		self.counters["sent"] += num_sent
+		self.counters["flushes"] += 1
+		self.flush_seconds += time.perf_counter() - t_start
+		
+		return num_sent
+	
+	#Poll for NACKs before every batch, and hold the batch back while the retransmission ring has no room for it
+	#Reports that are neither confirmed by a NACK nor past the horizon would otherwise be overwritten, and their loss could no longer be repaired
+	def waitForRoom(self, num_reports):
+		transport = self.transport
+		if self.nack_sock is not None:
+			self.counters["retransmitted"] += transport.poll(self.nack_sock, timeout=0.00001, count=transport.ring.capacity)
+		transport.release(time.monotonic())
+		if transport.occupancy() + num_reports <= transport.ring.capacity:
+			return
+		if self.nack_sock is None and transport.horizon is None: #Nothing would ever free the ring
+			return
+		
+		self.counters["stalls"] += 1
+		t_start = time.perf_counter()
+		while transport.occupancy() + num_reports > transport.ring.capacity and time.perf_counter() - t_start < self.max_stall:
+			if self.nack_sock is not None:
+				self.counters["retransmitted"] += transport.poll(self.nack_sock, count=transport.ring.capacity)
+			else:
+				time.sleep(0.0001)
+			transport.release(time.monotonic())
+		self.stall_seconds += time.perf_counter() - t_start
+	
+	def start(self):
+		self.running = True
+		self.wakeup = self.event.set
+		self.worker = threading.Thread(target=self.run, name="dta reporter flusher", daemon=True)
+		self.worker.start()
+		return self
+	
+	def run(self):
+		while self.running:
+			if self.event.wait(self.flush_interval):
+				self.counters["early_flushes"] += 1
+			self.event.clear()
+			self.flush()
+		self.flush()
+	
+	#Stop the flusher, sending what is still staged
+	def close(self):
+		if self.worker is not None:
+			self.running = False
+			self.event.set()
+			self.worker.join()
+			self.worker = None
+		else:
+			self.flush()
+	
+	def __enter__(self):
+		return self.start()
+	
+	def __exit__(self, exc_type, exc, traceback):
+		self.close()
+		return False
+	
+	#The flusher as an asyncio task. Reports can be staged from coroutines, and from other threads
+	async def runAsync(self):
+		loop = asyncio.get_running_loop()
+		event = asyncio.Event()
+		self.wakeup = lambda: loop.call_soon_threadsafe(event.set)
+		
+		while self.running:
+			try:
+				await asyncio.wait_for(event.wait(), self.flush_interval)
+				self.counters["early_flushes"] += 1
+			except asyncio.TimeoutError:
+				pass
+			event.clear()
+			self.flush()
+		self.flush()
+	
+	async def __aenter__(self):
+		self.running = True
+		self.task = asyncio.create_task(self.runAsync())
+		await asyncio.sleep(0) #Let the task install its wakeup
+		return self
+	
+	async def __aexit__(self, exc_type, exc, traceback):
+		self.running = False
+		self.wakeup()
+		await self.task
+		self.task = None
+		return False
+	
+	def stats(self):
+		stats = dict(self.counters)
+		stats["threads"] = len(self.buffers)
+		stats["max_staged"] = self.max_staged
+		stats["dropped_staged"] = sum(buffer.dropped for buffer in self.buffers)
+		stats["reports_per_flush"] = self.counters["reports"]/max(self.counters["flushes"], 1)
+		stats["coalescing_ratio"] = self.counters["coalesced"]/max(self.counters["reports"], 1)
+		stats["flush_seconds"] = self.flush_seconds
+		if self.retransmitting:
+			#Reports that were lost for good: evicted from the ring before they were confirmed, or skipped by a resync
+			transport = self.transport.stats()
+			stats["stall_seconds"] = self.stall_seconds
+			stats["overwritten"] = transport["overwritten"]
+			stats["unrecoverable"] = transport["unrecoverable"]
+			stats["max_occupancy"] = transport["max_occupancy"]
+		return stats
+
+#Benchmark load: keys with a Zipf-like popularity over num_keys keys
+def benchmarkKeys(num_keys, seed, count=1<<16):
+	return (np.random.default_rng(seed).zipf(1.2, count) % num_keys).tolist()
+
+#Call report() (a bound HostReporter method) for the keys in a loop, until the deadline. Returns the number of reports
+def reportKeys(report, keys, deadline, batch=1024, offset=0):
+	count = 0
+	while time.perf_counter() < deadline:
+		start = (offset + count) % len(keys)
+		for key in keys[start:start+batch]:
+			report(key, 1)
+		count += len(keys[start:start+batch])
+	return count
+
+#The same from a coroutine, yielding to the event loop every slice seconds
+async def reportKeysAsync(report, keys, deadline, batch=1024, slice=0.001):
+	count = 0
+	while time.perf_counter() < deadline:
+		count += reportKeys(report, keys, min(deadline, time.perf_counter() + slice), batch, offset=count)
+		await asyncio.sleep(0)
+	return count
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmark the host reporter: threads (or coroutines) staging single reports, flushed and sent in batches.')
+	parser.add_argument('--operation', type=str, default="keyincrement", choices=list(DTA_PRIMITIVE_NAMES), help='The DTA operation to report')
+	parser.add_argument('--threads', type=int, default=1, help='Number of reporting threads')
+	parser.add_argument('--duration', type=float, default=5, help='Seconds to report for')
+	parser.add_argument('--keys', type=int, default=10000, help='Number of distinct keys (list IDs for Append) reported to')
+	parser.add_argument('--flush_interval', type=float, default=0.001, help='Seconds between flushes')
+	parser.add_argument('--flush_size', type=int, default=4096, help='Staged reports per thread that trigger an early flush')
+	parser.add_argument('--max_staged', type=int, default=1<<18, help='Staged reports per thread beyond which reports are dropped')
+	parser.add_argument('--no_coalesce', action='store_true', help='Send every KeyIncrement as its own report')
+	parser.add_argument('--asyncio', action='store_true', help='Run the flusher and the reporters (one coroutine per --threads) on an asyncio event loop')
+	parser.add_argument('--iface', type=str, help='Send on this interface. Without it, reports are encoded but not sent')
+	parser.add_argument('--retransmitable', action='store_true', help='Send retransmitable reports through dta.retransmit, repairing losses from the NACKs received on --iface')
+	parser.add_argument('--srcIP', type=str, default="10.0.0.101", help='The reporter IP address')
+	parser.add_argument('--dstIP', type=str, default="10.0.0.51", help='The collector IP address')
+	parser.add_argument('--dstMac', type=str, default="b8:ce:f6:d2:12:c7", help='The destination MAC address')
+	args = parser.parse_args()
+	
+	from dta.translator import POSTCARDER_NUM_HOPS
+	
+	opcode = DTA_PRIMITIVE_NAMES[args.operation]
+	sender = RawSender(args.iface) if args.iface else NullSender()
+	srcMac = ifaceMac(args.iface) if args.iface else "00:00:00:00:00:00"
+	
+	nack_sock = None
+	if args.retransmitable:
+		from dta.retransmit import RetransmittingReporter, nackSocket
+		transport = RetransmittingReporter(sender, srcIP=args.srcIP, dstIP=args.dstIP, dstMac=args.dstMac, srcMac=srcMac)
+		nack_sock = nackSocket(args.iface) if args.iface else None
+		batch_size = 128 #Fewer than 256 retransmitable reports in flight per NACK round trip
+	else:
+		transport = DirectTransport(sender, dstMac=args.dstMac, srcMac=srcMac, srcIP=args.srcIP, dstIP=args.dstIP)
+		batch_size = 1024
+	
+	reporter = HostReporter(transport, flush_interval=args.flush_interval, flush_size=args.flush_size, batch_size=batch_size, coalesce=not args.no_coalesce, nack_sock=nack_sock, max_staged=args.max_staged)
+	report = {
+		DTA_OPCODE_KEYWRITE: lambda key, value: reporter.keyWrite(key, value, 2),
+		DTA_OPCODE_KEYINCREMENT: reporter.keyIncrement,
+		DTA_OPCODE_APPEND: reporter.append,
+		DTA_OPCODE_POSTCARDER: lambda key, value: reporter.postcard(key, key % POSTCARDER_NUM_HOPS + 1, value)
+	}[opcode]
+	
+	print("Reporting %s with %i %s for %gs..." %(args.operation, args.threads, "coroutines" if args.asyncio else "threads", args.duration))
+	
+	cpu_start = time.process_time()
+	t_start = time.perf_counter()
+	deadline = t_start + args.duration
+	if args.asyncio:
+		async def main():
+			async with reporter:
+				return sum(await asyncio.gather(*[reportKeysAsync(report, benchmarkKeys(args.keys, seed), deadline) for seed in range(args.threads)]))
+		num_reports = asyncio.run(main())
+	else:
+		counts = [0]*args.threads
+		def reportThread(thread):
+			counts[thread] = reportKeys(report, benchmarkKeys(args.keys, thread), deadline)
+		
+		with reporter:
+			threads = [threading.Thread(target=reportThread, args=(thread,)) for thread in range(args.threads)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		num_reports = sum(counts)
+	duration = time.perf_counter() - t_start
+	cpu = time.process_time() - cpu_start
+	
+	for name,value in reporter.stats().items():
+		print("%s: %s" %(name, "%.6f" %value if isinstance(value, float) else value))
+	print("Frames %s: %i" %("sent" if args.iface else "encoded", sender.num_sent))
+	print("Reported %i in %.3f seconds. This equals %.3f million reports per second, at %.3f CPU microseconds per report" %(num_reports, duration, num_reports/(duration*1000000), cpu*1000000/max(num_reports, 1)))
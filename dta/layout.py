@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+#Memory layouts of the collector data structures (see the structs in Collector/collector.cpp), as NumPy dtypes
+#Byte orders follow what the translator actually writes into collector memory:
+# - KeyWrite checksums are byte-swapped by the translator (setRDMAPayload), so they read correctly on a little-endian host without ntohl
+# - KeyWrite data and Postcarder hop values are written as-is from the reports (network byte order)
+# - Append data is byte-swapped in the translator ingress, landing in host byte order
+# - KeyIncrement counters are RDMA Fetch&Add targets, which the NIC keeps in host byte order
+
+import os
+import numpy as np
+
+KEYWRITE_ENTRY = np.dtype([
+	("checksum", "<u4"),
+	("data", ">u4")
+])
+
+KEYINCREMENT_ENTRY = np.dtype([
+	("counter", "<u8")
+])
+
+POSTCARDER_ENTRY = np.dtype([
+	("hop1_data", ">u4"),
+	("hop2_data", ">u4"),
+	("hop3_data", ">u4"),
+	("hop4_data", ">u4"),
+	("hop5_data", ">u4"),
+	("padding", ">u4", 3) #Slots are padded to 32B, the translator needs power-of-2 slot sizes
+])
+
+DATALIST_ENTRY = np.dtype([
+	("data", "<u4")
+])
+
+#The translator only supports stores of this many entries or fewer (see the KeywriteStore constructor in the collector)
+MAX_TRANSLATOR_ENTRIES = 536870912
+
+def isPowerOfTwo(value):
+	return value > 0 and value & (value-1) == 0
+
+#Map a raw dump of a collector structure without copying it. Returns a structured array backed by the file
+def mapDump(path, entry, writable=False, offset=0, num_entries=None):
+	size = os.path.getsize(path) - offset
+	
+	if num_entries is None:
+		assert size % entry.itemsize == 0, "Dump size %i is not a multiple of the %iB entry size!" %(size, entry.itemsize)
+		num_entries = size//entry.itemsize
+	
+	assert num_entries*entry.itemsize <= size, "Dump %s is smaller than %i entries!" %(path, num_entries)
+	
+	mode = "r+" if writable else "r"
+	return np.memmap(path, dtype=entry, mode=mode, offset=offset, shape=(num_entries,))
+
+#Wrap an existing buffer (bytes, bytearray, mmap, shared memory) as a structured array, without copying
+def mapBuffer(buffer, entry, offset=0, num_entries=None):
+	if num_entries is None:
+		num_entries = (len(buffer)-offset)//entry.itemsize
+	
+	return np.frombuffer(buffer, dtype=entry, count=num_entries, offset=offset)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+#Occupancy and collision analytics of the KeyWrite store, and a sizing model for it
+#The store (a memory-mapped dump, or the shared memory of the stand-in collector) is reduced in chunks by a pool of forked workers, each counting a slice of the slots
+#For a key population, the redundancy slots of every key are checked for its checksum, giving the number of surviving entries per key and the query success rate
+#Store sizes are predicted by simulating reports with the slots of the translator hash. The textbook model (independent slots, each surviving w later slot writes with probability exp(-w/S)) is only a bound:
+#the slot hash is a CRC, which is linear, so the N slots of every key are its first slot XOR the same N offsets, and keys overwrite each other's slots together
+#Usage example: python3 -m dta.occupancy /dev/shm/dta/keywrite.bin --key_range 0 1000000 --redundancy 4 --workers 8, or python3 -m dta.occupancy --rate 10e6 --retention 0.5 --target 0.99 (sizing only)
+
+import argparse
+import math
+import multiprocessing
+import time
+import numpy as np
+
+from dta.layout import KEYWRITE_ENTRY, MAX_TRANSLATOR_ENTRIES, mapDump, isPowerOfTwo
+from dta.query import keyChecksums, keySlotMatrix
+
+CHECKSUM_SPACE = 1<<32
+
+#Inherited by forked workers, so the store is never pickled or copied
+_storage = None
+
+#Number of used slots (not all-zero, as in KeywriteStore::analStorage) per block, for a slice of the store
+def countBlocks(start, end, block_size, chunk_size):
+	counts = []
+	for chunk_start in range(start, end, chunk_size):
+		chunk = _storage[chunk_start:min(end, chunk_start+chunk_size)].view(np.uint64) #An entry is all-zero iff its 8 bytes are
+		counts.append(np.count_nonzero(chunk.reshape(-1, block_size), axis=1))
+	
+	return np.concatenate(counts)
+
+#Number of slots of each key that still hold its checksum, for a slice of the key population
+def countSurvivors(keys, num_entries, redundancy):
+	checksums = keyChecksums(keys)
+	slots = keySlotMatrix(keys, num_entries, redundancy)
+	
+	survivors = np.zeros(len(keys), dtype=np.uint8)
+	for n in range(redundancy):
+		survivors += _storage["checksum"][slots[:,n]] == checksums
+	
+	return survivors
+
+def runTasks(function, tasks, num_workers):
+	if num_workers <= 1 or len(tasks) <= 1:
+		return [function(*task) for task in tasks]
+	
+	with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+		return pool.starmap(function, tasks)
+
+class OccupancyAnalysis:
+	storage = None
+	num_entries = None
+	redundancy = None
+	num_workers = 1
+	chunk_size = 1<<24 #Slots per reduction (128MiB of store)
+	num_blocks = 4096 #The store is split into this many blocks to check that slots are hashed evenly
+	key_chunk_size = 1<<22
+	
+	def __init__(self, storage, redundancy=4, num_workers=None):
+		assert storage.dtype == KEYWRITE_ENTRY, "Storage is not laid out as keywriteEntry!"
+		assert isPowerOfTwo(len(storage)), "The translator only supports power-of-2 store sizes, got %i entries" %len(storage)
+		
+		self.storage = storage
+		self.num_entries = len(storage)
+		self.redundancy = redundancy
+		self.num_workers = num_workers or multiprocessing.cpu_count()
+		self.num_blocks = min(self.num_blocks, self.num_entries)
+	
+	@classmethod
+	def fromDump(cls, path, redundancy=4, num_workers=None):
+		return cls(mapDump(path, KEYWRITE_ENTRY), redundancy, num_workers)
+	
+	#Used slots per block of the store
+	def blockCounts(self):
+		global _storage
+		_storage = self.storage
+		
+		block_size = self.num_entries//self.num_blocks
+		chunk_size = max(block_size, min(self.chunk_size, self.num_entries))
+		slice_size = max(chunk_size, self.num_entries//self.num_workers//chunk_size*chunk_size)
+		tasks = [(start, min(self.num_entries, start+slice_size), block_size, chunk_size) for start in range(0, self.num_entries, slice_size)]
+		
+		return np.concatenate(runTasks(countBlocks, tasks, self.num_workers))
+	
+	def occupancy(self):
+		counts = self.blockCounts()
+		block_size = self.num_entries//len(counts)
+		used = int(counts.sum())
+		
+		#With uniform hashing, the used slots per block are close to binomial. A much larger spread points at skewed keys or a broken hash
+		expected = used/len(counts)
+		variance = expected*(1 - expected/block_size)
+		dispersion = float(counts.var()/variance) if variance > 0 else 0.0
+		
+		return {
+			"slots": self.num_entries,
+			"used_slots": used,
+			"load_factor": used/self.num_entries,
+			"block_size": block_size,
+			"block_load_min": float(counts.min()/block_size),
+			"block_load_max": float(counts.max()/block_size),
+			"block_dispersion": dispersion
+		}
+	
+	#The number of surviving redundancy entries of every key
+	def survivors(self, keys):
+		global _storage
+		_storage = self.storage
+		
+		keys = np.asarray(keys, dtype=np.uint32).ravel()
+		tasks = [(keys[start:start+self.key_chunk_size], self.num_entries, self.redundancy) for start in range(0, len(keys), self.key_chunk_size)]
+		if not tasks:
+			return np.zeros(0, dtype=np.uint8)
+		
+		return np.concatenate(runTasks(countSurvivors, tasks, self.num_workers))
+	
+	def keyAnalysis(self, keys, load_factor):
+		keys = np.asarray(keys, dtype=np.uint32).ravel()
+		survivors = self.survivors(keys)
+		histogram = np.bincount(survivors, minlength=self.redundancy+1)
+		lost = int(histogram[0])
+		
+		#Keys sharing a checksum answer each other's queries if their slots overlap
+		_, checksum_counts = np.unique(keyChecksums(keys), return_counts=True)
+		
+		return {
+			"keys": len(keys),
+			"survivors": histogram[:self.redundancy+1].tolist(),
+			"query_success": 1 - lost/len(keys) if len(keys) else 0.0,
+			"mean_survivors": float(survivors.mean()) if len(keys) else 0.0,
+			"shared_checksum_keys": int(checksum_counts[checksum_counts > 1].sum()),
+			"expected_shared_checksum_keys": expectedSharedChecksums(len(keys)),
+			"expected_false_answers": lost*falseAnswerProbability(load_factor, self.redundancy)
+		}
+
+#Expected number of keys (out of num_keys) whose checksum is shared with at least one other key
+def expectedSharedChecksums(num_keys):
+	return num_keys*(1 - math.exp(-(num_keys-1)/CHECKSUM_SPACE)) if num_keys > 1 else 0.0
+
+#Probability that a query for a lost key is answered by another key's entry with an equal checksum
+def falseAnswerProbability(load_factor, redundancy):
+	return 1 - (1 - load_factor/CHECKSUM_SPACE)**redundancy
+
+#Expected load factor after num_keys distinct keys were written once
+def expectedLoadFactor(num_keys, num_entries, redundancy):
+	return 1 - math.exp(-num_keys*redundancy/num_entries)
+
+#Query success of a key after later_writes further KeyWrite reports, if its redundancy slots were independent
+#This is an upper bound: the slot hash is a CRC, so the slots of a key are its first slot XOR offsets that are the same for all keys (see simulateQuerySuccess)
+def querySuccessAfter(later_writes, num_entries, redundancy):
+	slot_survival = np.exp(-np.asarray(later_writes, dtype=np.float64)*redundancy/num_entries)
+	return 1 - (1 - slot_survival)**redundancy
+
+#Random keys, as the simulations' stand-in for telemetry keys
+def randomKeys(num_keys, seed):
+	return np.random.default_rng(seed).integers(0, CHECKSUM_SPACE, num_keys, dtype=np.uint64).astype(np.uint32)
+
+#Query success of num_probes keys after later_writes further reports, with the slots of the translator hash
+#Stores beyond max_entries are simulated at that size, with the same ratio of writes to slots
+def simulateQuerySuccess(later_writes, num_entries, redundancy, num_probes=1<<18, max_entries=1<<24, seed=0):
+	scale = min(1.0, max_entries/num_entries)
+	num_entries = int(num_entries*scale)
+	
+	written = np.zeros(num_entries, dtype=bool)
+	written[keySlotMatrix(randomKeys(int(round(later_writes*scale)), seed+1), num_entries, redundancy).ravel()] = True
+	
+	probe_slots = keySlotMatrix(randomKeys(num_probes, seed), num_entries, redundancy)
+	return float((~written[probe_slots]).any(axis=1).mean())
+
+#Query success over a population of num_keys keys, each written once in random order, with the slots of the translator hash
+def simulatePopulation(num_keys, num_entries, redundancy, max_entries=1<<24, seed=0):
+	scale = min(1.0, max_entries/num_entries)
+	num_entries = int(num_entries*scale)
+	num_keys = max(1, int(round(num_keys*scale)))
+	slots = keySlotMatrix(randomKeys(num_keys, seed), num_entries, redundancy)
+	
+	#The last report writing a slot owns it
+	owner = np.full(num_entries, -1, dtype=np.int64)
+	np.maximum.at(owner, slots.ravel(), np.arange(num_keys).repeat(redundancy))
+	
+	return float((owner[slots] == np.arange(num_keys)[:,None]).any(axis=1).mean())
+
+#Expected query success over a population of num_keys keys, each written once in random order
+def expectedQuerySuccess(num_keys, num_entries, redundancy, simulate=True):
+	if simulate:
+		return simulatePopulation(num_keys, num_entries, redundancy)
+	
+	later_writes = np.linspace(0, num_keys, 4096)
+	return float(querySuccessAfter(later_writes, num_entries, redundancy).mean())
+
+#The smallest power-of-2 store answering queries for reports of the given age (retention, s) with the target success rate
+#Starts from the independent-slot bound, and doubles the store until the simulation with the translator hash meets the target
+def requiredStoreSize(rate, retention, redundancy, target=0.99, simulate=True):
+	#Solve 1-(1-exp(-rate*retention*N/S))^N = target for S
+	slot_survival = 1 - (1-target)**(1/redundancy)
+	num_entries = rate*retention*redundancy/-math.log(slot_survival)
+	num_entries = 1<<max(0, math.ceil(math.log2(max(num_entries, 1))))
+	
+	while simulate and simulateQuerySuccess(rate*retention, num_entries, redundancy) < target:
+		assert num_entries < 1<<48, "No store size reaches %.4f%% query success" %(100*target)
+		num_entries *= 2
+	
+	return num_entries
+
+#The required store size for every redundancy level, and the level needing the least memory. Sizes beyond what the translator supports are marked
+def optimalStoreSize(rate, retention, target=0.99, max_redundancy=4, simulate=True):
+	options = []
+	for redundancy in range(1, max_redundancy+1):
+		num_entries = requiredStoreSize(rate, retention, redundancy, target, simulate)
+		if simulate:
+			success = simulateQuerySuccess(rate*retention, num_entries, redundancy)
+		else:
+			success = float(querySuccessAfter(rate*retention, num_entries, redundancy))
+		
+		options.append({
+			"redundancy": redundancy,
+			"entries": num_entries,
+			"bytes": num_entries*KEYWRITE_ENTRY.itemsize,
+			"supported": num_entries <= MAX_TRANSLATOR_ENTRIES,
+			"query_success": success
+		})
+	
+	return min(options, key=lambda option: (option["entries"], option["redundancy"])), options
+
+def formatBytes(size):
+	for unit in ["B", "KiB", "MiB", "GiB"]:
+		if size < 1024 or unit == "GiB":
+			return "%.1f%s" %(size, unit)
+		size /= 1024
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Occupancy, survival and collision analytics of a KeyWrite store dump, and store sizing.')
+	parser.add_argument('dump', type=str, nargs='?', help='Path to the raw keywriteEntry dump (omit for sizing only)')
+	parser.add_argument('--redundancy', type=int, default=4, help='The KeyWrite redundancy (N) used by the reporters')
+	parser.add_argument('--key_range', type=int, nargs=2, help='The key population, all keys in the range [start, end)')
+	parser.add_argument('--keys_file', type=str, help='The key population, as a .npy array of uint32 keys')
+	parser.add_argument('--workers', type=int, help='Number of worker processes (default: one per CPU)')
+	parser.add_argument('--rate', type=float, help='KeyWrite reports per second, to predict the store size')
+	parser.add_argument('--retention', type=float, default=1.0, help='Age (seconds) of the reports that queries must still find')
+	parser.add_argument('--target', type=float, default=0.99, help='Target query success rate at that age')
+	parser.add_argument('--independent', action='store_true', help='Size with the independent-slot model instead of simulating the translator hash (faster, optimistic)')
+	args = parser.parse_args()
+	
+	assert args.dump or args.rate, "Specify a dump and/or --rate!"
+	
+	if args.dump:
+		analysis = OccupancyAnalysis.fromDump(args.dump, args.redundancy, args.workers)
+		print("Analyzing %s: %i slots (%s) with %i workers..." %(args.dump, analysis.num_entries, formatBytes(analysis.num_entries*KEYWRITE_ENTRY.itemsize), analysis.num_workers))
+		
+		t_start = time.perf_counter()
+		occupancy = analysis.occupancy()
+		duration = time.perf_counter() - t_start
+		print("Memory slots in use: %i / %i (load factor %.2f%%), scanned in %.3fs (%.1f GiB/s)" %(occupancy["used_slots"], occupancy["slots"], 100*occupancy["load_factor"], duration, analysis.num_entries*KEYWRITE_ENTRY.itemsize/duration/(1<<30)))
+		print("Load per block of %i slots: %.2f%% - %.2f%%, dispersion %.2f (about 1 for uniform hashing)" %(occupancy["block_size"], 100*occupancy["block_load_min"], 100*occupancy["block_load_max"], occupancy["block_dispersion"]))
+		
+		if args.key_range or args.keys_file:
+			if args.keys_file:
+				keys = np.load(args.keys_file, mmap_mode="r")
+			else:
+				keys = np.arange(args.key_range[0], args.key_range[1], dtype=np.uint64).astype(np.uint32)
+			
+			t_start = time.perf_counter()
+			result = analysis.keyAnalysis(keys, occupancy["load_factor"])
+			duration = time.perf_counter() - t_start
+			
+			print("Key population: %i keys, checked in %.3fs" %(result["keys"], duration))
+			for survivors,count in enumerate(result["survivors"]):
+				print("  %i/%i entries surviving: %i keys (%.2f%%)" %(survivors, args.redundancy, count, 100*count/max(1, result["keys"])))
+			print("Query success: %.4f%% (each key written once: %.4f%% simulated, %.4f%% with independent slots)" %(100*result["query_success"], 100*expectedQuerySuccess(result["keys"], analysis.num_entries, args.redundancy), 100*expectedQuerySuccess(result["keys"], analysis.num_entries, args.redundancy, simulate=False)))
+			print("Load factor model (each key written once): %.2f%%" %(100*expectedLoadFactor(result["keys"], analysis.num_entries, args.redundancy)))
+			print("Keys with a shared checksum: %i (expected %.2f), expected false answers for lost keys: %.2e" %(result["shared_checksum_keys"], result["expected_shared_checksum_keys"], result["expected_false_answers"]))
+	
+	if args.rate:
+		best, options = optimalStoreSize(args.rate, args.retention, args.target, simulate=not args.independent)
+		print("Store sizes for %.0f reports/s, answering %.2f%% of queries for reports %gs old:" %(args.rate, 100*args.target, args.retention))
+		for option in options:
+			print("  N=%i: %11i slots (%9s), success %.4f%%%s" %(option["redundancy"], option["entries"], formatBytes(option["bytes"]), 100*option["query_success"], "" if option["supported"] else ", beyond the translator limit!"))
+		print("Smallest store: %i slots (%s) at redundancy %i" %(best["entries"], formatBytes(best["bytes"]), best["redundancy"]))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+#Path reconstruction from the Postcarder store (postcarderEntry slots in collector memory), for batches of flows at once
+#A flow's slot is CRC32 over its 32-bit flow ID (hash_memory_slot in the translator), and every hop value is stored XOR a per-hop CRC of the flow ID (cache_hop1..5), so decoding also tells foreign slot contents apart
+#Flow IDs are the 32-bit postcarder keys. 5-tuples (as in Generator/int_paths.py and udp_report_flowcard.py) are turned into flow IDs with flowKeys()
+#Usage example: python3 -m dta.postcarder postcarder.bin --key_range 0 1000000 --valid_hops 1 10000 --index 42
+
+import argparse
+import time
+import numpy as np
+
+from dta.crc import CRC32, customCRC32, uint32Bytes
+from dta.layout import POSTCARDER_ENTRY, mapDump, isPowerOfTwo
+from dta.translator import POSTCARDER_NUM_HOPS, POSTCARDER_SEEDS
+
+#A flow 5-tuple, packed as the int_flow header of Generator/int_paths.py
+FLOW_TUPLE = np.dtype([
+	("srcIP", ">u4"),
+	("dstIP", ">u4"),
+	("proto", "u1"),
+	("srcPort", ">u2"),
+	("dstPort", ">u2")
+])
+
+HOP_FIELDS = ["hop%i_data" %(hop+1) for hop in range(POSTCARDER_NUM_HOPS)]
+
+#Conformance of a flow's path to the expected one
+CONFORMANT = 0
+MISSING = 1 #No (valid) entry for the flow
+INCOMPLETE = 2 #Some expected hops were not reported
+DEVIATING = 3 #A reported hop differs from the expected one
+
+#32-bit flow IDs of 5-tuples: CRC32 over the packed tuple
+def flowKeys(tuples):
+	tuples = np.ascontiguousarray(tuples, dtype=FLOW_TUPLE)
+	return CRC32.compute(tuples.view(np.uint8).reshape(len(tuples), FLOW_TUPLE.itemsize))
+
+#The flow ID as the translator hashes it (hdr.dta_postcarder.key, network byte order)
+def keyBytes(keys):
+	return uint32Bytes(keys, "big")
+
+def postcarderSlots(keys, num_entries):
+	return CRC32.compute(keyBytes(keys)) & np.uint32(num_entries-1)
+
+class PostcarderStore:
+	storage = None
+	num_entries = None
+	hashes = None
+	valid_hops = None #Sorted array of possible hop values (e.g., switch IDs). Decoded values outside it come from another flow's entry
+	chunk_size = 1<<22
+	
+	def __init__(self, storage, valid_hops=None):
+		assert storage.dtype == POSTCARDER_ENTRY, "Storage is not laid out as postcarderEntry!"
+		assert isPowerOfTwo(len(storage)), "The translator only supports power-of-2 store sizes, got %i entries" %len(storage)
+		
+		self.storage = storage
+		self.num_entries = len(storage)
+		self.hashes = [customCRC32(seed) for seed in POSTCARDER_SEEDS]
+		if valid_hops is not None:
+			self.valid_hops = np.unique(np.asarray(valid_hops, dtype=np.uint32))
+	
+	@classmethod
+	def fromDump(cls, path, valid_hops=None):
+		return cls(mapDump(path, POSTCARDER_ENTRY), valid_hops)
+	
+	#Paths of a batch of flows. Returns (hops, reported, found):
+	#hops (num_flows, 5) holds the decoded hop values, reported marks the hops present in the entry, and found the flows whose entry decodes to valid hops
+	def query(self, keys):
+		keys = np.asarray(keys, dtype=np.uint32).ravel()
+		hops = np.zeros((len(keys), POSTCARDER_NUM_HOPS), dtype=np.uint32)
+		reported = np.zeros((len(keys), POSTCARDER_NUM_HOPS), dtype=bool)
+		
+		for start in range(0, len(keys), self.chunk_size):
+			chunk = slice(start, start+self.chunk_size)
+			hops[chunk], reported[chunk] = self.queryChunk(keys[chunk])
+		
+		valid = reported
+		if self.valid_hops is not None:
+			valid = reported & np.isin(hops, self.valid_hops)
+		found = reported.any(axis=1) & (valid == reported).all(axis=1)
+		
+		return hops, reported & found[:,None], found
+	
+	def queryChunk(self, keys):
+		key_bytes = keyBytes(keys)
+		entries = self.storage[CRC32.compute(key_bytes) & np.uint32(self.num_entries-1)] #Gathers only the touched slots
+		
+		hops = np.empty((len(keys), POSTCARDER_NUM_HOPS), dtype=np.uint32)
+		reported = np.empty((len(keys), POSTCARDER_NUM_HOPS), dtype=bool)
+		for hop,field in enumerate(HOP_FIELDS):
+			encoded = entries[field].astype(np.uint32)
+			reported[:,hop] = encoded != 0 #Hops missing from evicted paths are written as 0
+			hops[:,hop] = np.where(reported[:,hop], encoded ^ self.hashes[hop].compute(key_bytes), 0)
+		
+		return hops, reported
+	
+	#The path of a single flow as a list of hop values (None for unreported hops), or None if it is not found
+	def path(self, key):
+		hops, reported, found = self.query([key])
+		if not found[0]:
+			return None
+		
+		return [int(value) if present else None for value,present in zip(hops[0], reported[0])]
+	
+	#Compare the paths of a batch of flows with the expected ones (num_flows, 5), where 0 marks hops that are not expected. Returns a conformance code per flow
+	def conformance(self, keys, expected):
+		expected = np.asarray(expected, dtype=np.uint32)
+		hops, reported, found = self.query(keys)
+		
+		deviating = (reported & (hops != expected)).any(axis=1)
+		incomplete = ((expected != 0) & ~reported).any(axis=1)
+		
+		codes = np.full(len(hops), CONFORMANT, dtype=np.uint8)
+		codes[incomplete] = INCOMPLETE
+		codes[deviating] = DEVIATING
+		codes[~found] = MISSING
+		
+		return codes
+	
+	#Inverted index over the reported hops of a batch of flows
+	def hopIndex(self, keys):
+		keys = np.asarray(keys, dtype=np.uint32).ravel()
+		hops, reported, _ = self.query(keys)
+		
+		return HopIndex(hops, reported, keys)
+
+#Flows by hop value: all (hop, flow) pairs sorted by hop, looked up with binary search
+class HopIndex:
+	hops = None
+	flows = None
+	positions = None #Hop number (1-5) of every pair
+	
+	def __init__(self, hops, reported, keys):
+		rows, columns = np.nonzero(reported)
+		order = np.argsort(hops[rows,columns], kind="stable")
+		
+		self.hops = hops[rows,columns][order]
+		self.flows = keys[rows][order]
+		self.positions = (columns[order] + 1).astype(np.uint8)
+	
+	def __len__(self):
+		return len(self.hops)
+	
+	#Flows through a hop (optionally at a given hop number)
+	def flowsThrough(self, hop, position=None):
+		start = np.searchsorted(self.hops, hop, side="left")
+		end = np.searchsorted(self.hops, hop, side="right")
+		flows = self.flows[start:end]
+		if position is not None:
+			flows = flows[self.positions[start:end] == position]
+		
+		return flows
+	
+	#Number of flows through every hop, as (hop values, counts)
+	def load(self):
+		return np.unique(self.hops, return_counts=True)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Reconstruct flow paths from a raw dump of the collector Postcarder store.')
+	parser.add_argument('dump', type=str, help='Path to the raw postcarderEntry dump')
+	parser.add_argument('--keys', type=int, nargs='+', help='The flow IDs to query')
+	parser.add_argument('--key_range', type=int, nargs=2, help='Query all flow IDs in the range [start, end)')
+	parser.add_argument('--flows_file', type=str, help='Query the flows in a .npy file, of uint32 flow IDs or of 5-tuples (FLOW_TUPLE)')
+	parser.add_argument('--valid_hops', type=int, nargs=2, help='Hop values are in the range [min, max], e.g., switch IDs. Decoded values outside it are not counted as found')
+	parser.add_argument('--index', type=int, nargs='*', help='Build the inverted index, and print the flows through these hops')
+	parser.add_argument('--print_limit', type=int, default=16, help='Prevent printing more paths than this')
+	args = parser.parse_args()
+	
+	assert args.keys or args.key_range or args.flows_file, "No flows specified!"
+	
+	if args.keys:
+		keys = np.array(args.keys, dtype=np.uint32)
+	elif args.key_range:
+		keys = np.arange(args.key_range[0], args.key_range[1], dtype=np.uint64).astype(np.uint32)
+	else:
+		flows = np.load(args.flows_file)
+		keys = flowKeys(flows) if flows.dtype.names else flows.astype(np.uint32)
+	
+	valid_hops = None
+	if args.valid_hops:
+		valid_hops = np.arange(args.valid_hops[0], args.valid_hops[1]+1, dtype=np.uint64).astype(np.uint32)
+	
+	store = PostcarderStore.fromDump(args.dump, valid_hops)
+	print("Querying %i flows in %s (%i slots)..." %(len(keys), args.dump, store.num_entries))
+	
+	t_start = time.perf_counter()
+	hops, reported, found = store.query(keys)
+	duration = time.perf_counter() - t_start
+	
+	for i in range(min(len(keys), args.print_limit)):
+		print("%i: %s" %(keys[i], " -> ".join(str(hop) if present else "?" for hop,present in zip(hops[i], reported[i])) if found[i] else "None"))
+	
+	complete = reported.all(axis=1)
+	print("Found %i / %i flows (%.2f%%), %i with complete paths" %(found.sum(), len(keys), 100*found.mean() if len(keys) else 0, complete.sum()))
+	print("Query rate: %.3f million flows per second" %(len(keys)/(duration*1000000)))
+	
+	if args.index is not None:
+		t_start = time.perf_counter()
+		index = HopIndex(hops, reported, keys)
+		print("Indexed %i hops of %i flows in %.3fs" %(len(index), found.sum(), time.perf_counter() - t_start))
+		
+		values, counts = index.load()
+		busiest = np.argsort(counts)[::-1][:5]
+		print("Busiest hops: %s" %", ".join("%i (%i flows)" %(values[i], counts[i]) for i in busiest))
+		for hop in args.index:
+			flows = index.flowsThrough(hop)
+			print("Hop %i: %i flows %s" %(hop, len(flows), flows[:args.print_limit].tolist()))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#Trace-driven simulation of the translator's Postcarder cache (ControlPreparePostcarder/ControlPostcarder_cache in Translator/p4src/dta_translator.p4), to size POSTCARDER_CACHE_SIZE
+#Postcards run through the cache model of the translator model (PostcarderCache in dta/translator.py: CRC32 cache index, reg_cache_flowid collisions, the 8-bit reg_cache_counter, the 5 seeded hop registers), with the cache index width swept
+#Every emitted RDMA write is classified: a compiled path (5th postcard of a flow since it took over its cache index), or an eviction by a colliding flow. An eviction flushes the cached hops early, as a partial path, and is written to the memory slot of the colliding flow (as in the pipeline)
+#Usage example: python3 -m dta.postcardercache --flows 1000000 --flow_rates 1e5 1e6 --index_bits 13 15 17, or python3 -m dta.postcardercache --pcap postcards.pcap --rate 10e6 --verify 100000
+
+import argparse
+import csv
+import os
+import numpy as np
+
+from dta.crc import CRC32, uint32Bytes
+from dta.frames import readPcap
+from dta.headers import DTA_BASE, DTA_BASE_NO_SEQNUM, DTA_BASE_OFFSET, DTA_OPCODE_POSTCARDER, UDP_OFFSET, DTA_PORT_NUMBER
+from dta.translator import PostcarderCache, POSTCARDER_CACHE_INDEX_BITS, POSTCARDER_CACHE_COUNTER_THRESHOLD, POSTCARDER_NUM_HOPS
+
+#SRAM per cache index: reg_cache_flowid (32b), reg_cache_counter (8b), and 5 hop registers (32b each)
+CACHE_ENTRY_BITS = 32 + 8 + POSTCARDER_NUM_HOPS*32
+
+RESULT_FIELDS = ["trace", "flows", "postcards", "duration", "cache_size", "sram_bytes", "writes", "writes_per_report", "writes_per_second", "compiled_writes", "complete_writes", "evictions", "partial_evictions", "empty_evictions", "incomplete_path_rate", "cache_incomplete_path_rate", "left_in_cache"]
+
+#Postcards in arrival order: flow ID (key), hop number (1-5), and the reported hop data
+class PostcardTrace:
+	name = None
+	timestamps = None
+	keys = None
+	hopNums = None
+	data = None
+	
+	def __init__(self, timestamps, keys, hopNums, data, name="trace"):
+		self.timestamps = np.asarray(timestamps, dtype=np.float64)
+		self.keys = np.asarray(keys, dtype=np.uint32)
+		self.hopNums = np.asarray(hopNums, dtype=np.uint8)
+		self.data = np.asarray(data, dtype=np.uint32)
+		self.name = name
+	
+	def __len__(self):
+		return len(self.keys)
+	
+	#Seconds covered by the trace (postcards without timestamps are spread at rate postcards per second)
+	def duration(self, rate=None):
+		if len(self) > 1 and self.timestamps[-1] > self.timestamps[0]:
+			return float(self.timestamps[-1] - self.timestamps[0])
+		assert rate, "The trace has no timestamps, a postcard rate is needed"
+		return len(self)/rate
+	
+	def select(self, rows):
+		return PostcardTrace(self.timestamps[rows], self.keys[rows], self.hopNums[rows], self.data[rows], self.name)
+	
+	#Postcarder reports (DTA opcode 4) of a capture, e.g., as generated with python3 -m dta.translator --generate postcarder
+	@classmethod
+	def fromPcap(cls, path, nack_tracking=True):
+		frames = readPcap(path)
+		primitive = DTA_BASE_OFFSET + (DTA_BASE.itemsize if nack_tracking else DTA_BASE_NO_SEQNUM.itemsize)
+		heads = frames.headers(primitive + 9)
+		
+		def field(offset, size):
+			return np.ascontiguousarray(heads[:,offset:offset+size]).view(">u%i" %size).ravel()
+		
+		postcards = (field(UDP_OFFSET+2, 2) == DTA_PORT_NUMBER) & (heads[:,DTA_BASE_OFFSET] == DTA_OPCODE_POSTCARDER) & (frames.lengths >= primitive+9)
+		rows = np.flatnonzero(postcards)
+		
+		return cls(frames.timestamps[rows], field(primitive, 4)[rows], heads[rows,primitive+4], field(primitive+5, 4)[rows], os.path.basename(path))
+	
+	#Flows arriving at flow_rate (Poisson), each reporting hops 1..path_length, with hop_delay between hops plus exponential jitter
+	#A fraction short_paths of the flows have 1-4 hops (never compiled, only flushed by evictions), and every postcard is lost with loss
+	@classmethod
+	def synthetic(cls, num_flows, flow_rate=1e6, hop_delay=1e-6, jitter=1e-6, short_paths=0.0, loss=0.0, seed=0):
+		rng = np.random.default_rng(seed)
+		
+		starts = np.cumsum(rng.exponential(1/flow_rate, size=num_flows))
+		keys = CRC32.compute(np.hstack([uint32Bytes(np.arange(num_flows)), uint32Bytes(np.full(num_flows, seed))])) #Distinct for up to 2^32 flows
+		keys[keys == 0] = 1 #flowID 0 never collides in the pipeline
+		lengths = np.where(rng.random(num_flows) < short_paths, rng.integers(1, POSTCARDER_NUM_HOPS, size=num_flows), POSTCARDER_NUM_HOPS)
+		
+		flows = np.repeat(np.arange(num_flows), lengths)
+		hops = np.arange(len(flows)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + 1
+		timestamps = starts[flows] + (hops-1)*hop_delay + rng.exponential(jitter, size=len(flows)) if jitter > 0 else starts[flows] + (hops-1)*hop_delay
+		
+		kept = rng.random(len(flows)) >= loss
+		order = np.argsort(timestamps[kept], kind="stable")
+		rows = np.flatnonzero(kept)[order]
+		
+		return cls(timestamps[rows], keys[flows[rows]], hops[rows], rng.integers(1, 1<<32, size=len(rows), dtype=np.uint64), "synthetic")
+
+#Postcard-by-postcard model of the cache registers, following the P4 control flow (slow, used to check the vectorized cache)
+class PostcarderRegisters:
+	def __init__(self, index_bits=POSTCARDER_CACHE_INDEX_BITS):
+		size = 1<<index_bits
+		self.cache = PostcarderCache(index_bits) #Only for the hashes
+		self.flowid = [0]*size
+		self.counter = [0]*size
+		self.hops = [[None]*POSTCARDER_NUM_HOPS for _ in range(size)] #Cached value per hop, None if empty
+	
+	def process(self, keys, hopNums, data):
+		key_bytes = uint32Bytes(keys, "big")
+		indexes = CRC32.compute(key_bytes) & ((1<<self.cache.index_bits)-1)
+		encoded = [data ^ hash.compute(key_bytes) for hash in self.cache.hashes]
+		
+		emit = np.zeros(len(keys), dtype=bool)
+		collisions = np.zeros(len(keys), dtype=bool)
+		payload = np.zeros((len(keys), POSTCARDER_NUM_HOPS), dtype=np.uint32)
+		hops = np.zeros((len(keys), POSTCARDER_NUM_HOPS), dtype=bool)
+		for i,(index,key,hopNum) in enumerate(zip(indexes.tolist(), keys.tolist(), hopNums.tolist())):
+			#flowid_verify, then cache_counter_reset or cache_counter_increment
+			collision = self.flowid[index] != 0 and self.flowid[index] != key
+			self.flowid[index] = key
+			if collision:
+				self.counter[index] = 1
+				cache_counter = 0
+			else:
+				self.counter[index] = (self.counter[index] + 1) & 0xff
+				cache_counter = self.counter[index]
+			ready = cache_counter == POSTCARDER_CACHE_COUNTER_THRESHOLD
+			
+			cached = self.hops[index]
+			for h in range(POSTCARDER_NUM_HOPS):
+				if hopNum == h+1:
+					if ready: #cache_extract, the output is the reported hop
+						cached[h] = None
+						result = int(encoded[h][i])
+					else: #cache_replace
+						result = cached[h]
+						cached[h] = int(encoded[h][i])
+				elif ready or collision: #cache_extract
+					result = cached[h]
+					cached[h] = None
+				else:
+					continue
+				
+				if result is not None:
+					payload[i,h] = result
+					hops[i,h] = True
+			
+			emit[i] = ready or collision
+			collisions[i] = collision
+		
+		return emit, collisions, payload, hops
+
+#Run a trace through a cache of 2^index_bits entries, in batches (the cache state carries over). Returns the emitted writes, classified
+def simulate(trace, index_bits=POSTCARDER_CACHE_INDEX_BITS, rate=None, batch_size=1<<22):
+	cache = PostcarderCache(index_bits)
+	
+	writes = compiled = complete = evictions = partial = empty = 0
+	complete_keys = []
+	for start in range(0, len(trace), batch_size):
+		batch = trace.select(slice(start, start+batch_size))
+		cached = cache.process(batch.keys, batch.hopNums, batch.data)
+		
+		num_hops = cached["hops"].sum(axis=1)
+		compiled_rows = cached["compile"]
+		complete_rows = compiled_rows & (num_hops == POSTCARDER_NUM_HOPS)
+		
+		writes += int(cached["emit"].sum())
+		compiled += int(compiled_rows.sum())
+		complete += int(complete_rows.sum())
+		evictions += int(cached["collision"].sum())
+		partial += int((cached["collision"] & (num_hops > 0)).sum())
+		empty += int((cached["collision"] & (num_hops == 0)).sum())
+		complete_keys.append(batch.keys[complete_rows])
+	
+	#Flows that reported every hop, and flows whose path reached the collector complete (a compiled write with all hops)
+	valid = (trace.hopNums >= 1) & (trace.hopNums <= POSTCARDER_NUM_HOPS)
+	reported = np.unique((trace.keys[valid].astype(np.uint64) << np.uint64(8)) | trace.hopNums[valid]) >> np.uint64(8) #Distinct (flow, hop) pairs
+	flows, distinct_hops = np.unique(reported, return_counts=True)
+	keys = np.unique(trace.keys)
+	full_paths = flows[distinct_hops == POSTCARDER_NUM_HOPS]
+	completed = np.unique(np.concatenate(complete_keys)) if complete_keys else np.zeros(0, dtype=np.uint32)
+	
+	num_postcards = len(trace)
+	duration = trace.duration(rate)
+	
+	return {
+		"trace": trace.name,
+		"flows": len(keys),
+		"postcards": num_postcards,
+		"duration": duration,
+		"cache_size": 1<<index_bits,
+		"sram_bytes": (1<<index_bits)*CACHE_ENTRY_BITS//8,
+		"writes": writes,
+		"writes_per_report": writes/max(1, num_postcards),
+		"writes_per_second": writes/duration,
+		"compiled_writes": compiled,
+		"complete_writes": complete,
+		"evictions": evictions,
+		"partial_evictions": partial,
+		"empty_evictions": empty,
+		"incomplete_path_rate": 1 - len(completed)/max(1, len(keys)), #Flows without a complete path at the collector
+		"cache_incomplete_path_rate": 1 - np.isin(full_paths, completed).sum()/max(1, len(full_paths)), #The same, among flows that reported all hops (losses caused by the cache)
+		"left_in_cache": int(cache.reg_cache_occupied.any(axis=1).sum()) #Cache indexes still holding hops at the end of the trace
+	}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Simulate the translator Postcarder cache on postcard traces, sweeping the cache size.')
+	parser.add_argument('--pcap', type=str, help='A capture of Postcarder reports to replay')
+	parser.add_argument('--no_nack_tracking', action='store_true', help='pcap: reports without the seqnum byte (translator built without DO_NACK_TRACKING)')
+	parser.add_argument('--flows', type=int, default=1000000, help='Synthetic traces: number of flows')
+	parser.add_argument('--flow_rates', type=float, nargs='+', default=[1e6], help='Synthetic traces: new flows per second (one trace per rate)')
+	parser.add_argument('--hop_delay', type=float, default=1e-6, help='Synthetic traces: seconds between the postcards of consecutive hops')
+	parser.add_argument('--jitter', type=float, default=1e-6, help='Synthetic traces: mean exponential jitter of every postcard, in seconds')
+	parser.add_argument('--short_paths', type=float, default=0.0, help='Synthetic traces: fraction of flows with fewer than 5 hops')
+	parser.add_argument('--loss', type=float, default=0.0, help='Synthetic traces: probability that a postcard is lost before the translator')
+	parser.add_argument('--rate', type=float, help='Postcards per second, for captures without timestamps')
+	parser.add_argument('--index_bits', type=int, nargs='+', default=[POSTCARDER_CACHE_INDEX_BITS], help='Cache index widths to sweep (the pipeline has %i, i.e., %i entries)' %(POSTCARDER_CACHE_INDEX_BITS, 1<<POSTCARDER_CACHE_INDEX_BITS))
+	parser.add_argument('--verify', type=int, default=0, help='Check the vectorized cache against the postcard-by-postcard register model on this many postcards')
+	parser.add_argument('--output', type=str, help='CSV file to append the results to')
+	parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic traces')
+	args = parser.parse_args()
+	
+	if args.pcap:
+		traces = [PostcardTrace.fromPcap(args.pcap, not args.no_nack_tracking)]
+	else:
+		traces = [PostcardTrace.synthetic(args.flows, flow_rate, args.hop_delay, args.jitter, args.short_paths, args.loss, args.seed) for flow_rate in args.flow_rates]
+		for trace,flow_rate in zip(traces, args.flow_rates):
+			trace.name = "synthetic %g flows/s" %flow_rate
+	
+	if args.verify:
+		for trace in traces:
+			sample = trace.select(slice(0, args.verify))
+			for index_bits in args.index_bits:
+				cached = PostcarderCache(index_bits).process(sample.keys, sample.hopNums, sample.data)
+				emit, collision, payload, hops = PostcarderRegisters(index_bits).process(sample.keys, sample.hopNums, sample.data)
+				assert np.array_equal(cached["emit"], emit) and np.array_equal(cached["collision"], collision), "Emitted writes differ from the register model (%i index bits)" %index_bits
+				assert np.array_equal(cached["hops"][emit], hops[emit]) and np.array_equal(cached["payload"][emit], payload[emit]), "Written hops differ from the register model (%i index bits)" %index_bits
+			print("Verified the cache model on %i postcards of %s" %(len(sample), trace.name))
+	
+	writer = None
+	if args.output:
+		new = not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+		output = open(args.output, "a", newline="")
+		writer = csv.writer(output)
+		if new:
+			writer.writerow(RESULT_FIELDS)
+	
+	print("%-26s %8s %9s %10s %10s %12s %10s %10s %10s %11s %11s" %("trace", "cache", "SRAM", "writes", "per report", "writes/s", "evictions", "partial", "empty", "incomplete", "(by cache)"))
+	for trace in traces:
+		for index_bits in args.index_bits:
+			result = simulate(trace, index_bits, args.rate)
+			print("%-26s %8i %8.0fK %10i %10.3f %12.0f %10i %10i %10i %10.2f%% %10.2f%%" %(trace.name, result["cache_size"], result["sram_bytes"]/1024, result["writes"], result["writes_per_report"], result["writes_per_second"], result["evictions"], result["partial_evictions"], result["empty_evictions"], 100*result["incomplete_path_rate"], 100*result["cache_incomplete_path_rate"]))
+			if writer:
+				writer.writerow([("%.6f" %result[field]) if isinstance(result[field], float) else result[field] for field in RESULT_FIELDS])
+	
+	if writer:
+		output.close()
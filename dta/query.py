@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#Batched query engine for the KeyWrite store, working directly on a memory-mapped dump of the collector keywriteEntry array
+#Usage example: python3 -m dta.query keywrite.dump --key_range 0 1000000 --redundancy 4
+
+import argparse
+import time
+import numpy as np
+
+from dta.crc import CRC32, uint32Bytes
+from dta.layout import KEYWRITE_ENTRY, mapDump, isPowerOfTwo
+
+#The translator hashes keys with flipped endianness (key[7:0] ++ key[15:8] ++ key[23:16] ++ key[31:24]), i.e., the little-endian key bytes
+def keyBytes(keys):
+	return uint32Bytes(keys, "little")
+
+#The checksum stored alongside the data (hash_telemetry_key_checksum in the translator egress)
+def keyChecksums(keys):
+	return CRC32.compute(keyBytes(keys))
+
+#CRC state after the 4 key bytes. This is shared by all redundancy entries, only the trailing n-byte differs
+def keySlotStates(keys):
+	return CRC32.update(CRC32.start(len(keys)), keyBytes(keys))
+
+#The memory slot of redundancy entry n (hash_memory_slot over {key, n}, bounded by tbl_bound_slot)
+def keySlots(keys, n, num_entries, states=None):
+	if states is None:
+		states = keySlotStates(keys)
+	
+	redundancy_entry = np.full((len(states),1), n, dtype=np.uint8)
+	slots = CRC32.finish(CRC32.update(states, redundancy_entry))
+	
+	return slots & np.uint32(num_entries-1)
+
+#All redundancy slots of the keys, shape (num_keys, redundancy)
+def keySlotMatrix(keys, num_entries, redundancy):
+	states = keySlotStates(keys)
+	return np.stack([keySlots(None, n, num_entries, states) for n in range(redundancy)], axis=1)
+
+class KeyWriteStore:
+	storage = None
+	num_entries = None
+	redundancy = None
+	chunk_size = 1<<22 #Number of keys to hash at once, bounds temporary memory use during huge batches
+	
+	def __init__(self, storage, redundancy=4):
+		assert storage.dtype == KEYWRITE_ENTRY, "Storage is not laid out as keywriteEntry!"
+		assert isPowerOfTwo(len(storage)), "The translator only supports power-of-2 store sizes, got %i entries" %len(storage)
+		
+		self.storage = storage
+		self.num_entries = len(storage)
+		self.redundancy = redundancy
+	
+	@classmethod
+	def fromDump(cls, path, redundancy=4, writable=False):
+		return cls(mapDump(path, KEYWRITE_ENTRY, writable=writable), redundancy=redundancy)
+	
+	#All slots of the keys, shape (num_keys, redundancy)
+	def slots(self, keys, redundancy=None):
+		if redundancy is None:
+			redundancy = self.redundancy
+		
+		keys = np.asarray(keys, dtype=np.uint32)
+		states = keySlotStates(keys)
+		
+		slots = np.empty((len(keys), redundancy), dtype=np.uint32)
+		for n in range(redundancy):
+			slots[:,n] = keySlots(keys, n, self.num_entries, states)
+		
+		return slots
+	
+	#Query a batch of keys. Returns (data, found), data is 0 where no redundancy entry had a matching checksum
+	#Entries are checked in order n=0..N-1, and the first checksum match answers the query (same as KeywriteStore::query)
+	def query(self, keys, redundancy=None):
+		if redundancy is None:
+			redundancy = self.redundancy
+		
+		keys = np.asarray(keys, dtype=np.uint32).ravel()
+		data = np.zeros(len(keys), dtype=np.uint32)
+		found = np.zeros(len(keys), dtype=bool)
+		
+		for start in range(0, len(keys), self.chunk_size):
+			chunk = keys[start:start+self.chunk_size]
+			chunk_data, chunk_found = self.queryChunk(chunk, redundancy)
+			data[start:start+len(chunk)] = chunk_data
+			found[start:start+len(chunk)] = chunk_found
+		
+		return data, found
+	
+	def queryChunk(self, keys, redundancy):
+		checksums = keyChecksums(keys)
+		states = keySlotStates(keys)
+		
+		data = np.zeros(len(keys), dtype=np.uint32)
+		found = np.zeros(len(keys), dtype=bool)
+		pending = np.arange(len(keys))
+		
+		for n in range(redundancy):
+			slots = keySlots(None, n, self.num_entries, states[pending])
+			entries = self.storage[slots] #Gathers only the touched slots from the mapping
+			
+			match = entries["checksum"] == checksums[pending]
+			answered = pending[match]
+			data[answered] = entries["data"][match]
+			found[answered] = True
+			
+			pending = pending[~match]
+			if len(pending) == 0:
+				break
+		
+		return data, found
+	
+	#Query a single key, returns None if it was not found
+	def get(self, key, redundancy=None):
+		data, found = self.query([key], redundancy)
+		
+		return int(data[0]) if found[0] else None
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Query keys in a raw dump of the collector KeyWrite store.')
+	parser.add_argument('dump', type=str, help='Path to the raw keywriteEntry dump')
+	parser.add_argument('--keys', type=int, nargs='+', help='The telemetry keys to query')
+	parser.add_argument('--key_range', type=int, nargs=2, help='Query all keys in the range [start, end)')
+	parser.add_argument('--redundancy', type=int, default=4, help='The KeyWrite redundancy (N) used by the reporters')
+	parser.add_argument('--print_limit', type=int, default=64, help='Prevent printing more answers than this')
+	args = parser.parse_args()
+	
+	assert args.keys or args.key_range, "No keys specified!"
+	
+	if args.keys:
+		keys = np.array(args.keys, dtype=np.uint32)
+	else:
+		keys = np.arange(args.key_range[0], args.key_range[1], dtype=np.uint64).astype(np.uint32)
+	
+	store = KeyWriteStore.fromDump(args.dump, redundancy=args.redundancy)
+	print("Querying %i keys in %s (%i slots) at redundancy %i..." %(len(keys), args.dump, store.num_entries, args.redundancy))
+	
+	t_start = time.perf_counter()
+	data, found = store.query(keys)
+	duration = time.perf_counter() - t_start
+	
+	for i in range(min(len(keys), args.print_limit)):
+		print("%i: %s" %(keys[i], str(data[i]) if found[i] else "None"))
+	
+	print("Answered %i / %i queries (%.2f%%)" %(found.sum(), len(keys), 100*found.mean() if len(keys) else 0))
+	print("Query rate: %.3f million queries per second" %(len(keys)/(duration*1000000)))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#Multi-threaded KeyWrite query benchmark, running the collector's query logic (Collector/keywrite_query.h) through the libdtaquery.so library
+#Query threads are pinned to cores, and the store is placed on a NUMA node (first touched by a thread on that node). Threads, redundancy, and store sizes are swept, and every configuration is appended to a CSV file as a row, so query performance can be compared release to release
+#Build the library first: cd Collector && g++ -O3 -shared -fPIC -o libdtaquery.so query_benchmark.cpp -lpthread
+#Usage example: python3 -m dta.querybench --threads 1 2 4 8 --redundancy 1 2 4 --entries 1048576 16777216 --placement spread --label v1.2 --output query_benchmark.csv
+
+import argparse
+import csv
+import ctypes
+import os
+import time
+import numpy as np
+
+from dta.layout import KEYWRITE_ENTRY, mapDump, isPowerOfTwo
+from dta.query import KeyWriteStore, keyChecksums, keySlotMatrix
+
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Collector", "libdtaquery.so")
+
+RESULT_FIELDS = ["timestamp", "label", "entries", "size", "redundancy", "threads", "placement", "cpus", "memory_node", "load_factor", "queries", "found", "duration", "mqps", "p50_ns", "p99_ns", "p999_ns"]
+
+def loadLibrary(path=None):
+	path = path or os.environ.get("DTA_QUERY_LIBRARY") or LIBRARY_PATH
+	assert os.path.exists(path), "%s not found. Build it with: cd Collector && g++ -O3 -shared -fPIC -o libdtaquery.so query_benchmark.cpp -lpthread" %path
+	
+	library = ctypes.CDLL(path)
+	library.dtaAllocate.restype = ctypes.c_void_p
+	library.dtaAllocate.argtypes = [ctypes.c_uint64, ctypes.c_int]
+	library.dtaFree.restype = None
+	library.dtaFree.argtypes = [ctypes.c_void_p, ctypes.c_uint64]
+	library.dtaBenchmarkQueries.restype = ctypes.c_double
+	library.dtaBenchmarkQueries.argtypes = [ctypes.c_void_p, ctypes.c_uint64, ctypes.c_void_p, ctypes.c_uint64, ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_uint64, ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint64)]
+	library.dtaQuery.restype = ctypes.c_uint32
+	library.dtaQuery.argtypes = [ctypes.c_void_p, ctypes.c_uint64, ctypes.c_uint32, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+	
+	return library
+
+def parseCpuList(text):
+	cpus = []
+	for part in text.strip().split(","):
+		if "-" in part:
+			start, end = part.split("-")
+			cpus.extend(range(int(start), int(end)+1))
+		elif part:
+			cpus.append(int(part))
+	
+	return cpus
+
+#The usable cores of every NUMA node, node -> list of cpus. Without NUMA information, all usable cores are on node 0
+def numaNodes():
+	usable = os.sched_getaffinity(0)
+	nodes = {}
+	
+	directory = "/sys/devices/system/node"
+	if os.path.isdir(directory):
+		for name in sorted(os.listdir(directory)):
+			if name.startswith("node") and name[4:].isdigit():
+				with open(os.path.join(directory, name, "cpulist")) as f:
+					cpus = [cpu for cpu in parseCpuList(f.read()) if cpu in usable]
+				if cpus:
+					nodes[int(name[4:])] = cpus
+	
+	return nodes or {0: sorted(usable)}
+
+#The cores of num_threads threads. "compact" fills the cores of one node before the next (starting at first_node), "spread" alternates between nodes, and "none" leaves the threads unpinned
+def placeThreads(nodes, num_threads, placement="compact", first_node=0):
+	if placement == "none":
+		return None
+	
+	order = sorted(nodes, key=lambda node: (node != first_node, node))
+	if placement == "compact":
+		cpus = [cpu for node in order for cpu in nodes[node]]
+	elif placement == "spread":
+		longest = max(len(nodes[node]) for node in order)
+		cpus = [nodes[node][i] for i in range(longest) for node in order if i < len(nodes[node])]
+	else:
+		assert False, "Unknown placement %s" %placement
+	
+	#More threads than cores share cores
+	return [cpus[i % len(cpus)] for i in range(num_threads)]
+
+#Store memory allocated by the library, placed on the node of the given cpu
+class BenchmarkStore:
+	library = None
+	address = None
+	size = None
+	storage = None
+	
+	def __init__(self, library, num_entries, cpu=-1):
+		self.library = library
+		self.size = num_entries*KEYWRITE_ENTRY.itemsize
+		self.address = library.dtaAllocate(self.size, cpu)
+		assert self.address, "Could not allocate %iB of store memory" %self.size
+		
+		buffer = (ctypes.c_char*self.size).from_address(self.address)
+		self.storage = np.frombuffer(buffer, dtype=KEYWRITE_ENTRY)
+	
+	#Write the keys in order (as reports would arrive), all N redundancy entries of each. Later keys overwrite earlier ones in shared slots
+	def populate(self, keys, redundancy):
+		slots = keySlotMatrix(keys, len(self.storage), redundancy)
+		checksums = keyChecksums(keys)
+		
+		self.storage["checksum"][slots.ravel()] = np.repeat(checksums, redundancy)
+		self.storage["data"][slots.ravel()] = np.repeat(keys, redundancy)
+	
+	def copyFrom(self, storage):
+		self.storage[:] = storage
+	
+	def close(self):
+		self.storage = None
+		self.library.dtaFree(self.address, self.size)
+
+#Run num_queries queries of the keys (cycling through them) in threads pinned to cpus. Returns (duration, found)
+def runQueries(library, store, keys, redundancy, num_threads, cpus, num_queries, latencies=None):
+	keys = np.ascontiguousarray(keys, dtype=np.uint32)
+	cpu_array = None if cpus is None else (ctypes.c_int*num_threads)(*cpus)
+	found = ctypes.c_uint64(0)
+	
+	duration = library.dtaBenchmarkQueries(store.address, len(store.storage), keys.ctypes.data, len(keys), redundancy, num_threads, cpu_array, num_queries, None if latencies is None else latencies.ctypes.data, ctypes.byref(found))
+	
+	return duration, found.value
+
+#One configuration: a throughput run without timers, then a run timing every query (the timer adds some tens of ns to each latency)
+def benchmark(library, store, keys, redundancy, num_threads, cpus, num_queries, num_timed):
+	duration, found = runQueries(library, store, keys, redundancy, num_threads, cpus, num_queries)
+	
+	latencies = np.zeros(num_timed, dtype=np.uint64)
+	if num_timed > 0:
+		runQueries(library, store, keys, redundancy, num_threads, cpus, num_timed, latencies)
+	percentiles = np.percentile(latencies, [50, 99, 99.9]) if num_timed > 0 else [0, 0, 0]
+	
+	return {
+		"queries": num_queries,
+		"found": found,
+		"duration": duration,
+		"mqps": num_queries/(duration*1000000),
+		"p50_ns": percentiles[0],
+		"p99_ns": percentiles[1],
+		"p999_ns": percentiles[2]
+	}
+
+#Check that the library answers like the Python query engine
+def verify(library, store, keys, redundancy):
+	data, found = KeyWriteStore(store.storage, redundancy).query(keys)
+	
+	key_found = ctypes.c_int(0)
+	for i in range(len(keys)):
+		answer = library.dtaQuery(store.address, len(store.storage), int(keys[i]), redundancy, ctypes.byref(key_found))
+		assert bool(key_found.value) == found[i], "Key %i: library found=%i, dta.query found=%i" %(keys[i], key_found.value, found[i])
+		assert not found[i] or answer == int(data[i].byteswap()), "Key %i: library answered %i, dta.query %i" %(keys[i], answer, data[i])
+
+#Appends a row per configuration, so results from several runs (and releases) collect in one file
+class ResultWriter:
+	path = None
+	rows = 0
+	
+	def __init__(self, path):
+		self.path = path
+		if not os.path.exists(path) or os.path.getsize(path) == 0:
+			with open(path, "w", newline="") as f:
+				csv.writer(f).writerow(RESULT_FIELDS)
+	
+	def write(self, result):
+		with open(self.path, "a", newline="") as f:
+			csv.writer(f).writerow([("%.3f" %result[field]) if isinstance(result[field], float) else result[field] for field in RESULT_FIELDS])
+		self.rows += 1
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmark multi-threaded KeyWrite querying with the collector query logic, sweeping threads, redundancy, and store sizes.')
+	parser.add_argument('--threads', type=int, nargs='+', default=[1], help='Numbers of query threads to sweep')
+	parser.add_argument('--redundancy', type=int, nargs='+', default=[2], help='Redundancy levels (N) to sweep')
+	parser.add_argument('--entries', type=int, nargs='+', default=[1<<24], help='Store sizes to sweep, in entries (powers of 2)')
+	parser.add_argument('--dump', type=str, help='Benchmark on a copy of this keywriteEntry dump (e.g., /dev/shm/dta/keywrite.bin) instead of generated stores')
+	parser.add_argument('--load_factor', type=float, default=0.5, help='Generated stores: keys written per slot, counting all redundancy entries')
+	parser.add_argument('--miss_ratio', type=float, default=0.0, help='Fraction of queried keys that were never written')
+	parser.add_argument('--queries', type=int, default=10000000, help='Queries per throughput run')
+	parser.add_argument('--timed', type=int, default=1000000, help='Individually timed queries per latency run')
+	parser.add_argument('--placement', type=str, default='compact', choices=['compact', 'spread', 'none'], help='Thread placement: fill one NUMA node first, alternate between nodes, or do not pin')
+	parser.add_argument('--memory_node', type=int, default=0, help='NUMA node to place the store on (threads also start filling this node)')
+	parser.add_argument('--library', type=str, help='Path to libdtaquery.so (default: Collector/libdtaquery.so)')
+	parser.add_argument('--label', type=str, default='', help='Label of the rows, e.g., the release under test')
+	parser.add_argument('--output', type=str, default='query_benchmark.csv', help='CSV file to append the results to')
+	parser.add_argument('--seed', type=int, default=0, help='Seed of the generated keys')
+	args = parser.parse_args()
+	
+	library = loadLibrary(args.library)
+	nodes = numaNodes()
+	assert args.memory_node in nodes, "No usable cores on NUMA node %i (nodes: %s)" %(args.memory_node, ", ".join(map(str, sorted(nodes))))
+	print("NUMA nodes: %s" %"; ".join("%i: %i cores" %(node, len(cpus)) for node,cpus in sorted(nodes.items())))
+	
+	dump = mapDump(args.dump, KEYWRITE_ENTRY) if args.dump else None
+	sizes = [len(dump)] if dump is not None else args.entries
+	writer = ResultWriter(args.output)
+	rng = np.random.default_rng(args.seed)
+	
+	for num_entries in sizes:
+		assert isPowerOfTwo(num_entries), "Store sizes must be powers of 2, got %i" %num_entries
+		
+		for redundancy in args.redundancy:
+			store = BenchmarkStore(library, num_entries, nodes[args.memory_node][0])
+			
+			#The key population: written keys first, and never written ones for misses
+			if dump is not None:
+				store.copyFrom(dump)
+				keys = rng.integers(0, 1<<32, size=min(args.queries, 1<<24), dtype=np.uint64).astype(np.uint32)
+			else:
+				num_keys = max(1, int(args.load_factor*num_entries/redundancy))
+				written = rng.permutation(num_keys*2).astype(np.uint32)
+				store.populate(written[:num_keys], redundancy)
+				num_misses = int(min(args.queries, 1<<24)*args.miss_ratio)
+				keys = np.concatenate([rng.choice(written[:num_keys], min(args.queries, 1<<24) - num_misses), rng.choice(written[num_keys:], num_misses)])
+				rng.shuffle(keys)
+			
+			verify(library, store, keys[:1000], redundancy)
+			
+			for num_threads in args.threads:
+				cpus = placeThreads(nodes, num_threads, args.placement, args.memory_node)
+				result = benchmark(library, store, keys, redundancy, num_threads, cpus, args.queries, args.timed)
+				result.update({
+					"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+					"label": args.label,
+					"entries": num_entries,
+					"size": store.size,
+					"redundancy": redundancy,
+					"threads": num_threads,
+					"placement": args.placement,
+					"cpus": " ".join(map(str, cpus)) if cpus is not None else "",
+					"memory_node": args.memory_node,
+					"load_factor": args.load_factor if dump is None else float(np.count_nonzero(store.storage["checksum"]))/num_entries
+				})
+				writer.write(result)
+				
+				print("%10i entries, N=%i, %2i threads: %8.3f Mqps, p50 %6.0fns, p99 %6.0fns (%.2f%% answered)" %(num_entries, redundancy, num_threads, result["mqps"], result["p50_ns"], result["p99_ns"], 100*result["found"]/max(1, result["queries"])))
+			
+			store.close()
+	
+	print("Appended %i rows to %s" %(writer.rows, args.output))
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+#Software model of the report suppression of the reporter pipeline (Reporter/p4src/dta_reporter.p4), to size the report volume reaching translators and collectors
+#ControlChangeDetection: a CRC16 checksum of the telemetry data is looked up in a 3-level checksum cache indexed by CRC32(srcAddr, dstAddr). ControlProbabilisticReporting: packets without a detected change are still reported when a 16-bit random value falls in a range
+#The cache levels behave as a most-recently-used list of checksums per cache index (level 1 newest), starting out as all zeros. A packet hits the cache iff its checksum was seen at the index before, with fewer than <levels> other checksums in between
+#That makes the cache vectorizable over whole traces: packets are sorted by index, consecutive equal checksums are merged into runs, and the previous run with the same checksum tells how many other checksums were cached since
+#Usage example: python3 -m dta.reporter --pcap trace.pcap --cache_sizes 4096 65536 --probabilities 0 0.001 0.0153, or python3 -m dta.reporter --flows 100000 --packets 10000000 --change_probability 0.01 --paths 4
+
+import argparse
+import csv
+import os
+import time
+import numpy as np
+
+from dta.crc import CRC32, CRC16, uint32Bytes, truncate
+from dta.frames import readPcap
+from dta.headers import IPV4_OFFSET, UDP_OFFSET
+
+#Constants hard-coded in the pipeline
+CHECKSUM_CACHE_REGISTER_SIZE = 65536
+CHECKSUM_CACHE_LEVELS = 3
+RANDOM_RANGE = 1<<16 #random_t
+REPORT_RANDOM_MAX = 1000 #tbl_probabilistic_reporting: (0 .. 1000) -> flag_report_generation
+PIPELINE_REPORT_PROBABILITY = (REPORT_RANDOM_MAX+1)/RANDOM_RANGE
+
+ETHERTYPE_IPV4 = 0x0800
+INT_FLOW_SIZE = 13 #int_flow of Generator/int_paths.py (srcIP, dstIP, proto, srcPort, dstPort)
+INT_PATH_SIZE = 20 #int_path of Generator/int_paths.py (5 hops of 4B)
+
+RESULT_FIELDS = ["trace", "packets", "duration", "cache_size", "levels", "report_probability", "reports", "change_reports", "sampled_reports", "reports_per_second", "suppression_ratio", "cache_hit_rate"]
+
+#Packets as the reporter sees them: the cache key (srcAddr, dstAddr) and the 32-bit telemetry data
+class ReporterTrace:
+	name = None
+	timestamps = None
+	srcAddr = None
+	dstAddr = None
+	data = None
+	
+	def __init__(self, timestamps, srcAddr, dstAddr, data, name="trace"):
+		self.timestamps = np.asarray(timestamps, dtype=np.float64)
+		self.srcAddr = np.asarray(srcAddr, dtype=np.uint32)
+		self.dstAddr = np.asarray(dstAddr, dtype=np.uint32)
+		self.data = np.asarray(data, dtype=np.uint32)
+		self.name = name
+	
+	def __len__(self):
+		return len(self.data)
+	
+	#Seconds covered by the trace (packets without timestamps are spread at rate packets per second)
+	def duration(self, rate=None):
+		if len(self) > 1 and self.timestamps[-1] > self.timestamps[0]:
+			return float(self.timestamps[-1] - self.timestamps[0])
+		assert rate, "The trace has no timestamps, a packet rate is needed"
+		return len(self)/rate
+	
+	#Telemetry is ipv4.identification as in the compiled reporter, or (int_path) a CRC32 of the 5 hops of Generator/int_paths.py packets, keyed by the flow in int_flow
+	@classmethod
+	def fromPcap(cls, path, telemetry="identification"):
+		frames = readPcap(path)
+		width = UDP_OFFSET + 8 + INT_FLOW_SIZE + INT_PATH_SIZE
+		heads = frames.headers(width)
+		
+		def field(offset, size):
+			return np.ascontiguousarray(heads[:,offset:offset+size]).view(">u%i" %size).ravel()
+		
+		ipv4 = (field(12, 2) == ETHERTYPE_IPV4) & (frames.lengths >= IPV4_OFFSET+20)
+		if telemetry == "int_path":
+			ipv4 &= frames.lengths >= width
+			flow = UDP_OFFSET + 8
+			srcAddr, dstAddr = field(flow, 4), field(flow+4, 4)
+			data = CRC32.compute(heads[:,flow+INT_FLOW_SIZE:flow+INT_FLOW_SIZE+INT_PATH_SIZE])
+		else:
+			srcAddr, dstAddr = field(IPV4_OFFSET+12, 4), field(IPV4_OFFSET+16, 4)
+			data = field(IPV4_OFFSET+4, 2).astype(np.uint32)
+		
+		rows = np.flatnonzero(ipv4)
+		return cls(frames.timestamps[rows], srcAddr[rows], dstAddr[rows], data[rows], os.path.basename(path))
+	
+	#Flows with Zipf-distributed packet counts. Every packet changes the telemetry (e.g., the path) of its flow with change_probability, to a new value, or with paths > 0 to one of that many alternatives per flow (e.g., flapping between ECMP paths)
+	@classmethod
+	def synthetic(cls, num_packets, num_flows, change_probability=0.01, paths=0, zipf=1.0, rate=None, seed=0):
+		rng = np.random.default_rng(seed)
+		
+		weights = 1/np.arange(1, num_flows+1, dtype=np.float64)**zipf
+		flows = rng.choice(num_flows, size=num_packets, p=weights/weights.sum())
+		srcAddr = rng.integers(1, 1<<32, size=num_flows, dtype=np.uint64).astype(np.uint32)
+		dstAddr = rng.integers(1, 1<<32, size=num_flows, dtype=np.uint64).astype(np.uint32)
+		
+		#Version of every packet's flow telemetry: the number of changes of the flow so far
+		changes = rng.random(num_packets) < change_probability
+		order = np.argsort(flows, kind="stable")
+		counts = np.cumsum(changes[order])
+		starts = np.flatnonzero(np.r_[True, flows[order][1:] != flows[order][:-1]])
+		base = np.repeat(counts[starts] - changes[order][starts], np.diff(np.r_[starts, num_packets]))
+		versions = np.empty(num_packets, dtype=np.uint32)
+		versions[order] = counts - base
+		
+		if paths > 0: #Every version picks one of the flow's alternatives
+			versions = (CRC32.compute(np.hstack([uint32Bytes(flows), uint32Bytes(versions), uint32Bytes(np.full(num_packets, seed))])) % paths).astype(np.uint32)
+		data = CRC32.compute(np.hstack([uint32Bytes(flows), uint32Bytes(versions)]))
+		
+		timestamps = np.arange(num_packets)/rate if rate else np.zeros(num_packets)
+		return cls(timestamps, srcAddr[flows], dstAddr[flows], data, "synthetic")
+
+#hash_cache_index: CRC32 over {srcAddr, dstAddr}, truncated to the cache index width
+def cacheIndexes(srcAddr, dstAddr, cache_size=CHECKSUM_CACHE_REGISTER_SIZE):
+	assert cache_size & (cache_size-1) == 0 and cache_size <= 1<<32, "The cache size must be a power of 2 (at most 2^32), got %i" %cache_size
+	return truncate(CRC32.compute(np.hstack([uint32Bytes(srcAddr), uint32Bytes(dstAddr)])), cache_size.bit_length()-1)
+
+#hash_telemetry_checksum: CRC16 over telemetry_data
+def telemetryChecksums(data):
+	return CRC16.compute(uint32Bytes(data))
+
+#True for every packet whose checksum was not found in any cache level (ig_md.detected_change), for packets in arrival order
+def changeDetected(indexes, checksums, levels=CHECKSUM_CACHE_LEVELS):
+	assert 1 <= levels <= 3, "Only 1-3 cache levels are modeled, got %i" %levels
+	num_packets = len(indexes)
+	
+	#The registers start out as 0, modeled as a packet with checksum 0 ahead of the first packet of every index
+	initial = np.unique(indexes)
+	index = np.concatenate([initial, indexes]).astype(np.int64)
+	checksum = np.concatenate([np.zeros(len(initial)), checksums]).astype(np.int64)
+	order = np.argsort(index, kind="stable")
+	index, checksum = index[order], checksum[order]
+	
+	#Runs of equal checksums per index
+	new_run = np.ones(len(index), dtype=bool)
+	new_run[1:] = (index[1:] != index[:-1]) | (checksum[1:] != checksum[:-1])
+	run = np.cumsum(new_run) - 1
+	run_checksums = checksum[new_run]
+	
+	#The run of the previous packet with the same index and checksum
+	by_checksum = np.argsort((index << 16) | checksum, kind="stable") #Stable, so packets stay in arrival order
+	same = (index[by_checksum[1:]] == index[by_checksum[:-1]]) & (checksum[by_checksum[1:]] == checksum[by_checksum[:-1]])
+	previous = np.full(len(index), -1, dtype=np.int64)
+	previous[by_checksum[1:][same]] = by_checksum[:-1][same]
+	
+	seen = previous >= 0
+	gap = np.where(seen, run - run[previous], 0) #Adjacent runs differ, so gap-1 other checksums (runs) came in between, gap-1 >= 1 unless in the same run
+	if levels == 1:
+		hit = seen & (gap == 0)
+	elif levels == 2:
+		hit = seen & (gap <= 2)
+	else:
+		#With 3+ runs in between, they hold only 2 distinct checksums iff they alternate (every run equals the one 2 runs before, from the 3rd run in between on)
+		alternates = np.zeros(len(run_checksums), dtype=bool)
+		alternates[2:] = run_checksums[2:] == run_checksums[:-2]
+		next_break = np.minimum.accumulate(np.where(alternates, len(run_checksums), np.arange(len(run_checksums)))[::-1])[::-1]
+		hit = seen & ((gap <= 3) | (next_break[np.minimum(run - gap + 3, len(run_checksums)-1)] >= run))
+	
+	detected = np.empty(num_packets, dtype=bool)
+	real = order >= len(initial)
+	detected[order[real] - len(initial)] = ~hit[real]
+	
+	return detected
+
+#Packet-by-packet model of the cache registers, as in ControlChangeDetection (slow, used to check changeDetected())
+class ChecksumCache:
+	registers = None
+	levels = CHECKSUM_CACHE_LEVELS
+	
+	def __init__(self, cache_size=CHECKSUM_CACHE_REGISTER_SIZE, levels=CHECKSUM_CACHE_LEVELS):
+		self.levels = levels
+		self.registers = [[0]*cache_size for _ in range(levels)]
+	
+	def process(self, indexes, checksums):
+		detected = np.ones(len(indexes), dtype=bool)
+		for i,(index,checksum) in enumerate(zip(indexes.tolist(), checksums.tolist())):
+			insert = checksum
+			for level,register in enumerate(self.registers):
+				#Level 2 is processed if level 1 replaced another checksum, level 3 if level 2 did, and no level matched yet
+				if level > 0:
+					if last == insert or not detected[i]:
+						break
+					insert = last
+				last = register[index]
+				register[index] = insert
+				if last == checksum:
+					detected[i] = False
+		
+		return detected
+
+#Reports of a configuration: detected changes always, other packets with report_probability
+def emulate(trace, cache_size=CHECKSUM_CACHE_REGISTER_SIZE, levels=CHECKSUM_CACHE_LEVELS, report_probability=PIPELINE_REPORT_PROBABILITY, random=None, detected=None, rate=None):
+	if random is None:
+		random = np.random.default_rng().integers(0, RANDOM_RANGE, size=len(trace))
+	if detected is None:
+		detected = changeDetected(cacheIndexes(trace.srcAddr, trace.dstAddr, cache_size), telemetryChecksums(trace.data), levels)
+	
+	sampled = ~detected & (random < round(report_probability*RANDOM_RANGE))
+	
+	num_packets = len(trace)
+	reports = int(detected.sum() + sampled.sum())
+	duration = trace.duration(rate)
+	
+	return {
+		"trace": trace.name,
+		"packets": num_packets,
+		"duration": duration,
+		"cache_size": cache_size,
+		"levels": levels,
+		"report_probability": report_probability,
+		"reports": reports,
+		"change_reports": int(detected.sum()),
+		"sampled_reports": int(sampled.sum()),
+		"reports_per_second": reports/duration,
+		"suppression_ratio": 1 - reports/max(1, num_packets),
+		"cache_hit_rate": 1 - detected.sum()/max(1, num_packets)
+	}
+
+#Emulate every combination of cache sizes, levels, and report probabilities. The random values are shared, so configurations are compared on the same packets
+def sweep(trace, cache_sizes=[CHECKSUM_CACHE_REGISTER_SIZE], levels=[CHECKSUM_CACHE_LEVELS], report_probabilities=[PIPELINE_REPORT_PROBABILITY], rate=None, seed=0):
+	checksums = telemetryChecksums(trace.data)
+	random = np.random.default_rng(seed).integers(0, RANDOM_RANGE, size=len(trace))
+	
+	results = []
+	for cache_size in cache_sizes:
+		indexes = cacheIndexes(trace.srcAddr, trace.dstAddr, cache_size)
+		for num_levels in levels:
+			detected = changeDetected(indexes, checksums, num_levels)
+			for report_probability in report_probabilities:
+				results.append(emulate(trace, cache_size, num_levels, report_probability, random, detected, rate))
+	
+	return results
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Emulate the change detection and probabilistic reporting of the reporter on a trace, sweeping cache sizes and report probabilities.')
+	parser.add_argument('--pcap', type=str, help='A packet trace to replay (e.g., captured Generator/int_paths.py traffic)')
+	parser.add_argument('--telemetry', type=str, default='identification', choices=['identification', 'int_path'], help='pcap: telemetry data of a packet, ipv4.identification (as compiled), or the int_path hops of int_paths.py packets (keyed by their int_flow)')
+	parser.add_argument('--packets', type=int, default=10000000, help='Synthetic trace: number of packets')
+	parser.add_argument('--flows', type=int, default=100000, help='Synthetic trace: number of flows')
+	parser.add_argument('--zipf', type=float, default=1.0, help='Synthetic trace: Zipf exponent of the packets per flow')
+	parser.add_argument('--change_probability', type=float, default=0.01, help='Synthetic trace: probability that a packet changes the telemetry of its flow')
+	parser.add_argument('--paths', type=int, default=0, help='Synthetic trace: alternatives a flow changes between (0: every change is new)')
+	parser.add_argument('--rate', type=float, default=100e6, help='Packets per second, for traces without timestamps')
+	parser.add_argument('--cache_sizes', type=int, nargs='+', default=[CHECKSUM_CACHE_REGISTER_SIZE], help='Checksum cache sizes (entries per level, powers of 2) to sweep')
+	parser.add_argument('--levels', type=int, nargs='+', default=[CHECKSUM_CACHE_LEVELS], help='Numbers of cache levels (1-3) to sweep')
+	parser.add_argument('--probabilities', type=float, nargs='+', default=[PIPELINE_REPORT_PROBABILITY], help='Report probabilities of unchanged packets to sweep (the pipeline uses %.4f)' %PIPELINE_REPORT_PROBABILITY)
+	parser.add_argument('--verify', type=int, default=0, help='Check the vectorized cache against the packet-by-packet register model on this many packets')
+	parser.add_argument('--output', type=str, help='CSV file to append the results to')
+	parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic trace and the random values')
+	args = parser.parse_args()
+	
+	if args.pcap:
+		trace = ReporterTrace.fromPcap(args.pcap, args.telemetry)
+	else:
+		trace = ReporterTrace.synthetic(args.packets, args.flows, args.change_probability, args.paths, args.zipf, args.rate, args.seed)
+	print("%i packets over %.3f seconds" %(len(trace), trace.duration(args.rate)))
+	
+	if args.verify:
+		sample = min(args.verify, len(trace))
+		checksums = telemetryChecksums(trace.data[:sample])
+		for cache_size in args.cache_sizes:
+			indexes = cacheIndexes(trace.srcAddr[:sample], trace.dstAddr[:sample], cache_size)
+			for num_levels in args.levels:
+				mismatches = np.count_nonzero(changeDetected(indexes, checksums, num_levels) != ChecksumCache(cache_size, num_levels).process(indexes, checksums))
+				assert mismatches == 0, "Cache model mismatch on %i of %i packets (cache size %i, %i levels)" %(mismatches, sample, cache_size, num_levels)
+		print("Verified the cache model on %i packets" %sample)
+	
+	t_start = time.perf_counter()
+	results = sweep(trace, args.cache_sizes, args.levels, args.probabilities, args.rate, args.seed)
+	duration = time.perf_counter() - t_start
+	
+	print("%10s %6s %11s %12s %14s %12s %9s" %("cache", "levels", "probability", "reports", "reports/s", "suppression", "hit rate"))
+	for result in results:
+		print("%10i %6i %11.5f %12i %14.0f %11.2f%% %8.2f%%" %(result["cache_size"], result["levels"], result["report_probability"], result["reports"], result["reports_per_second"], 100*result["suppression_ratio"], 100*result["cache_hit_rate"]))
+	print("Emulated %i configurations in %.3f seconds" %(len(results), duration))
+	
+	if args.output:
+		new = not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+		with open(args.output, "a", newline="") as f:
+			writer = csv.writer(f)
+			if new:
+				writer.writerow(RESULT_FIELDS)
+			for result in results:
+				writer.writerow([("%.6f" %result[field]) if isinstance(result[field], float) else result[field] for field in RESULT_FIELDS])
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+#Reporter-side retransmission of DTA reports flagged retransmitable, driven by the NACKs of the translator (DO_NACK_TRACKING)
+#The translator only accepts the seqnum following its last in-order one, and bounces every other retransmitable report as a NACK carrying that last in-order seqnum. Everything after the NACKed seqnum is therefore missing, and is resent in seqnum order (go-back-N) in one batch
+#Sent frames are kept in a ring indexed by their 8-bit seqnum (the seqnum space bounds the window, the tracker can not tell laps apart). Every transmission is stamped with an id in ipv4.identification, which NACKs echo, so NACKs of reports sent before a retransmission are recognized as stale instead of triggering another one
+#The translator sends no positive ACKs: NACKs confirm everything up to their seqnum, and reports without a NACK for horizon seconds are presumed delivered. Reports evicted from the ring before that are counted as buffer pressure, as their loss could no longer be repaired
+#Usage example: python3 -m dta.retransmit --count 1000000 --loss 0.001 (loopback through the translator model with induced loss), or python3 -m dta.retransmit --iface enp4s0f0 --count 1000000
+
+import argparse
+import socket
+import time
+import numpy as np
+
+from dta.encoder import ReportEncoder, RawSender, rawFrames
+from dta.frames import FrameBatch, captureFrames, concatFrames
+from dta.headers import *
+
+SEQNUM_SPACE = 256
+TX_ID_SPACE = 1<<16 #ipv4.identification
+MAX_REPORT_LEN = max(reportFrame(opcode).itemsize for opcode in DTA_PRIMITIVES)
+NACK_WIDTH = DTA_BASE_OFFSET + DTA_ACK.itemsize
+
+#Signed difference of 16-bit transmission ids (positive: a was transmitted after b)
+def txDistance(a, b):
+	return ((np.asarray(a, dtype=np.int64) - b + TX_ID_SPACE//2) % TX_ID_SPACE) - TX_ID_SPACE//2
+
+#DTA NACKs in a batch of frames: (last in-order seqnums, transmission ids of the bounced reports). Only NACKs to dstAddr if it is given
+def parseNacks(batch, dstAddr=None):
+	if len(batch) == 0:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	
+	heads = batch.headers(NACK_WIDTH)
+	etherType = heads[:,12].astype(np.uint16) << 8 | heads[:,13]
+	dstPort = heads[:,UDP_OFFSET+2].astype(np.uint16) << 8 | heads[:,UDP_OFFSET+3]
+	is_nack = (etherType == ETHERTYPE_IPV4) & (heads[:,IPV4_OFFSET+9] == IPV4_PROTO_UDP) & (dstPort == DTA_ACK_PORT_NUMBER) & (heads[:,DTA_BASE_OFFSET+1] & 0x80 != 0) & (batch.lengths >= NACK_WIDTH)
+	if dstAddr is not None:
+		is_nack &= np.ascontiguousarray(heads[:,IPV4_OFFSET+16:IPV4_OFFSET+20]).view(">u4").ravel() == dstAddr
+	
+	rows = np.flatnonzero(is_nack)
+	tx_ids = heads[rows,IPV4_OFFSET+4].astype(np.int64) << 8 | heads[rows,IPV4_OFFSET+5]
+	return heads[rows,DTA_BASE_OFFSET].astype(np.int64), tx_ids
+
+#Sent report frames, one slot per seqnum. Reports are numbered with their laps (seqnum = report & 0xff), so a lookup can tell whether the slot still holds the report
+class RetransmissionRing:
+	capacity = SEQNUM_SPACE
+	frames = None #slot -> frame bytes (zero-padded to MAX_REPORT_LEN)
+	lengths = None #slot -> frame length
+	reports = None #slot -> report number, -1 if empty
+	sent_at = None #slot -> time of the last transmission
+	tx_ids = None #slot -> ipv4.identification of the last transmission
+	
+	def __init__(self):
+		self.frames = np.zeros((self.capacity, MAX_REPORT_LEN), dtype=np.uint8)
+		self.lengths = np.zeros(self.capacity, dtype=np.int64)
+		self.reports = np.full(self.capacity, -1, dtype=np.int64)
+		self.sent_at = np.zeros(self.capacity, dtype=np.float64)
+		self.tx_ids = np.zeros(self.capacity, dtype=np.int64)
+	
+	#Store consecutive reports (first, first+1, ...) from a (num_reports, frame_len) byte array. Returns the report numbers evicted from their slots
+	def insert(self, first, raw, tx_ids, now):
+		#Of a batch larger than the ring, only the last lap survives
+		skip = max(len(raw) - self.capacity, 0)
+		reports = first + skip + np.arange(len(raw) - skip, dtype=np.int64)
+		slots = reports & (self.capacity-1)
+		
+		evicted = self.reports[slots]
+		evicted = np.concatenate([first + np.arange(skip, dtype=np.int64), evicted[evicted >= 0]])
+		
+		self.frames[slots,:raw.shape[1]] = raw[skip:]
+		self.lengths[slots] = raw.shape[1]
+		self.reports[slots] = reports
+		self.sent_at[slots] = now
+		self.tx_ids[slots] = np.asarray(tx_ids)[skip:]
+		
+		return evicted
+	
+	#Slot of a report, None if it is no longer (or not yet) stored
+	def lookup(self, report):
+		slot = report & (self.capacity-1)
+		if report < 0 or self.reports[slot] != report:
+			return None
+		return slot
+	
+	#Slots of the reports first..last, None unless all of them are stored
+	def slots(self, first, last):
+		reports = np.arange(first, last+1, dtype=np.int64)
+		slots = reports & (self.capacity-1)
+		if len(reports) > self.capacity or first < 0 or not np.array_equal(self.reports[slots], reports):
+			return None
+		return slots
+
+#Sends retransmitable reports of all primitives under one seqnum sequence (the translator has a single tracker), and repairs the losses its NACKs reveal
+#sender is anything with send(frames) taking a (num_frames, frame_len) byte array, e.g., a RawSender
+class RetransmittingReporter:
+	sender = None
+	ring = None
+	encoders = None #opcode -> ReportEncoder
+	encoder_args = None
+	srcAddr = None
+	horizon = 0.001
+	
+	next_report = 1 #Number of the next report (the tracker starts at 0, expecting seqnum 1)
+	released = 0 #Reports up to here are confirmed by a NACK, presumed delivered, or evicted
+	tracker = None #Highest last in-order report seen in a NACK
+	probed = None #Last report sent as a tail loss probe
+	next_tx_id = 0
+	
+	counters = None
+	max_occupancy = 0
+	
+	def __init__(self, sender, srcIP="10.0.0.101", dstIP="10.0.0.51", dstMac="b8:ce:f6:d2:12:c7", srcMac="00:00:00:00:00:00", horizon=0.001, immediate=False, udp_checksum=True):
+		self.sender = sender
+		self.ring = RetransmissionRing()
+		self.encoders = {}
+		self.encoder_args = dict(dstMac=dstMac, srcMac=srcMac, srcIP=srcIP, dstIP=dstIP, immediate=immediate, retransmitable=True, udp_checksum=udp_checksum)
+		self.srcAddr = ipToInt(srcIP)
+		self.horizon = horizon
+		self.counters = {name:0 for name in ["reports", "transmissions", "retransmitted", "retransmit_batches", "nacks", "stale_nacks", "unrecoverable", "overwritten", "resyncs"]}
+	
+	def encoder(self, opcode):
+		if opcode not in self.encoders:
+			self.encoders[opcode] = ReportEncoder(opcode, **self.encoder_args)
+		return self.encoders[opcode]
+	
+	#Encode and send a batch of reports. Fields are named as in ReportEncoder.encode(). Returns the number of reports sent
+	def send(self, opcode, **fields):
+		encoder = self.encoder(opcode)
+		num_reports = max(np.size(value) for value in fields.values())
+		reports = self.next_report + np.arange(num_reports, dtype=np.int64)
+		raw = rawFrames(encoder.encode(seqnums=reports & 0xff, **fields))
+		
+		now = time.monotonic()
+		self.release(now)
+		tx_ids = self.stamp(raw)
+		
+		evicted = self.ring.insert(self.next_report, raw, tx_ids, now)
+		overwritten = evicted[evicted > self.released]
+		if len(overwritten):
+			self.counters["overwritten"] += len(overwritten)
+			self.released = int(overwritten.max())
+		self.next_report += num_reports
+		self.max_occupancy = max(self.max_occupancy, self.occupancy())
+		
+		self.sender.send(raw)
+		self.counters["reports"] += num_reports
+		self.counters["transmissions"] += num_reports
+		
+		return num_reports
+	
+	def sendKeyWrite(self, keys, data, redundancy):
+		return self.send(DTA_OPCODE_KEYWRITE, key=keys, data=data, redundancy=redundancy)
+	
+	def sendKeyIncrement(self, keys, counters, redundancy):
+		return self.send(DTA_OPCODE_KEYINCREMENT, key=keys, counter=counters, redundancy=redundancy)
+	
+	def sendAppend(self, listIDs, data):
+		return self.send(DTA_OPCODE_APPEND, listID=listIDs, data=data)
+	
+	def sendPostcarder(self, keys, hopNums, data):
+		return self.send(DTA_OPCODE_POSTCARDER, key=keys, hopNum=hopNums, data=data)
+	
+	#Write fresh transmission ids into ipv4.identification (and fix the IPv4 checksum, the UDP checksum does not cover it)
+	def stamp(self, raw):
+		tx_ids = (self.next_tx_id + np.arange(len(raw), dtype=np.int64)) % TX_ID_SPACE
+		self.next_tx_id = int((self.next_tx_id + len(raw)) % TX_ID_SPACE)
+		
+		raw[:,IPV4_OFFSET+4] = tx_ids >> 8
+		raw[:,IPV4_OFFSET+5] = tx_ids & 0xff
+		checksums = ipv4Checksums(raw[:,IPV4_OFFSET:UDP_OFFSET])
+		raw[:,IPV4_OFFSET+10] = checksums >> 8
+		raw[:,IPV4_OFFSET+11] = checksums & 0xff
+		
+		return tx_ids
+	
+	#Presume reports delivered that got no NACK within the horizon (transmission times only grow along the pending reports)
+	def release(self, now):
+		if self.horizon is None:
+			return
+		
+		first = max(self.released+1, self.next_report-self.ring.capacity)
+		if first >= self.next_report:
+			return
+		slots = np.arange(first, self.next_report, dtype=np.int64) & (self.ring.capacity-1)
+		expired = int(np.searchsorted(self.ring.sent_at[slots], now - self.horizon, side="right"))
+		if expired:
+			self.released = first + expired - 1
+	
+	#Reports sent but not released
+	def occupancy(self):
+		return min(self.next_report - 1 - self.released, self.ring.capacity)
+	
+	#Handle a batch of received frames (non-NACK frames are ignored). Returns the number of reports retransmitted
+	def handleNacks(self, batch):
+		seqnums, tx_ids = parseNacks(batch, self.srcAddr)
+		if len(seqnums) == 0:
+			return 0
+		self.counters["nacks"] += len(seqnums)
+		
+		#Last in-order report of every NACK, taken as the latest report with that seqnum. The tracker only advances, so the highest one is the current state
+		newest = self.next_report - 1
+		in_order = newest - ((newest - seqnums) & 0xff)
+		latest = int(in_order.max())
+		current = in_order == latest
+		if self.tracker is not None and latest < self.tracker:
+			current[:] = False
+		self.counters["stale_nacks"] += len(seqnums) - int(current.sum())
+		if not np.any(current):
+			return 0
+		
+		self.tracker = latest
+		self.released = max(self.released, latest)
+		if latest == newest: #Everything arrived, the bounced reports were duplicates
+			self.counters["stale_nacks"] += int(current.sum())
+			return 0
+		
+		slots = self.ring.slots(latest+1, newest)
+		if slots is None:
+			self.resync(latest)
+			return 0
+		
+		#NACKs of reports transmitted before the last retransmission of the missing report are already being handled
+		fresh = txDistance(tx_ids[current], self.ring.tx_ids[slots[0]]) > 0
+		self.counters["stale_nacks"] += int((~fresh).sum())
+		if not np.any(fresh):
+			return 0
+		
+		return self.retransmit(slots)
+	
+	#Resend the reports in slots (in seqnum order) as one batch, under fresh transmission ids
+	def retransmit(self, slots):
+		lengths = self.ring.lengths[slots]
+		raw = self.ring.frames[slots]
+		tx_ids = self.stamp(raw)
+		self.ring.frames[slots] = raw
+		self.ring.tx_ids[slots] = tx_ids
+		self.ring.sent_at[slots] = time.monotonic()
+		self.probed = None
+		
+		#Frames of different primitives differ in length: send runs of equal length, keeping the order
+		bounds = np.concatenate([[0], np.flatnonzero(np.diff(lengths)) + 1, [len(slots)]])
+		for start,end in zip(bounds[:-1], bounds[1:]):
+			self.sender.send(np.ascontiguousarray(raw[start:end,:lengths[start]]))
+		
+		self.counters["retransmitted"] += len(slots)
+		self.counters["retransmit_batches"] += 1
+		self.counters["transmissions"] += len(slots)
+		return len(slots)
+	
+	#The report after the tracker is gone (evicted, or the translator tracks a sequence from before a reporter restart): continue the numbering right after the tracker, so new reports are accepted again
+	def resync(self, tracker):
+		skip = (tracker + 1 - self.next_report) & 0xff
+		self.counters["unrecoverable"] += self.next_report - 1 - tracker
+		self.counters["resyncs"] += 1
+		
+		self.next_report += skip
+		self.tracker = self.next_report - 1
+		self.released = self.next_report - 1
+	
+	#Tail loss probe: a lost last report causes no NACK until the next report, so resend it, and the translator NACKs the gap before it if there is one
+	#If it had arrived, the tracker accepts the repeat of its last in-order seqnum and applies it again, so only KeyWrite reports (idempotent) are probed
+	def probe(self):
+		slot = self.ring.lookup(self.next_report - 1)
+		if slot is None or self.next_report - 1 in (self.tracker, self.probed) or self.ring.frames[slot,DTA_BASE_OFFSET] != DTA_OPCODE_KEYWRITE:
+			return 0
+		sent = self.retransmit(np.array([slot], dtype=np.int64))
+		self.probed = self.next_report - 1
+		return sent
+	
+	#Receive NACKs from a raw socket (see nackSocket()) for up to timeout seconds, and repair. Returns the number of reports retransmitted
+	def poll(self, sock, timeout=0.0001, count=4096):
+		return self.handleNacks(captureFrames(None, count, timeout=timeout, sock=sock))
+	
+	def stats(self):
+		self.release(time.monotonic())
+		stats = dict(self.counters)
+		stats["retransmit_rate"] = self.counters["retransmitted"]/max(self.counters["reports"], 1)
+		stats["occupancy"] = self.occupancy()
+		stats["max_occupancy"] = self.max_occupancy
+		stats["buffer_pressure"] = self.occupancy()/self.ring.capacity
+		return stats
+
+#Raw socket receiving the NACKs on an interface (they are UDP, but their checksum is left from the bounced report)
+def nackSocket(iface):
+	sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(0x0800)) #ETH_P_IP
+	sock.bind((iface, 0))
+	return sock
+
+#Reports passed through the translator model, dropping a share of the reports and of the NACKs on the way
+class LoopbackLink:
+	translator = None
+	loss = 0
+	nack_loss = 0
+	random = None
+	pending = None
+	dropped = 0
+	
+	def __init__(self, translator, loss=0, nack_loss=0, seed=1):
+		self.translator = translator
+		self.loss = loss
+		self.nack_loss = nack_loss
+		self.random = np.random.default_rng(seed)
+		self.pending = []
+	
+	def send(self, frames):
+		kept = self.random.random(len(frames)) >= self.loss
+		self.dropped += int((~kept).sum())
+		if np.any(kept):
+			self.pending.append(FrameBatch.fromArray(np.array(frames)[kept]))
+		return len(frames)
+	
+	#Translate what was sent since the last call, and return the NACKs making it back
+	def deliver(self):
+		emitted = concatFrames([self.translator.process(batch) for batch in self.pending if len(batch)])
+		self.pending = []
+		
+		return emitted.select(np.flatnonzero(self.random.random(len(emitted)) >= self.nack_loss))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Send retransmitable DTA reports and repair losses from translator NACKs, through the translator model (with induced loss) or an interface.')
+	parser.add_argument('--operation', type=str, default="keywrite", choices=list(DTA_PRIMITIVE_NAMES), help='The DTA operation')
+	parser.add_argument('--count', type=int, default=1000000, help='Total number of reports to send')
+	parser.add_argument('--batchsize', type=int, default=64, help='Number of reports encoded and sent per batch (losses are only recoverable with fewer than 256 reports in flight per NACK round trip)')
+	parser.add_argument('--redundancy', type=int, default=1, help='The redundancy for KeyWrite and KeyIncrement')
+	parser.add_argument('--num_lists', type=int, default=4, help='Number of lists to round-robin Append reports over')
+	parser.add_argument('--horizon', type=float, default=0.001, help='Seconds without a NACK after which a report is presumed delivered')
+	parser.add_argument('--loss', type=float, default=0.001, help='Loopback: share of reports (and retransmissions) dropped before the translator')
+	parser.add_argument('--nack_loss', type=float, default=0, help='Loopback: share of NACKs dropped on the way back')
+	parser.add_argument('--iface', type=str, help='Send on this interface and receive the NACKs there, instead of the loopback')
+	parser.add_argument('--srcIP', type=str, default="10.0.0.101", help='The reporter IP address')
+	parser.add_argument('--dstIP', type=str, default="10.0.0.51", help='The collector IP address')
+	parser.add_argument('--dstMac', type=str, default="b8:ce:f6:d2:12:c7", help='The destination MAC address')
+	args = parser.parse_args()
+	
+	opcode = DTA_PRIMITIVE_NAMES[args.operation]
+	
+	if args.iface:
+		from dta.encoder import ifaceMac
+		link = RawSender(args.iface)
+		sock = nackSocket(args.iface)
+		srcMac = ifaceMac(args.iface)
+	else:
+		from dta.translator import Translator, POSTCARDER_NUM_HOPS
+		translator = Translator()
+		translator.setupDefault(collectorIP=args.dstIP)
+		link = LoopbackLink(translator, loss=args.loss, nack_loss=args.nack_loss)
+		srcMac = "00:00:00:00:00:00"
+	
+	reporter = RetransmittingReporter(link, srcIP=args.srcIP, dstIP=args.dstIP, dstMac=args.dstMac, srcMac=srcMac, horizon=args.horizon)
+	
+	def repair():
+		if args.iface:
+			return reporter.poll(sock)
+		return reporter.handleNacks(link.deliver())
+	
+	print("Sending %i retransmitable %s reports in batches of %i..." %(args.count, args.operation, args.batchsize))
+	
+	counter = np.arange(args.batchsize, dtype=np.uint64)
+	t_start = time.perf_counter()
+	for batch_start in range(0, args.count, args.batchsize):
+		values = counter[:min(args.batchsize, args.count-batch_start)] + batch_start
+		
+		if opcode == DTA_OPCODE_KEYWRITE:
+			reporter.sendKeyWrite(values, values+1, args.redundancy)
+		elif opcode == DTA_OPCODE_KEYINCREMENT:
+			reporter.sendKeyIncrement(values, 1, args.redundancy)
+		elif opcode == DTA_OPCODE_APPEND:
+			reporter.sendAppend(values % args.num_lists, values+1)
+		elif opcode == DTA_OPCODE_POSTCARDER:
+			reporter.sendPostcarder(values//POSTCARDER_NUM_HOPS, values%POSTCARDER_NUM_HOPS + 1, values+1)
+		
+		#Loopback retransmissions are translated right away, so repair until the link is quiet
+		while repair() and not args.iface:
+			pass
+	
+	#Tail losses only show through the probe
+	repair()
+	while reporter.probe():
+		while repair() and not args.iface:
+			pass
+	duration = time.perf_counter() - t_start
+	
+	for name,value in reporter.stats().items():
+		print("%s: %s" %(name, "%.6f" %value if isinstance(value, float) else value))
+	
+	if not args.iface:
+		print("Translator: tracker at seqnum %i (last sent %i), %i NACKs, %i reports dropped by the link" %(translator.reg_nack_tracker, (reporter.next_report-1) & 0xff, translator.counters["nacks"], link.dropped))
+		if opcode in (DTA_OPCODE_KEYWRITE, DTA_OPCODE_KEYINCREMENT):
+			writes = translator.counters["keywrite_writes" if opcode == DTA_OPCODE_KEYWRITE else "keyincrement_fetchadds"]
+			print("Delivered %i of %i reports" %(writes//args.redundancy, args.count))
+	print("Done in %.3f seconds. This equals %.3f million reports per second" %(duration, args.count/(duration*1000000)))
@@ -0,0 +1,831 @@
+#!/usr/bin/env python3
+#Software model of the DTA translator pipeline (Translator/p4src/dta_translator.p4)
+#Consumes DTA reports (from a pcap, a raw socket, or generated in memory) and emits the RoCEv2 frames the ASIC would generate
+#All pipeline state (PSN registers, redundancy fan-out, Append batch registers and HEAD pointers, the Postcarder cache, RDMA rate limiting, NACK tracking) is modeled batch-wise with NumPy
+#Usage example: python3 -m dta.translator --pcap reports.pcap --output rdma.pcap
+
+import argparse
+import time
+import numpy as np
+
+from dta.crc import CRC32, customCRC32, uint32Bytes, truncate
+from dta.headers import *
+from dta.layout import KEYWRITE_ENTRY, DATALIST_ENTRY, isPowerOfTwo
+from dta.frames import FrameBatch, mergeFrames, readPcap, writePcap, captureFrames
+from dta.query import keyChecksums, keySlotStates
+
+#Constants hard-coded in the pipeline
+TRANSLATOR_SRC_MAC = "b8:ce:f6:d2:13:26"
+TRANSLATOR_DST_MAC = "b8:ce:f6:d2:12:c7"
+TRANSLATOR_IP = "10.0.0.101"
+CONGESTION_ACK_SRC_IP = "10.0.0.51"
+IPV4_IDENTIFICATION = 11381
+IPV4_FLAGS_DF = 0x4000
+CPU_PORT = 64 #tbl_forward default action (to_cpu)
+
+MAX_SUPPORTED_QPS = 256
+NUM_DROP_COUNTERS = 1024
+QP_RESYNC_PACKET_DROP_NUM = 100000
+KEYWRITE_RDMA_PAYLOAD_SIZE = KEYWRITE_ENTRY.itemsize
+APPEND_SLOT_SIZE = DATALIST_ENTRY.itemsize
+
+POSTCARDER_CACHE_SIZE = 32768
+POSTCARDER_CACHE_INDEX_BITS = 15
+POSTCARDER_NUM_HOPS = 5
+POSTCARDER_CACHE_COUNTER_THRESHOLD = 5
+POSTCARDER_SLOT_SIZE = 32
+POSTCARDER_SEEDS = [0x1e12a700, 0x65b96595, 0x49cf878b, 0x36518f0d, 0x7a40a908] #CRC polynomials of cache_hop1..cache_hop5
+
+#RDMA payloads, laid out exactly like the collector memory they are written into
+POSTCARDER_PAYLOAD = np.dtype([("hop%i_data" %(hop+1), ">u4") for hop in range(POSTCARDER_NUM_HOPS)])
+KEYINCREMENT_PAYLOAD = np.dtype([
+	("checksum", "<u4") #rdma_payload_keyval is emitted after the atomic ETH for KeyIncrement as well
+])
+
+#Enough bytes to parse any DTA report or congestion ACK
+PARSE_WIDTH = 64
+
+#RDMA metadata of one collector memory region (the action data of the tbl_getCollectorMetadata* tables)
+class RDMAConnection:
+	queue_pair = None
+	remote_key = None
+	memory_start = None
+	num_slots = None
+	qp_reg_index = None
+	
+	def __init__(self, queue_pair, remote_key, memory_start, num_slots, qp_reg_index):
+		assert qp_reg_index < MAX_SUPPORTED_QPS, "qp_reg_index %i exceeds MAX_SUPPORTED_QPS" %qp_reg_index
+		
+		self.queue_pair = queue_pair
+		self.remote_key = remote_key
+		self.memory_start = memory_start
+		self.num_slots = num_slots
+		self.qp_reg_index = qp_reg_index
+	
+	#tbl_bound_slot only has entries for powers of two, other sizes leave the hashed slot unbounded
+	@property
+	def slot_mask(self):
+		return self.num_slots-1 if isPowerOfTwo(self.num_slots) else 0xffffffff
+
+#Vectorized exact-match table lookup. Returns (hit, index into the table values)
+def lookup(table, queries):
+	keys = np.array(sorted(table), dtype=np.uint64)
+	queries = np.asarray(queries, dtype=np.uint64)
+	
+	if len(keys) == 0:
+		return np.zeros(len(queries), dtype=bool), np.zeros(len(queries), dtype=np.int64)
+	
+	index = np.clip(np.searchsorted(keys, queries), 0, len(keys)-1)
+	return keys[index] == queries, index
+
+#Per-entry columns of a table of RDMAConnections, ordered as lookup() indexes them
+def connectionColumns(table):
+	connections = [table[key] for key in sorted(table)] or [RDMAConnection(0, 0, 0, 0, 0)]
+	
+	return {
+		"queue_pair": np.array([c.queue_pair for c in connections], dtype=np.uint32),
+		"remote_key": np.array([c.remote_key for c in connections], dtype=np.uint32),
+		"memory_start": np.array([c.memory_start for c in connections], dtype=np.uint64),
+		"num_slots": np.array([c.num_slots for c in connections], dtype=np.int64),
+		"slot_mask": np.array([c.slot_mask for c in connections], dtype=np.uint32),
+		"qp_reg_index": np.array([c.qp_reg_index for c in connections], dtype=np.int64)
+	}
+
+#Synthetic RDMA metadata (QP numbers, rkeys, and addresses are made up) for the collector structures, as (name, RDMAConnection, source QP)
+#Same order and CM ports as insertCollectorMetadataRules() in switch_cpu.py. The soft collector (dta/collector.py) registers the same regions
+def defaultConnections(keywrite_slots=1<<20, append_slots=1<<16, num_lists=4, postcarder_slots=1<<16):
+	connections = []
+	psn_reg_index = 0
+	
+	connections.append(("postcarder", RDMAConnection(0x100+psn_reg_index, 0x1000+psn_reg_index, 0x7f0000000000, postcarder_slots, psn_reg_index), 1336))
+	psn_reg_index += 1
+	
+	connections.append(("keywrite", RDMAConnection(0x100+psn_reg_index, 0x1000+psn_reg_index, 0x7f1000000000, keywrite_slots, psn_reg_index), 1337))
+	psn_reg_index += 1
+	
+	for listID in range(num_lists):
+		connections.append(("list%i" %listID, RDMAConnection(0x100+psn_reg_index, 0x1000+psn_reg_index, 0x7f2000000000 + listID*0x100000000, append_slots, psn_reg_index), 1338+listID))
+		psn_reg_index += 1
+	
+	return connections
+
+#Rank of every element among the elements of the same group (in array order), and the group sizes
+def groupRanks(groups, num_groups):
+	order = np.argsort(groups, kind="stable")
+	counts = np.bincount(groups, minlength=num_groups)
+	starts = np.cumsum(counts) - counts
+	
+	ranks = np.empty(len(groups), dtype=np.int64)
+	ranks[order] = np.arange(len(groups)) - starts[groups[order]]
+	
+	return ranks, counts
+
+#Index of the latest flagged element at or before each position (-1 if none)
+def lastFlagged(flags):
+	return np.maximum.accumulate(np.where(flags, np.arange(len(flags)), -1)) if len(flags) else np.zeros(0, dtype=np.int64)
+
+#The Postcarder cache of ControlPreparePostcarder: per cache index the flowID (reg_cache_flowid), a postcard counter (reg_cache_counter), and one register per hop (cache_hop1..cache_hop5) holding data XOR h_hop(flowID)
+#A postcard of another flowID evicts the cached hops (a collision), and the 5th postcard since then compiles the path. Both emit an RDMA write of the extracted hops, and empty the cache except for the colliding postcard
+class PostcarderCache:
+	index_bits = POSTCARDER_CACHE_INDEX_BITS
+	reg_cache_flowid = None
+	reg_cache_counter = None
+	reg_cache = None
+	reg_cache_occupied = None #Not in the pipeline: which hop registers hold a postcard, to tell complete paths from partial ones (a cached value can be 0)
+	hashes = None
+	
+	def __init__(self, index_bits=POSTCARDER_CACHE_INDEX_BITS):
+		self.index_bits = index_bits
+		size = 1<<index_bits
+		self.reg_cache_flowid = np.zeros(size, dtype=np.uint32)
+		self.reg_cache_counter = np.zeros(size, dtype=np.int64)
+		self.reg_cache = np.zeros((size, POSTCARDER_NUM_HOPS), dtype=np.uint32)
+		self.reg_cache_occupied = np.zeros((size, POSTCARDER_NUM_HOPS), dtype=bool)
+		self.hashes = [customCRC32(seed) for seed in POSTCARDER_SEEDS]
+	
+	#Process postcards in arrival order. Returns per postcard: emit (an RDMA write is generated), collision, compile, and the written hops (payload, and which of them hold a postcard)
+	def process(self, keys, hopNums, data):
+		key_bytes = uint32Bytes(keys, "big")
+		cache_index = truncate(CRC32.compute(key_bytes), self.index_bits).astype(np.int64)
+		
+		#The value cached for the reported hop: data XOR h_hop(flowID)
+		encoded = np.zeros(len(keys), dtype=np.uint32)
+		for hop in range(POSTCARDER_NUM_HOPS):
+			selected = hopNums == hop+1
+			if np.any(selected):
+				encoded[selected] = data[selected] ^ self.hashes[hop].compute(key_bytes[selected])
+		
+		#Work per cache index, in arrival order
+		order = np.argsort(cache_index, kind="stable")
+		index = cache_index[order]
+		k = np.asarray(keys, dtype=np.uint32)[order]
+		hop = np.asarray(hopNums)[order].astype(np.int64)
+		e = encoded[order]
+		j = np.arange(len(order))
+		
+		group_start = np.flatnonzero(np.concatenate([[True], index[1:] != index[:-1]]))
+		starts = np.repeat(group_start, np.diff(np.concatenate([group_start, [len(order)]])))
+		first = j == starts
+		
+		#flowid_verify: a collision is a non-zero stored flowID different from this key
+		stored_flowid = np.where(first, self.reg_cache_flowid[index], np.roll(k, 1))
+		collision = (stored_flowid != 0) & (stored_flowid != k)
+		
+		#The counter restarts at 1 on a collision, and increments otherwise
+		last_collision = lastFlagged(collision)
+		counter = np.where(last_collision >= starts, 1 + j - last_collision, self.reg_cache_counter[index] + j - starts + 1) & 0xff
+		compile = ~collision & (counter == POSTCARDER_CACHE_COUNTER_THRESHOLD)
+		
+		#Cache contents before each postcard. Compiling empties the cache, a collision leaves only the colliding postcard
+		reset = compile | collision
+		previous_reset = np.concatenate([[-1], lastFlagged(reset)[:-1]])
+		has_reset = previous_reset >= starts
+		segment_start = np.where(has_reset, previous_reset + compile[np.maximum(previous_reset, 0)], starts)
+		
+		before = np.zeros((len(order), POSTCARDER_NUM_HOPS), dtype=np.uint32)
+		occupied = np.zeros((len(order), POSTCARDER_NUM_HOPS), dtype=bool)
+		for h in range(POSTCARDER_NUM_HOPS):
+			writes = ~compile & (hop == h+1)
+			previous_write = np.concatenate([[-1], lastFlagged(writes)[:-1]])
+			valid = previous_write >= segment_start
+			before[:,h] = np.where(valid, e[np.maximum(previous_write, 0)], np.where(has_reset, 0, self.reg_cache[index, h]))
+			occupied[:,h] = valid | (~has_reset & self.reg_cache_occupied[index, h])
+		
+		#Compiled payloads carry the reported hop directly, evictions carry the old cached values
+		payload = before.copy()
+		hops = occupied.copy()
+		own_hop = compile & (hop >= 1) & (hop <= POSTCARDER_NUM_HOPS)
+		payload[own_hop, hop[own_hop]-1] = e[own_hop]
+		hops[own_hop, hop[own_hop]-1] = True
+		
+		#Register state after the last postcard of every cache index
+		last = np.concatenate([group_start[1:]-1, [len(order)-1]]) if len(order) else np.zeros(0, dtype=np.int64)
+		after = np.where(collision[last,None], 0, before[last])
+		after_occupied = ~collision[last,None] & occupied[last]
+		after[compile[last]] = 0
+		after_occupied[compile[last]] = False
+		writes_own = ~compile[last] & (hop[last] >= 1) & (hop[last] <= POSTCARDER_NUM_HOPS)
+		after[writes_own, hop[last][writes_own]-1] = e[last][writes_own]
+		after_occupied[writes_own, hop[last][writes_own]-1] = True
+		
+		self.reg_cache[index[last]] = after
+		self.reg_cache_occupied[index[last]] = after_occupied
+		self.reg_cache_flowid[index[last]] = k[last]
+		self.reg_cache_counter[index[last]] = counter[last]
+		
+		#Back to arrival order
+		unsorted = np.empty(len(order), dtype=np.int64)
+		unsorted[order] = j
+		
+		return {
+			"emit": reset[unsorted],
+			"collision": collision[unsorted],
+			"compile": compile[unsorted],
+			"payload": payload[unsorted],
+			"hops": hops[unsorted],
+			"cache_index": cache_index
+		}
+
+class Translator:
+	append_batch_size = 4
+	nack_tracking = True
+	resync_drop_num = QP_RESYNC_PACKET_DROP_NUM
+	
+	#Match-action tables
+	forwardTable = None #dstAddr -> egress port
+	multicastTable = None #(dstAddr, redundancy) -> egress port of the multicast group
+	keyvalTable = None #dstAddr -> RDMAConnection
+	appendTable = None #listID -> RDMAConnection
+	postcarderTable = None #dstAddr -> RDMAConnection
+	qpRegTable = None #source QP -> qp_reg_index
+	
+	#Registers
+	reg_rdma_sequence_number = None
+	reg_rdma_drop_counter = None
+	reg_num_batched_elements = None
+	reg_batch = None
+	reg_head_pointer = None
+	reg_nack_tracker = 0
+	postcarderCache = None
+	
+	counters = None
+	
+	def __init__(self, append_batch_size=4, nack_tracking=True, resync_drop_num=QP_RESYNC_PACKET_DROP_NUM):
+		assert append_batch_size in [1, 2, 4, 8, 16], "APPEND_BATCH_SIZE must be 1, 2, 4, 8, or 16"
+		
+		self.append_batch_size = append_batch_size
+		self.nack_tracking = nack_tracking
+		self.resync_drop_num = resync_drop_num
+		
+		self.forwardTable = {}
+		self.multicastTable = {}
+		self.keyvalTable = {}
+		self.appendTable = {}
+		self.postcarderTable = {}
+		self.qpRegTable = {}
+		
+		self.reg_rdma_sequence_number = np.zeros(MAX_SUPPORTED_QPS, dtype=np.uint32)
+		self.reg_rdma_drop_counter = np.zeros(NUM_DROP_COUNTERS, dtype=np.int64)
+		self.reg_num_batched_elements = np.zeros(MAX_SUPPORTED_QPS, dtype=np.int64)
+		self.reg_batch = np.zeros((MAX_SUPPORTED_QPS, max(append_batch_size-1, 1)), dtype=np.uint32)
+		self.reg_head_pointer = np.zeros(MAX_SUPPORTED_QPS, dtype=np.int64)
+		self.postcarderCache = PostcarderCache()
+		
+		self.dta_base_size = DTA_BASE.itemsize if nack_tracking else DTA_BASE_NO_SEQNUM.itemsize
+		
+		self.counters = {name:0 for name in ["reports", "keywrite_writes", "keyincrement_fetchadds", "append_writes", "postcarder_writes", "append_batched", "postcarder_cached", "ratelimited", "unmapped", "no_multicast", "nacks", "resyncs", "ignored"]}
+	
+	#
+	# Control plane, mirroring Translator/switch_cpu.py
+	#
+	def addForwardingRule(self, dstAddr, egressPort):
+		self.forwardTable[ipToInt(dstAddr)] = egressPort
+	
+	#tbl_Prep_KeyWrite and the multicast group it points to (redundancy copies towards egressPort)
+	def addMulticastRule(self, dstAddr, redundancy, egressPort):
+		self.multicastTable[(ipToInt(dstAddr), redundancy)] = egressPort
+	
+	def addKeyvalConnection(self, dstAddr, connection, source_qp, start_psn=0):
+		self.keyvalTable[ipToInt(dstAddr)] = connection
+		self.addConnection(connection, source_qp, start_psn)
+	
+	def addAppendConnection(self, listID, connection, source_qp, start_psn=0):
+		self.appendTable[listID] = connection
+		self.addConnection(connection, source_qp, start_psn)
+	
+	def addPostcarderConnection(self, dstAddr, connection, source_qp, start_psn=0):
+		self.postcarderTable[ipToInt(dstAddr)] = connection
+		self.addConnection(connection, source_qp, start_psn)
+	
+	def addConnection(self, connection, source_qp, start_psn):
+		self.reg_rdma_sequence_number[connection.qp_reg_index] = start_psn & PSN_MASK
+		self.qpRegTable[source_qp] = connection.qp_reg_index
+	
+	#Populate the tables the way switch_cpu.py does, with the synthetic RDMA metadata of defaultConnections()
+	def setupDefault(self, collectorIP="10.0.0.51", egressPort=156, keywrite_slots=1<<20, append_slots=1<<16, num_lists=4, postcarder_slots=1<<16, redundancies=[1,2,3,4]):
+		self.addForwardingRule(TRANSLATOR_IP, 64)
+		self.addForwardingRule("10.0.0.102", 65)
+		self.addForwardingRule("10.0.0.200", 8)
+		self.addForwardingRule(collectorIP, egressPort)
+		
+		for redundancy in redundancies:
+			self.addMulticastRule(collectorIP, redundancy, egressPort)
+		
+		for name,connection,source_qp in defaultConnections(keywrite_slots, append_slots, num_lists, postcarder_slots):
+			if name == "postcarder":
+				self.addPostcarderConnection(collectorIP, connection, source_qp)
+			elif name == "keywrite":
+				self.addKeyvalConnection(collectorIP, connection, source_qp)
+			else:
+				self.addAppendConnection(int(name[len("list"):]), connection, source_qp)
+	
+	#
+	# Data plane
+	#
+	#Translate a batch of frames. Returns the emitted frames (RoCEv2, plus DTA NACKs) in emission order
+	def process(self, batch):
+		heads = batch.headers(PARSE_WIDTH)
+		
+		etherType = heads[:,12].astype(np.uint16) << 8 | heads[:,13]
+		protocol = heads[:,IPV4_OFFSET+9]
+		dstPort = heads[:,UDP_OFFSET+2].astype(np.uint16) << 8 | heads[:,UDP_OFFSET+3]
+		srcAddr = np.ascontiguousarray(heads[:,IPV4_OFFSET+12:IPV4_OFFSET+16]).view(">u4").ravel()
+		is_udp = (etherType == ETHERTYPE_IPV4) & (protocol == IPV4_PROTO_UDP)
+		
+		opcode = heads[:,DTA_BASE_OFFSET]
+		is_dta = is_udp & (dstPort == DTA_PORT_NUMBER) & (opcode >= DTA_OPCODE_KEYWRITE) & (opcode <= DTA_OPCODE_POSTCARDER)
+		is_ack = is_udp & (dstPort == ROCEV2_UDP_PORT) & (heads[:,UDP_OFFSET+UDP.itemsize] == RDMA_OPCODE_ACK) & (srcAddr == ipToInt(CONGESTION_ACK_SRC_IP))
+		
+		self.counters["reports"] += int(is_dta.sum())
+		self.counters["ignored"] += int((~is_dta & ~is_ack).sum())
+		
+		#Congestion ACKs change the PSN and rate limiting state, so the reports between them are processed as separate segments
+		outputs = []
+		segment_start = 0
+		for ack in list(np.flatnonzero(is_ack)) + [len(batch)]:
+			reports = segment_start + np.flatnonzero(is_dta[segment_start:ack])
+			if len(reports):
+				self.processReports(heads[reports], reports.astype(np.float64), batch.timestamps[reports], outputs)
+			if ack < len(batch):
+				self.processCongestionAck(heads[ack])
+			segment_start = ack+1
+		
+		return mergeFrames(outputs)
+	
+	#ControlRDMARatelimit (congestion ACK branch) and the set_psn resync in ControlCraftRDMA
+	def processCongestionAck(self, head):
+		bth = np.ascontiguousarray(head[UDP_OFFSET+UDP.itemsize:UDP_OFFSET+UDP.itemsize+BTH.itemsize]).view(BTH)[0]
+		srcAddr = int(np.ascontiguousarray(head[IPV4_OFFSET+12:IPV4_OFFSET+16]).view(">u4")[0])
+		
+		#The ACK is bounced back to its ingress port, i.e., the port towards the collector
+		port = self.forwardTable.get(srcAddr, CPU_PORT)
+		self.reg_rdma_drop_counter[port] = self.resync_drop_num
+		
+		#A miss in tbl_get_qp_reg_num leaves qp_reg_index at 0
+		qp_reg_index = self.qpRegTable.get(int(bth["destinationQP"]) & QP_MASK, 0)
+		self.reg_rdma_sequence_number[qp_reg_index] = int(bth["packetSequenceNumber"]) & PSN_MASK
+		
+		self.counters["resyncs"] += 1
+	
+	#Ingress and egress processing of DTA reports (no congestion ACKs in between)
+	def processReports(self, heads, positions, timestamps, outputs):
+		opcode = heads[:,DTA_BASE_OFFSET]
+		dstAddr = np.ascontiguousarray(heads[:,IPV4_OFFSET+16:IPV4_OFFSET+20]).view(">u4").ravel()
+		
+		#Primitive fields start after the (build-dependent) dta_base header
+		primitive = DTA_BASE_OFFSET + self.dta_base_size
+		def field(offset, size):
+			return np.ascontiguousarray(heads[:,primitive+offset:primitive+offset+size]).view(">u%i" %size).ravel()
+		
+		nacked = self.trackSeqnums(heads, timestamps, positions, outputs)
+		
+		#Egress events, one per packet reaching egress (multicast copies included)
+		events = []
+		
+		is_keyval = ((opcode == DTA_OPCODE_KEYWRITE) | (opcode == DTA_OPCODE_KEYINCREMENT)) & ~nacked
+		if np.any(is_keyval):
+			rows = np.flatnonzero(is_keyval)
+			events += self.prepareKeyval(heads[rows], opcode[rows], dstAddr[rows], heads[rows,primitive], field(1, 4)[rows], positions[rows], timestamps[rows])
+		
+		is_append = opcode == DTA_OPCODE_APPEND
+		if np.any(is_append):
+			rows = np.flatnonzero(is_append)
+			event = self.prepareAppend(heads[rows], dstAddr[rows], field(0, 4)[rows], field(4, 4)[rows], nacked[rows], positions[rows], timestamps[rows])
+			if event:
+				events.append(event)
+		
+		is_postcarder = (opcode == DTA_OPCODE_POSTCARDER) & ~nacked
+		if np.any(is_postcarder):
+			rows = np.flatnonzero(is_postcarder)
+			events.append(self.preparePostcarder(heads[rows], dstAddr[rows], field(0, 4)[rows], heads[rows,primitive+4], field(5, 4)[rows], positions[rows], timestamps[rows]))
+		
+		if len(events) == 0:
+			return
+		
+		#Rate limiting and PSNs depend on the order packets traverse egress, across all primitives
+		all_positions = np.concatenate([event["positions"] for event in events])
+		order = np.argsort(all_positions, kind="stable")
+		ports = np.concatenate([event["ports"] for event in events])[order]
+		candidates = np.concatenate([event["candidates"] for event in events])[order]
+		qp_reg_indexes = np.concatenate([event["qp_reg_indexes"] for event in events])[order]
+		
+		dropped = self.rateLimit(ports)
+		generated = candidates & ~dropped
+		self.counters["ratelimited"] += int((candidates & dropped).sum())
+		
+		psns = np.zeros(len(order), dtype=np.uint32)
+		psns[generated] = self.nextPSNs(qp_reg_indexes[generated])
+		
+		#Back to per-primitive order
+		unsorted_generated = np.empty(len(order), dtype=bool)
+		unsorted_generated[order] = generated
+		unsorted_psns = np.empty(len(order), dtype=np.uint32)
+		unsorted_psns[order] = psns
+		
+		first = 0
+		for event in events:
+			count = len(event["positions"])
+			selected = unsorted_generated[first:first+count]
+			
+			frames = event["frames"][selected]
+			frames["bth"]["packetSequenceNumber"] = unsorted_psns[first:first+count][selected]
+			outputs.append((frames, event["positions"][selected], event["timestamps"][selected]))
+			self.counters[event["counter"]] += int(selected.sum())
+			
+			first += count
+	
+	#DO_NACK_TRACKING in ControlProcessDTAPacket. Returns which reports were turned into NACKs
+	def trackSeqnums(self, heads, timestamps, positions, outputs):
+		nacked = np.zeros(len(heads), dtype=bool)
+		if not self.nack_tracking:
+			return nacked
+		
+		flags = heads[:,DTA_BASE_OFFSET+2]
+		rows = np.flatnonzero(flags & DTA_FLAG_RETRANSMITABLE)
+		if len(rows) == 0:
+			return nacked
+		
+		seqnums = heads[rows,DTA_BASE_OFFSET+1].astype(np.int64)
+		expected = (self.reg_nack_tracker + 1 + np.arange(len(rows))) & 0xff
+		
+		if np.array_equal(seqnums, expected): #Fast path: no gaps
+			self.reg_nack_tracker = int(seqnums[-1])
+			return nacked
+		
+		#The tracker only advances on in-order seqnums, so gaps are resolved sequentially
+		responses = np.zeros(len(rows), dtype=np.uint8)
+		tracker = self.reg_nack_tracker
+		for i in range(len(rows)):
+			if seqnums[i] == (tracker + 1) & 0xff:
+				tracker = int(seqnums[i])
+			responses[i] = tracker
+			nacked[rows[i]] = seqnums[i] != tracker
+		self.reg_nack_tracker = tracker
+		
+		nack_rows = rows[nacked[rows]]
+		if len(nack_rows) == 0: #Only repeats of the last in-order seqnum, which the tracker accepts
+			return nacked
+		outputs.append((self.craftNacks(heads[nack_rows], responses[nacked[rows]]), positions[nack_rows], timestamps[nack_rows]))
+		self.counters["nacks"] += len(nack_rows)
+		
+		return nacked
+	
+	#craft_nack: the report is bounced to the reporter, carrying the last in-order seqnum. Only the ack header is emitted here, not the report bytes trailing it
+	def craftNacks(self, heads, seqnums):
+		frame = np.dtype([("ethernet", ETHERNET), ("ipv4", IPV4), ("udp", UDP), ("dta_ack", DTA_ACK)])
+		frames = np.ascontiguousarray(heads[:,:frame.itemsize]).view(frame).ravel().copy()
+		
+		srcAddr = frames["ipv4"]["srcAddr"].copy()
+		frames["ipv4"]["srcAddr"] = frames["ipv4"]["dstAddr"]
+		frames["ipv4"]["dstAddr"] = srcAddr
+		
+		hit, _ = lookup(self.forwardTable, srcAddr)
+		frames["ipv4"]["ttl"] = frames["ipv4"]["ttl"] - hit
+		frames["ipv4"]["hdrChecksum"] = ipv4Checksums(self.ipv4Bytes(frames))
+		
+		frames["udp"]["dstPort"] = DTA_ACK_PORT_NUMBER
+		frames["dta_ack"]["seqnum"] = seqnums
+		frames["dta_ack"]["flags"] = 0x80
+		
+		return frames
+	
+	def ipv4Bytes(self, frames):
+		return frames.view(np.uint8).reshape(len(frames), -1)[:,IPV4_OFFSET:UDP_OFFSET]
+	
+	#tbl_forward for non-multicast DTA traffic. Returns (egress ports, whether the TTL was decremented)
+	def forward(self, dstAddr):
+		hit, index = lookup(self.forwardTable, dstAddr)
+		ports = np.array([self.forwardTable[key] for key in sorted(self.forwardTable)] or [CPU_PORT], dtype=np.int64)
+		
+		return np.where(hit, ports[index], CPU_PORT), hit
+	
+	#Ethernet/IPv4/UDP/BTH as set by ControlCraftRDMA. The IPv4 and UDP lengths count a RETH, also for Fetch&Add
+	def craftRoCE(self, frame, heads, ttl, bth_opcode, connections, index, payload_length):
+		template = np.zeros(1, dtype=frame)
+		
+		template["ethernet"]["dstAddr"] = macBytes(TRANSLATOR_DST_MAC)
+		template["ethernet"]["srcAddr"] = macBytes(TRANSLATOR_SRC_MAC)
+		template["ethernet"]["etherType"] = ETHERTYPE_IPV4
+		
+		template["ipv4"]["version_ihl"] = 0x45
+		template["ipv4"]["totalLen"] = IPV4.itemsize + UDP.itemsize + BTH.itemsize + RETH.itemsize + ICRC.itemsize + payload_length
+		template["ipv4"]["identification"] = IPV4_IDENTIFICATION
+		template["ipv4"]["flags_fragOffset"] = IPV4_FLAGS_DF
+		template["ipv4"]["protocol"] = IPV4_PROTO_UDP
+		template["ipv4"]["srcAddr"] = ipToInt(TRANSLATOR_IP)
+		
+		template["udp"]["srcPort"] = ROCEV2_SRC_PORT
+		template["udp"]["dstPort"] = ROCEV2_UDP_PORT
+		template["udp"]["length"] = UDP.itemsize + BTH.itemsize + RETH.itemsize + ICRC.itemsize + payload_length
+		
+		template["bth"]["opcode"] = bth_opcode
+		template["bth"]["flags"] = BTH_MIGREQ
+		template["bth"]["partitionKey"] = 0xffff
+		
+		#Only the fields that differ between packets are written per frame
+		frames = np.repeat(template, len(heads))
+		frames["ipv4"]["tos"] = heads[:,IPV4_OFFSET+1] & 0xfc #dscp is kept, ecn is cleared
+		frames["ipv4"]["ttl"] = ttl
+		frames["ipv4"]["dstAddr"] = np.ascontiguousarray(heads[:,IPV4_OFFSET+16:IPV4_OFFSET+20]).view(">u4").ravel()
+		frames["ipv4"]["hdrChecksum"] = ipv4Checksums(self.ipv4Bytes(frames))
+		frames["bth"]["destinationQP"] = connections["queue_pair"][index] & QP_MASK
+		
+		return frames
+	
+	#Multicast fan-out (tbl_Prep_KeyWrite) and ControlPrepareKeyWrite, for KeyWrite and KeyIncrement
+	def prepareKeyval(self, heads, opcode, dstAddr, redundancy, keys, positions, timestamps):
+		multicastKeys = {ip<<8 | n: port for (ip,n),port in self.multicastTable.items()}
+		hit, index = lookup(multicastKeys, dstAddr.astype(np.uint64) << 8 | redundancy)
+		multicastPorts = np.array([multicastKeys[key] for key in sorted(multicastKeys)] or [0], dtype=np.int64)
+		
+		self.counters["no_multicast"] += int((~hit).sum())
+		rows = np.flatnonzero(hit)
+		
+		#One egress copy per redundancy entry n, processed back-to-back (reg_redundancy_iterator)
+		copies = redundancy[rows].astype(np.int64)
+		source = np.repeat(rows, copies)
+		n = np.arange(len(source)) - np.repeat(np.cumsum(copies) - copies, copies)
+		
+		keys = keys[source]
+		connections = connectionColumns(self.keyvalTable)
+		mapped, connection = lookup(self.keyvalTable, dstAddr[source])
+		self.counters["unmapped"] += int((~mapped).sum())
+		
+		states = keySlotStates(keys)
+		slots = CRC32.finish(CRC32.update(states, n.astype(np.uint8).reshape(-1,1))) & connections["slot_mask"][connection]
+		virtualAddress = connections["memory_start"][connection] + slots.astype(np.uint64)*np.uint64(KEYWRITE_RDMA_PAYLOAD_SIZE)
+		checksums = keyChecksums(keys)
+		
+		is_increment = opcode[source] == DTA_OPCODE_KEYINCREMENT
+		ttl = heads[source,IPV4_OFFSET+8] #Multicast traffic skips tbl_forward, so the TTL is untouched
+		
+		#Frames of both kinds are crafted, and the right one picked per copy
+		writes = self.craftRoCE(rocev2Frame(KEYWRITE_ENTRY), heads[source], ttl, RDMA_OPCODE_WRITE_ONLY, connections, connection, KEYWRITE_RDMA_PAYLOAD_SIZE)
+		writes["eth"]["virtualAddress"] = virtualAddress
+		writes["eth"]["rKey"] = connections["remote_key"][connection]
+		writes["eth"]["dmaLength"] = KEYWRITE_RDMA_PAYLOAD_SIZE
+		writes["payload"]["checksum"] = checksums
+		writes["payload"]["data"] = np.ascontiguousarray(heads[source,DTA_BASE_OFFSET+self.dta_base_size+5:DTA_BASE_OFFSET+self.dta_base_size+9]).view(">u4").ravel()
+		
+		event = {
+			"positions": positions[source] + n/256.0,
+			"timestamps": timestamps[source],
+			"ports": multicastPorts[index[source]],
+			"candidates": mapped,
+			"qp_reg_indexes": connections["qp_reg_index"][connection]
+		}
+		
+		if not np.any(is_increment):
+			event.update({"frames": writes, "counter": "keywrite_writes"})
+			return [event]
+		
+		increments = self.craftRoCE(rocev2Frame(KEYINCREMENT_PAYLOAD, eth=ATOMIC_ETH), heads[source], ttl, RDMA_OPCODE_FETCH_ADD, connections, connection, KEYWRITE_RDMA_PAYLOAD_SIZE)
+		increments["eth"]["virtualAddress"] = virtualAddress
+		increments["eth"]["rKey"] = connections["remote_key"][connection]
+		increments["eth"]["data"] = np.ascontiguousarray(heads[source,DTA_BASE_OFFSET+self.dta_base_size+5:DTA_BASE_OFFSET+self.dta_base_size+13]).view(">u8").ravel()
+		increments["payload"]["checksum"] = checksums
+		
+		if np.all(is_increment):
+			event.update({"frames": increments, "counter": "keyincrement_fetchadds"})
+			return [event]
+		
+		#Mixed batch: the two frame types have different sizes, so they become separate events
+		events = []
+		for selected,frames,counter in [(~is_increment, writes, "keywrite_writes"), (is_increment, increments, "keyincrement_fetchadds")]:
+			events.append({name: value[selected] for name,value in event.items()})
+			events[-1].update({"frames": frames[selected], "counter": counter})
+		
+		return events
+	
+	#ControlAppendBatchHandling (ingress) and ControlPrepareAppend (egress)
+	def prepareAppend(self, heads, dstAddr, listIDs, data, nacked, positions, timestamps):
+		B = self.append_batch_size
+		registers = (listIDs & (MAX_SUPPORTED_QPS-1)).astype(np.int64)
+		
+		#Position of every report in its list's batch
+		ranks, counts = groupRanks(registers, MAX_SUPPORTED_QPS)
+		batch_position = (self.reg_num_batched_elements[registers] + ranks) % B
+		ready = batch_position == B-1
+		
+		#Batch entries come from the B-1 previous reports of the same list, or from the registers for reports batched before this call
+		order = np.argsort(registers, kind="stable")
+		sorted_data = data[order]
+		group_starts = np.cumsum(counts) - counts
+		
+		rows = np.flatnonzero(ready)
+		payload = np.zeros((len(rows), B), dtype=np.uint32)
+		for entry in range(B-1):
+			source_rank = ranks[rows] - (B-1) + entry
+			from_batch = source_rank >= 0
+			source = group_starts[registers[rows]] + np.maximum(source_rank, 0)
+			payload[:,entry] = np.where(from_batch, sorted_data[source], self.reg_batch[registers[rows], entry])
+		payload[:,B-1] = data[rows]
+		
+		#Update the registers: entry e holds the latest report at batch position e, or the latest completed batch
+		for entry in range(B-1):
+			writers = np.flatnonzero((batch_position == entry) | ready)
+			latest = np.full(MAX_SUPPORTED_QPS, -1, dtype=np.int64)
+			np.maximum.at(latest, registers[writers], writers)
+			updated = latest >= 0
+			self.reg_batch[updated, entry] = data[latest[updated]]
+		self.reg_num_batched_elements = (self.reg_num_batched_elements + counts) % B
+		
+		self.counters["append_batched"] += int((~ready).sum())
+		
+		#Only completed, non-NACKed batches reach egress
+		payload = payload[~nacked[rows]]
+		rows = rows[~nacked[rows]]
+		if len(rows) == 0:
+			return None
+		
+		connections = connectionColumns(self.appendTable)
+		mapped, connection = lookup(self.appendTable, listIDs[rows])
+		self.counters["unmapped"] += int((~mapped).sum())
+		
+		qp_reg_indexes = connections["qp_reg_index"][connection]
+		slots = self.nextHeadSlots(qp_reg_indexes, connections["num_slots"][connection], mapped)
+		
+		ports, forwarded = self.forward(dstAddr[rows])
+		frames = self.craftRoCE(rocev2Frame((DATALIST_ENTRY, B)), heads[rows], heads[rows,IPV4_OFFSET+8] - forwarded, RDMA_OPCODE_WRITE_ONLY, connections, connection, B*APPEND_SLOT_SIZE)
+		frames["eth"]["virtualAddress"] = connections["memory_start"][connection] + slots.astype(np.uint64)*np.uint64(APPEND_SLOT_SIZE)
+		frames["eth"]["rKey"] = connections["remote_key"][connection]
+		frames["eth"]["dmaLength"] = B*APPEND_SLOT_SIZE
+		frames["payload"]["data"] = payload #Byte-swapped in ingress, so the data lands in collector (host) byte order
+		
+		return {
+			"frames": frames,
+			"counter": "append_writes",
+			"positions": positions[rows],
+			"timestamps": timestamps[rows],
+			"ports": ports,
+			"candidates": mapped,
+			"qp_reg_indexes": qp_reg_indexes
+		}
+	
+	#reg_head_pointer: the head moves APPEND_BATCH_SIZE slots per write. Once past the end, one write goes to slot 0 and the head restarts from 0
+	def nextHeadSlots(self, qp_reg_indexes, num_slots, mapped):
+		B = self.append_batch_size
+		slots = np.zeros(len(qp_reg_indexes), dtype=np.int64)
+		
+		for qp_reg_index in np.unique(qp_reg_indexes[mapped]):
+			selected = np.flatnonzero(mapped & (qp_reg_indexes == qp_reg_index))
+			S = int(num_slots[selected[0]])
+			head = int(self.reg_head_pointer[qp_reg_index])
+			k = np.arange(len(selected)+1)
+			
+			#Writes until the first wrap, then a cycle of [0, B, ..., (c-2)*B, 0]
+			before_wrap = max(0, -(-(S-head)//B))
+			cycle = -(-S//B) + 1
+			cycle_position = (k - before_wrap - 1) % cycle
+			outputs = np.where(k < before_wrap, head + k*B, np.where((k == before_wrap) | (cycle_position == cycle-1), 0, cycle_position*B))
+			
+			slots[selected] = outputs[:-1]
+			
+			#Head state after the last write
+			last = len(selected)-1
+			if last < before_wrap:
+				self.reg_head_pointer[qp_reg_index] = head + (last+1)*B
+			elif last == before_wrap or cycle_position[last] == cycle-1:
+				self.reg_head_pointer[qp_reg_index] = 0
+			else:
+				self.reg_head_pointer[qp_reg_index] = (cycle_position[last]+1)*B
+		
+		return slots
+	
+	#ControlPreparePostcarder: per cache index, postcards are cached until 5 arrived (then compiled into one write), or a flowID collision evicts the cached ones
+	def preparePostcarder(self, heads, dstAddr, keys, hopNums, data, positions, timestamps):
+		cached = self.postcarderCache.process(keys, hopNums, data)
+		emit = cached["emit"]
+		payload = cached["payload"]
+		self.counters["postcarder_cached"] += int((~emit).sum())
+		
+		connections = connectionColumns(self.postcarderTable)
+		mapped, connection = lookup(self.postcarderTable, dstAddr)
+		self.counters["unmapped"] += int((emit & ~mapped).sum())
+		
+		slots = CRC32.compute(uint32Bytes(keys, "big")) & connections["slot_mask"][connection]
+		
+		ports, forwarded = self.forward(dstAddr)
+		frames = self.craftRoCE(rocev2Frame(POSTCARDER_PAYLOAD), heads, heads[:,IPV4_OFFSET+8] - forwarded, RDMA_OPCODE_WRITE_ONLY, connections, connection, POSTCARDER_PAYLOAD.itemsize)
+		frames["eth"]["virtualAddress"] = connections["memory_start"][connection] + slots.astype(np.uint64)*np.uint64(POSTCARDER_SLOT_SIZE)
+		frames["eth"]["rKey"] = connections["remote_key"][connection]
+		frames["eth"]["dmaLength"] = POSTCARDER_PAYLOAD.itemsize
+		for h in range(POSTCARDER_NUM_HOPS):
+			frames["payload"]["hop%i_data" %(h+1)] = payload[:,h]
+		
+		#Every postcard passes the rate limiter, but only compiled/evicting ones generate RDMA
+		return {
+			"frames": frames,
+			"counter": "postcarder_writes",
+			"positions": positions,
+			"timestamps": timestamps,
+			"ports": ports,
+			"candidates": emit & mapped,
+			"qp_reg_indexes": connections["qp_reg_index"][connection]
+		}
+	
+	#get_drop_counter: while a port's counter is above 0 it is decremented, and packets are dropped until it reaches 0
+	def rateLimit(self, ports):
+		ranks, counts = groupRanks(ports, NUM_DROP_COUNTERS)
+		counters = self.reg_rdma_drop_counter[ports]
+		
+		dropped = ranks < counters-1
+		self.reg_rdma_drop_counter = np.maximum(self.reg_rdma_drop_counter - counts, 0)
+		
+		return dropped
+	
+	#get_psn: every generated RDMA packet takes the next PSN of its QP
+	def nextPSNs(self, qp_reg_indexes):
+		ranks, counts = groupRanks(qp_reg_indexes, MAX_SUPPORTED_QPS)
+		psns = (self.reg_rdma_sequence_number[qp_reg_indexes].astype(np.int64) + ranks) & PSN_MASK
+		
+		self.reg_rdma_sequence_number = ((self.reg_rdma_sequence_number.astype(np.int64) + counts) & PSN_MASK).astype(np.uint32)
+		
+		return psns
+
+
+#Synthetic report traffic, for benchmarking the model without a capture
+def generateReports(operation, count, redundancy=2, num_lists=4, nack_tracking=True, dstIP="10.0.0.51"):
+	from dta.encoder import ReportEncoder
+	
+	opcode = DTA_PRIMITIVE_NAMES[operation]
+	encoder = ReportEncoder(opcode, dstIP=dstIP, udp_checksum=False)
+	values = np.arange(count, dtype=np.uint64)
+	
+	if opcode == DTA_OPCODE_KEYWRITE:
+		frames = encoder.encodeKeyWrite(values, values+1, redundancy)
+	elif opcode == DTA_OPCODE_KEYINCREMENT:
+		frames = encoder.encodeKeyIncrement(values, 1, redundancy)
+	elif opcode == DTA_OPCODE_APPEND:
+		frames = encoder.encodeAppend(values % num_lists, values+1)
+	elif opcode == DTA_OPCODE_POSTCARDER:
+		frames = encoder.encodePostcarder(values//POSTCARDER_NUM_HOPS, values%POSTCARDER_NUM_HOPS + 1, values+1)
+	
+	batch = FrameBatch.fromArray(frames)
+	if not nack_tracking: #Drop the seqnum byte
+		raw = batch.buffer.reshape(len(batch), -1)
+		raw = np.delete(raw, DTA_BASE_OFFSET+1, axis=1)
+		batch = FrameBatch.fromArray(raw)
+	
+	return batch
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Translate DTA reports into RoCEv2 frames with a software model of the translator pipeline.')
+	parser.add_argument('--pcap', type=str, help='A capture of DTA reports to translate')
+	parser.add_argument('--iface', type=str, help='Capture DTA reports from this interface instead of a pcap')
+	parser.add_argument('--generate', type=str, choices=list(DTA_PRIMITIVE_NAMES), help='Translate synthetic reports of this type instead of a pcap')
+	parser.add_argument('--count', type=int, default=1000000, help='Number of reports to generate or capture')
+	parser.add_argument('--redundancy', type=int, default=2, help='Redundancy of generated KeyWrite/KeyIncrement reports')
+	parser.add_argument('--output', type=str, help='Write the generated frames to this pcap')
+	parser.add_argument('--out_iface', type=str, help='Send the generated frames on this interface')
+	parser.add_argument('--batchsize', type=int, default=1<<20, help='Number of frames to translate per batch')
+	parser.add_argument('--collector', type=str, default="10.0.0.51", help='The collector IP address')
+	parser.add_argument('--egress_port', type=int, default=156, help='The switch port towards the collector')
+	parser.add_argument('--keywrite_slots', type=int, default=1<<20, help='Number of KeyWrite slots at the collector')
+	parser.add_argument('--append_slots', type=int, default=1<<16, help='Number of slots per Append list at the collector')
+	parser.add_argument('--num_lists', type=int, default=4, help='Number of Append lists')
+	parser.add_argument('--postcarder_slots', type=int, default=1<<16, help='Number of Postcarder slots at the collector')
+	parser.add_argument('--append_batch_size', type=int, default=4, help='APPEND_BATCH_SIZE of the modeled pipeline')
+	parser.add_argument('--no_nack_tracking', action='store_true', help='Model a translator built without DO_NACK_TRACKING (2-byte dta_base, no seqnum)')
+	args = parser.parse_args()
+	
+	assert args.pcap or args.iface or args.generate, "Specify one of --pcap, --iface, or --generate!"
+	
+	translator = Translator(append_batch_size=args.append_batch_size, nack_tracking=not args.no_nack_tracking)
+	translator.setupDefault(collectorIP=args.collector, egressPort=args.egress_port, keywrite_slots=args.keywrite_slots, append_slots=args.append_slots, num_lists=args.num_lists, postcarder_slots=args.postcarder_slots)
+	
+	if args.pcap:
+		reports = readPcap(args.pcap)
+	elif args.generate:
+		reports = generateReports(args.generate, args.count, redundancy=args.redundancy, num_lists=args.num_lists, nack_tracking=not args.no_nack_tracking, dstIP=args.collector)
+	else:
+		reports = captureFrames(args.iface, args.count, timeout=10)
+	
+	sender = None
+	if args.out_iface:
+		from dta.encoder import RawSender
+		sender = RawSender(args.out_iface)
+	
+	print("Translating %i frames..." %len(reports))
+	
+	outputs = []
+	duration = 0
+	for start in range(0, len(reports), args.batchsize):
+		t_start = time.perf_counter()
+		emitted = translator.process(reports.select(slice(start, start+args.batchsize)))
+		duration += time.perf_counter() - t_start
+		
+		if args.output:
+			outputs.append(emitted)
+		if sender:
+			for i in range(len(emitted)):
+				sender.sock.send(emitted.frame(i))
+	
+	if args.output:
+		from dta.frames import concatFrames
+		writePcap(args.output, concatFrames(outputs))
+	
+	for name,value in translator.counters.items():
+		print("%s: %i" %(name, value))
+	print("Translated in %.3f seconds. This equals %.3f million reports per second" %(duration, len(reports)/(max(duration, 1e-9)*1000000)))